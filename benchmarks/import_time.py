@@ -0,0 +1,97 @@
+# benchmarks/import_time.py
+"""
+Время импорта каждой точки входа бота в чистом процессе интерпретатора.
+
+Каждый модуль импортируется в отдельном `python -X importtime` несколько раз; в отчете -
+медиана полного времени процесса, собственное время импорта модуля (по -X importtime)
+и какие тяжелые зависимости оказались загружены.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 10 --json import_time.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time as time_module
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = [
+    'configs.settings',
+    'core.data_fetcher',
+    'ts_logic.context_analyzer_1h',
+    'ts_logic.fractal_analyzer',
+    'core.chart_payload',
+    'core.live_feed',
+    'core.chart_server',
+    'utils.decimation',
+    'utils.chart_cache',
+    'utils.chart_batch',
+    'utils.plotter',
+]
+HEAVY_MODULES = ['numpy', 'pandas', 'matplotlib', 'mplfinance', 'requests', 'dotenv']
+
+PROBE = (
+    "import sys, json, {module}\n"
+    "print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+)
+
+
+def _run_once(module: str):
+    """Один запуск: (время процесса в мс, время импорта модуля по -X importtime в мс, тяжелые модули)."""
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES) if module else "pass"
+    started = time_module.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=PROJECT_ROOT, capture_output=True, text=True)
+    wall_ms = (time_module.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} завершился с ошибкой:\n{result.stderr[-2000:]}")
+
+    import_ms = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            import_ms = int(parts[1].strip()) / 1000
+    loaded = json.loads(result.stdout.strip().splitlines()[-1]) if module else []
+    return wall_ms, import_ms, loaded
+
+
+def measure(modules: list, repeat: int = 5) -> dict:
+    baseline = statistics.median(_run_once(None)[0] for _ in range(repeat))
+    results = {'python': sys.version.split()[0], 'repeat': repeat, 'interpreter_startup_ms': round(baseline, 1),
+               'entry_points': {}}
+    for module in modules:
+        runs = [_run_once(module) for _ in range(repeat)]
+        results['entry_points'][module] = {
+            'wall_ms': round(statistics.median(r[0] for r in runs), 1),
+            'import_ms': round(statistics.median(r[1] for r in runs if r[1] is not None), 1),
+            'heavy_modules': runs[-1][2],
+        }
+    return results
+
+
+def print_report(results: dict):
+    print(f"Python {results['python']}, повторов: {results['repeat']}, "
+          f"запуск интерпретатора: {results['interpreter_startup_ms']} мс")
+    print(f"{'модуль':<32}{'процесс, мс':>12}{'импорт, мс':>12}  тяжелые зависимости")
+    for module, entry in results['entry_points'].items():
+        print(f"{module:<32}{entry['wall_ms']:>12}{entry['import_ms']:>12}  {', '.join(entry['heavy_modules']) or '-'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Время импорта точек входа бота")
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    report = measure(args.modules, args.repeat)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены в {args.json_path}")
@@ -0,0 +1,234 @@
+# benchmarks/run_benchmarks.py
+"""
+Время горячих участков конвейера на синтетических FX-данных (benchmarks/synthetic.py)
+разного размера: поиск свингов, структура рынка, линии тренда, выборка свечей сессии,
+сессионные фракталы, разбор ответа API и кодирование ответа графика, рендер графика.
+
+Для каждого размера и бенчмарка - медиана и минимум из --repeat запусков. Результаты
+сохраняются в JSON вместе с окружением, и два прогона можно сравнить:
+
+    python benchmarks/run_benchmarks.py --sizes 1000,10000,100000 --json baseline.json
+    python benchmarks/run_benchmarks.py --json current.json --compare baseline.json
+    python benchmarks/run_benchmarks.py --only swings,structure --sizes 10000000 --repeat 1
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as time_module
+import warnings
+from datetime import datetime, timezone
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import numpy as np  # noqa: E402
+
+from benchmarks.synthetic import generate_fx_ohlcv, to_twelve_data_values  # noqa: E402
+from configs import settings  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+# Изменение медианы меньше порога при сравнении считается шумом
+COMPARE_THRESHOLD = 0.10
+
+
+def _swing_points(df):
+    from ts_logic.context_analyzer_1h import find_swing_points
+    return find_swing_points(df, n=settings.SWING_POINT_N)
+
+
+def _setup_swings(df):
+    from ts_logic.context_analyzer_1h import find_swing_points
+    return lambda: find_swing_points(df, n=settings.SWING_POINT_N)
+
+
+def _setup_structure(df):
+    from ts_logic.context_analyzer_1h import analyze_market_structure_points
+    swing_highs, swing_lows = _swing_points(df)
+    return lambda: analyze_market_structure_points(swing_highs, swing_lows)
+
+
+def _setup_trend_lines(df):
+    from ts_logic.context_analyzer_1h import determine_trend_lines_v2
+    swing_highs, swing_lows = _swing_points(df)
+    prices = df[['high', 'low', 'close']]
+    return lambda: determine_trend_lines_v2(swing_highs, swing_lows, df.index[-1], prices,
+                                            points_window_size=settings.TRENDLINE_POINTS_WINDOW_SIZE)
+
+
+def _setup_session_candles(df):
+    from datetime import time
+    from ts_logic.fractal_analyzer import get_candles_for_session
+    start = time(settings.ASIAN_SESSION_START_HOUR_UTC, settings.ASIAN_SESSION_START_MINUTE_UTC)
+    end = time(settings.ASIAN_SESSION_END_HOUR_UTC, settings.ASIAN_SESSION_END_MINUTE_UTC)
+    target_date = df.index[-1].normalize()
+    return lambda: get_candles_for_session(df, target_date, start, end)
+
+
+def _setup_session_fractals(df):
+    from ts_logic.fractal_analyzer import find_all_session_fractals
+    return lambda: find_all_session_fractals(df, settings.SESSION_FRACTAL_N)
+
+
+def _setup_fractal_setups(df):
+    from ts_logic.fractal_analyzer import analyze_fractal_setups
+    return lambda: analyze_fractal_setups(df, df.index[-1])
+
+
+def _setup_fetch_decode(df):
+    from core.data_fetcher import time_series_to_dataframe
+    body = json.dumps({'status': 'ok', 'values': to_twelve_data_values(df)})
+    return lambda: time_series_to_dataframe(json.loads(body)['values'])
+
+
+def _snapshot(df):
+    from core.chart_payload import ChartSnapshot
+    from ts_logic.context_analyzer_1h import analyze_market_structure_points
+    structure_points = analyze_market_structure_points(*_swing_points(df))
+    analysis = {'structure_points': structure_points, 'session_points': [], 'trend_lines': [], 'summary': []}
+    return ChartSnapshot(1, df, analysis)
+
+
+def _setup_encode_json(df):
+    from core.chart_payload import ENCODING_ROWS, encode_payload
+    payload = _snapshot(df).full_payload()
+    return lambda: json.dumps(encode_payload(payload, ENCODING_ROWS))
+
+
+def _setup_encode_binary(df):
+    from core.chart_payload import ENCODING_COLUMNAR, PRICES_PIPS, encode_binary, encode_payload
+    payload = _snapshot(df).full_payload()
+    return lambda: encode_binary(encode_payload(payload, ENCODING_COLUMNAR, PRICES_PIPS))
+
+
+def _setup_plot(df):
+    from ts_logic.context_analyzer_1h import analyze_market_structure_points
+    from utils.plotter import make_chart_style, plot_market_structure
+    structure_points = analyze_market_structure_points(*_swing_points(df))
+    style = make_chart_style()
+    directory = tempfile.mkdtemp(prefix='tsbot-bench-')
+    return lambda: plot_market_structure(df, structure_points, 'EUR/USD', '1h', directory, 'bench.png',
+                                         style=style, use_cache=False)
+
+
+# имя -> (подготовка: df -> функция без аргументов, максимальный размер или None)
+BENCHMARKS = {
+    'swings': (_setup_swings, None),
+    'structure': (_setup_structure, None),
+    'trend_lines': (_setup_trend_lines, None),
+    'session_candles': (_setup_session_candles, None),
+    'session_fractals': (_setup_session_fractals, None),  # все сессии всех дней за один проход
+    'fractal_setups': (_setup_fractal_setups, None),
+    'fetch_decode': (_setup_fetch_decode, 1000000),    # реальные ответы API - до 5000 свечей
+    'encode_json': (_setup_encode_json, 1000000),
+    'encode_binary': (_setup_encode_binary, None),
+    'plot': (_setup_plot, 100000),                      # с прореживанием до PLOT_DECIMATION_WIDTH
+}
+
+
+def freq_for_size(bars: int) -> str:
+    """Часовые свечи, пока их метки помещаются в диапазон pd.Timestamp; для длинных рядов - минутные."""
+    return '1h' if bars <= 1000000 else '1min'
+
+
+def _time_call(func, repeat: int) -> list:
+    func()  # прогрев: ленивые импорты, кэши pandas
+    timings = []
+    for _ in range(repeat):
+        started = time_module.perf_counter()
+        func()
+        timings.append(time_module.perf_counter() - started)
+    return timings
+
+
+def _git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(sizes: list, names: list, repeat: int = 5, volatility_pips: float = 8.0, seed: int = 42) -> dict:
+    import pandas as pd
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'repeat': repeat,
+        'volatility_pips': volatility_pips,
+        'seed': seed,
+        'benchmarks': {},
+    }
+    for size in sizes:
+        df = generate_fx_ohlcv(size, freq=freq_for_size(size), volatility_pips=volatility_pips, seed=seed)
+        for name in names:
+            setup, max_size = BENCHMARKS[name]
+            if max_size is not None and size > max_size:
+                continue
+            timings = _time_call(setup(df), repeat)
+            entry = {
+                'median_s': statistics.median(timings),
+                'min_s': min(timings),
+                'per_bar_ns': statistics.median(timings) / size * 1e9,
+            }
+            results['benchmarks'].setdefault(name, {})[str(size)] = entry
+            print(f"{name:<16}{size:>10}{entry['median_s'] * 1000:>12.2f} мс{entry['per_bar_ns']:>12.1f} нс/свеча",
+                  flush=True)
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float = COMPARE_THRESHOLD) -> list:
+    """Строки сравнения медиан: бенчмарк, размер, было/стало и отношение; отмечены изменения больше порога."""
+    lines = [f"Сравнение с {baseline.get('git_revision') or '?'} ({baseline.get('created', '?')}):"]
+    for name, by_size in current['benchmarks'].items():
+        for size, entry in by_size.items():
+            previous = baseline.get('benchmarks', {}).get(name, {}).get(size)
+            if previous is None:
+                continue
+            ratio = entry['median_s'] / previous['median_s'] if previous['median_s'] else float('inf')
+            mark = ''
+            if ratio > 1 + threshold:
+                mark = '  медленнее'
+            elif ratio < 1 - threshold:
+                mark = '  быстрее'
+            lines.append(f"{name:<16}{size:>10}{previous['median_s'] * 1000:>12.2f} ->"
+                         f"{entry['median_s'] * 1000:>10.2f} мс  x{ratio:.2f}{mark}")
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих участков на синтетических данных")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="размеры рядов через запятую (1000 .. 10000000)")
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help="бенчмарки через запятую")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--volatility', type=float, default=8.0, help="размах часовой свечи в пипсах")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    parser.add_argument('--compare', dest='baseline_path', help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.only.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"неизвестные бенчмарки: {', '.join(unknown)}; доступны: {', '.join(BENCHMARKS)}")
+
+    warnings.filterwarnings('ignore', module='mplfinance')  # предупреждение о большом числе свечей
+    report = run([int(s) for s in args.sizes.split(',')], selected, args.repeat, args.volatility, args.seed)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены в {args.json_path}")
+    if args.baseline_path:
+        with open(args.baseline_path, 'r', encoding='utf-8') as f:
+            print('\n'.join(compare(report, json.load(f))))
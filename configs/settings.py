@@ -2,11 +2,14 @@
 import os
 from dotenv import load_dotenv
 
-# Загружаем переменные окружения из файла .env
+# Загружаем переменные окружения из файла .env - до всех os.getenv("TSBOT_*") ниже
+# (python-dotenv легкий, ~10 мс на импорт)
 load_dotenv()
 
 # --- НАСТРОЙКИ API ---
-API_KEY_TWELVE_DATA = os.getenv("TWELVE_DATA_API_KEY", "YOUR_TWELVE_DATA_API_KEY_HERE")
+# API_KEY_TWELVE_DATA вычисляется лениво (см. __getattr__ в конце файла): предупреждение
+# об отсутствии ключа печатается только при первом обращении к ключу.
+API_KEY_PLACEHOLDER = "YOUR_TWELVE_DATA_API_KEY_HERE"
 BASE_URL_TWELVE_DATA = "https://api.twelvedata.com"
 
 # --- ОБЩИЕ НАСТРОЙКИ БОТА ---
@@ -59,10 +62,139 @@ NY_SESSION_END_MINUTE_UTC = 0
 
 NY_SESSIONS_TO_CHECK_PREVIOUS_DAYS = 1 # Проверка предыдущего дня для NY сессии
 FRACTAL_PROXIMITY_THRESHOLD_PIPS = 15
+LIQUIDITY_LOOKBACK_DAYS = 90 # Сколько дней сессионных фракталов держит индекс ликвидности (ts_logic/liquidity_index.py)
 PIP_VALUE_DEFAULT = 0.0001
+# Размер пипса по котируемой валюте пары (XXX/JPY - 0.01); отдельные инструменты - в PIP_VALUES
+PIP_VALUES_BY_QUOTE = {"JPY": 0.01, "HUF": 0.01}
+PIP_VALUES = {"XAU/USD": 0.1, "XAG/USD": 0.01}
+
+# --- СКАНЕР ПАР (core/scanner.py) ---
+SCANNER_SYMBOLS = [
+    "EUR/USD", "GBP/USD", "USD/JPY", "USD/CHF", "USD/CAD", "AUD/USD", "NZD/USD",
+    "EUR/GBP", "EUR/JPY", "EUR/CHF", "EUR/CAD", "EUR/AUD", "EUR/NZD",
+    "GBP/JPY", "GBP/CHF", "GBP/CAD", "GBP/AUD", "GBP/NZD",
+    "AUD/JPY", "AUD/CHF", "AUD/CAD", "AUD/NZD",
+    "NZD/JPY", "NZD/CHF", "NZD/CAD", "CAD/JPY", "CAD/CHF", "CHF/JPY",
+    "XAU/USD", "XAG/USD",
+]
+SCANNER_FETCH_CONCURRENCY = 8 # Одновременных запросов к API (ограничение по кредитам Twelve Data)
+SCANNER_ANALYSIS_WORKERS = 4 # Процессов анализа в пуле сканера
+SCANNER_OUTPUT_SIZE = CONTEXT_OUTPUT_SIZE # Свечей на пару за проход
+
+# --- ПЛАНИРОВЩИК ПО ЗАКРЫТИЮ СВЕЧЕЙ (core/scheduler.py) ---
+SCHEDULER_TIMEFRAMES = {"3m": 180, "1h": 3600} # Таймфрейм -> длительность свечи в секундах
+SCHEDULER_SETTLEMENT_DELAY_SECONDS = 2.0 # Пауза после закрытия свечи, чтобы API успел ее отдать
+SCHEDULER_WORKERS = 4 # Одновременных запусков загрузки и анализа
+SCHEDULER_MAX_IN_FLIGHT = 64 # Больше ключей в работе - новые запуски отбрасываются
+SCHEDULER_SHARED = True # Сканер и сервер графиков получают закрытые свечи через общий планировщик процесса
+SCHEDULER_REQUEST_TIMEOUT_SECONDS = 120 # Сколько потребитель ждет результат запуска
+# Рынок FX закрыт с пятницы 21:00 до воскресенья 21:00 UTC (день недели: 0 - понедельник)
+MARKET_CLOSE_WEEKDAY = 4
+MARKET_CLOSE_HOUR_UTC = 21
+MARKET_OPEN_WEEKDAY = 6
+MARKET_OPEN_HOUR_UTC = 21
+
+# --- ХРАНИЛИЩЕ СВЕЧЕЙ НА ДИСКЕ (core/ohlcv_store.py) ---
+OHLCV_STORE_DIRECTORY = os.getenv("TSBOT_OHLCV_DIR", os.path.join("data", "ohlcv")) # Относительный путь - от корня проекта
+OHLCV_STORE_PRICES = "pips" # pips - int32 в пипеттах (1/10 пипса), float32 - цены как есть
+
+# --- ХРАНИЛИЩЕ РЕЗУЛЬТАТОВ АНАЛИЗА (core/analysis_store.py) ---
+ANALYSIS_STORE_PATH = os.getenv("TSBOT_ANALYSIS_DB", os.path.join("data", "analysis.sqlite3")) # Относительный путь - от корня проекта
+ANALYSIS_STORE_ENABLED = os.getenv("TSBOT_ANALYSIS_STORE", "1") != "0" # Сервер графиков сохраняет каждый анализ
+ANALYSIS_STORE_QUEUE_SIZE = 256 # Прогонов в очереди фоновой записи; при переполнении новые пропускаются
+
+# --- СВЕЧИ ИЗ ПОТОКА КОТИРОВОК (core/tick_aggregator.py) ---
+TICK_TIMEFRAMES = SCHEDULER_TIMEFRAMES # Какие свечи строятся из тиков
+TICK_QUEUE_SIZE = 10000 # Очередь событий свечей к анализаторам
+TICK_QUEUE_PUT_TIMEOUT_SECONDS = 5.0 # Сколько ждать места в очереди для закрытой свечи
+TICK_LATE_GRACE_SECONDS = 2.0 # Опоздавший тик младше этого исправляет закрытую свечу, старше - отбрасывается
+TICK_FORMING_EMIT_SECONDS = 1.0 # Формирующаяся свеча отправляется не чаще (по времени тиков)
+TICK_REPLAY_CHUNK_SIZE = 50000 # Тиков за пакет при воспроизведении файла
+TICK_SOCKET_HOST = "127.0.0.1"
+TICK_SOCKET_PORT = 9100 # Построчный поток "time_ms,bid,ask" (заглушка потока брокера)
+
+# --- КОНТЕКСТ СТАРШИХ ТАЙМФРЕЙМОВ (ts_logic/multi_timeframe.py) ---
+MTF_HIGHER_TIMEFRAMES = {"4h": 14400, "1D": 86400} # Таймфрейм -> длительность свечи в секундах (собираются из 1h)
+MTF_WINDOW_BARS = 120 # Свечей старшего таймфрейма в окне анализа
+MTF_SWING_POINT_N = SWING_POINT_N # N для свингов старших таймфреймов
+MTF_BIAS_WEIGHTS = {"1h": 1, "4h": 2, "1D": 3} # Вес направления каждого уровня в общем смещении
+MTF_BIAS_THRESHOLD = 0.5 # |взвешенная сумма| от этого значения - LONG/SHORT, иначе NEUTRAL
+
+# --- СОСТОЯНИЕ ИНКРЕМЕНТАЛЬНОГО АНАЛИЗА (ts_logic/incremental.py) ---
+ANALYZER_STATE_DIRECTORY = os.getenv("TSBOT_STATE_DIR", os.path.join("data", "state")) # Относительный путь - от корня проекта
+ANALYZER_STATE_FINGERPRINT_BARS = 16 # Последних свечей в отпечатке данных снимка (сверка с источником при запуске)
+
+# --- АЛЕРТЫ ПО СЕТАПАМ И СИГНАЛАМ (core/alerts.py) ---
+ALERTS_ENABLED = os.getenv("TSBOT_ALERTS", "1") != "0" # Планировщик отправляет найденные сетапы в алерты
+ALERT_QUEUE_SIZE = 10000 # Алертов в очереди диспетчера; при переполнении новые отбрасываются (анализ не ждет)
+ALERT_BATCH_SIZE = 100 # Алертов в одной пачке для приемников
+ALERT_BATCH_WINDOW_SECONDS = 0.25 # Сколько ждать остальные алерты после первого (всплеск на закрытии часа - одна пачка)
+ALERT_DEDUPE_TTL_SECONDS = 24 * 3600 # Повтор того же сетапа на том же уровне в течение этого времени не отправляется
+ALERT_SINK_QUEUE_SIZE = 100 # Пачек в очереди каждого приемника; медленный приемник теряет свои пачки, а не задерживает других
+ALERT_JSONL_PATH = os.getenv("TSBOT_ALERTS_FILE", os.path.join("data", "alerts", "alerts.jsonl")) # Относительный путь - от корня проекта; пусто - без файла
+ALERT_WEBHOOK_URL = os.getenv("TSBOT_ALERT_WEBHOOK_URL", "") # POST JSON с пачкой алертов; пусто - без вебхука
+ALERT_SOCKET_ADDRESS = os.getenv("TSBOT_ALERT_SOCKET", "") # host:port локального TCP-приемника (строки JSON); пусто - без сокета
+ALERT_SINK_TIMEOUTS_SECONDS = {"jsonl": 2.0, "webhook": 5.0, "socket": 1.0} # Таймаут отправки пачки для каждого приемника
+ALERT_SINK_THREADS = 1 # Потоков у блокирующего приемника (файл, вебхук); пока все заняты - его пачки отбрасываются
+
+# --- ЯДРА С ПОСЛЕДОВАТЕЛЬНЫМ СОСТОЯНИЕМ И БЭКТЕСТ (ts_logic/kernels.py) ---
+KERNELS_BACKEND = os.getenv("TSBOT_KERNELS", "auto") # auto - numba, если установлена, иначе numpy; numba | numpy (numba - и для свингов find_swing_points)
+KERNELS_NUMBA_CACHE = True # Скомпилированные ядра сохраняются в __pycache__ и не компилируются при каждом запуске
+BACKTEST_STOP_PIPS = 15 # Стоп ордера от уровня сетапа, пипсов
+BACKTEST_REWARD_RISK = 2.0 # Тейк в стопах
+BACKTEST_ORDER_EXPIRY_BARS = 24 # Лимитный ордер снимается, если не исполнен за столько свечей
 
 # --- НАСТРОЙКИ ДЛЯ ГРАФИКОВ ---
 CHARTS_DIRECTORY_NAME = "charts"
+HEADLESS_PLOTTING = os.getenv("TSBOT_HEADLESS", "1") != "0" # Бэкенд Agg: графики только сохраняются в файлы
+PLOT_MAX_POINT_LABELS = 400 # Больше точек - подписи только у сетапов (маркеры рисуются все)
+CHART_RENDER_WORKERS = 2 # Процессов в пуле пакетного рендеринга (utils/chart_batch.py)
+CHART_CACHE_ENABLED = True # Контентно-адресуемый кэш графиков: <hash>.png + манифест (utils/chart_cache.py)
+CHART_CACHE_MANIFEST = "manifest.json"
+CHART_CACHE_MAX_AGE_DAYS = 14 # Картинки, не использованные дольше, удаляются
+CHART_CACHE_MAX_MB = 500 # Предел суммарного размера кэша, сверх него удаляются давно не использованные
+DECIMATION_PIXELS_PER_BAR = 2 # Минимум пикселей на свечу: длинная история объединяется в корзины (utils/decimation.py)
+PLOT_DECIMATION_WIDTH = 1600 # Ширина области свечей PNG-графика в пикселях для прореживания
+
+# --- НАСТРОЙКИ ЛОГИРОВАНИЯ (utils/logger.py) ---
+LOG_DIRECTORY = os.getenv("TSBOT_LOG_DIR", os.path.join("data", "logs")) # Относительный путь - от корня проекта
+LOG_LEVEL = os.getenv("TSBOT_LOG_LEVEL", "INFO")
+LOG_TO_CONSOLE = True # Дублировать записи в stdout (из фонового потока логгера)
+LOG_QUEUE_SIZE = 10000 # Очередь записей к потоку логгера; при переполнении записи отбрасываются
+LOG_RATE_LIMIT_SECONDS = 10 # Окно ограничения повторяющихся сообщений
+LOG_RATE_LIMIT_BURST = 5 # Сколько одинаковых сообщений пропускать за окно (ERROR - всегда)
+
+# --- МЕТРИКИ (utils/metrics.py) ---
+METRICS_ENABLED = os.getenv("TSBOT_METRICS", "1") != "0" # Выключено - почти нулевые накладные расходы
+METRICS_LOG_INTERVAL_SECONDS = 300 # Периодическая сводка метрик в лог (0 - не писать)
+
+# --- ПРОФИЛИРОВАНИЕ ПО ЗАПРОСУ (utils/profiling.py) ---
+PROFILING_ENABLED = os.getenv("TSBOT_PROFILE", "0") != "0" # Профилировать каждый запуск анализа/рендера/запрос API
+PROFILING_MODE = os.getenv("TSBOT_PROFILE_MODE", "cprofile") # cprofile - детерминированный, sampling - выборочный стек
+PROFILING_SAMPLE_INTERVAL_SECONDS = 0.005 # Период снятия стека в режиме sampling
+PROFILING_MEMORY = os.getenv("TSBOT_PROFILE_MEMORY", "1") != "0" # tracemalloc по этапам анализа
+PROFILING_TOP_N = 30 # Строк в отчетах top-N (функции и места выделения памяти)
+PROFILING_DIRECTORY_NAME = "profiles" # Поддиректория в charts/: отчеты лежат рядом с графиками
+PROFILING_ALLOW_HTTP = os.getenv("TSBOT_PROFILE_HTTP", "0") != "0" # Параметр profile=1 в запросах /api/chart_data и /api/chart_history
+PROFILING_MAX_REPORT_FILES = 200 # Файлов отчетов в директории профилей; старые удаляются после каждой сессии
+
+# --- НАСТРОЙКИ СЕРВЕРА ГРАФИКОВ (front/) ---
+FRONTEND_DIRECTORY_NAME = "front"
+CHART_SERVER_HOST = "127.0.0.1"
+CHART_SERVER_PORT = 8000
+CHART_OUTPUT_SIZE = 500 # Сколько свечей держим в истории графика
+CHART_TAIL_OUTPUT_SIZE = 10 # Сколько последних свечей дозапрашиваем при обновлении
+CHART_FORMING_OUTPUT_SIZE = 2 # Ключи планировщика: закрытые свечи и анализ - из его запуска, у API запрашиваем только формирующуюся свечу (и только что закрытую, пока запуск не готов)
+CHART_FOLLOW_IDLE_SECONDS = 3600 # Ключ планировщика без запросов дольше - отписывается и выгружается из памяти
+CHART_REFRESH_SECONDS = 30 # Не чаще одного запроса к API на (символ, интервал) за этот период
+CHART_SNAPSHOT_HISTORY = 20 # Сколько снимков храним для ответов дельтой по cursor
+CHART_HISTORY_WINDOW_SIZE = 500 # Свечей в одном окне истории при прокрутке влево
+CHART_HISTORY_MAX_WINDOW_SIZE = 5000 # Максимум Twelve Data за один запрос
+CHART_HISTORY_CACHE_WINDOWS = 64 # Сколько окон истории держит сервер (LRU)
+CHART_HISTORY_LOCK_STRIPES = 64 # Блокировок для загрузки окон истории (окно -> блокировка по хэшу ключа)
+LIVE_PUSH_INTERVAL_SECONDS = 5 # Как часто живой канал (SSE) проверяет новый снимок
+LIVE_SUBSCRIBER_QUEUE_SIZE = 100 # Очередь событий на подписчика; переполнение - отключение клиента
+LIVE_HEARTBEAT_SECONDS = 15 # Комментарий-пинг в SSE-потоке при отсутствии событий
 
 # configs/settings.py
 TRENDLINE_OFFSET_PERCENTAGE = 0.001
@@ -71,7 +203,35 @@ TRENDLINE_POINTS_WINDOW_SIZE = 5
 TRENDLINE_SLOPE_TOLERANCE = 1e-9
 
 
-# --- ПРОВЕРКА API КЛЮЧА ---
-if API_KEY_TWELVE_DATA == "YOUR_TWELVE_DATA_API_KEY_HERE":
-    print("ПРЕДУПРЕЖДЕНИЕ: API ключ для Twelve Data не установлен или используется значение по умолчанию.")
-    print("Пожалуйста, установите переменную окружения TWELVE_DATA_API_KEY в файле .env")
+def get_pip_value(symbol: str = None) -> float:
+    """Размер пипса инструмента: PIP_VALUES, затем по котируемой валюте, иначе PIP_VALUE_DEFAULT."""
+    if not symbol:
+        return PIP_VALUE_DEFAULT
+    if symbol in PIP_VALUES:
+        return PIP_VALUES[symbol]
+    return PIP_VALUES_BY_QUOTE.get(symbol.rsplit('/', 1)[-1], PIP_VALUE_DEFAULT)
+
+
+# --- ЛЕНИВЫЕ НАСТРОЙКИ ---
+def _load_api_key_twelve_data():
+    """Проверяем API ключ (.env уже загружен при импорте модуля)."""
+    api_key = os.getenv("TWELVE_DATA_API_KEY", API_KEY_PLACEHOLDER)
+    if api_key == API_KEY_PLACEHOLDER:
+        print("ПРЕДУПРЕЖДЕНИЕ: API ключ для Twelve Data не установлен или используется значение по умолчанию.")
+        print("Пожалуйста, установите переменную окружения TWELVE_DATA_API_KEY в файле .env")
+    return api_key
+
+
+_LAZY_SETTINGS = {
+    'API_KEY_TWELVE_DATA': _load_api_key_twelve_data,
+}
+
+
+def __getattr__(name):
+    """Ленивые настройки: значение вычисляется при первом обращении и кэшируется в модуле."""
+    loader = _LAZY_SETTINGS.get(name)
+    if loader is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = loader()
+    globals()[name] = value
+    return value
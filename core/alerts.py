@@ -0,0 +1,495 @@
+# core/alerts.py
+"""
+Неблокирующая отправка алертов по сетапам и сигналам.
+
+publish() вызывается из цикла анализа (потоки планировщика, сканер) и только кладет алерт
+в ограниченную очередь диспетчера - без ожидания приемников. Диспетчер работает в своем
+потоке с циклом asyncio:
+    очередь (ALERT_QUEUE_SIZE)  - при переполнении новые алерты отбрасываются, анализ не ждет
+    дедупликация                - тот же сетап на том же уровне (символ, таймфрейм, тип, время, цена)
+                                  отправляется один раз за ALERT_DEDUPE_TTL_SECONDS: планировщик
+                                  находит его заново на каждой свече дня
+    пачки                       - после первого алерта диспетчер ждет остальные ALERT_BATCH_WINDOW_SECONDS
+                                  (до ALERT_BATCH_SIZE): всплеск на закрытии часа по всем парам - одна пачка
+    приемники                   - у каждого своя очередь пачек, свой обработчик и таймаут; медленный или
+                                  упавший приемник теряет свои пачки, но не задерживает остальных.
+                                  Блокирующие приемники (файл, вебхук) работают в своем пуле из
+                                  ALERT_SINK_THREADS потоков, а не в общем пуле asyncio: отправка,
+                                  пережившая таймаут, занимает только поток своего приемника
+
+Приемники: JsonlSink (файл, строка JSON на алерт), WebhookSink (POST пачки в JSON),
+SocketSink (локальный TCP, строки JSON). Набор по умолчанию - из настроек ALERT_*.
+"""
+import asyncio
+import json
+import os
+import threading
+import time as time_module
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from configs import settings
+from utils.logger import get_logger
+from utils import metrics
+
+try:
+    import requests
+except ImportError:  # вебхук недоступен, остальные приемники работают
+    requests = None
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KIND_SETUP = 'setup'
+KIND_SIGNAL = 'signal'
+
+ALERTS_TOTAL = 'tsbot_alerts_total'
+ALERT_DELIVERIES = 'tsbot_alert_deliveries_total'
+ALERT_QUEUE_DEPTH = 'tsbot_alert_queue_depth'
+metrics.registry.describe(ALERTS_TOTAL, "Алерты на входе диспетчера (result=queued|duplicate|dropped)")
+metrics.registry.describe(ALERT_DELIVERIES, "Отправка пачек алертов (sink, result=ok|timeout|busy|error|dropped)")
+metrics.registry.describe(ALERT_QUEUE_DEPTH, "Алертов в очереди диспетчера")
+
+
+def _iso(ts) -> str:
+    if ts is None:
+        return None
+    if hasattr(ts, 'isoformat'):
+        return ts.isoformat()
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def setup_alert(symbol: str, timeframe: str, point: dict) -> dict:
+    """Алерт из точки сетапа analyze_fractal_setups (session == 'Setup')."""
+    return {
+        'kind': KIND_SETUP,
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'type': point['type'],
+        'time': _iso(point['time']),
+        'price': float(point['price']),
+        'details': point.get('details'),
+        'created_at': _iso(time_module.time()),
+    }
+
+
+def signal_alert(symbol: str, timeframe: str, signal: dict) -> dict:
+    """Алерт из сигнала генератора (type или direction, time, price; остальное - в details)."""
+    details = {k: v for k, v in signal.items() if k not in ('type', 'direction', 'time', 'price')}
+    return {
+        'kind': KIND_SIGNAL,
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'type': signal.get('type') or signal.get('direction'),
+        'time': _iso(signal.get('time')),
+        'price': float(signal['price']) if signal.get('price') is not None else None,
+        'details': details or None,
+        'created_at': _iso(time_module.time()),
+    }
+
+
+def alert_key(alert: dict) -> tuple:
+    """Ключ дедупликации: один уровень одного сетапа (цена - с точностью до 1e-6)."""
+    price = round(alert['price'], 6) if alert.get('price') is not None else None
+    return alert['kind'], alert['symbol'], alert['timeframe'], alert['type'], alert['time'], price
+
+
+class _Deduper:
+    """Ключи, отправленные за последние ttl секунд (OrderedDict по времени появления)."""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl = ttl_seconds
+        self._expires = OrderedDict()
+
+    def seen(self, key: tuple, now: float) -> bool:
+        while self._expires:
+            oldest, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            del self._expires[oldest]
+        return key in self._expires
+
+    def add(self, key: tuple, now: float):
+        self._expires[key] = now + self.ttl
+
+
+class SinkBusyError(Exception):
+    """Все потоки приемника заняты предыдущими (в том числе просроченными) отправками."""
+
+
+class _ThreadedSink:
+    """
+    Приемник с блокирующей отправкой (_send_blocking) в собственном ограниченном пуле потоков.
+    Отправка, пережившая таймаут диспетчера, продолжается в потоке и держит его; пока заняты
+    все потоки, новые пачки не ставятся в очередь пула (SinkBusyError), так что зависший
+    приемник не копит работу и не занимает потоки других приемников.
+    """
+    name = None
+
+    def __init__(self, threads: int = settings.ALERT_SINK_THREADS):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"alert-{self.name}")
+        self._slots = threading.BoundedSemaphore(threads)
+
+    async def send(self, batch: list):
+        if not self._slots.acquire(blocking=False):
+            raise SinkBusyError(f"{self.name}: все потоки заняты")
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._run_blocking, batch)
+
+    def _run_blocking(self, batch: list):
+        try:
+            self._send_blocking(batch)
+        finally:
+            self._slots.release()
+
+    def _send_blocking(self, batch: list):
+        raise NotImplementedError
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class JsonlSink(_ThreadedSink):
+    """Файл JSONL; запись идет в потоке приемника, чтобы не занимать цикл диспетчера."""
+    name = 'jsonl'
+
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__()
+        self.path = path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path)
+        self.timeout = timeout or settings.ALERT_SINK_TIMEOUTS_SECONDS.get(self.name, 2.0)
+        # Запись, переждавшая таймаут, продолжается в потоке - следующая не должна с ней перемешаться
+        self._lock = threading.Lock()
+
+    def _send_blocking(self, batch: list):
+        lines = ''.join(json.dumps(alert, ensure_ascii=False, default=str) + '\n' for alert in batch)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+
+
+class WebhookSink(_ThreadedSink):
+    """POST {'alerts': [...]} на url (HTTP-приемник или его заглушка)."""
+    name = 'webhook'
+
+    def __init__(self, url: str, timeout: float = None):
+        if requests is None:
+            raise ImportError("Для WebhookSink нужен пакет requests")
+        super().__init__()
+        self.url = url
+        self.timeout = timeout or settings.ALERT_SINK_TIMEOUTS_SECONDS.get(self.name, 5.0)
+        self._session = requests.Session()
+
+    def _send_blocking(self, batch: list):
+        body = json.dumps({'alerts': batch}, ensure_ascii=False, default=str).encode('utf-8')
+        response = self._session.post(self.url, data=body, headers={'Content-Type': 'application/json'},
+                                      timeout=self.timeout)
+        response.raise_for_status()
+
+    async def close(self):
+        await super().close()
+        self._session.close()
+
+
+class SocketSink:
+    """Локальный TCP-приемник: строка JSON на алерт, соединение держится и переоткрывается после ошибки."""
+    name = 'socket'
+
+    def __init__(self, host: str, port: int, timeout: float = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout or settings.ALERT_SINK_TIMEOUTS_SECONDS.get(self.name, 1.0)
+        self._writer = None
+
+    async def send(self, batch: list):
+        if self._writer is None or self._writer.is_closing():
+            _, self._writer = await asyncio.open_connection(self.host, self.port)
+        payload = ''.join(json.dumps(alert, ensure_ascii=False, default=str) + '\n' for alert in batch)
+        try:
+            self._writer.write(payload.encode('utf-8'))
+            await self._writer.drain()
+        except (OSError, asyncio.CancelledError):
+            await self.close()
+            raise
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class AlertDispatcher:
+    """Очередь алертов и отправка пачками по приемникам в отдельном потоке с циклом asyncio."""
+
+    def __init__(self, sinks: list, queue_size: int = settings.ALERT_QUEUE_SIZE,
+                 batch_size: int = settings.ALERT_BATCH_SIZE,
+                 batch_window_seconds: float = settings.ALERT_BATCH_WINDOW_SECONDS,
+                 dedupe_ttl_seconds: float = settings.ALERT_DEDUPE_TTL_SECONDS,
+                 sink_queue_size: int = settings.ALERT_SINK_QUEUE_SIZE):
+        self.sinks = list(sinks)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window_seconds
+        self.sink_queue_size = sink_queue_size
+        self._deduper = _Deduper(dedupe_ttl_seconds)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._loop = None
+        self._queue = None
+        self._sink_queues = {}
+        self._tasks = []
+        self._thread = None
+        self._ready = threading.Event()
+
+    # --- вызывается из цикла анализа ---
+
+    def publish(self, alert: dict) -> bool:
+        """Кладет алерт в очередь; False - повтор или очередь полна. Никогда не ждет приемники."""
+        if self._loop is None:
+            self.start()
+        key = alert_key(alert)
+        now = time_module.monotonic()
+        with self._lock:
+            if self._deduper.seen(key, now):
+                metrics.inc(ALERTS_TOTAL, result='duplicate')
+                return False
+            if self._pending >= self.queue_size:
+                metrics.inc(ALERTS_TOTAL, result='dropped')
+                logger.warning("Очередь алертов полна (%d), алерт %s %s отброшен", self.queue_size,
+                               alert['symbol'], alert['type'], extra={'symbol': alert['symbol'], 'stage': 'alerts'})
+                return False
+            # Отброшенный по переполнению алерт не запоминается - следующая свеча отправит его снова
+            self._deduper.add(key, now)
+            self._pending += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, alert)
+        metrics.inc(ALERTS_TOTAL, result='queued')
+        return True
+
+    def publish_many(self, alerts) -> int:
+        return sum(1 for alert in alerts if self.publish(alert))
+
+    # --- цикл диспетчера ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        for sink in self.sinks:
+            self._sink_queues[sink.name] = asyncio.Queue(maxsize=self.sink_queue_size)
+            self._tasks.append(self._loop.create_task(self._sink_worker(sink, self._sink_queues[sink.name])))
+        self._tasks.append(self._loop.create_task(self._dispatch()))
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        with self._lock:
+            self._pending -= len(batch)
+            metrics.set_gauge(ALERT_QUEUE_DEPTH, self._pending)
+        return batch
+
+    async def _dispatch(self):
+        while True:
+            batch = await self._next_batch()
+            for sink_name, sink_queue in self._sink_queues.items():
+                try:
+                    sink_queue.put_nowait(batch)
+                except asyncio.QueueFull:
+                    metrics.inc(ALERT_DELIVERIES, sink=sink_name, result='dropped')
+                    logger.warning("Приемник %s не успевает, пачка из %d алертов отброшена", sink_name, len(batch),
+                                   extra={'stage': 'alerts'})
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _sink_worker(self, sink, sink_queue: asyncio.Queue):
+        while True:
+            batch = await sink_queue.get()
+            started = time_module.perf_counter()
+            try:
+                await asyncio.wait_for(sink.send(batch), sink.timeout)
+                result = 'ok'
+            except asyncio.TimeoutError:
+                result = 'timeout'
+                logger.warning("Приемник %s: таймаут %.1f с, пачка из %d алертов не отправлена", sink.name,
+                               sink.timeout, len(batch), extra={'stage': 'alerts'})
+            except SinkBusyError:
+                result = 'busy'
+                logger.warning("Приемник %s занят прошлой отправкой, пачка из %d алертов отброшена", sink.name,
+                               len(batch), extra={'stage': 'alerts'})
+            except Exception as e:
+                result = 'error'
+                logger.warning("Приемник %s: ошибка отправки пачки из %d алертов: %s", sink.name, len(batch), e,
+                               extra={'stage': 'alerts'})
+            metrics.inc(ALERT_DELIVERIES, sink=sink.name, result=result)
+            metrics.observe(metrics.STAGE_SECONDS, time_module.perf_counter() - started, stage=f'alert_{sink.name}')
+            sink_queue.task_done()
+
+    async def _drain(self):
+        await self._queue.join()
+        for sink_queue in self._sink_queues.values():
+            await sink_queue.join()
+
+    async def _shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for sink in self.sinks:
+            await sink.close()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Ждет отправки всего, что уже в очереди (не дольше timeout); True - все отправлено."""
+        if self._loop is None:
+            return True
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result(timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    def stop(self, timeout: float = 10.0):
+        """Отправляет очередь (не дольше timeout) и останавливает поток диспетчера."""
+        if self._thread is None:
+            return
+        if not self.flush(timeout):
+            logger.warning("Алерты не отправлены за %.1f с при остановке", timeout, extra={'stage': 'alerts'})
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        self._loop = None
+        self._tasks = []
+        self._sink_queues = {}
+        self._ready.clear()
+
+
+def default_sinks() -> list:
+    """Приемники из настроек ALERT_*."""
+    sinks = []
+    if settings.ALERT_JSONL_PATH:
+        sinks.append(JsonlSink(settings.ALERT_JSONL_PATH))
+    if settings.ALERT_WEBHOOK_URL and requests is not None:
+        sinks.append(WebhookSink(settings.ALERT_WEBHOOK_URL))
+    if settings.ALERT_SOCKET_ADDRESS:
+        host, _, port = settings.ALERT_SOCKET_ADDRESS.rpartition(':')
+        sinks.append(SocketSink(host or '127.0.0.1', int(port)))
+    return sinks
+
+
+_default_dispatcher = None
+_default_lock = threading.Lock()
+
+
+def get_dispatcher() -> AlertDispatcher:
+    """Общий диспетчер процесса с приемниками из настроек (запускается при первом вызове)."""
+    global _default_dispatcher
+    with _default_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = AlertDispatcher(default_sinks()).start()
+        return _default_dispatcher
+
+
+def stop_dispatcher(timeout: float = 10.0):
+    """
+    Отправляет очередь общего диспетчера и останавливает его. Вызывать до выхода из процесса
+    (поток диспетчера - демон; после начала завершения интерпретатора потоки записи уже не создаются).
+    """
+    global _default_dispatcher
+    with _default_lock:
+        dispatcher, _default_dispatcher = _default_dispatcher, None
+    if dispatcher is not None:
+        dispatcher.stop(timeout)
+
+
+def publish_setups(symbol: str, timeframe: str, session_points: list, dispatcher: AlertDispatcher = None) -> int:
+    """Сетапы из session_points анализа в алерты; возвращает число новых (не повторов)."""
+    setups = [point for point in session_points if point.get('session') == 'Setup']
+    if not setups:
+        return 0
+    dispatcher = dispatcher or get_dispatcher()
+    return dispatcher.publish_many(setup_alert(symbol, timeframe, point) for point in setups)
+
+
+if __name__ == '__main__':
+    import socketserver
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from utils.logger import setup_logger
+
+    setup_logger()
+    print("Тестирование alerts.py...")
+
+    received = {'socket': 0, 'webhook': 0}
+
+    class _SocketHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for _ in self.rfile:
+                received['socket'] += 1
+
+    class _SlowWebhook(BaseHTTPRequestHandler):
+        """Заглушка вебхука: отвечает через 1.5 с - дольше таймаута приемника."""
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time_module.sleep(1.5)
+            received['webhook'] += len(body['alerts'])
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    socket_server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SocketHandler)
+    socket_server.daemon_threads = True
+    http_server = HTTPServer(('127.0.0.1', 0), _SlowWebhook)
+    for server in (socket_server, http_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    jsonl_path = os.path.join(tempfile.mkdtemp(prefix='alerts_'), 'alerts.jsonl')
+    dispatcher = AlertDispatcher([
+        JsonlSink(jsonl_path),
+        WebhookSink(f"http://127.0.0.1:{http_server.server_address[1]}/alerts", timeout=0.5),
+        SocketSink('127.0.0.1', socket_server.server_address[1]),
+    ]).start()
+
+    # Закрытие часа: 30 пар по 3 сетапа, и каждый сетап найден повторно
+    setups = [{'time': datetime(2024, 5, 14, 3, i, tzinfo=timezone.utc), 'price': 1.08 + i * 0.001,
+               'type': 'SETUP_Resist', 'session': 'Setup', 'details': 'test'} for i in range(3)]
+    started = time_module.perf_counter()
+    queued = 0
+    for _ in range(2):
+        for symbol in settings.SCANNER_SYMBOLS:
+            queued += publish_setups(symbol, '1h', setups, dispatcher)
+    publish_seconds = time_module.perf_counter() - started
+    print(f"Опубликовано {queued} алертов (повторы отброшены) за {publish_seconds * 1000:.2f} мс - "
+          f"{publish_seconds / (2 * len(settings.SCANNER_SYMBOLS) * len(setups)) * 1e6:.1f} мкс на вызов")
+
+    dispatcher.stop()
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        print(f"JSONL: {sum(1 for _ in f)} строк, сокет: {received['socket']} алертов, "
+              f"вебхук (медленный, таймаут): {received['webhook']}")
+    deliveries = {dict(labels)['sink'] + ':' + dict(labels)['result']: int(value)
+                  for (name, labels), value in metrics.registry.snapshot()['counters'].items() if name == ALERT_DELIVERIES}
+    print("Отправки пачек:", deliveries)
+    socket_server.shutdown()
+    http_server.shutdown()
@@ -0,0 +1,438 @@
+# core/analysis_store.py
+"""
+Постоянное хранилище результатов анализа в SQLite: свинги (с их N), точки структуры
+HH/HL/LH/LL, линии тренда, сессионные фракталы и сетапы SETUP_Resist/SETUP_Support
+с деталями. Бэктесты и дашборды читают исторические уровни отсюда, а не пересчитывают их.
+
+Таблицы:
+    runs        - прогон анализа: символ, таймфрейм, последняя свеча, контекст и сводка; одна строка
+                  на (символ, таймфрейм, последняя свеча) - обновления формирующейся свечи ее перезаписывают
+    points      - уровни; одна строка на (символ, таймфрейм, вид, N, сторона, время) - повторный
+                  анализ того же окна обновляет строку, а не дублирует ее
+    trend_lines - линии тренда каждого прогона (заменяются вместе с прогоном)
+
+Индексы (symbol, timeframe, time) и (symbol, type, price) покрывают выборки по периоду
+и по ценовому диапазону: "нетронутые сетапы поддержки в 20 пипсах от цены за 3 месяца" -
+это диапазон по индексу цены, а не перебор таблицы.
+
+touched_at - время первой более поздней свечи, дошедшей до уровня (high >= цены для
+сопротивлений, low <= цены для поддержек); NULL - уровень еще не тронут. checked_through -
+последняя свеча, по которой нетронутый уровень уже проверен: каждое сохранение проверяет
+только свечи новее нее.
+
+Сервер графиков пишет через save_analysis_async: запись идет в фоновом потоке, запрос
+не ждет SQLite.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time as time_module
+
+import numpy as np
+import pandas as pd
+
+from configs import settings
+from utils.epoch import index_to_epoch_seconds, to_epoch_seconds
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCHEMA_VERSION = 2
+
+KIND_SWING = 'swing'
+KIND_STRUCTURE = 'structure'
+KIND_FRACTAL = 'fractal'
+KIND_SETUP = 'setup'
+
+SIDE_HIGH = 'H'
+SIDE_LOW = 'L'
+HIGH_POINT_TYPES = ('H_SWING', 'HH', 'LH', 'H', 'SETUP_Resist')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    analyzed_at INTEGER NOT NULL,
+    first_bar_time INTEGER,
+    last_bar_time INTEGER,
+    bars INTEGER NOT NULL,
+    overall_context TEXT,
+    summary_json TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS runs_symbol_timeframe_last_bar_key ON runs (symbol, timeframe, last_bar_time);
+
+CREATE TABLE IF NOT EXISTS points (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    side TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    price REAL NOT NULL,
+    session TEXT,
+    details TEXT,
+    touched_at INTEGER,
+    checked_through INTEGER,
+    UNIQUE (symbol, timeframe, kind, n, side, time)
+);
+CREATE INDEX IF NOT EXISTS points_symbol_timeframe_time ON points (symbol, timeframe, time);
+CREATE INDEX IF NOT EXISTS points_symbol_type_price ON points (symbol, type, price);
+
+CREATE TABLE IF NOT EXISTS trend_lines (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    start_price REAL NOT NULL,
+    end_time INTEGER NOT NULL,
+    end_price REAL NOT NULL,
+    color TEXT,
+    line_style INTEGER
+);
+CREATE INDEX IF NOT EXISTS trend_lines_run ON trend_lines (run_id);
+"""
+
+_UPSERT_POINT = """
+INSERT INTO points (run_id, symbol, timeframe, kind, n, side, time, type, price, session, details)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (symbol, timeframe, kind, n, side, time) DO UPDATE SET
+    run_id = excluded.run_id, type = excluded.type, price = excluded.price,
+    session = excluded.session, details = excluded.details,
+    touched_at = CASE WHEN points.price = excluded.price THEN points.touched_at END,
+    checked_through = CASE WHEN points.price = excluded.price THEN points.checked_through END
+"""
+
+_UPSERT_RUN = """
+INSERT INTO runs (symbol, timeframe, analyzed_at, first_bar_time, last_bar_time, bars, overall_context, summary_json)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (symbol, timeframe, last_bar_time) DO UPDATE SET
+    analyzed_at = excluded.analyzed_at, first_bar_time = excluded.first_bar_time, bars = excluded.bars,
+    overall_context = excluded.overall_context, summary_json = excluded.summary_json
+RETURNING id
+"""
+
+# Кандидатов на касание за один проход: матрица (уровни x новые свечи) остается небольшой
+_TOUCH_CHUNK = 2048
+
+
+def point_side(point_type: str) -> str:
+    """Сторона уровня: H - сопротивление (свинг/фрактал максимума, SETUP_Resist), L - поддержка."""
+    if point_type in HIGH_POINT_TYPES or point_type.startswith('F_H'):
+        return SIDE_HIGH
+    return SIDE_LOW
+
+
+def _normalize_fractal(point: dict) -> tuple:
+    """
+    (тип, сессия) фрактала без относительного номера дня: F_H_NY1 -> F_H_NY, 'NY (Day -1)' -> 'NY'.
+    Номер дня считается от текущей свечи и меняется каждый день - в хранилище он не нужен.
+    """
+    point_type = point['type'].rstrip('0123456789')
+    session = point.get('session') or ''
+    return point_type, session.split(' (', 1)[0] or None
+
+
+def _point_rows(analysis: dict) -> list:
+    """Строки (kind, n, side, time, type, price, session, details) из результата run_chart_analysis."""
+    rows = []
+    swings = analysis.get('swings') or {}
+    swing_n = swings.get('n', settings.SWING_POINT_N)
+    for p in (swings.get('highs') or []) + (swings.get('lows') or []):
+        rows.append((KIND_SWING, swing_n, point_side(p['type']), to_epoch_seconds(p['time']), p['type'],
+                     float(p['price']), None, None))
+    for p in analysis.get('structure_points') or []:
+        rows.append((KIND_STRUCTURE, swing_n, point_side(p['type']), to_epoch_seconds(p['time']), p['type'],
+                     float(p['price']), None, None))
+    for p in analysis.get('session_points') or []:
+        if p['type'].startswith('SETUP_'):
+            rows.append((KIND_SETUP, settings.SESSION_FRACTAL_N, point_side(p['type']), to_epoch_seconds(p['time']),
+                         p['type'], float(p['price']), 'Asia', p.get('details')))
+        elif p['type'].startswith('F_'):
+            point_type, session = _normalize_fractal(p)
+            rows.append((KIND_FRACTAL, settings.SESSION_FRACTAL_N, point_side(point_type),
+                         to_epoch_seconds(p['time']), point_type, float(p['price']), session, None))
+    return rows
+
+
+def _resolve_path(path: str) -> str:
+    if path == ':memory:' or os.path.isabs(path):
+        return path
+    return os.path.join(PROJECT_ROOT, path)
+
+
+class AnalysisStore:
+    """
+    Файл SQLite с уровнями анализа. Одно соединение на экземпляр под блокировкой (потоки
+    HTTP-сервера короткоживущие); режим WAL позволяет другим процессам читать во время записи.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = _resolve_path(path or settings.ANALYSIS_STORE_PATH)
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._writes = None
+        self._writer = None
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if 0 < version < SCHEMA_VERSION:
+                self._migrate(version)
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _migrate(self, version: int):
+        """Схема 1 -> 2: один прогон на последнюю свечу (дубликаты сливаются в последний) и checked_through."""
+        if version < 2:
+            logger.info("Миграция хранилища анализа: схема %d -> 2", version, extra={'stage': 'analysis_store'})
+            self._conn.execute("ALTER TABLE points ADD COLUMN checked_through INTEGER")
+            self._conn.execute(
+                "CREATE TEMP TABLE run_keep AS SELECT r.id AS id, "
+                "(SELECT MAX(k.id) FROM runs k WHERE k.symbol = r.symbol AND k.timeframe = r.timeframe "
+                "AND k.last_bar_time = r.last_bar_time) AS keep_id FROM runs r WHERE r.last_bar_time IS NOT NULL")
+            self._conn.execute("UPDATE points SET run_id = (SELECT keep_id FROM run_keep WHERE run_keep.id = points.run_id) "
+                               "WHERE run_id IN (SELECT id FROM run_keep WHERE id != keep_id)")
+            self._conn.execute("DELETE FROM trend_lines WHERE run_id IN (SELECT id FROM run_keep WHERE id != keep_id)")
+            self._conn.execute("DELETE FROM runs WHERE id IN (SELECT id FROM run_keep WHERE id != keep_id)")
+            self._conn.execute("DROP TABLE run_keep")
+            self._conn.execute("DROP INDEX IF EXISTS runs_symbol_timeframe_last_bar")
+
+    def close(self):
+        """Дописывает очередь фоновой записи и закрывает соединение."""
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._lock:
+            self._conn.close()
+
+    def save_analysis(self, symbol: str, timeframe: str, analysis: dict, df: pd.DataFrame = None) -> int:
+        """
+        Сохраняет результат run_chart_analysis и, если передан df, отмечает тронутые уровни
+        по его свечам. Повторное сохранение с той же последней свечой (обновилась формирующаяся)
+        перезаписывает прогон и его линии тренда. Возвращает id прогона.
+        """
+        started = time_module.perf_counter()
+        bar_times = index_to_epoch_seconds(df.index) if df is not None and not df.empty else []
+        rows = _point_rows(analysis)
+        with self._lock, self._conn:
+            run_id = self._conn.execute(_UPSERT_RUN, (
+                symbol, timeframe, int(time_module.time()),
+                int(bar_times[0]) if len(bar_times) else None, int(bar_times[-1]) if len(bar_times) else None,
+                len(bar_times), analysis.get('overall_context'),
+                json.dumps(analysis.get('summary') or [], ensure_ascii=False, default=str))).fetchone()[0]
+            self._conn.execute("DELETE FROM trend_lines WHERE run_id = ?", (run_id,))
+            self._conn.executemany(_UPSERT_POINT, [(run_id, symbol, timeframe) + row for row in rows])
+            self._conn.executemany(
+                "INSERT INTO trend_lines (run_id, symbol, timeframe, start_time, start_price, end_time, end_price, "
+                "color, line_style) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, symbol, timeframe, to_epoch_seconds(line['start_time']), float(line['start_price']),
+                  to_epoch_seconds(line['end_time']), float(line['end_price']), line.get('color'),
+                  line.get('lineStyle')) for line in analysis.get('trend_lines') or []])
+            if len(bar_times):
+                touched = self._mark_touches(symbol, timeframe, df, bar_times)
+            else:
+                touched = 0
+        metrics.observe(metrics.STAGE_SECONDS, time_module.perf_counter() - started, stage='analysis_store')
+        logger.debug("Сохранен анализ: прогон %d, уровней %d, тронуто %d", run_id, len(rows), touched,
+                     extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'analysis_store'})
+        return run_id
+
+    def save_analysis_async(self, symbol: str, timeframe: str, analysis: dict, df: pd.DataFrame = None) -> bool:
+        """
+        save_analysis в фоновом потоке записи (для пути HTTP-запроса). analysis и df после вызова
+        не должны меняться. False - очередь (ANALYSIS_STORE_QUEUE_SIZE) полна и прогон пропущен.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writes = queue.Queue(maxsize=settings.ANALYSIS_STORE_QUEUE_SIZE)
+                self._writer = threading.Thread(target=self._write_loop, name="analysis-store-writer", daemon=True)
+                self._writer.start()
+        try:
+            self._writes.put_nowait((symbol, timeframe, analysis, df))
+            return True
+        except queue.Full:
+            logger.warning("Очередь записи анализа заполнена, прогон пропущен",
+                           extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'analysis_store'})
+            return False
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            symbol, timeframe, analysis, df = item
+            try:
+                self.save_analysis(symbol, timeframe, analysis, df)
+            except Exception as e:
+                logger.exception("Ошибка сохранения анализа: %s", e,
+                                 extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'analysis_store'})
+
+    def update_touches(self, symbol: str, timeframe: str, df: pd.DataFrame) -> int:
+        """Отмечает уровни, до которых дошли свечи df; возвращает число новых касаний."""
+        if df is None or df.empty:
+            return 0
+        with self._lock, self._conn:
+            return self._mark_touches(symbol, timeframe, df, index_to_epoch_seconds(df.index))
+
+    def _mark_touches(self, symbol: str, timeframe: str, df: pd.DataFrame, bar_times) -> int:
+        """
+        Первая свеча строго после уровня, дошедшая до его цены. Уровень проверяется только по свечам
+        новее checked_through; проверенной считается предпоследняя свеча df - последняя может еще
+        формироваться и проверяется снова. Вызывается под блокировкой в транзакции.
+        """
+        last_time = int(bar_times[-1])
+        candidates = self._conn.execute(
+            "SELECT id, side, time, price, checked_through FROM points WHERE symbol = ? AND timeframe = ? "
+            "AND touched_at IS NULL AND time < ? AND (checked_through IS NULL OR checked_through < ?)",
+            (symbol, timeframe, last_time, last_time)).fetchall()
+        highs = df['high'].to_numpy()
+        lows = df['low'].to_numpy()
+        updates = []
+        for chunk_start in range(0, len(candidates), _TOUCH_CHUNK):
+            chunk = candidates[chunk_start:chunk_start + _TOUCH_CHUNK]
+            ids = np.array([row['id'] for row in chunk])
+            prices = np.array([row['price'] for row in chunk])
+            is_high = np.array([row['side'] == SIDE_HIGH for row in chunk])
+            checked_from = np.array([max(row['time'], row['checked_through'] or row['time']) for row in chunk])
+            starts = bar_times.searchsorted(checked_from, side='right')
+            first_start = int(starts.min())
+            if first_start >= len(bar_times):
+                continue
+            positions = np.arange(first_start, len(bar_times))
+            hits = np.where(is_high[:, None], highs[None, first_start:] >= prices[:, None],
+                            lows[None, first_start:] <= prices[:, None])
+            hits &= positions[None, :] >= starts[:, None]
+            touched = hits.any(axis=1)
+            first = hits.argmax(axis=1)
+            updates.extend((int(bar_times[first_start + f]), int(point_id))
+                           for point_id, f in zip(ids[touched], first[touched]))
+        self._conn.executemany("UPDATE points SET touched_at = ? WHERE id = ?", updates)
+        if len(bar_times) > 1:
+            settled = int(bar_times[-2])
+            self._conn.execute(
+                "UPDATE points SET checked_through = ? WHERE symbol = ? AND timeframe = ? AND touched_at IS NULL "
+                "AND time < ? AND (checked_through IS NULL OR checked_through < ?)",
+                (settled, symbol, timeframe, last_time, settled))
+        return len(updates)
+
+    def find_levels(self, symbol: str, types=None, timeframe: str = None, kind: str = None, session: str = None,
+                    near_price: float = None, within_pips: float = None, pip_value: float = None,
+                    since=None, until=None, untouched: bool = None, limit: int = None) -> list:
+        """
+        Уровни символа с фильтрами. near_price + within_pips - ценовой диапазон (пипс пары из
+        settings.get_pip_value, если pip_value не задан); since/until - epoch-секунды или дата;
+        untouched=True - только нетронутые, False - только тронутые. Сортировка - по времени.
+        """
+        clauses, params = ["symbol = ?"], [symbol]
+        if types:
+            types = [types] if isinstance(types, str) else list(types)
+            clauses.append(f"type IN ({', '.join('?' * len(types))})")
+            params.extend(types)
+        for column, value in (('timeframe', timeframe), ('kind', kind), ('session', session)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if near_price is not None and within_pips is not None:
+            distance = within_pips * (pip_value or settings.get_pip_value(symbol))
+            clauses.append("price BETWEEN ? AND ?")
+            params.extend([near_price - distance, near_price + distance])
+        if since is not None:
+            clauses.append("time >= ?")
+            params.append(to_epoch_seconds(since))
+        if until is not None:
+            clauses.append("time < ?")
+            params.append(to_epoch_seconds(until))
+        if untouched is not None:
+            clauses.append("touched_at IS NULL" if untouched else "touched_at IS NOT NULL")
+        sql = ("SELECT symbol, timeframe, kind, n, side, time, type, price, session, details, touched_at "
+               f"FROM points WHERE {' AND '.join(clauses)} ORDER BY time")
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [_row_to_level(row) for row in rows]
+
+    def trend_lines_for(self, symbol: str, timeframe: str, as_of=None) -> list:
+        """Линии тренда последнего прогона, чья последняя свеча не позже as_of (для бэктеста)."""
+        sql = "SELECT id FROM runs WHERE symbol = ? AND timeframe = ?"
+        params = [symbol, timeframe]
+        if as_of is not None:
+            sql += " AND last_bar_time <= ?"
+            params.append(to_epoch_seconds(as_of))
+        sql += " ORDER BY last_bar_time DESC, id DESC LIMIT 1"
+        with self._lock:
+            run = self._conn.execute(sql, params).fetchone()
+            if run is None:
+                return []
+            rows = self._conn.execute(
+                "SELECT start_time, start_price, end_time, end_price, color, line_style FROM trend_lines "
+                "WHERE run_id = ? ORDER BY id", (run['id'],)).fetchall()
+        return [{'start_time': _epoch_to_timestamp(r['start_time']), 'start_price': r['start_price'],
+                 'end_time': _epoch_to_timestamp(r['end_time']), 'end_price': r['end_price'],
+                 'color': r['color'], 'lineStyle': r['line_style']} for r in rows]
+
+
+def _epoch_to_timestamp(value):
+    return pd.Timestamp(value, unit='s', tz='UTC') if value is not None else None
+
+
+def _row_to_level(row) -> dict:
+    level = dict(row)
+    level['time'] = _epoch_to_timestamp(level['time'])
+    level['touched_at'] = _epoch_to_timestamp(level['touched_at'])
+    return level
+
+
+if __name__ == '__main__':
+    import tempfile
+    from benchmarks.synthetic import generate_fx_ohlcv
+    from core.chart_payload import run_chart_analysis
+    from utils.logger import setup_logger
+
+    setup_logger()
+    print("Тестирование analysis_store.py...")
+    store = AnalysisStore(os.path.join(tempfile.mkdtemp(prefix='analysis_store_'), 'analysis.sqlite3'))
+
+    # Два года 1h-свечей, анализ скользящими окнами - как при обновлениях сервера графиков
+    df = generate_fx_ohlcv(24 * 520, freq='1h')
+    started = time_module.perf_counter()
+    window = settings.CHART_OUTPUT_SIZE
+    for end in range(window, len(df) + 1, 24):
+        frame = df.iloc[end - window:end]
+        store.save_analysis('EUR/USD', '1h', run_chart_analysis(frame), frame)
+    print(f"Сохранено за {time_module.perf_counter() - started:.2f} с")
+
+    last_close = float(df['close'].iloc[-1])
+    three_months_ago = df.index[-1] - pd.Timedelta(days=91)
+    timings = []
+    for _ in range(20):
+        started = time_module.perf_counter()
+        levels = store.find_levels('EUR/USD', types='SETUP_Support', session='Asia', near_price=last_close,
+                                   within_pips=20, since=three_months_ago, untouched=True)
+        timings.append(time_module.perf_counter() - started)
+    print(f"Нетронутые азиатские SETUP_Support в 20 пипсах от {last_close:.5f} за 3 месяца: {len(levels)}, "
+          f"медиана запроса {np.median(timings) * 1000:.2f} мс")
+    for level in levels[:5]:
+        print(f"  {level['time']} {level['type']} {level['price']:.5f} {level['details']}")
+
+    all_levels = store.find_levels('EUR/USD')
+    print("Уровней по видам:", {k: sum(1 for l in all_levels if l['kind'] == k)
+                               for k in (KIND_SWING, KIND_STRUCTURE, KIND_FRACTAL, KIND_SETUP)})
+    print("Тронуто:", sum(1 for l in all_levels if l['touched_at'] is not None))
+    print("Линий тренда в последнем прогоне:", len(store.trend_lines_for('EUR/USD', '1h')))
+    store.close()
@@ -0,0 +1,396 @@
+# core/chart_payload.py
+import json
+import threading
+import numpy as np
+import pandas as pd
+from configs import settings
+from ts_logic.context_analyzer_1h import (
+    find_swing_points,
+    analyze_market_structure_points,
+    determine_overall_market_context,
+    determine_trend_lines_v2,
+    summarize_analysis,
+)
+from ts_logic.fractal_analyzer import analyze_fractal_setups
+from utils.decimation import decimate_ohlcv, pin_epochs
+from utils.epoch import index_to_epoch_seconds, price_scale_for, to_epoch_seconds
+from utils import metrics, profiling
+
+
+def run_chart_analysis(df: pd.DataFrame, pip_value: float = settings.PIP_VALUE_DEFAULT,
+                       liquidity_index=None) -> dict:
+    """
+    Выполняет полный анализ для графика: свинги, структура рынка, линии тренда,
+    сессионные фракталы/сетапы и текстовая сводка. pip_value - размер пипса пары;
+    liquidity_index - индекс уровней за длинный период для поиска сетапов (необязательно).
+    """
+    analysis = {
+        'structure_points': [],
+        'session_points': [],
+        'trend_lines': [],
+        'overall_context': None,
+        'summary': [],
+        'swings': {'n': settings.SWING_POINT_N, 'highs': [], 'lows': []},
+    }
+    if df is None or df.empty:
+        return analysis
+
+    with profiling.profile_run('analysis', bars=len(df)):
+        with metrics.stage_timer('swings'), profiling.stage('swings'):
+            swing_highs, swing_lows = find_swing_points(df, n=settings.SWING_POINT_N)
+        with metrics.stage_timer('structure'), profiling.stage('structure'):
+            structure_points = analyze_market_structure_points(swing_highs, swing_lows)
+            overall_context = determine_overall_market_context(structure_points)
+        with metrics.stage_timer('trend_lines'), profiling.stage('trend_lines'):
+            trend_lines = determine_trend_lines_v2(
+                swing_highs, swing_lows,
+                df.index[-1],
+                df[['high', 'low', 'close']],
+                points_window_size=settings.TRENDLINE_POINTS_WINDOW_SIZE,
+            )
+        with metrics.stage_timer('fractal_setups'), profiling.stage('fractal_setups'):
+            session_points = analyze_fractal_setups(df, df.index[-1], pip_value, liquidity_index)
+
+        analysis['swings'] = {'n': settings.SWING_POINT_N, 'highs': swing_highs, 'lows': swing_lows}
+        analysis['structure_points'] = structure_points
+        analysis['session_points'] = session_points
+        analysis['trend_lines'] = trend_lines
+        analysis['overall_context'] = overall_context
+        with metrics.stage_timer('summary'), profiling.stage('summary'):
+            analysis['summary'] = summarize_analysis(df, structure_points, session_points, overall_context, trend_lines)
+    return analysis
+
+
+def history_window_payload(df: pd.DataFrame) -> dict:
+    """
+    Ответ для окна истории: свечи окна и маркеры структуры (HH/HL/LH/LL), найденные
+    внутри окна. Сессионные фракталы считаются только для текущего дня и сюда не входят;
+    свинги в последних SWING_POINT_N свечах окна не подтверждаются (нет правого контекста).
+    """
+    markers = []
+    if df is not None and not df.empty:
+        swing_highs, swing_lows = find_swing_points(df, n=settings.SWING_POINT_N)
+        markers = list(collect_markers(analyze_market_structure_points(swing_highs, swing_lows)).values())
+    else:
+        df = pd.DataFrame()
+    return {
+        'full': True,
+        'cursor': None,
+        'ohlcv': df,
+        'markers': markers,
+        'trendLines': [],
+        'analysisSummary': None,
+        'fractalCount': None,
+    }
+
+
+# Кодировки ответа /api/chart_data
+ENCODING_ROWS = 'rows'          # список объектов-свечей с ISO-временем (исходный формат)
+ENCODING_COLUMNAR = 'columnar'  # колонки: epoch-секунды + массивы цен
+PRICES_FLOAT = 'float'
+PRICES_PIPS = 'pips'            # цены целыми в пипеттах (1/10 пипса)
+
+
+def epoch_to_iso(epoch: int) -> str:
+    return pd.Timestamp(epoch, unit='s', tz='UTC').isoformat()
+
+
+def marker_id(point: dict) -> str:
+    """Стабильный идентификатор маркера: тип + время."""
+    return f"{point['type']}@{to_epoch_seconds(point['time'])}"
+
+
+def collect_markers(points: list) -> dict:
+    """Маркеры по идентификатору (id -> маркер), время в epoch-секундах."""
+    markers = {}
+    for point in points:
+        if point.get('time') is None or point.get('type') is None:
+            continue
+        marker = {
+            'id': marker_id(point),
+            'time': to_epoch_seconds(point['time']),
+            'type': point['type'],
+            'price': float(point['price']) if point.get('price') is not None else None,
+        }
+        markers[marker['id']] = marker
+    return markers
+
+
+def collect_trend_lines(trend_lines: list) -> list:
+    """Линии тренда с временем в epoch-секундах."""
+    collected = []
+    for line in trend_lines:
+        collected.append({
+            'start_time': to_epoch_seconds(line['start_time']),
+            'start_price': float(line['start_price']),
+            'end_time': to_epoch_seconds(line['end_time']),
+            'end_price': float(line['end_price']),
+            'color': line.get('color'),
+            'lineStyle': line.get('lineStyle'),
+        })
+    return collected
+
+
+def encode_ohlcv(df: pd.DataFrame, encoding: str = ENCODING_ROWS, prices: str = PRICES_FLOAT,
+                 price_scale: int = None):
+    """
+    Кодирует свечи для ответа API.
+    rows: [{'time': ISO, 'open': ..., ...}]; columnar: {'time': [epoch...], 'open': [...], ...}.
+    """
+    if encoding == ENCODING_ROWS:
+        rows = []
+        if df.empty:
+            return rows
+        for ts, o, h, l, c in zip(df.index, df['open'].values, df['high'].values, df['low'].values, df['close'].values):
+            rows.append({'time': ts.isoformat(), 'open': float(o), 'high': float(h), 'low': float(l), 'close': float(c)})
+        return rows
+
+    if df.empty:
+        df = pd.DataFrame(columns=['open', 'high', 'low', 'close'], dtype=np.float64,
+                          index=pd.DatetimeIndex([], tz='UTC'))
+    columns = {'time': index_to_epoch_seconds(df.index)}
+    for col in ('open', 'high', 'low', 'close'):
+        values = df[col].to_numpy(dtype=np.float64)
+        if prices == PRICES_PIPS:
+            values = np.rint(values * price_scale).astype(np.int32)
+        columns[col] = values
+    return columns
+
+
+def encode_markers(markers: list, encoding: str = ENCODING_ROWS):
+    """rows: список объектов с ISO-временем; columnar: колонки time/typeIndex/price + словарь типов."""
+    if encoding == ENCODING_ROWS:
+        return [dict(m, time=epoch_to_iso(m['time'])) for m in markers]
+    types = sorted({m['type'] for m in markers})
+    type_index = {t: i for i, t in enumerate(types)}
+    return {
+        'types': types,
+        'time': np.array([m['time'] for m in markers], dtype=np.int64),
+        'typeIndex': np.array([type_index[m['type']] for m in markers], dtype=np.int32),
+        'price': np.array([m['price'] if m['price'] is not None else np.nan for m in markers], dtype=np.float64),
+    }
+
+
+def encode_trend_lines(trend_lines, encoding: str = ENCODING_ROWS):
+    if trend_lines is None or encoding != ENCODING_ROWS:
+        return trend_lines
+    return [dict(line, start_time=epoch_to_iso(line['start_time']), end_time=epoch_to_iso(line['end_time']))
+            for line in trend_lines]
+
+
+def columns_to_lists(value):
+    """Рекурсивно переводит numpy-массивы в списки для json.dumps."""
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f' and np.isnan(value).any():
+            return [None if np.isnan(v) else v for v in value.tolist()]
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: columns_to_lists(v) for k, v in value.items()}
+    return value
+
+
+class ChartSnapshot:
+    """
+    Неизменяемый снимок данных графика для одного ключа (символ, интервал, дата бэктеста).
+    version - монотонный номер, который клиент получает как cursor.
+    """
+
+    def __init__(self, version: int, df: pd.DataFrame, analysis: dict):
+        self.version = version
+        self.df = df
+        self.bar_times = index_to_epoch_seconds(df.index) if not df.empty else np.empty(0, dtype=np.int64)
+        self.markers = collect_markers(analysis['structure_points'] + analysis['session_points'])
+        self.trend_lines = collect_trend_lines(analysis['trend_lines'])
+        self.summary = analysis['summary']
+        self.fractal_count = sum(1 for p in analysis['session_points'] if p['type'].startswith('F_'))
+
+    @property
+    def last_bar_time(self):
+        return int(self.bar_times[-1]) if len(self.bar_times) else None
+
+    def bars_since(self, since_epoch: int) -> pd.DataFrame:
+        """Свечи с временем >= since_epoch (последняя известная клиенту свеча могла измениться)."""
+        start = int(np.searchsorted(self.bar_times, since_epoch, side='left'))
+        return self.df.iloc[start:]
+
+    def _payload(self, full: bool, bars: pd.DataFrame, markers: list, trend_lines, **extra) -> dict:
+        payload = {
+            'full': full,
+            'cursor': str(self.version),
+            'ohlcv': bars,
+            'markers': markers,
+            'trendLines': trend_lines,
+            'analysisSummary': self.summary,
+            'fractalCount': self.fractal_count,
+        }
+        payload.update(extra)
+        return payload
+
+    def full_payload(self) -> dict:
+        """Полный ответ: вся история свечей и все маркеры."""
+        return self._payload(True, self.df, list(self.markers.values()), self.trend_lines)
+
+    def delta_from(self, previous: 'ChartSnapshot') -> dict:
+        """
+        Инкрементальный ответ относительно снимка, который уже есть у клиента:
+        только новые/изменённые свечи, новые и исчезнувшие маркеры, линии тренда (если изменились).
+        """
+        since = previous.last_bar_time if previous.last_bar_time is not None else 0
+        added_markers = [m for mid, m in self.markers.items() if previous.markers.get(mid) != m]
+        removed_markers = [mid for mid in previous.markers if mid not in self.markers]
+        trend_lines = self.trend_lines if self.trend_lines != previous.trend_lines else None
+        return self._payload(False, self.bars_since(since), added_markers, trend_lines,
+                             removedMarkers=removed_markers)
+
+    def since_payload(self, since_epoch: int) -> dict:
+        """
+        Ответ по метке времени без cursor: свечи и маркеры начиная с since_epoch.
+        Клиент заменяет все свои маркеры с временем >= markersFrom.
+        """
+        markers = [m for m in self.markers.values() if m['time'] >= since_epoch]
+        return self._payload(False, self.bars_since(since_epoch), markers, self.trend_lines,
+                             markersFrom=since_epoch)
+
+
+def decimate_payload(payload: dict, width: int = None, bars_per_bucket: int = None) -> dict:
+    """
+    Прореживает полный ответ до разрешения экрана: свечи объединяются в корзины с корректным OHLC,
+    маркеры и концы линий тренда переносятся на начало своей корзины (id маркеров не меняются).
+    Дельты не прореживаются - клиент с прореженным видом запрашивает полный ответ заново.
+    """
+    if not payload.get('full') or (not width and not bars_per_bucket):
+        return payload
+    bars, factor = decimate_ohlcv(payload['ohlcv'], width, bars_per_bucket)
+    if factor <= 1:
+        return payload
+    bucket_epochs = index_to_epoch_seconds(bars.index)
+    decimated = dict(payload, ohlcv=bars, barsPerBucket=factor)
+    if payload['markers']:
+        pinned = pin_epochs([m['time'] for m in payload['markers']], bucket_epochs)
+        decimated['markers'] = [dict(m, time=int(t)) for m, t in zip(payload['markers'], pinned)]
+    if payload['trendLines']:
+        starts = pin_epochs([line['start_time'] for line in payload['trendLines']], bucket_epochs)
+        ends = pin_epochs([line['end_time'] for line in payload['trendLines']], bucket_epochs)
+        decimated['trendLines'] = [dict(line, start_time=int(st), end_time=int(et))
+                                   for line, st, et in zip(payload['trendLines'], starts, ends)]
+    return decimated
+
+
+def encode_payload(payload: dict, encoding: str = ENCODING_ROWS, prices: str = PRICES_FLOAT,
+                   price_scale: int = None) -> dict:
+    """
+    Кодирует ответ снимка (свечи - DataFrame, маркеры/линии - epoch) в выбранный формат.
+    Для columnar числовые колонки остаются numpy-массивами: их сериализует вызывающий
+    (json через columns_to_lists или бинарное тело).
+    """
+    if price_scale is None:
+        price_scale = price_scale_for()
+    encoded = dict(payload)
+    encoded['ohlcv'] = encode_ohlcv(payload['ohlcv'], encoding, prices, price_scale)
+    encoded['markers'] = encode_markers(payload['markers'], encoding)
+    encoded['trendLines'] = encode_trend_lines(payload['trendLines'], encoding)
+    if encoding != ENCODING_ROWS:
+        encoded['encoding'] = encoding
+        encoded['prices'] = prices
+        if prices == PRICES_PIPS:
+            encoded['priceScale'] = price_scale
+    return encoded
+
+
+BINARY_MAGIC = b'TSB1'
+BINARY_ALIGNMENT = 8
+
+
+def _align(offset: int) -> int:
+    return (offset + BINARY_ALIGNMENT - 1) // BINARY_ALIGNMENT * BINARY_ALIGNMENT
+
+
+def encode_binary(encoded: dict) -> bytes:
+    """
+    Бинарное тело columnar-ответа для типизированных массивов на фронтенде:
+    b'TSB1' | uint32 LE длина заголовка | JSON-заголовок | выравнивание до 8 | колонки.
+    Заголовок - тот же ответ без числовых колонок плюс список 'columns'
+    (путь, dtype, offset от начала секции данных, длина). Время - uint32 epoch-секунды.
+    """
+    header = {k: v for k, v in encoded.items() if k not in ('ohlcv', 'markers')}
+    header['markers'] = {'types': encoded['markers']['types']}
+    columns = []
+    chunks = []
+    offset = 0
+    for group in ('ohlcv', 'markers'):
+        for name, values in encoded[group].items():
+            if not isinstance(values, np.ndarray):
+                continue
+            values = values.astype('<u4') if name == 'time' else values.astype(values.dtype.newbyteorder('<'))
+            columns.append({'path': f'{group}.{name}', 'dtype': values.dtype.str[1:],
+                             'offset': offset, 'length': int(len(values))})
+            chunks.append((offset, values.tobytes()))
+            offset = _align(offset + values.nbytes)
+    header['columns'] = columns
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(BINARY_MAGIC) + 4 + len(header_bytes))
+    body = bytearray(data_start + offset)
+    body[0:4] = BINARY_MAGIC
+    body[4:8] = len(header_bytes).to_bytes(4, 'little')
+    body[8:8 + len(header_bytes)] = header_bytes
+    for chunk_offset, chunk in chunks:
+        body[data_start + chunk_offset:data_start + chunk_offset + len(chunk)] = chunk
+    return bytes(body)
+
+
+class ChartSnapshotStore:
+    """
+    Хранит последние снимки графика по ключу, чтобы отвечать дельтами по cursor.
+    Если cursor клиента уже вытеснен из истории, отдаётся полный ответ.
+    """
+
+    def __init__(self, history_size: int = settings.CHART_SNAPSHOT_HISTORY):
+        self.history_size = history_size
+        self._snapshots = {}  # key -> list[ChartSnapshot], от старых к новым
+        self._next_version = 1
+        self._lock = threading.Lock()
+
+    def publish(self, key, df: pd.DataFrame, analysis: dict) -> ChartSnapshot:
+        with self._lock:
+            snapshot = ChartSnapshot(self._next_version, df, analysis)
+            self._next_version += 1
+            history = self._snapshots.setdefault(key, [])
+            history.append(snapshot)
+            del history[:-self.history_size]
+            return snapshot
+
+    def discard(self, key):
+        with self._lock:
+            self._snapshots.pop(key, None)
+
+    def latest(self, key):
+        with self._lock:
+            history = self._snapshots.get(key)
+            return history[-1] if history else None
+
+    def get(self, key, version: int):
+        with self._lock:
+            for snapshot in self._snapshots.get(key, []):
+                if snapshot.version == version:
+                    return snapshot
+            return None
+
+    def payload(self, key, cursor: str = None, since: int = None) -> dict:
+        """
+        Выбирает полный ответ, дельту по cursor или ответ по since.
+        Результат ещё не закодирован - см. encode_payload.
+        """
+        latest = self.latest(key)
+        if latest is None:
+            return None
+        if cursor:
+            try:
+                previous = self.get(key, int(cursor))
+            except ValueError:
+                previous = None
+            if previous is not None:
+                return latest.delta_from(previous)
+        elif since is not None:
+            return latest.since_payload(since)
+        return latest.full_payload()
@@ -0,0 +1,506 @@
+# core/chart_server.py
+import gzip
+import json
+import os
+import queue
+import threading
+import time as time_module
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+from configs import settings
+from utils.logger import get_logger, setup_logger
+from utils import metrics, profiling
+from core.data_fetcher import get_forex_data
+from core.live_feed import LiveFeedHub, format_sse
+from core.analysis_store import AnalysisStore
+from core.scheduler import get_scheduler, request_result, stop_scheduler
+from core.chart_payload import (
+    run_chart_analysis, history_window_payload, ChartSnapshotStore, encode_payload, encode_binary, columns_to_lists,
+    decimate_payload, price_scale_for,
+    ENCODING_ROWS, ENCODING_COLUMNAR, PRICES_FLOAT, PRICES_PIPS,
+)
+
+try:
+    import brotli  # опционально: сжатие br, если пакет установлен
+except ImportError:
+    brotli = None
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_COLUMNAR_JSON = 'application/vnd.tsbot.columnar+json'
+CONTENT_TYPE_COLUMNAR_BINARY = 'application/vnd.tsbot.columnar'
+CONTENT_TYPE_METRICS = 'text/plain; version=0.0.4; charset=utf-8'
+COMPRESSION_MIN_BYTES = 1024
+
+# Таймфреймы фронтенда -> интервалы Twelve Data
+INTERVALS_TWELVE_DATA = {
+    '1m': '1min', '5m': '5min', '15m': '15min', '30m': '30min',
+    '1h': '1h', '2h': '2h', '4h': '4h', '1d': '1day',
+}
+INTERVAL_SECONDS = {
+    '1m': 60, '5m': 300, '15m': 900, '30m': 1800,
+    '1h': 3600, '2h': 7200, '4h': 14400, '1d': 86400,
+}
+
+
+class ChartDataService:
+    """
+    Держит историю свечей и результат анализа для каждого (символ, интервал, дата бэктеста).
+    Все дашборды, опрашивающие один ключ, используют один запрос к API и один анализ;
+    при обновлении дозапрашиваются только последние свечи. Живые ключи таймфреймов общего
+    планировщика берут закрытые свечи и анализ из его запуска (окно CONTEXT_OUTPUT_SIZE,
+    более старые свечи - через /api/chart_history), сами дозапрашивают только формирующуюся свечу.
+    """
+
+    def __init__(self, fetch_func=get_forex_data, store: ChartSnapshotStore = None,
+                 analysis_store: AnalysisStore = None, scheduler=None):
+        self.fetch_func = fetch_func
+        self.scheduler = scheduler
+        self.store = store or ChartSnapshotStore()
+        self.analysis_store = analysis_store
+        self._frames = {}        # key -> pd.DataFrame
+        self._refreshed_at = {}  # key -> time.monotonic()
+        self._accessed_at = {}   # key -> time.monotonic() последнего запроса (ключи планировщика)
+        self._saved_close = {}   # key -> bar_close запуска планировщика, уже отправленного в analysis_store
+        self._key_locks = {}
+        self._locks_guard = threading.Lock()
+        self._history_windows = OrderedDict()  # LRU окон истории, общий для всех клиентов
+        # Ключ окна задает клиент (to): фиксированный набор блокировок вместо блокировки на ключ
+        self._history_locks = [threading.Lock() for _ in range(settings.CHART_HISTORY_LOCK_STRIPES)]
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _fetch_initial(self, symbol: str, interval: str, end_date: str = None) -> pd.DataFrame:
+        api_interval = INTERVALS_TWELVE_DATA.get(interval, interval)
+        if end_date:
+            end_dt = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59, tzinfo=timezone.utc)
+            return self.fetch_func(symbol, api_interval, outputsize=settings.CHART_OUTPUT_SIZE, end_date=end_dt)
+        return self.fetch_func(symbol, api_interval, outputsize=settings.CHART_OUTPUT_SIZE)
+
+    def _fetch_tail(self, symbol: str, interval: str, df: pd.DataFrame) -> pd.DataFrame:
+        tail = self.fetch_func(symbol, INTERVALS_TWELVE_DATA.get(interval, interval),
+                               outputsize=settings.CHART_TAIL_OUTPUT_SIZE)
+        if tail.empty:
+            return df
+        merged = pd.concat([df, tail])
+        merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+        return merged.iloc[-settings.CHART_OUTPUT_SIZE:]
+
+    def refresh(self, symbol: str, interval: str, end_date: str = None):
+        """Обновляет данные ключа не чаще CHART_REFRESH_SECONDS; бэктест загружается один раз."""
+        key = (symbol, interval, end_date)
+        if self._scheduled(interval, end_date):
+            return self._refresh_scheduled(key)
+        with self._lock_for(key):
+            df = self._frames.get(key)
+            now = time_module.monotonic()
+            if df is not None:
+                if (end_date and not df.empty) or now - self._refreshed_at[key] < settings.CHART_REFRESH_SECONDS:
+                    metrics.record_cache('chart_data', True)
+                    return key
+            metrics.record_cache('chart_data', False)
+            if df is not None and not df.empty:
+                new_df = self._fetch_tail(symbol, interval, df)
+            else:
+                new_df = self._fetch_initial(symbol, interval, end_date)
+            self._refreshed_at[key] = now
+
+            if df is not None and new_df.equals(df):
+                return key
+            self._frames[key] = new_df
+            analysis = run_chart_analysis(new_df, settings.get_pip_value(symbol))
+            self.store.publish(key, new_df, analysis)
+            if self.analysis_store is not None and not end_date:
+                self._save_analysis(symbol, interval, analysis, new_df)
+        return key
+
+    def _scheduled(self, interval: str, end_date: str = None) -> bool:
+        return self.scheduler is not None and not end_date and interval in self.scheduler.timeframes
+
+    def _refresh_scheduled(self, key: tuple) -> tuple:
+        """
+        Ключ планировщика: закрытые свечи и анализ - результат его запуска (один на ключ и свечу
+        для всех потребителей), к ним дописывается формирующаяся свеча из короткого запроса к API.
+        Анализ по формирующейся свече не пересчитывается.
+        """
+        symbol, interval, _ = key
+        with self._lock_for(key):
+            now = time_module.monotonic()
+            self._accessed_at[key] = now
+            df = self._frames.get(key)
+            if df is not None and now - self._refreshed_at[key] < settings.CHART_REFRESH_SECONDS:
+                metrics.record_cache('chart_data', True)
+                return key
+            metrics.record_cache('chart_data', False)
+            if df is None:
+                self._follow_bar_closes(key)
+            try:
+                result = request_result(symbol, interval, self.scheduler)
+            except Exception as e:
+                logger.warning("Нет результата планировщика: %s", e,
+                               extra={'symbol': symbol, 'timeframe': interval, 'stage': 'chart_data'})
+                return key
+            self._refreshed_at[key] = now
+            closed = result['df']
+            if closed.empty:
+                return key
+            new_df = self._append_forming(symbol, interval, closed)
+            if df is not None and new_df.equals(df):
+                return key
+            self._frames[key] = new_df
+            self.store.publish(key, new_df, result['analysis'])
+            last_closed = closed.index[-1]
+            if self.analysis_store is not None and self._saved_close.get(key) != last_closed:
+                self._saved_close[key] = last_closed
+                self._save_analysis(symbol, interval, result['analysis'], closed)
+        return key
+
+    def _append_forming(self, symbol: str, interval: str, closed: pd.DataFrame) -> pd.DataFrame:
+        tail = self.fetch_func(symbol, INTERVALS_TWELVE_DATA.get(interval, interval),
+                               outputsize=settings.CHART_FORMING_OUTPUT_SIZE)
+        if tail is None or tail.empty:
+            return closed
+        tail = tail[tail.index > closed.index[-1]]
+        return pd.concat([closed, tail]) if not tail.empty else closed
+
+    def _follow_bar_closes(self, key: tuple):
+        """
+        Подписка ключа на закрытие свечей: запуск планировщика (индекс ликвидности, старшие
+        таймфреймы, алерты) идет сразу после закрытия, а следующий запрос графика забирает его
+        результат, не дожидаясь CHART_REFRESH_SECONDS. Ключ без запросов дольше
+        CHART_FOLLOW_IDLE_SECONDS отписывается и выгружается при очередном закрытии свечи.
+        """
+        symbol, interval, _ = key
+
+        def on_bar_close(symbol, timeframe, bar_close, result):
+            if time_module.monotonic() - self._accessed_at.get(key, float('-inf')) > settings.CHART_FOLLOW_IDLE_SECONDS:
+                self._evict(key)
+            else:
+                self._refreshed_at[key] = float('-inf')
+
+        self.scheduler.subscribe(symbol, interval, 'chart_server', on_bar_close)
+
+    def _evict(self, key: tuple):
+        symbol, interval, _ = key
+        self.scheduler.unsubscribe(symbol, interval, 'chart_server')
+        with self._lock_for(key):
+            for state in (self._frames, self._refreshed_at, self._accessed_at, self._saved_close):
+                state.pop(key, None)
+            self.store.discard(key)
+        with self._locks_guard:
+            self._key_locks.pop(key, None)
+        logger.info("Ключ графика выгружен: нет запросов %d с", settings.CHART_FOLLOW_IDLE_SECONDS,
+                    extra={'symbol': symbol, 'timeframe': interval, 'stage': 'chart_data'})
+
+    def _save_analysis(self, symbol: str, interval: str, analysis: dict, df: pd.DataFrame):
+        """Ставит уровни в очередь записи core/analysis_store.py: запрос не ждет SQLite, ошибка не мешает графику."""
+        try:
+            self.analysis_store.save_analysis_async(symbol, interval, analysis, df)
+        except Exception as e:
+            logger.exception("Ошибка сохранения анализа: %s", e,
+                             extra={'symbol': symbol, 'timeframe': interval, 'stage': 'analysis_store'})
+
+    def get_levels(self, symbol: str, interval: str = None, types: list = None, near: float = None,
+                   within_pips: float = None, days: float = None, untouched: bool = None) -> dict:
+        """Сохраненные уровни символа (без пересчета анализа) для дашбордов и бэктестов."""
+        if self.analysis_store is None:
+            raise ValueError("analysis store is disabled")
+        since = int(time_module.time() - days * 86400) if days else None
+        levels = self.analysis_store.find_levels(symbol, types=types, timeframe=interval, near_price=near,
+                                                 within_pips=within_pips, since=since, untouched=untouched)
+        return {'symbol': symbol, 'levels': [
+            dict(level, time=int(level['time'].timestamp()),
+                 touched_at=int(level['touched_at'].timestamp()) if level['touched_at'] is not None else None)
+            for level in levels]}
+
+    def get_history(self, symbol: str, interval: str, to_epoch: int, count: int = None,
+                    from_epoch: int = None) -> dict:
+        """
+        Окно истории, заканчивающееся строго до to_epoch. Окна кэшируются (LRU), так что
+        прокрутка назад на нескольких дашбордах не повторяет запросы к API.
+        """
+        count = min(count or settings.CHART_HISTORY_WINDOW_SIZE, settings.CHART_HISTORY_MAX_WINDOW_SIZE)
+        key = ('history', symbol, interval, to_epoch, from_epoch, count)
+        with self._history_locks[hash(key) % len(self._history_locks)]:
+            with self._locks_guard:
+                cached = self._history_windows.get(key)
+                metrics.record_cache('history_window', cached is not None)
+                if cached is not None:
+                    self._history_windows.move_to_end(key)
+                    return cached
+
+            api_interval = INTERVALS_TWELVE_DATA.get(interval, interval)
+            end_dt = datetime.fromtimestamp(to_epoch - 1, tz=timezone.utc)  # end_date у Twelve Data включительно
+            if from_epoch is not None:
+                start_dt = datetime.fromtimestamp(from_epoch, tz=timezone.utc)
+                df = self.fetch_func(symbol, api_interval, start_date=start_dt, end_date=end_dt)
+            else:
+                df = self.fetch_func(symbol, api_interval, outputsize=count, end_date=end_dt)
+            payload = history_window_payload(df)
+            if df is None or df.empty:
+                # Сбой или пустой ответ API не кэшируется: следующий запрос окна повторит загрузку
+                return payload
+
+            with self._locks_guard:
+                self._history_windows[key] = payload
+                while len(self._history_windows) > settings.CHART_HISTORY_CACHE_WINDOWS:
+                    self._history_windows.popitem(last=False)
+        return payload
+
+    def get_payload(self, symbol: str, interval: str, end_date: str = None,
+                    cursor: str = None, since: int = None) -> dict:
+        key = self.refresh(symbol, interval, end_date)
+        payload = self.store.payload(key, cursor=cursor, since=since)
+        if payload is None:
+            return {'full': True, 'cursor': None, 'ohlcv': [], 'markers': [], 'trendLines': [],
+                    'analysisSummary': [], 'fractalCount': 0}
+        return payload
+
+
+class ChartRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Отдаёт статику из front/, API /api/chart_data, /api/chart_history и /api/levels,
+    SSE-поток /api/stream и метрики в формате Prometheus на /metrics.
+    """
+
+    service: ChartDataService = None
+    live_hub: LiveFeedHub = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=os.path.join(PROJECT_ROOT, settings.FRONTEND_DIRECTORY_NAME), **kwargs)
+
+    def log_message(self, format, *args):
+        # Журнал запросов - через очередь логгера, а не синхронной записью в stderr
+        logger.debug("%s - " + format, self.address_string(), *args, extra={'stage': 'http'})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == '/api/chart_data':
+            self._handle_chart_data(parse_qs(parsed.query))
+        elif parsed.path == '/api/chart_history':
+            self._handle_chart_history(parse_qs(parsed.query))
+        elif parsed.path == '/api/levels':
+            self._handle_levels(parse_qs(parsed.query))
+        elif parsed.path == '/api/stream':
+            self._handle_stream(parse_qs(parsed.query))
+        elif parsed.path == '/metrics':
+            self._send_body(metrics.registry.render_prometheus().encode('utf-8'), CONTENT_TYPE_METRICS)
+        else:
+            super().do_GET()
+
+    def _response_format(self, query: dict) -> str:
+        """
+        Формат ответа: параметр format=rows|columnar|binary или заголовок Accept
+        (application/vnd.tsbot.columnar - бинарный, ...columnar+json - колоночный JSON).
+        """
+        fmt = query.get('format', [None])[0]
+        if fmt:
+            return fmt
+        accepted = [part.split(';')[0].strip() for part in self.headers.get('Accept', '').split(',')]
+        if CONTENT_TYPE_COLUMNAR_BINARY in accepted:
+            return 'binary'
+        if CONTENT_TYPE_COLUMNAR_JSON in accepted:
+            return ENCODING_COLUMNAR
+        return ENCODING_ROWS
+
+    def _handle_chart_data(self, query: dict):
+        interval = query.get('interval', [settings.CONTEXT_TIMEFRAME])[0]
+        symbol = query.get('symbol', [settings.DEFAULT_SYMBOL])[0]
+        end_date = query.get('endDate', [None])[0] or None
+        cursor = query.get('cursor', [None])[0] or None
+        since = query.get('since', [None])[0]
+        self._handle_payload_request(
+            query, symbol, interval,
+            lambda: self.service.get_payload(symbol, interval, end_date, cursor=cursor,
+                                             since=int(since) if since else None))
+
+    def _handle_chart_history(self, query: dict):
+        """
+        Окно истории для подгрузки при прокрутке: свечи строго раньше to (epoch-секунды),
+        count штук или начиная с from, плюс маркеры структуры этого окна.
+        """
+        interval = query.get('interval', [settings.CONTEXT_TIMEFRAME])[0]
+        symbol = query.get('symbol', [settings.DEFAULT_SYMBOL])[0]
+        to_epoch = query.get('to', [None])[0]
+        from_epoch = query.get('from', [None])[0]
+        count = query.get('count', [None])[0]
+
+        def build():
+            if not to_epoch:
+                raise ValueError("parameter 'to' is required")
+            return self.service.get_history(symbol, interval, int(to_epoch),
+                                            count=int(count) if count else None,
+                                            from_epoch=int(from_epoch) if from_epoch else None)
+
+        self._handle_payload_request(query, symbol, interval, build)
+
+    def _handle_levels(self, query: dict):
+        """
+        Уровни из хранилища анализа: symbol, interval, types (через запятую), near + withinPips,
+        days (за сколько последних дней), untouched=1|0.
+        """
+        symbol = query.get('symbol', [settings.DEFAULT_SYMBOL])[0]
+        interval = query.get('interval', [None])[0] or None
+        types = query.get('types', [None])[0]
+        near = query.get('near', [None])[0]
+        within_pips = query.get('withinPips', [None])[0]
+        days = query.get('days', [None])[0]
+        untouched = query.get('untouched', [None])[0]
+        try:
+            payload = self.service.get_levels(
+                symbol, interval, types=types.split(',') if types else None,
+                near=float(near) if near else None, within_pips=float(within_pips) if within_pips else None,
+                days=float(days) if days else None, untouched={'1': True, '0': False}.get(untouched))
+        except ValueError as e:
+            self._send_json({'error': str(e)}, status=400)
+            return
+        except Exception as e:
+            logger.exception("Ошибка чтения уровней: %s", e, extra={'symbol': symbol, 'stage': 'api'})
+            self._send_json({'error': 'internal error'}, status=500)
+            return
+        self._send_json(payload)
+
+    def _handle_payload_request(self, query: dict, symbol: str, interval: str, build_payload):
+        """
+        Общая часть JSON/колоночных ответов. profile=1 (при PROFILING_ALLOW_HTTP) профилирует
+        этот запрос целиком - загрузку, анализ и сериализацию (utils/profiling.py).
+        """
+        requested = settings.PROFILING_ALLOW_HTTP and query.get('profile', [None])[0] == '1'
+        endpoint = urlparse(self.path).path.rsplit('/', 1)[-1]
+        with profiling.profile_run(f"api_{endpoint}", True if requested else None, symbol=symbol, timeframe=interval):
+            self._respond_payload(query, symbol, interval, build_payload)
+
+    def _respond_payload(self, query: dict, symbol: str, interval: str, build_payload):
+        """Проверка параметров, сборка и кодирование ответа."""
+        fmt = self._response_format(query)
+        prices = query.get('prices', [PRICES_FLOAT])[0]
+        width = query.get('width', [None])[0]
+        bars_per_bucket = query.get('barsPerBucket', [None])[0]
+        try:
+            if fmt not in (ENCODING_ROWS, ENCODING_COLUMNAR, 'binary'):
+                raise ValueError(f"unknown format: {fmt}")
+            if prices not in (PRICES_FLOAT, PRICES_PIPS):
+                raise ValueError(f"unknown prices: {prices}")
+            # width (пиксели) или barsPerBucket (масштаб): прореживание полного ответа до разрешения экрана
+            width = int(width) if width else None
+            bars_per_bucket = int(bars_per_bucket) if bars_per_bucket else None
+            payload = decimate_payload(build_payload(), width, bars_per_bucket)
+        except ValueError as e:
+            self._send_json({'error': str(e)}, status=400)
+            return
+        except Exception as e:
+            logger.exception("Ошибка при подготовке данных графика: %s", e,
+                             extra={'symbol': symbol, 'timeframe': interval, 'stage': 'api'})
+            self._send_json({'error': 'internal error'}, status=500)
+            return
+
+        with metrics.stage_timer('serialize', format=fmt):
+            if fmt == ENCODING_ROWS:
+                body, content_type = json.dumps(encode_payload(payload)).encode('utf-8'), CONTENT_TYPE_JSON
+            else:
+                encoded = encode_payload(payload, ENCODING_COLUMNAR, prices,
+                                         price_scale_for(settings.get_pip_value(symbol)))
+                if fmt == 'binary':
+                    body, content_type = encode_binary(encoded), CONTENT_TYPE_COLUMNAR_BINARY
+                else:
+                    body, content_type = json.dumps(columns_to_lists(encoded)).encode('utf-8'), CONTENT_TYPE_COLUMNAR_JSON
+        metrics.observe('tsbot_payload_bytes', len(body), metrics.SIZE_BUCKETS, format=fmt, full=str(bool(payload.get('full'))).lower())
+        self._send_body(body, content_type)
+
+    def _handle_stream(self, query: dict):
+        """
+        SSE-поток живых обновлений: свечи (закрытые и формирующаяся), изменения структуры
+        и новые сетапы. Первое событие hello содержит текущий cursor канала.
+        """
+        interval = query.get('interval', [settings.CONTEXT_TIMEFRAME])[0]
+        symbol = query.get('symbol', [settings.DEFAULT_SYMBOL])[0]
+        if interval not in INTERVAL_SECONDS:
+            self._send_json({'error': f"unknown interval: {interval}"}, status=400)
+            return
+
+        channel = self.live_hub.channel(symbol, interval)
+        subscriber = channel.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-store')
+            self.send_header('Connection', 'keep-alive')
+            self.end_headers()
+            self.wfile.write(format_sse('hello', {'cursor': channel.current_cursor()}))
+            self.wfile.flush()
+            while True:
+                try:
+                    message = subscriber.get(timeout=settings.LIVE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    message = b': ping\n\n'
+                if message is None:
+                    break
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            channel.unsubscribe(subscriber)
+            self.close_connection = True
+
+    def _send_json(self, payload: dict, status: int = 200):
+        self._send_body(json.dumps(payload).encode('utf-8'), CONTENT_TYPE_JSON, status)
+
+    def _compress(self, body: bytes):
+        """Сжимает тело по Accept-Encoding: br (если установлен brotli), иначе gzip."""
+        if len(body) < COMPRESSION_MIN_BYTES:
+            return body, None
+        accepted = [part.split(';')[0].strip() for part in self.headers.get('Accept-Encoding', '').split(',')]
+        if brotli is not None and 'br' in accepted:
+            return brotli.compress(body, quality=4), 'br'
+        if 'gzip' in accepted:
+            return gzip.compress(body, compresslevel=5), 'gzip'
+        return body, None
+
+    def _send_body(self, body: bytes, content_type: str, status: int = 200):
+        with metrics.stage_timer('compress'):
+            body, content_encoding = self._compress(body)
+        metrics.observe('tsbot_response_bytes', len(body), metrics.SIZE_BUCKETS, encoding=content_encoding or 'identity')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_server(host: str = settings.CHART_SERVER_HOST, port: int = settings.CHART_SERVER_PORT):
+    setup_logger()
+    scheduler = get_scheduler() if settings.SCHEDULER_SHARED else None
+    ChartRequestHandler.service = ChartDataService(
+        analysis_store=AnalysisStore() if settings.ANALYSIS_STORE_ENABLED else None, scheduler=scheduler)
+    ChartRequestHandler.live_hub = LiveFeedHub(ChartRequestHandler.service, INTERVAL_SECONDS)
+    server = ThreadingHTTPServer((host, port), ChartRequestHandler)
+    metrics.MetricsReporter().start()
+    logger.info("Сервер запущен на http://%s:%s (метрики: /metrics)", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop_scheduler()
+        if settings.ALERTS_ENABLED:
+            from core.alerts import stop_dispatcher
+            stop_dispatcher()
+
+
+if __name__ == '__main__':
+    run_server()
@@ -1,13 +1,77 @@
 # bot/core/data_fetcher.py
-import requests
+import time as time_module
 import pandas as pd
 from configs import settings # Импортируем настройки из configs/settings.py
 from datetime import datetime, timedelta # Импортируем timedelta
+from utils.logger import get_logger
+from utils import metrics
 
-def get_forex_data(symbol: str, interval: str, outputsize: int = None, start_date: datetime = None, end_date: datetime = None, api_key: str = settings.API_KEY_TWELVE_DATA):
+logger = get_logger(__name__)
+
+
+def _record_api_usage(response):
+    """Метрики запроса к Twelve Data: статус и расход кредитов (заголовки api-credits-used/left)."""
+    if not metrics.enabled():
+        return
+    metrics.inc('tsbot_api_requests_total', status=str(response.status_code))
+    metrics.inc('tsbot_api_credits_total')  # time_series - 1 кредит на символ
+    for header, gauge in (('api-credits-used', 'tsbot_api_credits_used'), ('api-credits-left', 'tsbot_api_credits_left')):
+        value = response.headers.get(header)
+        if value is not None:
+            try:
+                metrics.set_gauge(gauge, float(value))
+            except ValueError:
+                pass
+
+
+def time_series_to_dataframe(values: list, log_fields: dict = None) -> pd.DataFrame:
+    """
+    Список 'values' ответа Twelve Data /time_series -> DataFrame OHLCV
+    с DatetimeIndex в UTC, отсортированный от старых к новым. Пустой DataFrame, если данных нет.
+    """
+    df = pd.DataFrame(values)
+
+    if df.empty:
+         logger.warning("API вернул пустой список значений.", extra=log_fields)
+         return pd.DataFrame()
+
+    # Конвертируем типы данных
+    # Twelve Data возвращает datetime в UTC, если запрошен timezone="UTC"
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    numeric_cols = ['open', 'high', 'low', 'close', 'volume']
+    for col in numeric_cols:
+        if col in df.columns: # 'volume' может отсутствовать
+            # errors='coerce' заменит нечисловые на NaN
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Устанавливаем datetime как индекс (требуется для mplfinance и удобства работы)
+    # Если API вернул данные в порядке от новых к старым (DESC), развернем DataFrame.
+    # Twelve Data с диапазоном дат обычно возвращает ASC, но лучше проверить.
+    if not df['datetime'].is_monotonic_increasing:
+         df = df.iloc[::-1].reset_index(drop=True)
+
+    df = df.set_index('datetime')
+
+    # Удаляем строки с NaN
+    df.dropna(subset=['open', 'high', 'low', 'close'], inplace=True)
+
+    if df.empty:
+        logger.warning("DataFrame пуст после обработки (возможно, все данные были NaN).", extra=log_fields)
+        return pd.DataFrame()
+
+    # Убедимся, что индекс в UTC (если Twelve Data не вернул его таким)
+    if df.index.tzinfo is None:
+         df = df.tz_localize('UTC')
+    else:
+         df = df.tz_convert('UTC')
+    return df
+
+
+def get_forex_data(symbol: str, interval: str, outputsize: int = None, start_date: datetime = None, end_date: datetime = None, api_key: str = None):
     """
     Получает исторические данные OHLCV для указанного символа с Twelve Data API.
     Может получать данные либо по outputsize (последние N свечей), либо по диапазону дат.
+    outputsize вместе с одной end_date возвращает N свечей, заканчивающихся на end_date.
 
     Args:
         symbol (str): Символ валютной пары (например, "EUR/USD").
@@ -15,12 +79,18 @@ def get_forex_data(symbol: str, interval: str, outputsize: int = None, start_dat
         outputsize (int, optional): Количество возвращаемых точек данных (используется, если start_date и end_date не указаны).
         start_date (datetime, optional): Начальная дата диапазона данных (в UTC).
         end_date (datetime, optional): Конечная дата диапазона данных (в UTC).
-        api_key (str, optional): API ключ для Twelve Data. По умолчанию используется из settings.
+        api_key (str, optional): API ключ для Twelve Data. По умолчанию используется из settings
+                                 (читается при первом запросе, а не при импорте модуля).
 
     Returns:
         pd.DataFrame: DataFrame с данными OHLCV, отсортированный от старых к новым,
                       с DatetimeIndex. Возвращает пустой DataFrame в случае ошибки.
     """
+    import requests # HTTP-клиент нужен только при реальном запросе - не замедляет импорт модуля
+
+    if api_key is None:
+        api_key = settings.API_KEY_TWELVE_DATA
+    log_fields = {'symbol': symbol, 'timeframe': interval, 'stage': 'fetch'}
     params = {
         "symbol": symbol,
         "interval": interval,
@@ -34,77 +104,52 @@ def get_forex_data(symbol: str, interval: str, outputsize: int = None, start_dat
         # Форматируем даты в строку YYYY-MM-DD HH:MM:SS (Twelve Data ожидает такой формат)
         params["start_date"] = start_date.strftime('%Y-%m-%d %H:%M:%S')
         params["end_date"] = end_date.strftime('%Y-%m-%d %H:%M:%S')
-        print(f"data_fetcher: Запрос данных для {symbol}, интервал {interval}, диапазон: {params['start_date']} - {params['end_date']}...")
+        logger.info("Запрос данных, диапазон: %s - %s...", params['start_date'], params['end_date'], extra=log_fields)
     elif outputsize is not None:
         params["outputsize"] = outputsize
-        print(f"data_fetcher: Запрос данных для {symbol}, интервал {interval}, {outputsize} свечей...")
+        if end_date:
+            # outputsize свечей, заканчивающихся на end_date
+            params["end_date"] = end_date.strftime('%Y-%m-%d %H:%M:%S')
+        logger.info("Запрос данных, %s свечей...", outputsize, extra=log_fields)
     else:
-        print("data_fetcher: Ошибка: Не указаны ни outputsize, ни диапазон дат.")
+        logger.error("Не указаны ни outputsize, ни диапазон дат.", extra=log_fields)
         return pd.DataFrame()
 
 
     url = f"{settings.BASE_URL_TWELVE_DATA}/time_series"
 
     try:
-        response = requests.get(url, params=params)
+        with metrics.stage_timer('fetch_http'):
+            response = requests.get(url, params=params)
+        _record_api_usage(response)
         response.raise_for_status()  # Вызовет исключение для HTTP ошибок (4xx или 5xx)
+        decode_started = time_module.perf_counter()
         data = response.json()
 
         if data.get("status") == "ok" and "values" in data:
-            df = pd.DataFrame(data["values"])
-
-            if df.empty:
-                 print(f"data_fetcher: API вернул пустой список значений для {symbol} ({interval}).")
-                 return pd.DataFrame()
-
-            # Конвертируем типы данных
-            # Twelve Data возвращает datetime в UTC, если запрошен timezone="UTC"
-            df['datetime'] = pd.to_datetime(df['datetime'])
-            numeric_cols = ['open', 'high', 'low', 'close', 'volume']
-            for col in numeric_cols:
-                if col in df.columns: # 'volume' может отсутствовать
-                    # errors='coerce' заменит нечисловые на NaN
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-
-            # Устанавливаем datetime как индекс (требуется для mplfinance и удобства работы)
-            # Если API вернул данные в порядке от новых к старым (DESC), развернем DataFrame.
-            # Twelve Data с диапазоном дат обычно возвращает ASC, но лучше проверить.
-            if not df['datetime'].is_monotonic_increasing:
-                 df = df.iloc[::-1].reset_index(drop=True)
-
-            df = df.set_index('datetime')
-
-            # Удаляем строки с NaN
-            df.dropna(subset=['open', 'high', 'low', 'close'], inplace=True)
-
-            if df.empty:
-                print(f"data_fetcher: DataFrame для {symbol} пуст после обработки (возможно, все данные были NaN).")
-                return pd.DataFrame()
-
-            # Убедимся, что индекс в UTC (если Twelve Data не вернул его таким)
-            if df.index.tzinfo is None:
-                 df = df.tz_localize('UTC')
-            else:
-                 df = df.tz_convert('UTC')
-
-
-            # print(f"data_fetcher: Данные для {symbol} успешно получены. Свечей: {len(df)}")
+            df = time_series_to_dataframe(data["values"], log_fields)
+            if not df.empty:
+                logger.debug("Данные успешно получены. Свечей: %d", len(df), extra=log_fields)
+            metrics.observe(metrics.STAGE_SECONDS, time_module.perf_counter() - decode_started, stage='fetch_decode')
             return df
         elif "message" in data:
-            print(f"data_fetcher: Ошибка API Twelve Data для {symbol}: {data['message']} (Код: {data.get('code')})")
+            logger.error("Ошибка API Twelve Data: %s (Код: %s)", data['message'], data.get('code'), extra=log_fields)
             return pd.DataFrame()
         else:
-            print(f"data_fetcher: Неожиданный ответ от API Twelve Data для {symbol}: {data}")
+            logger.error("Неожиданный ответ от API Twelve Data: %s", data, extra=log_fields)
             return pd.DataFrame()
 
     except requests.exceptions.RequestException as e:
-        print(f"data_fetcher: Ошибка HTTP запроса при получении данных для {symbol}: {e}")
+        logger.error("Ошибка HTTP запроса при получении данных: %s", e, extra=log_fields)
         return pd.DataFrame()
     except Exception as e:
-        print(f"data_fetcher: Произошла непредвиденная ошибка при обработке данных для {symbol}: {e}")
+        logger.exception("Произошла непредвиденная ошибка при обработке данных: %s", e, extra=log_fields)
         return pd.DataFrame()
 
 if __name__ == '__main__':
+    from datetime import timezone
+    from utils.logger import setup_logger
+    setup_logger()
     print("Тестирование data_fetcher.py (с диапазоном дат)...")
     if settings.API_KEY_TWELVE_DATA == "YOUR_TWELVE_DATA_API_KEY_HERE" or not settings.API_KEY_TWELVE_DATA:
         print("Тест не может быть выполнен: API ключ не настроен в configs/settings.py или .env файле.")
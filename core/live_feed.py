@@ -0,0 +1,175 @@
+# core/live_feed.py
+import json
+import queue
+import threading
+import time as time_module
+
+from configs import settings
+from utils.logger import get_logger
+from core.chart_payload import encode_ohlcv, encode_markers, columns_to_lists, ENCODING_COLUMNAR
+
+logger = get_logger(__name__)
+
+SETUP_TYPES = ('SETUP_Resist', 'SETUP_Support')
+
+
+def format_sse(event: str, data: dict) -> bytes:
+    """Одно событие Server-Sent Events в готовом к отправке виде."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+
+class LiveChannel:
+    """
+    Живой канал одного (символ, интервал): один поток обновляет данные и анализ
+    через ChartDataService и рассылает готовые SSE-события всем подписчикам.
+    Сколько бы ни было зрителей, запрос к API, анализ и сериализация выполняются один раз.
+    """
+
+    def __init__(self, service, symbol: str, interval: str, interval_seconds: int,
+                 poll_seconds: float = settings.LIVE_PUSH_INTERVAL_SECONDS):
+        self.service = service
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_seconds = interval_seconds
+        self.poll_seconds = poll_seconds
+        self.key = (symbol, interval, None)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_version = None
+
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue(maxsize=settings.LIVE_SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            # Переподключение: старый поток мог получить _stop от ушедшего последнего подписчика
+            self._stop.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"live-{self.symbol}-{self.interval}", daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                self._stop.set()
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def current_cursor(self):
+        snapshot = self.service.store.latest(self.key)
+        return str(snapshot.version) if snapshot else None
+
+    def _broadcast(self, messages: list):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            for message in messages:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Медленный клиент: отключаем, после переподключения он догонит по cursor
+                    self._disconnect(subscriber)
+                    break
+
+    def _disconnect(self, subscriber: queue.Queue):
+        """Снимает подписку и оставляет в очереди только маркер конца потока (None)."""
+        self.unsubscribe(subscriber)
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        subscriber.put_nowait(None)
+
+    def build_events(self, previous, snapshot) -> list:
+        """
+        SSE-события перехода previous -> snapshot: свечи, структура, новые сетапы.
+        fromCursor позволяет клиенту заметить пропущенные события и догнать дельтой по cursor.
+        """
+        cursor = str(snapshot.version)
+        if previous is None:
+            return [format_sse('reset', {'cursor': cursor})]
+
+        delta = snapshot.delta_from(previous)
+        from_cursor = str(previous.version)
+        events = []
+        bars = delta['ohlcv']
+        if not bars.empty:
+            forming_time = None
+            last_time = snapshot.last_bar_time
+            if last_time is not None and last_time + self.interval_seconds > time_module.time():
+                forming_time = last_time
+            events.append(format_sse('candles', {
+                'cursor': cursor, 'fromCursor': from_cursor,
+                'ohlcv': columns_to_lists(encode_ohlcv(bars, ENCODING_COLUMNAR)),
+                'formingTime': forming_time,
+            }))
+
+        structure_markers = [m for m in delta['markers'] if m['type'] not in SETUP_TYPES]
+        setup_markers = [m for m in delta['markers'] if m['type'] in SETUP_TYPES]
+        if structure_markers or delta['removedMarkers'] or delta['trendLines'] is not None:
+            events.append(format_sse('structure', {
+                'cursor': cursor, 'fromCursor': from_cursor,
+                'markers': encode_markers(structure_markers),
+                'removedMarkers': delta['removedMarkers'],
+                'trendLines': delta['trendLines'],
+                'analysisSummary': delta['analysisSummary'],
+                'fractalCount': delta['fractalCount'],
+            }))
+        for setup in setup_markers:
+            events.append(format_sse('setup', {'cursor': cursor, 'fromCursor': from_cursor, 'symbol': self.symbol,
+                                               'interval': self.interval, 'marker': encode_markers([setup])[0]}))
+        return events
+
+    def poll_once(self):
+        """Одно обновление канала: refresh данных и рассылка событий, если снимок изменился."""
+        previous = self.service.store.get(self.key, self._last_version) if self._last_version else None
+        self.service.refresh(self.symbol, self.interval)
+        snapshot = self.service.store.latest(self.key)
+        if snapshot is None or snapshot.version == self._last_version:
+            return
+        events = self.build_events(previous, snapshot)
+        self._last_version = snapshot.version
+        if events:
+            self._broadcast(events)
+
+    def _run(self):
+        while True:
+            if self._stop.is_set():
+                # Выход только если за время ожидания никто не подписался; _thread сбрасывается
+                # под той же блокировкой, чтобы subscribe запустил новый поток, а не надеялся на этот
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        return
+                    self._stop.clear()
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.exception("Ошибка обновления канала: %s", e,
+                                 extra={'symbol': self.symbol, 'timeframe': self.interval, 'stage': 'live'})
+            self._stop.wait(self.poll_seconds)
+
+
+class LiveFeedHub:
+    """Реестр живых каналов: один канал на (символ, интервал) для всех подписчиков."""
+
+    def __init__(self, service, interval_seconds: dict):
+        self.service = service
+        self.interval_seconds = interval_seconds
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def channel(self, symbol: str, interval: str) -> LiveChannel:
+        with self._lock:
+            channel = self._channels.get((symbol, interval))
+            if channel is None:
+                channel = LiveChannel(self.service, symbol, interval, self.interval_seconds[interval])
+                self._channels[(symbol, interval)] = channel
+            return channel
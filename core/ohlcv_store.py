@@ -0,0 +1,264 @@
+# core/ohlcv_store.py
+"""
+Компактное хранилище свечей на диске: один файл на (символ, таймфрейм),
+data/ohlcv/EUR_USD/3m.ohlcv. Запись - структура фиксированного размера:
+
+    time   int64    epoch-секунды UTC (время открытия свечи)
+    open/high/low/close  int32 в пипеттах (price * price_scale) или float32
+    volume float32
+
+28 байт на свечу вместо ~48 у DataFrame с float64 и tz-aware индексом. Файл открывается
+через np.memmap только для чтения: выборка диапазона дат - срез без копирования, а все
+процессы-воркеры делят одни страницы кэша ОС. Новые свечи дописываются в конец файла.
+
+Заголовок (64 байта): b'TSO1', uint32 версия, uint32 формат цен (0 - pips, 1 - float32),
+uint32 резерв, int64 price_scale, остальное - нули.
+"""
+import bisect
+import os
+import struct
+import threading
+
+import numpy as np
+import pandas as pd
+
+from configs import settings
+from utils.epoch import index_to_epoch_seconds, price_scale_for
+from utils.logger import get_logger
+
+try:
+    import fcntl  # блокировка записи между процессами; на Windows недоступен
+except ImportError:
+    fcntl = None
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STORE_MAGIC = b'TSO1'
+STORE_VERSION = 1
+HEADER_SIZE = 64
+_HEADER_STRUCT = struct.Struct('<4sIIIq')
+FILE_EXTENSION = '.ohlcv'
+
+PRICES_PIPS = 'pips'
+PRICES_FLOAT32 = 'float32'
+_PRICE_FORMAT_CODES = {PRICES_PIPS: 0, PRICES_FLOAT32: 1}
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+
+def record_dtype(prices: str) -> np.dtype:
+    price_type = '<i4' if prices == PRICES_PIPS else '<f4'
+    return np.dtype([('time', '<i8')] + [(c, price_type) for c in PRICE_COLUMNS] + [('volume', '<f4')])
+
+
+class OhlcvSeries:
+    """
+    Свечи одного файла, отображенные в память (только чтение). Срезы - представления
+    без копирования; цены в float64 и DataFrame - копии только запрошенного диапазона.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, price_code, _, price_scale = _HEADER_STRUCT.unpack(f.read(_HEADER_STRUCT.size))
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"{path}: не файл хранилища свечей (magic={magic!r}, version={version})")
+        self.prices = PRICES_PIPS if price_code == _PRICE_FORMAT_CODES[PRICES_PIPS] else PRICES_FLOAT32
+        self.price_scale = price_scale
+        self.dtype = record_dtype(self.prices)
+        self._size = None
+        self.records = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Переотображает файл, если другой процесс дописал свечи; True, если размер изменился."""
+        size = os.path.getsize(self.path)
+        if size == self._size:
+            return False
+        count = (size - HEADER_SIZE) // self.dtype.itemsize  # недописанная запись в конце игнорируется
+        if count > 0:
+            self.records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+        self._size = size
+        return True
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.records['time']
+
+    def bounds(self, start=None, end=None) -> tuple:
+        """Индексы [i, j) свечей с start <= time < end (epoch-секунды или Timestamp/строка)."""
+        # bisect по представлению читает ~log2(n) записей; np.searchsorted скопировал бы
+        # всю колонку времени (она не непрерывна в массиве записей)
+        times = self.records['time']
+        i = 0 if start is None else bisect.bisect_left(times, _to_epoch(start))
+        j = len(times) if end is None else bisect.bisect_left(times, _to_epoch(end))
+        return i, max(i, j)
+
+    def slice(self, start=None, end=None) -> np.ndarray:
+        """Записи диапазона - представление memmap без копирования."""
+        i, j = self.bounds(start, end)
+        return self.records[i:j]
+
+    def column(self, name: str, start=None, end=None) -> np.ndarray:
+        """Одна колонка диапазона как представление (цены - в формате хранения)."""
+        return self.slice(start, end)[name]
+
+    def price_array(self, name: str, start=None, end=None) -> np.ndarray:
+        """Цены диапазона в float64 (копия): пипетты делятся на price_scale."""
+        values = self.column(name, start, end)
+        if self.prices == PRICES_PIPS:
+            return values / self.price_scale
+        return values.astype(np.float64)
+
+    def to_dataframe(self, start=None, end=None) -> pd.DataFrame:
+        """DataFrame в формате data_fetcher.get_forex_data для анализаторов на pandas."""
+        records = self.slice(start, end)
+        index = pd.DatetimeIndex(pd.to_datetime(records['time'], unit='s', utc=True), name='datetime')
+        data = {c: self.price_array(c, start, end) for c in PRICE_COLUMNS}
+        data['volume'] = records['volume'].astype(np.float64)
+        return pd.DataFrame(data, index=index)
+
+
+class OhlcvStore:
+    """Директория файлов свечей: append() дописывает, open() отображает в память."""
+
+    _thread_lock = threading.Lock()
+
+    def __init__(self, root: str = None, prices: str = settings.OHLCV_STORE_PRICES):
+        root = root or settings.OHLCV_STORE_DIRECTORY
+        self.root = root if os.path.isabs(root) else os.path.join(PROJECT_ROOT, root)
+        self.prices = prices
+
+    def path_for(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, symbol.replace('/', '_'), f"{timeframe}{FILE_EXTENSION}")
+
+    def exists(self, symbol: str, timeframe: str) -> bool:
+        return os.path.exists(self.path_for(symbol, timeframe))
+
+    def open(self, symbol: str, timeframe: str) -> OhlcvSeries:
+        return OhlcvSeries(self.path_for(symbol, timeframe))
+
+    def _create(self, path: str, pip_value: float):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        price_scale = price_scale_for(pip_value) if self.prices == PRICES_PIPS else 0
+        header = _HEADER_STRUCT.pack(STORE_MAGIC, STORE_VERSION, _PRICE_FORMAT_CODES[self.prices], 0, price_scale)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b'\0'))
+        os.replace(tmp_path, path)
+
+    def append(self, symbol: str, timeframe: str, df: pd.DataFrame, pip_value: float = None) -> int:
+        """
+        Дописывает свечи df (DataFrame get_forex_data). Свечи старше последней сохраненной
+        пропускаются, свеча с тем же временем перезаписывается на месте (формировавшаяся свеча).
+        Возвращает число добавленных свечей.
+        """
+        if df is None or df.empty:
+            return 0
+        path = self.path_for(symbol, timeframe)
+        with _WriteLock(path + '.lock', self._thread_lock):
+            if not os.path.exists(path):
+                self._create(path, pip_value or settings.get_pip_value(symbol))
+            series = OhlcvSeries(path)
+            records = self._to_records(df, series)
+            last_time = int(series.times[-1]) if len(series) else None
+            # Запись с неполным хвостом (прерванная запись) - отрезаем до целого числа записей
+            valid_size = HEADER_SIZE + len(series) * series.dtype.itemsize
+            if os.path.getsize(path) != valid_size:
+                os.truncate(path, valid_size)
+
+            with open(path, 'r+b') as f:
+                if last_time is not None:
+                    same = records['time'] == last_time
+                    if same.any():
+                        f.seek(valid_size - series.dtype.itemsize)
+                        f.write(records[same][-1:].tobytes())
+                    records = records[records['time'] > last_time]
+                f.seek(valid_size)
+                f.write(records.tobytes())
+        logger.debug("Дописано свечей: %d", len(records),
+                     extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'store'})
+        return len(records)
+
+    def _to_records(self, df: pd.DataFrame, series: OhlcvSeries) -> np.ndarray:
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        records = np.empty(len(df), dtype=series.dtype)
+        records['time'] = index_to_epoch_seconds(df.index)
+        for c in PRICE_COLUMNS:
+            values = df[c].to_numpy(dtype=np.float64)
+            if series.prices == PRICES_PIPS:
+                records[c] = np.rint(values * series.price_scale)
+            else:
+                records[c] = values
+        records['volume'] = df['volume'].to_numpy(dtype=np.float64) if 'volume' in df.columns else 0
+        return records
+
+
+class _WriteLock:
+    """Один писатель на файл: между потоками процесса и (где есть fcntl) между процессами."""
+
+    def __init__(self, lock_path: str, thread_lock: threading.Lock):
+        self.lock_path = lock_path
+        self.thread_lock = thread_lock
+        self._file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            self._file = open(self.lock_path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self.thread_lock.release()
+
+
+def _to_epoch(value) -> int:
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return int(ts.timestamp())
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time as time_module
+
+    print("Тестирование ohlcv_store.py...")
+    bars = 1_000_000  # ~5.7 лет 3m-свечей
+    times = pd.date_range('2019-01-01', periods=bars, freq='3min', tz='UTC')
+    close = 1.1 + np.cumsum(np.random.default_rng(1).normal(0, 0.0002, bars))
+    df = pd.DataFrame({'open': close, 'high': close + 0.0003, 'low': close - 0.0003, 'close': close,
+                       'volume': 100.0}, index=times)
+
+    store = OhlcvStore(tempfile.mkdtemp(prefix='ohlcv_store_'))
+    started = time_module.perf_counter()
+    store.append('EUR/USD', '3m', df.iloc[:-10])
+    added = store.append('EUR/USD', '3m', df.iloc[-20:])  # перекрытие: 10 старых, 10 новых
+    print(f"Записано {bars} свечей за {time_module.perf_counter() - started:.2f} с, дописано {added}")
+
+    series = store.open('EUR/USD', '3m')
+    file_mb = os.path.getsize(series.path) / 1024 / 1024
+    frame_mb = df.memory_usage(index=True, deep=True).sum() / 1024 / 1024
+    print(f"Файл: {file_mb:.1f} МБ, DataFrame: {frame_mb:.1f} МБ, свечей в файле: {len(series)}")
+
+    started = time_module.perf_counter()
+    window = series.slice('2022-03-01', '2022-04-01')
+    print(f"Срез за март 2022: {len(window)} свечей за {(time_module.perf_counter() - started) * 1e6:.0f} мкс, "
+          f"без копирования: {np.shares_memory(window, series.records)}")
+    restored = series.to_dataframe('2022-03-01', '2022-04-01')
+    expected = df.loc['2022-03-01':'2022-03-31 23:59']
+    print("Макс. ошибка цены после пипетт:", float(np.abs(restored['close'] - expected['close']).max()))
@@ -0,0 +1,295 @@
+# core/scanner.py
+"""
+Сканер пар: один проход 1h-контекста и сессионных сетапов по всем SCANNER_SYMBOLS.
+
+Загрузка (ввод-вывод) идет асинхронно - до SCANNER_FETCH_CONCURRENCY запросов одновременно
+в потоках, - и каждая загруженная пара сразу уходит на анализ в пул процессов, не дожидаясь
+остальных. Пул создается один раз и прогревается (импорт pandas и модулей анализа), поэтому
+проход сразу после закрытия часовой свечи занимает секунды. С общим планировщиком
+(SCHEDULER_SHARED) загрузка и анализ пары идут один раз в его запуске по закрытию свечи,
+а сканер только собирает готовые результаты. Результат - пары, отсортированные
+по силе контекста и по расстоянию от цены до ближайшего уровня SETUP (в пипсах пары).
+
+    python -m core.scanner
+    python -m core.scanner --symbols EUR/USD,USD/JPY --top 5
+"""
+import asyncio
+import multiprocessing
+import threading
+import time as time_module
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from configs import settings
+from utils.logger import get_logger, setup_worker_logger, worker_log_queue
+from utils import metrics
+
+logger = get_logger(__name__)
+
+DIRECTION_LONG = 'LONG'
+DIRECTION_SHORT = 'SHORT'
+DIRECTION_NEUTRAL = 'NEUTRAL'
+SETUP_TYPES = ('SETUP_Resist', 'SETUP_Support')
+
+
+UP_CHANNELS = ("Восходящий", "Восходящий треугольник")
+DOWN_CHANNELS = ("Нисходящий", "Нисходящий треугольник")
+
+
+def channel_direction(summary: list) -> str:
+    """Направление канала по второму пункту сводки ('Trend Lines: <контекст канала>'), если он определен."""
+    if len(summary) < 2 or not summary[1].get('status'):
+        return DIRECTION_NEUTRAL
+    channel = summary[1].get('description', '').split(': ', 1)[-1]
+    if channel in UP_CHANNELS:
+        return DIRECTION_LONG
+    if channel in DOWN_CHANNELS:
+        return DIRECTION_SHORT
+    return DIRECTION_NEUTRAL
+
+
+def context_strength(overall_context: str, summary: list) -> tuple:
+    """
+    (направление, сила 0..4) по тексту determine_overall_market_context и сводке:
+    импульс/BOS - 3, коррекция - 2, потенциальный (первый HH/LL) - 1, NEUTRAL - 0;
+    +1, если канал линий тренда направлен в сторону тренда (горизонтальный канал, клин
+    или канал против тренда силы не добавляют).
+    """
+    overall_context = overall_context or ''
+    if overall_context.startswith('NEUTRAL') or not overall_context:
+        return DIRECTION_NEUTRAL, 0
+    direction = DIRECTION_LONG if 'LONG' in overall_context else DIRECTION_SHORT
+    if overall_context.startswith('Потенциальный'):
+        strength = 1
+    elif 'Коррекция' in overall_context:
+        strength = 2
+    else:
+        strength = 3
+    if channel_direction(summary) == direction:
+        strength += 1
+    return direction, strength
+
+
+def _init_scan_worker(log_queue=None):
+    """Инициализатор процесса пула: логгер (записи уходят в родителя), модули анализа - один раз на процесс."""
+    if log_queue is not None:
+        setup_worker_logger(log_queue)
+    import core.chart_payload  # noqa: F401
+
+
+def _warmup():
+    return True
+
+
+def analyze_symbol(symbol: str, df, pip_value: float = None) -> dict:
+    """
+    Полный анализ одной пары (в процессе пула) и компактный результат для ранжирования:
+    контекст, сила, сетапы и расстояние от последней цены до ближайшего уровня SETUP.
+    """
+    from core.chart_payload import run_chart_analysis
+    started = time_module.perf_counter()
+    analysis = run_chart_analysis(df, pip_value or settings.get_pip_value(symbol)) if df is not None and not df.empty else None
+    return summarize_analysis(symbol, df, analysis, pip_value, started)
+
+
+def summarize_analysis(symbol: str, df, analysis: dict, pip_value: float = None, started: float = None) -> dict:
+    """Компактный результат для ранжирования из готового анализа (свой проход или запуск планировщика)."""
+    pip_value = pip_value or settings.get_pip_value(symbol)
+    result = {
+        'symbol': symbol, 'bars': 0 if df is None else len(df), 'pip_value': pip_value, 'last_time': None,
+        'last_close': None, 'context': None, 'direction': DIRECTION_NEUTRAL, 'strength': 0, 'summary': [],
+        'setups': [], 'nearest_setup': None, 'distance_pips': None, 'error': None, 'analysis_seconds': None,
+    }
+    if df is None or df.empty or analysis is None:
+        result['error'] = "нет данных"
+        return result
+
+    last_close = float(df['close'].iloc[-1])
+    direction, strength = context_strength(analysis['overall_context'], analysis['summary'])
+    setups = [{'time': p['time'].isoformat(), 'price': float(p['price']), 'type': p['type']}
+              for p in analysis['session_points'] if p['type'] in SETUP_TYPES]
+    nearest = min(setups, key=lambda p: abs(p['price'] - last_close)) if setups else None
+
+    result.update({
+        'last_time': df.index[-1].isoformat(), 'last_close': last_close,
+        'context': analysis['overall_context'], 'direction': direction, 'strength': strength,
+        'summary': analysis['summary'], 'setups': setups, 'nearest_setup': nearest,
+        'distance_pips': round(abs(nearest['price'] - last_close) / pip_value, 1) if nearest else None,
+        'analysis_seconds': round(time_module.perf_counter() - started, 3) if started is not None else None,
+    })
+    return result
+
+
+def rank_results(results: list) -> list:
+    """Сначала сильный контекст, при равной силе - ближе к уровню SETUP; пары без данных - в конце."""
+    def key(r):
+        return (r['error'] is not None, -r['strength'],
+                r['distance_pips'] if r['distance_pips'] is not None else float('inf'), r['symbol'])
+    return sorted(results, key=key)
+
+
+class MarketScanner:
+    """
+    Конвейер сканирования: асинхронная загрузка (потоки, ограничение параллельности)
+    -> анализ в пуле процессов по мере готовности данных. Пулы живут между проходами.
+    """
+
+    def __init__(self, symbols: list = None, interval: str = settings.CONTEXT_TIMEFRAME,
+                 outputsize: int = settings.SCANNER_OUTPUT_SIZE, fetch_func=None,
+                 fetch_concurrency: int = settings.SCANNER_FETCH_CONCURRENCY,
+                 analysis_workers: int = settings.SCANNER_ANALYSIS_WORKERS):
+        self.symbols = list(symbols or settings.SCANNER_SYMBOLS)
+        self.interval = interval
+        self.outputsize = outputsize
+        self.fetch_func = fetch_func
+        self.scheduler = None  # общий планировщик, если пары берут из него готовый анализ
+        self.fetch_concurrency = fetch_concurrency
+        self.analysis_workers = analysis_workers
+        self._process_pool = None
+        self._thread_pool = None
+        self._lock = threading.Lock()
+
+    def _pools(self):
+        with self._lock:
+            if self._process_pool is None:
+                # spawn - как в пуле рендеринга: воркеры не наследуют потоки и блокировки родителя
+                self._process_pool = ProcessPoolExecutor(max_workers=self.analysis_workers,
+                                                         mp_context=multiprocessing.get_context('spawn'),
+                                                         initializer=_init_scan_worker,
+                                                         initargs=(worker_log_queue(),))
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.fetch_concurrency,
+                                                       thread_name_prefix="scanner-fetch")
+            return self._process_pool, self._thread_pool
+
+    def warm_up(self):
+        """Запускает и прогревает все процессы пула заранее (например, за минуту до закрытия свечи)."""
+        self._fetcher()
+        if self.scheduler is not None:
+            return self  # анализ делает планировщик - пул процессов не нужен
+        process_pool, _ = self._pools()
+        for future in [process_pool.submit(_warmup) for _ in range(self.analysis_workers)]:
+            future.result()
+        return self
+
+    def _fetcher(self):
+        """
+        Источник данных. По умолчанию (SCHEDULER_SHARED, таймфрейм планировщика, окно не больше
+        CONTEXT_OUTPUT_SIZE) пары подписываются на закрытие свечи в общем планировщике: загрузка
+        с анализом идет сразу после закрытия и одна на всех потребителей, а проход сканера
+        забирает готовый анализ (request_result) без повторного расчета в пуле процессов.
+        Иначе - загрузка fetch_func (по умолчанию get_forex_data) и анализ в пуле.
+        """
+        if self.fetch_func is None and self.scheduler is None:
+            if settings.SCHEDULER_SHARED and self.interval in settings.SCHEDULER_TIMEFRAMES \
+                    and self.outputsize <= settings.CONTEXT_OUTPUT_SIZE:
+                from core.scheduler import get_scheduler
+                self.scheduler = get_scheduler()
+                for symbol in self.symbols:
+                    self.scheduler.subscribe(symbol, self.interval, 'scanner', lambda *result: None)
+            else:
+                from core.data_fetcher import get_forex_data
+                self.fetch_func = get_forex_data
+        return self.fetch_func
+
+    def _request_analysis(self, symbol: str) -> dict:
+        from core.scheduler import request_result
+        scheduled = request_result(symbol, self.interval, self.scheduler)
+        df = scheduled['df'].iloc[-self.outputsize:]
+        return summarize_analysis(symbol, df, scheduled['analysis'] if not df.empty else None)
+
+    def _fetch(self, symbol: str):
+        return self.fetch_func(symbol, self.interval, outputsize=self.outputsize)
+
+    async def _scan_symbol(self, symbol: str, semaphore: asyncio.Semaphore, process_pool, thread_pool) -> dict:
+        loop = asyncio.get_running_loop()
+        log_fields = {'symbol': symbol, 'timeframe': self.interval, 'stage': 'scan'}
+        started = time_module.perf_counter()
+        try:
+            if self.scheduler is not None:
+                async with semaphore:
+                    result = await loop.run_in_executor(thread_pool, self._request_analysis, symbol)
+                result['fetch_seconds'] = round(time_module.perf_counter() - started, 3)
+            else:
+                async with semaphore:
+                    df = await loop.run_in_executor(thread_pool, self._fetch, symbol)
+                fetch_seconds = time_module.perf_counter() - started
+                result = await loop.run_in_executor(process_pool, analyze_symbol, symbol, df,
+                                                    settings.get_pip_value(symbol))
+                result['fetch_seconds'] = round(fetch_seconds, 3)
+        except Exception as e:
+            logger.exception("Ошибка сканирования: %s", e, extra=log_fields)
+            result = {'symbol': symbol, 'error': str(e), 'strength': 0, 'distance_pips': None,
+                      'direction': DIRECTION_NEUTRAL, 'setups': []}
+        metrics.observe(metrics.STAGE_SECONDS, time_module.perf_counter() - started, stage='scan_symbol')
+        return result
+
+    async def scan(self, symbols: list = None) -> dict:
+        """Один проход по парам; возвращает отчет с отсортированными результатами."""
+        symbols = list(symbols or self.symbols)
+        started = time_module.perf_counter()
+        process_pool, thread_pool = self._pools()
+        self._fetcher()
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+        results = await asyncio.gather(*(self._scan_symbol(s, semaphore, process_pool, thread_pool)
+                                         for s in symbols))
+        ranked = rank_results(results)
+        report = {
+            'interval': self.interval,
+            'symbols': len(symbols),
+            'failed': sum(1 for r in ranked if r.get('error')),
+            'wall_seconds': round(time_module.perf_counter() - started, 3),
+            'results': ranked,
+        }
+        metrics.observe(metrics.STAGE_SECONDS, report['wall_seconds'], stage='scan')
+        logger.info("Сканирование завершено: %d пар, ошибок: %d, %.3f с",
+                    report['symbols'], report['failed'], report['wall_seconds'], extra={'stage': 'scan'})
+        return report
+
+    def run(self, symbols: list = None) -> dict:
+        """Блокирующий вариант scan() для вызова вне event loop."""
+        return asyncio.run(self.scan(symbols))
+
+    def shutdown(self, wait_for_jobs: bool = True):
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=wait_for_jobs)
+                self._thread_pool.shutdown(wait=wait_for_jobs)
+                self._process_pool = None
+                self._thread_pool = None
+
+
+def format_report(report: dict, top: int = None) -> list:
+    lines = [f"{'пара':<10}{'контекст':<8}{'сила':>5}{'до SETUP, пипс':>16}  цена / уровень"]
+    for r in report['results'][:top]:
+        if r.get('error'):
+            lines.append(f"{r['symbol']:<10}ошибка: {r['error']}")
+            continue
+        distance = f"{r['distance_pips']:.1f}" if r['distance_pips'] is not None else '-'
+        level = (f"{r['last_close']:.5f} / {r['nearest_setup']['type']} {r['nearest_setup']['price']:.5f}"
+                 if r['nearest_setup'] else f"{r['last_close']:.5f}")
+        lines.append(f"{r['symbol']:<10}{r['direction']:<8}{r['strength']:>5}{distance:>16}  {level}")
+    return lines
+
+
+if __name__ == '__main__':
+    import argparse
+    from utils.logger import setup_logger
+
+    parser = argparse.ArgumentParser(description="Сканер пар: контекст 1h и сессионные сетапы")
+    parser.add_argument('--symbols', help="пары через запятую (по умолчанию settings.SCANNER_SYMBOLS)")
+    parser.add_argument('--top', type=int, default=None)
+    args = parser.parse_args()
+
+    setup_logger()
+    scanner = MarketScanner(args.symbols.split(',') if args.symbols else None)
+    try:
+        scanner.warm_up()
+        scan_report = scanner.run()
+        print(f"Пар: {scan_report['symbols']}, ошибок: {scan_report['failed']}, {scan_report['wall_seconds']} с")
+        print('\n'.join(format_report(scan_report, args.top)))
+    finally:
+        scanner.shutdown()
+        from core.scheduler import stop_scheduler
+        stop_scheduler()
+        if settings.ALERTS_ENABLED:
+            from core.alerts import stop_dispatcher
+            stop_dispatcher()
@@ -0,0 +1,477 @@
+# core/scheduler.py
+"""
+Планировщик анализа по закрытию свечей (UTC).
+
+Для каждого таймфрейма из SCHEDULER_TIMEFRAMES (3m, 1h) запуск происходит ровно на границе
+свечи плюс SCHEDULER_SETTLEMENT_DELAY_SECONDS; свечи, открытые вне торговых часов FX
+(пятница 21:00 - воскресенье 21:00 UTC), пропускаются. Потребители (API, сканер, генератор
+сигналов) подписываются на (символ, таймфрейм) или запрашивают результат по требованию -
+на каждый ключ и свечу выполняется одна загрузка с анализом, результат получают все.
+
+Противодавление: если запуск ключа еще идет, когда закрылась следующая свеча, новый запуск
+не стартует параллельно - он ждет в единственном слоте и заменяется более свежим
+(промежуточные свечи отбрасываются). При SCHEDULER_MAX_IN_FLIGHT ключей в работе новые
+ключи отбрасываются до освобождения места.
+"""
+import threading
+import time as time_module
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from configs import settings
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+WEEK_SECONDS = 7 * 86400
+# 1970-01-01 - четверг: сдвиг, после которого (epoch // 86400) % 7 дает 0 для понедельника
+_EPOCH_WEEKDAY_OFFSET = 3
+
+# Таймфрейм -> (интервал Twelve Data, правило пересборки). 3m в API нет - собирается из 1min
+API_INTERVALS = {
+    '3m': ('1min', '3min'),
+    '1h': ('1h', None),
+}
+
+SCHEDULER_RUNS = 'tsbot_scheduler_runs_total'
+metrics.registry.describe(SCHEDULER_RUNS, "Запуски планировщика (result=ok|error|coalesced|deferred|shed)")
+
+# (символ, таймфрейм) -> LiquidityIndex: засевается историей за LIQUIDITY_LOOKBACK_DAYS при первом
+# использовании и сохраняется на диск после каждого запуска (liquidity_index_for)
+_liquidity_indexes = {}
+_liquidity_lock = threading.Lock()
+# символ -> MultiTimeframeContext: 4h/1D собираются из закрытых 1h-свечей запусков CONTEXT_TIMEFRAME
+_mtf_contexts = {}
+
+
+def _week_offset(weekday: int, hour: int) -> int:
+    return weekday * 86400 + hour * 3600
+
+
+def is_market_open(epoch: float) -> bool:
+    """Открыт ли рынок FX в момент epoch (секунды UTC)."""
+    seconds_in_week = (int(epoch) + _EPOCH_WEEKDAY_OFFSET * 86400) % WEEK_SECONDS
+    close = _week_offset(settings.MARKET_CLOSE_WEEKDAY, settings.MARKET_CLOSE_HOUR_UTC)
+    reopen = _week_offset(settings.MARKET_OPEN_WEEKDAY, settings.MARKET_OPEN_HOUR_UTC)
+    return not (close <= seconds_in_week < reopen)
+
+
+def next_market_open(epoch: float) -> int:
+    """Ближайшее открытие рынка не раньше epoch."""
+    if is_market_open(epoch):
+        return int(epoch)
+    week_start = int(epoch) - (int(epoch) + _EPOCH_WEEKDAY_OFFSET * 86400) % WEEK_SECONDS
+    reopen = week_start + _week_offset(settings.MARKET_OPEN_WEEKDAY, settings.MARKET_OPEN_HOUR_UTC)
+    return reopen if reopen >= epoch else reopen + WEEK_SECONDS
+
+
+def last_bar_close(epoch: float, period_seconds: int) -> int:
+    """Время закрытия последней закрытой свечи (границы свечей кратны периоду от epoch 0)."""
+    return int(epoch) // period_seconds * period_seconds
+
+
+def next_bar_close(epoch: float, period_seconds: int) -> int:
+    """
+    Ближайшее закрытие свечи строго после epoch, у которой время открытия попадает
+    в торговые часы. Выходные пропускаются одним прыжком к открытию рынка.
+    """
+    close = last_bar_close(epoch, period_seconds) + period_seconds
+    if not is_market_open(close - period_seconds):
+        opened = next_market_open(close - period_seconds)
+        close = -(-(opened + 1) // period_seconds) * period_seconds
+    return close
+
+
+def resample_ohlcv(df, rule: str):
+    """Свечи большего таймфрейма из мелких: open - первая, high/low - экстремумы, close - последняя."""
+    aggregation = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'}
+    if 'volume' in df.columns:
+        aggregation['volume'] = 'sum'
+    resampled = df.resample(rule, label='left', closed='left').agg(aggregation)
+    return resampled.dropna(subset=['close'])
+
+
+def liquidity_index_for(symbol: str, timeframe: str, df, bars_source=None):
+    """
+    Индекс ликвидности ключа, готовый принять свечи окна df. При первом использовании в процессе
+    он читается с диска (состояние прошлого запуска); если состояния нет или между ним и окном
+    загрузки пропуск, индекс догоняется историей: хранилище свечей (core/ohlcv_store.py) или один
+    большой запрос к API (не больше CHART_HISTORY_MAX_WINDOW_SIZE свечей) на LIQUIDITY_LOOKBACK_DAYS.
+    """
+    from ts_logic.incremental import default_bars_source
+    from ts_logic.liquidity_index import LiquidityIndex, state_path_for
+
+    key = (symbol, timeframe)
+    with _liquidity_lock:
+        index = _liquidity_indexes.get(key)
+    if index is None:
+        pip_value = settings.get_pip_value(symbol)
+        index = LiquidityIndex.load(state_path_for(symbol, timeframe), pip_value) or LiquidityIndex(pip_value)
+        with _liquidity_lock:
+            _liquidity_indexes[key] = index
+    if not df.empty and (index.last_time is None or index.last_time < df.index[0]):
+        period = settings.SCHEDULER_TIMEFRAMES.get(timeframe, 3600)
+        history = (bars_source or default_bars_source)(
+            symbol, timeframe, count=int(settings.LIQUIDITY_LOOKBACK_DAYS * 86400 // period))
+        if history is not None and not history.empty:
+            seeded = index.update_from_dataframe(history[history.index < df.index[0]])
+            logger.info("Индекс ликвидности дополнен историей: %d свечей, уровней %d", seeded, len(index),
+                        extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'liquidity'})
+    return index
+
+
+def mtf_context_for(symbol: str, df, bars_source=None):
+    """
+    Контекст старших таймфреймов пары, готовый принять свечи окна df (CONTEXT_TIMEFRAME). Окна 4h/1D
+    (MTF_WINDOW_BARS свечей) намного длиннее окна загрузки, поэтому при первом использовании или
+    после пропуска контекст догоняется историей того же источника, что и индекс ликвидности.
+    """
+    from ts_logic.incremental import default_bars_source
+    from ts_logic.multi_timeframe import MultiTimeframeContext
+
+    with _liquidity_lock:
+        context = _mtf_contexts.get(symbol)
+        if context is None:
+            context = _mtf_contexts[symbol] = MultiTimeframeContext(symbol)
+    if not df.empty and (context.last_time is None or context.last_time < df.index[0]):
+        history = (bars_source or default_bars_source)(
+            symbol, settings.CONTEXT_TIMEFRAME, count=context.history_bars())
+        if history is not None and not history.empty:
+            seeded = context.update_from_dataframe(history[history.index < df.index[0]])
+            logger.info("Старшие таймфреймы дополнены историей: %d свечей", seeded,
+                        extra={'symbol': symbol, 'timeframe': settings.CONTEXT_TIMEFRAME, 'stage': 'mtf'})
+    return context
+
+
+def _save_liquidity_index(symbol: str, timeframe: str, index):
+    from ts_logic.liquidity_index import state_path_for
+    try:
+        index.save(state_path_for(symbol, timeframe))
+    except OSError as e:
+        logger.warning("Состояние индекса ликвидности не сохранено: %s", e,
+                       extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'liquidity'})
+
+
+def fetch_and_analyze(symbol: str, timeframe: str, bar_close: int,
+                      outputsize: int = settings.CONTEXT_OUTPUT_SIZE) -> dict:
+    """
+    Задание по умолчанию: загрузка свечей, отсечение формирующейся свечи (открытой в bar_close
+    или позже) и полный анализ с размером пипса пары. Закрытые свечи дописываются в индекс
+    ликвидности ключа (liquidity_index_for: засевается историей и переживает перезапуск), так что
+    сетапы сверяются с уровнями за LIQUIDITY_LOOKBACK_DAYS, а не только за окно загрузки. Для CONTEXT_TIMEFRAME в analysis добавляется
+    'higher_timeframes' - смещение 4h/1D (ts_logic/multi_timeframe.py, засев историей - mtf_context_for). Найденные сетапы
+    уходят в алерты (core/alerts.py), повторы на следующих свечах отсекаются диспетчером.
+    """
+    import pandas as pd
+    from core.alerts import publish_setups
+    from core.chart_payload import run_chart_analysis
+    from core.data_fetcher import get_forex_data
+    from ts_logic.context_analyzer_1h import determine_trend_channel_context
+
+    api_interval, rule = API_INTERVALS.get(timeframe, (timeframe, None))
+    if rule:
+        factor = int(pd.Timedelta(rule) / pd.Timedelta(api_interval))
+        df = get_forex_data(symbol, api_interval, outputsize=outputsize * factor)
+        if not df.empty:
+            df = resample_ohlcv(df, rule)
+    else:
+        df = get_forex_data(symbol, api_interval, outputsize=outputsize)
+    if not df.empty:
+        df = df[df.index < pd.Timestamp(bar_close, unit='s', tz='UTC')]
+    pip_value = settings.get_pip_value(symbol)
+    # Один запуск на ключ одновременно (объединение в BarCloseScheduler) - индекс ключа не делится
+    liquidity_index = liquidity_index_for(symbol, timeframe, df)
+    if liquidity_index.update_from_dataframe(df):
+        _save_liquidity_index(symbol, timeframe, liquidity_index)
+    analysis = run_chart_analysis(df, pip_value, liquidity_index=liquidity_index)
+    if timeframe == settings.CONTEXT_TIMEFRAME:
+        mtf_context = mtf_context_for(symbol, df)
+        mtf_context.update_from_dataframe(df)
+        analysis['higher_timeframes'] = mtf_context.bias(
+            analysis['overall_context'], determine_trend_channel_context(analysis['trend_lines']))
+    if settings.ALERTS_ENABLED:
+        # Только очередь диспетчера: отправка по приемникам не задерживает запуск
+        publish_setups(symbol, timeframe, analysis['session_points'])
+    return {'df': df, 'analysis': analysis}
+
+
+class _KeyState:
+    __slots__ = ('bar_close', 'future', 'pending_bar_close', 'pending_future')
+
+    def __init__(self, bar_close: int, future: Future):
+        self.bar_close = bar_close
+        self.future = future
+        self.pending_bar_close = None
+        self.pending_future = None
+
+
+class BarCloseScheduler:
+    """
+    Запускает job_func(symbol, timeframe, bar_close) по закрытию свечей для всех ключей,
+    на которые есть подписка, и по запросу (request). Одинаковые запросы объединяются.
+    """
+
+    def __init__(self, job_func=fetch_and_analyze, timeframes: dict = None,
+                 settlement_delay: float = settings.SCHEDULER_SETTLEMENT_DELAY_SECONDS,
+                 max_workers: int = settings.SCHEDULER_WORKERS,
+                 max_in_flight: int = settings.SCHEDULER_MAX_IN_FLIGHT,
+                 clock=time_module.time):
+        self.job_func = job_func
+        self.timeframes = dict(timeframes or settings.SCHEDULER_TIMEFRAMES)
+        self.settlement_delay = settlement_delay
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scheduler-job")
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # (symbol, timeframe) -> {consumer: callback}
+        self._in_flight = {}      # (symbol, timeframe) -> _KeyState
+        self._latest = {}         # (symbol, timeframe) -> (bar_close, result)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Подписки и запросы ---
+    def subscribe(self, symbol: str, timeframe: str, consumer: str, callback):
+        """callback(symbol, timeframe, bar_close, result) после каждого запуска ключа."""
+        if timeframe not in self.timeframes:
+            raise ValueError(f"unknown timeframe: {timeframe}")
+        with self._lock:
+            self._subscriptions.setdefault((symbol, timeframe), {})[consumer] = callback
+        self._wakeup.set()
+
+    def unsubscribe(self, symbol: str, timeframe: str, consumer: str):
+        with self._lock:
+            consumers = self._subscriptions.get((symbol, timeframe))
+            if consumers is not None:
+                consumers.pop(consumer, None)
+                if not consumers:
+                    del self._subscriptions[(symbol, timeframe)]
+
+    def latest(self, symbol: str, timeframe: str):
+        """(bar_close, result) последнего завершенного запуска ключа или None."""
+        with self._lock:
+            return self._latest.get((symbol, timeframe))
+
+    def request(self, symbol: str, timeframe: str) -> Future:
+        """
+        Результат для последней закрытой свечи: готовый, если уже посчитан, общий Future
+        идущего запуска или новый запуск. Повторные запросы к API не создают лишней работы.
+        """
+        if timeframe not in self.timeframes:
+            raise ValueError(f"unknown timeframe: {timeframe}")
+        bar_close = last_bar_close(self.clock(), self.timeframes[timeframe])
+        latest = self.latest(symbol, timeframe)
+        if latest is not None and latest[0] >= bar_close:
+            metrics.inc(SCHEDULER_RUNS, result='coalesced', timeframe=timeframe)
+            future = Future()
+            future.set_result(latest[1])
+            return future
+        return self._submit((symbol, timeframe), bar_close)
+
+    def _submit(self, key: tuple, bar_close: int) -> Future:
+        symbol, timeframe = key
+        with self._lock:
+            state = self._in_flight.get(key)
+            if state is not None:
+                if state.bar_close >= bar_close:
+                    metrics.inc(SCHEDULER_RUNS, result='coalesced', timeframe=timeframe)
+                    return state.future
+                if state.pending_bar_close is not None and state.pending_bar_close >= bar_close:
+                    metrics.inc(SCHEDULER_RUNS, result='coalesced', timeframe=timeframe)
+                    return state.pending_future
+                # Предыдущая свеча еще считается: ждем в единственном слоте, более старый ожидающий отбрасывается
+                if state.pending_future is not None:
+                    metrics.inc(SCHEDULER_RUNS, result='shed', timeframe=timeframe)
+                    logger.warning("Запуск для свечи %s отброшен: ключ перегружен",
+                                   _format_epoch(state.pending_bar_close),
+                                   extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'scheduler'})
+                else:
+                    state.pending_future = Future()
+                metrics.inc(SCHEDULER_RUNS, result='deferred', timeframe=timeframe)
+                state.pending_bar_close = bar_close
+                return state.pending_future
+
+            if len(self._in_flight) >= self.max_in_flight:
+                metrics.inc(SCHEDULER_RUNS, result='shed', timeframe=timeframe)
+                logger.warning("Запуск отброшен: в работе %d ключей", len(self._in_flight),
+                               extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'scheduler'})
+                future = Future()
+                future.set_exception(RuntimeError("scheduler overloaded"))
+                return future
+
+            state = self._in_flight[key] = _KeyState(bar_close, Future())
+        self._executor.submit(self._execute, key, state)
+        return state.future
+
+    def _execute(self, key: tuple, state: _KeyState):
+        symbol, timeframe = key
+        started = time_module.perf_counter()
+        result, error = None, None
+        try:
+            result = self.job_func(symbol, timeframe, state.bar_close)
+        except Exception as e:
+            error = e
+            logger.exception("Ошибка запуска для свечи %s: %s", _format_epoch(state.bar_close), e,
+                             extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'scheduler'})
+        metrics.observe(metrics.STAGE_SECONDS, time_module.perf_counter() - started, stage='scheduled_run',
+                        timeframe=timeframe)
+        metrics.inc(SCHEDULER_RUNS, result='error' if error else 'ok', timeframe=timeframe)
+
+        with self._lock:
+            if error is None:
+                self._latest[key] = (state.bar_close, result)
+            callbacks = list(self._subscriptions.get(key, {}).items())
+            if state.pending_bar_close is not None:
+                next_state = _KeyState(state.pending_bar_close, state.pending_future)
+                self._in_flight[key] = next_state
+            else:
+                next_state = None
+                del self._in_flight[key]
+
+        if error is None:
+            state.future.set_result(result)
+            for consumer, callback in callbacks:
+                try:
+                    callback(symbol, timeframe, state.bar_close, result)
+                except Exception as e:
+                    logger.exception("Ошибка в обработчике потребителя %s: %s", consumer, e,
+                                     extra={'symbol': symbol, 'timeframe': timeframe, 'stage': 'scheduler'})
+        else:
+            state.future.set_exception(error)
+        if next_state is not None:
+            self._executor.submit(self._execute, key, next_state)
+
+    # --- Расписание ---
+    def next_fire_time(self, now: float = None):
+        """(время запуска, [таймфреймы]) ближайшего закрытия свечи с учетом паузы."""
+        now = self.clock() if now is None else now
+        closes = {tf: next_bar_close(now - self.settlement_delay, period) for tf, period in self.timeframes.items()}
+        earliest = min(closes.values())
+        return earliest + self.settlement_delay, sorted(tf for tf, close in closes.items() if close == earliest)
+
+    def fire(self, timeframes: list, bar_close: int = None) -> list:
+        """Запускает все подписанные ключи указанных таймфреймов; возвращает их Future."""
+        with self._lock:
+            keys = [key for key in self._subscriptions if key[1] in timeframes]
+        futures = []
+        for key in keys:
+            close = bar_close if bar_close is not None else last_bar_close(self.clock(), self.timeframes[key[1]])
+            futures.append(self._submit(key, close))
+        return futures
+
+    def _run(self):
+        while not self._stop.is_set():
+            fire_at, timeframes = self.next_fire_time()
+            delay = fire_at - self.clock()
+            if delay > 0:
+                self._wakeup.clear()
+                if self._stop.wait(min(delay, 60)) or self._wakeup.is_set():
+                    continue
+                if fire_at - self.clock() > 0:
+                    continue  # длинное ожидание (выходные) - по кускам, чтобы замечать смену часов
+            logger.debug("Закрытие свечей %s: %s", ', '.join(timeframes),
+                         _format_epoch(fire_at - self.settlement_delay), extra={'stage': 'scheduler'})
+            self.fire(timeframes, int(fire_at - self.settlement_delay))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="bar-close-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, wait_for_jobs: bool = True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=wait_for_jobs)
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_scheduler() -> BarCloseScheduler:
+    """Общий планировщик процесса (запускается при первом вызове): одна загрузка на ключ и свечу для всех потребителей."""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = BarCloseScheduler().start()
+        return _shared_scheduler
+
+
+def stop_scheduler(wait_for_jobs: bool = True):
+    """
+    Останавливает общий планировщик. Диспетчер алертов не трогает - его останавливает
+    владелец процесса (stop_dispatcher), когда закончили все, кто публикует алерты.
+    """
+    global _shared_scheduler
+    with _shared_lock:
+        scheduler, _shared_scheduler = _shared_scheduler, None
+    if scheduler is not None:
+        scheduler.stop(wait_for_jobs)
+
+
+def request_result(symbol: str, timeframe: str, scheduler: BarCloseScheduler = None) -> dict:
+    """
+    Результат запуска для последней закрытой свечи из общего планировщика: {'df': закрытые свечи,
+    'analysis': полный анализ}. Потребители берут готовый анализ, а не пересчитывают его по 'df'.
+    """
+    return (scheduler or get_scheduler()).request(symbol, timeframe).result(
+        timeout=settings.SCHEDULER_REQUEST_TIMEOUT_SECONDS)
+
+
+def fetch_via_scheduler(symbol: str, interval: str, outputsize: int = None, scheduler: BarCloseScheduler = None,
+                        **kwargs):
+    """
+    Замена get_forex_data для потребителей, которым нужны только свечи: закрытые свечи последнего
+    запуска ключа из общего планировщика (одновременные запросы объединяются в одну загрузку).
+    С датами, незнакомым планировщику таймфреймом или окном больше CONTEXT_OUTPUT_SIZE - прямой запрос к API.
+    """
+    if kwargs or interval not in settings.SCHEDULER_TIMEFRAMES or (outputsize or 0) > settings.CONTEXT_OUTPUT_SIZE:
+        from core.data_fetcher import get_forex_data
+        return get_forex_data(symbol, interval, outputsize=outputsize, **kwargs)
+    df = request_result(symbol, interval, scheduler)['df']
+    return df.iloc[-outputsize:] if outputsize else df
+
+
+def _format_epoch(epoch) -> str:
+    if epoch is None:
+        return '-'
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+if __name__ == '__main__':
+    from utils.logger import setup_logger
+    setup_logger()
+    print("Тестирование scheduler.py...")
+
+    friday_evening = datetime(2024, 3, 8, 20, 59, 0, tzinfo=timezone.utc).timestamp()
+    for tf, period in settings.SCHEDULER_TIMEFRAMES.items():
+        print(f"{tf}: после {_format_epoch(friday_evening)} -> {_format_epoch(next_bar_close(friday_evening, period))}, "
+              f"затем {_format_epoch(next_bar_close(next_bar_close(friday_evening, period), period))}")
+    print("Рынок открыт в субботу 12:00:", is_market_open(datetime(2024, 3, 9, 12, tzinfo=timezone.utc).timestamp()))
+
+    calls = []
+
+    def slow_job(symbol, timeframe, bar_close):
+        calls.append((symbol, timeframe, bar_close))
+        time_module.sleep(0.3)
+        return {'symbol': symbol, 'bar_close': bar_close}
+
+    scheduler = BarCloseScheduler(job_func=slow_job)
+    for consumer in ('api', 'scanner', 'signals_3m'):
+        scheduler.subscribe('EUR/USD', '3m', consumer, lambda s, tf, close, result, c=consumer: None)
+    now = time_module.time()
+    close = last_bar_close(now, 180)
+    first = scheduler.fire(['3m'], close)
+    duplicate = scheduler.request('EUR/USD', '3m')
+    deferred = scheduler.fire(['3m'], close + 180)
+    superseding = scheduler.fire(['3m'], close + 360)
+    print("Запрос API объединен с запуском по расписанию:", duplicate is first[0])
+    print("Результат отложенного запуска:", superseding[0].result(timeout=5), "отложенный заменен:", deferred[0] is superseding[0])
+    print("Вызовов задания:", len(calls), "(ожидается 2: текущая свеча и самая свежая)")
+    scheduler.stop()
+    print('\n'.join(metrics.summary_lines()))
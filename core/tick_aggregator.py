@@ -0,0 +1,500 @@
+# core/tick_aggregator.py
+"""
+Свечи из потока котировок: тики bid/ask -> свечи по средней цене (bid + ask) / 2
+для каждого таймфрейма TICK_TIMEFRAMES (3m, 1h) с границами по UTC (epoch кратно длительности).
+
+События уходят анализаторам через ограниченную очередь (TICK_QUEUE_SIZE):
+    closed  - свеча закрылась (пришел тик следующей свечи или advance() по часам);
+              при полной очереди производитель ждет (противодавление), а не теряет свечу
+    forming - текущее состояние формирующейся свечи, не чаще TICK_FORMING_EMIT_SECONDS;
+              при полной очереди отбрасывается - следующее обновление его заменит
+    revised - опоздавший тик (не старше TICK_LATE_GRACE_SECONDS) изменил закрытую свечу
+
+Пропуски (интервалы без тиков) свечей не порождают - как у Twelve Data, пустых свечей нет;
+они считаются в метрике. Тики старше допуска отбрасываются.
+
+Тики приходят пакетами (on_ticks): тики в порядке времени сворачиваются в свечи numpy
+(reduceat по границам свечей), Python-код выполняется один раз на свечу, а не на тик.
+Опоздавшие тики пакета обрабатываются поштучно после него.
+
+    python -m core.tick_aggregator                       # самопроверка и замер на синтетике
+    python -m core.tick_aggregator --file ticks.csv      # воспроизведение файла time,bid,ask
+    python -m core.tick_aggregator --socket              # поток с TICK_SOCKET_HOST:TICK_SOCKET_PORT в
+                                                         # инкрементальные анализаторы (ts_logic/incremental.py)
+"""
+import queue
+import socket
+import threading
+import time as time_module
+
+import numpy as np
+import pandas as pd
+
+from configs import settings
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+EVENT_CLOSED = 'closed'
+EVENT_FORMING = 'forming'
+EVENT_REVISED = 'revised'
+
+TICKS = 'tsbot_ticks_total'
+BAR_EVENTS = 'tsbot_tick_bar_events_total'
+TICKS_DROPPED = 'tsbot_ticks_dropped_total'
+BAR_GAPS = 'tsbot_tick_bar_gaps_total'
+metrics.registry.describe(TICKS, "Тики агрегатора (result=ok|late - не по порядку времени|malformed - строка потока не разобрана)")
+metrics.registry.describe(TICKS_DROPPED, "Опоздавшие тики старше допуска, отброшенные для таймфрейма")
+metrics.registry.describe(BAR_EVENTS, "События свечей из тиков (event=closed|forming|revised, result=ok|dropped)")
+metrics.registry.describe(BAR_GAPS, "Пропуски: между соседними свечами были интервалы без тиков")
+
+
+class _BarBuilder:
+    """Состояние одного таймфрейма: формирующаяся свеча и последняя закрытая (для исправлений)."""
+
+    __slots__ = ('timeframe', 'ms', 'start', 'open', 'high', 'low', 'close', 'last_ts', 'count',
+                 'closed', 'dirty', 'last_forming_emit')
+
+    def __init__(self, timeframe: str, seconds: int):
+        self.timeframe = timeframe
+        self.ms = seconds * 1000
+        self.start = None
+        self.open = self.high = self.low = self.close = None
+        self.last_ts = None
+        self.count = 0
+        self.closed = None
+        self.dirty = False
+        self.last_forming_emit = None
+
+    def bar(self, event: str) -> dict:
+        return {'timeframe': self.timeframe, 'event': event, 'time': self.start // 1000,
+                'open': self.open, 'high': self.high, 'low': self.low, 'close': self.close, 'volume': self.count}
+
+
+class TickAggregator:
+    """
+    Агрегатор одного символа. Время тиков - epoch-миллисекунды UTC (int). Один поток-производитель
+    на экземпляр; события читаются из bar_queue любым числом потребителей.
+    """
+
+    def __init__(self, symbol: str, timeframes: dict = None, bar_queue: queue.Queue = None,
+                 late_grace_seconds: float = settings.TICK_LATE_GRACE_SECONDS,
+                 forming_emit_seconds: float = settings.TICK_FORMING_EMIT_SECONDS):
+        self.symbol = symbol
+        self.bar_queue = bar_queue if bar_queue is not None else queue.Queue(maxsize=settings.TICK_QUEUE_SIZE)
+        self.late_grace_ms = int(late_grace_seconds * 1000)
+        self.forming_emit_ms = int(forming_emit_seconds * 1000)
+        self._builders = [_BarBuilder(tf, seconds) for tf, seconds in (timeframes or settings.TICK_TIMEFRAMES).items()]
+        self.watermark = None  # максимум из времени тиков и advance(now)
+        self._counts = {'ok': 0, 'late': 0}
+        self._dropped = {}  # таймфрейм -> тиков
+        self._gaps = {}
+
+    # --- вход ---
+
+    def on_tick(self, ts: int, bid: float, ask: float):
+        """Один тик (поштучный путь; для потока лучше on_ticks пакетами)."""
+        mid = (bid + ask) * 0.5
+        late_ms = 0
+        if self.watermark is None or ts >= self.watermark:
+            self.watermark = ts
+        else:
+            late_ms = self.watermark - ts
+        for builder in self._builders:
+            bucket = ts - ts % builder.ms
+            self._add_segment(builder, bucket, mid, mid, mid, mid, 1, ts, late_ms)
+        self._count('late' if late_ms else 'ok')
+        if not late_ms:
+            self._emit_forming(ts)
+
+    def on_ticks(self, times, bids, asks):
+        """
+        Пакет тиков. Тики не раньше текущего максимума времени сворачиваются векторно,
+        опоздавшие - поштучно после пакета (порядок их событий относительно пакета не сохраняется).
+        """
+        times = np.asarray(times, dtype=np.int64)
+        if not len(times):
+            return
+        mids = (np.asarray(bids, dtype=np.float64) + np.asarray(asks, dtype=np.float64)) * 0.5
+        running_max = np.maximum.accumulate(times)
+        if self.watermark is not None:
+            running_max = np.maximum(running_max, self.watermark)
+        previous_max = np.concatenate(([times[0] if self.watermark is None else self.watermark], running_max[:-1]))
+        in_order = times >= previous_max
+
+        if in_order.all():
+            ordered_times, ordered_mids = times, mids
+        else:
+            ordered_times, ordered_mids = times[in_order], mids[in_order]
+        if len(ordered_times):
+            self.watermark = int(ordered_times[-1])
+            for builder in self._builders:
+                self._add_ordered(builder, ordered_times, ordered_mids)
+            self._counts['ok'] += len(ordered_times)
+            self._emit_forming(self.watermark)
+
+        if not in_order.all():
+            for i in np.flatnonzero(~in_order):
+                ts, mid = int(times[i]), float(mids[i])
+                for builder in self._builders:
+                    self._add_segment(builder, ts - ts % builder.ms, mid, mid, mid, mid, 1, ts, self.watermark - ts)
+                self._count('late')
+        self.flush_metrics()
+
+    def advance(self, now_ms: int):
+        """
+        Закрывает свечи, чье время истекло более TICK_LATE_GRACE_SECONDS назад, даже если тиков
+        следующей свечи нет (тихий рынок). В живом режиме вызывается по часам.
+        """
+        if self.watermark is None or now_ms > self.watermark:
+            self.watermark = now_ms
+        for builder in self._builders:
+            if builder.start is not None and builder.start + builder.ms + self.late_grace_ms <= now_ms:
+                self._close(builder)
+
+    # --- свертка ---
+
+    def _add_ordered(self, builder: _BarBuilder, times: np.ndarray, mids: np.ndarray):
+        """Тики по возрастанию времени: отрезки одной свечи сворачиваются reduceat."""
+        buckets = times - times % builder.ms
+        starts = np.flatnonzero(buckets[1:] != buckets[:-1]) + 1
+        starts = np.concatenate(([0], starts))
+        ends = np.append(starts[1:], len(times)) - 1
+        highs = np.maximum.reduceat(mids, starts)
+        lows = np.minimum.reduceat(mids, starts)
+        counts = np.diff(np.append(starts, len(times)))
+        late_ms = 0
+        for k, (i, j) in enumerate(zip(starts.tolist(), ends.tolist())):
+            self._add_segment(builder, int(buckets[i]), float(mids[i]), float(highs[k]), float(lows[k]),
+                              float(mids[j]), int(counts[k]), int(times[j]), late_ms)
+
+    def _add_segment(self, builder: _BarBuilder, bucket: int, open_: float, high: float, low: float,
+                     close: float, count: int, last_ts: int, late_ms: int):
+        """Тики одной свечи (bucket) с ценами open/high/low/close: продолжение, новая свеча или опоздание."""
+        if builder.start is not None and bucket == builder.start:
+            if high > builder.high:
+                builder.high = high
+            if low < builder.low:
+                builder.low = low
+            if last_ts >= builder.last_ts:
+                builder.close, builder.last_ts = close, last_ts
+            builder.count += count
+            builder.dirty = True
+            return
+        # Начало последней известной свечи: формирующейся или (после advance) закрытой
+        latest = builder.start if builder.start is not None else (
+            builder.closed['time'] * 1000 if builder.closed is not None else None)
+        if latest is not None and bucket < latest or builder.start is None and bucket == latest:
+            self._revise(builder, bucket, high, low, close, count, last_ts, late_ms)
+            return
+        if builder.start is not None:
+            self._close(builder)
+        if latest is not None and bucket - latest > builder.ms:
+            self._gaps[builder.timeframe] = self._gaps.get(builder.timeframe, 0) + 1
+        builder.start, builder.open, builder.high, builder.low, builder.close = bucket, open_, high, low, close
+        builder.last_ts, builder.count, builder.dirty = last_ts, count, True
+
+    def _revise(self, builder: _BarBuilder, bucket: int, high: float, low: float, close: float,
+                count: int, last_ts: int, late_ms: int):
+        """Опоздавшие тики последней закрытой свечи в пределах допуска исправляют ее; остальные отбрасываются."""
+        closed = builder.closed
+        if closed is None or bucket != closed['time'] * 1000 or late_ms > self.late_grace_ms:
+            self._dropped[builder.timeframe] = self._dropped.get(builder.timeframe, 0) + count
+            return
+        changed = high > closed['high'] or low < closed['low'] or last_ts > closed['_last_ts']
+        closed['high'], closed['low'] = max(closed['high'], high), min(closed['low'], low)
+        if last_ts > closed['_last_ts']:
+            closed['close'], closed['_last_ts'] = close, last_ts
+        closed['volume'] += count
+        if changed:
+            self._put(dict(self._public(closed), event=EVENT_REVISED), droppable=False)
+
+    def _close(self, builder: _BarBuilder):
+        closed = builder.bar(EVENT_CLOSED)
+        closed['_last_ts'] = builder.last_ts
+        builder.closed = closed
+        builder.start = None
+        builder.dirty = False
+        builder.last_forming_emit = None
+        self._put(self._public(closed), droppable=False)
+
+    def _emit_forming(self, now_ts: int):
+        for builder in self._builders:
+            if builder.start is None or not builder.dirty:
+                continue
+            if builder.last_forming_emit is not None and now_ts - builder.last_forming_emit < self.forming_emit_ms:
+                continue
+            builder.last_forming_emit = now_ts
+            builder.dirty = False
+            self._put(self._public(builder.bar(EVENT_FORMING)), droppable=True)
+
+    # --- выход ---
+
+    def _public(self, bar: dict) -> dict:
+        event = {k: v for k, v in bar.items() if not k.startswith('_')}
+        event['symbol'] = self.symbol
+        return event
+
+    def _put(self, event: dict, droppable: bool):
+        try:
+            if droppable:
+                self.bar_queue.put_nowait(event)
+            else:
+                self.bar_queue.put(event, timeout=settings.TICK_QUEUE_PUT_TIMEOUT_SECONDS)
+        except queue.Full:
+            metrics.inc(BAR_EVENTS, event=event['event'], result='dropped')
+            if not droppable:
+                logger.error("Очередь свечей переполнена, закрытая свеча %s потеряна", event['time'],
+                             extra={'symbol': self.symbol, 'timeframe': event['timeframe'], 'stage': 'ticks'})
+            return
+        metrics.inc(BAR_EVENTS, event=event['event'], result='ok')
+
+    def _count(self, result: str):
+        self._counts[result] += 1
+        if self._counts['ok'] >= settings.TICK_REPLAY_CHUNK_SIZE:
+            self.flush_metrics()
+
+    def flush_metrics(self):
+        """Счетчики копятся локально (блокировка реестра на каждый тик дорога) и сбрасываются пакетом."""
+        for result, value in self._counts.items():
+            if value:
+                metrics.inc(TICKS, value, result=result)
+                self._counts[result] = 0
+        for name, counts in ((TICKS_DROPPED, self._dropped), (BAR_GAPS, self._gaps)):
+            for timeframe, value in counts.items():
+                metrics.inc(name, value, timeframe=timeframe)
+            counts.clear()
+
+    def forming_bars(self) -> list:
+        return [self._public(b.bar(EVENT_FORMING)) for b in self._builders if b.start is not None]
+
+
+def ticks_to_bars(times, bids, asks, seconds: int) -> pd.DataFrame:
+    """
+    Свечи из отсортированных по времени тиков одним векторным проходом (для бэктестов и сверки),
+    в формате get_forex_data: индекс datetime UTC, open/high/low/close/volume (число тиков).
+    """
+    times = np.asarray(times, dtype=np.int64)
+    mids = (np.asarray(bids, dtype=np.float64) + np.asarray(asks, dtype=np.float64)) * 0.5
+    if not len(times):
+        return pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'], dtype=np.float64,
+                            index=pd.DatetimeIndex([], tz='UTC', name='datetime'))
+    buckets = times - times % (seconds * 1000)
+    starts = np.concatenate(([0], np.flatnonzero(buckets[1:] != buckets[:-1]) + 1))
+    ends = np.append(starts[1:], len(times))
+    index = pd.DatetimeIndex(pd.to_datetime(buckets[starts], unit='ms', utc=True), name='datetime')
+    return pd.DataFrame({
+        'open': mids[starts], 'high': np.maximum.reduceat(mids, starts), 'low': np.minimum.reduceat(mids, starts),
+        'close': mids[ends - 1], 'volume': (ends - starts).astype(np.float64),
+    }, index=index)
+
+
+def bars_to_dataframe(events: list) -> pd.DataFrame:
+    """События closed/revised одного таймфрейма -> DataFrame get_forex_data (исправление заменяет свечу)."""
+    rows = {}
+    for event in events:
+        if event['event'] in (EVENT_CLOSED, EVENT_REVISED):
+            rows[event['time']] = (event['open'], event['high'], event['low'], event['close'], event['volume'])
+    times = sorted(rows)
+    index = pd.DatetimeIndex(pd.to_datetime(times, unit='s', utc=True), name='datetime')
+    return pd.DataFrame([rows[t] for t in times], index=index,
+                        columns=['open', 'high', 'low', 'close', 'volume'], dtype=np.float64)
+
+
+def read_tick_file(path: str) -> tuple:
+    """
+    Файл тиков CSV с заголовком time,bid,ask: time - epoch-миллисекунды или ISO-время.
+    Возвращает (times int64 мс, bids, asks).
+    """
+    frame = pd.read_csv(path, usecols=['time', 'bid', 'ask'])
+    if pd.api.types.is_numeric_dtype(frame['time']):
+        times = frame['time'].to_numpy(dtype=np.int64)
+    else:
+        times = pd.to_datetime(frame['time'], utc=True).to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    return times, frame['bid'].to_numpy(dtype=np.float64), frame['ask'].to_numpy(dtype=np.float64)
+
+
+def replay(aggregator: TickAggregator, times, bids, asks, chunk_size: int = settings.TICK_REPLAY_CHUNK_SIZE) -> int:
+    """Подает тики агрегатору пакетами по chunk_size; возвращает число тиков."""
+    for i in range(0, len(times), chunk_size):
+        aggregator.on_ticks(times[i:i + chunk_size], bids[i:i + chunk_size], asks[i:i + chunk_size])
+    return len(times)
+
+
+class SocketTickSource:
+    """
+    Заглушка потока брокера: TCP-поток строк "time_ms,bid,ask". Полные строки одного recv
+    разбираются построчно (ровно три числовых поля, иначе строка пропускается и считается
+    в метрике) и подаются агрегатору пакетом; по таймауту чтения вызывается advance() по часам,
+    чтобы закрывать свечи тихого рынка.
+    """
+
+    def __init__(self, aggregator: TickAggregator, host: str = settings.TICK_SOCKET_HOST,
+                 port: int = settings.TICK_SOCKET_PORT, recv_bytes: int = 1 << 20, idle_seconds: float = 1.0):
+        self.aggregator = aggregator
+        self.host = host
+        self.port = port
+        self.recv_bytes = recv_bytes
+        self.idle_seconds = idle_seconds
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        log_fields = {'symbol': self.aggregator.symbol, 'stage': 'ticks'}
+        with socket.create_connection((self.host, self.port)) as conn:
+            conn.settimeout(self.idle_seconds)
+            logger.info("Поток тиков подключен: %s:%s", self.host, self.port, extra=log_fields)
+            tail = b''
+            while not self._stop.is_set():
+                try:
+                    data = conn.recv(self.recv_bytes)
+                except socket.timeout:
+                    self.aggregator.advance(int(time_module.time() * 1000))
+                    continue
+                if not data:
+                    break
+                data = tail + data
+                cut = data.rfind(b'\n') + 1
+                tail = data[cut:]
+                if cut:
+                    try:
+                        self._feed(data[:cut])
+                    except Exception as e:  # пакет теряется, поток продолжает работу
+                        logger.exception("Ошибка обработки пакета тиков: %s", e, extra=log_fields)
+        self.aggregator.flush_metrics()
+        logger.info("Поток тиков закрыт", extra=log_fields)
+
+    def _feed(self, lines: bytes):
+        times, bids, asks, malformed = parse_tick_lines(lines)
+        if malformed:
+            metrics.inc(TICKS, malformed, result='malformed')
+            logger.warning("Пропущены неразобранные строки тиков: %d", malformed,
+                           extra={'symbol': self.aggregator.symbol, 'stage': 'ticks'})
+        if len(times):
+            self.aggregator.on_ticks(times, bids, asks)
+
+
+def parse_tick_lines(lines: bytes) -> tuple:
+    """
+    Строки "time_ms,bid,ask" -> (times int64, bids, asks, пропущено строк). Строка с другим
+    числом полей, нечисловым или неположительным значением пропускается целиком, так что одна
+    битая строка не сдвигает поля следующих. Пустые строки не считаются.
+    """
+    times, bids, asks = [], [], []
+    malformed = 0
+    for line in lines.split(b'\n'):
+        if not line.strip():
+            continue
+        fields = line.split(b',')
+        try:
+            if len(fields) != 3:
+                raise ValueError(line)
+            ts, bid, ask = int(float(fields[0])), float(fields[1]), float(fields[2])
+        except (ValueError, OverflowError):
+            malformed += 1
+            continue
+        if not (0 < bid < np.inf and 0 < ask < np.inf):
+            malformed += 1
+            continue
+        times.append(ts)
+        bids.append(bid)
+        asks.append(ask)
+    return np.array(times, dtype=np.int64), np.array(bids), np.array(asks), malformed
+
+
+def consume(bar_queue: queue.Queue, handler, stop: threading.Event = None, poll_seconds: float = 0.5):
+    """Цикл потребителя: handler(event) для каждого события очереди до stop."""
+    while stop is None or not stop.is_set():
+        try:
+            event = bar_queue.get(timeout=poll_seconds)
+        except queue.Empty:
+            continue
+        if event is None:
+            break
+        try:
+            handler(event)
+        except Exception as e:
+            logger.exception("Ошибка обработчика свечи: %s", e,
+                             extra={'symbol': event.get('symbol'), 'timeframe': event.get('timeframe'), 'stage': 'ticks'})
+
+
+def synthetic_ticks(count: int, start: str = '2024-01-08', mean_interval_ms: float = 250.0,
+                    seed: int = 42, spread: float = 0.00008) -> tuple:
+    """Тики для самопроверки и замеров: случайное блуждание mid, экспоненциальные интервалы."""
+    rng = np.random.default_rng(seed)
+    start_ms = int(pd.Timestamp(start, tz='UTC').timestamp() * 1000)
+    times = start_ms + np.cumsum(rng.exponential(mean_interval_ms, count)).astype(np.int64)
+    mids = 1.1 + np.cumsum(rng.normal(0, 0.00002, count))
+    return times, mids - spread / 2, mids + spread / 2
+
+
+if __name__ == '__main__':
+    import argparse
+    from utils.logger import setup_logger
+
+    parser = argparse.ArgumentParser(description="Свечи 3m/1h из потока котировок")
+    parser.add_argument('--file', help="CSV time,bid,ask для воспроизведения")
+    parser.add_argument('--socket', action='store_true', help="читать поток с TICK_SOCKET_HOST:TICK_SOCKET_PORT")
+    parser.add_argument('--symbol', default=settings.DEFAULT_SYMBOL)
+    args = parser.parse_args()
+    setup_logger()
+
+    if args.socket:
+        from ts_logic.incremental import BarEventRouter
+        # Анализаторы поднимаются из снимков ANALYZER_STATE_DIRECTORY с догоном пропущенных свечей,
+        # дальше получают закрытые свечи из тиков и сохраняют снимок после каждой
+        router = BarEventRouter.restore([args.symbol], list(settings.TICK_TIMEFRAMES))
+        stream_aggregator = TickAggregator(args.symbol)
+        threading.Thread(target=consume, args=(stream_aggregator.bar_queue, router.on_bar_event), daemon=True).start()
+        SocketTickSource(stream_aggregator).run()
+    else:
+        print("Тестирование tick_aggregator.py...")
+        if args.file:
+            tick_times, tick_bids, tick_asks = read_tick_file(args.file)
+        else:
+            tick_times, tick_bids, tick_asks = synthetic_ticks(2_000_000)
+        events = []
+        sink = queue.Queue(maxsize=settings.TICK_QUEUE_SIZE)
+        stop_consumer = threading.Event()
+        consumer = threading.Thread(target=consume, args=(sink, events.append, stop_consumer), daemon=True)
+        consumer.start()
+
+        batch_aggregator = TickAggregator(args.symbol, bar_queue=sink)
+        started = time_module.perf_counter()
+        replay(batch_aggregator, tick_times, tick_bids, tick_asks)
+        elapsed = time_module.perf_counter() - started
+        print(f"Пакетами: {len(tick_times)} тиков за {elapsed:.2f} с - {len(tick_times) / elapsed:,.0f} тиков/с")
+
+        single = TickAggregator(args.symbol, bar_queue=queue.Queue())
+        n_single = min(len(tick_times), 300_000)
+        started = time_module.perf_counter()
+        for t, b, a in zip(tick_times[:n_single].tolist(), tick_bids[:n_single].tolist(), tick_asks[:n_single].tolist()):
+            single.on_tick(t, b, a)
+        elapsed = time_module.perf_counter() - started
+        print(f"Поштучно: {n_single} тиков за {elapsed:.2f} с - {n_single / elapsed:,.0f} тиков/с")
+
+        while not sink.empty():
+            time_module.sleep(0.05)
+        stop_consumer.set()
+        consumer.join()
+        for timeframe, seconds in settings.TICK_TIMEFRAMES.items():
+            streamed = bars_to_dataframe([e for e in events if e['timeframe'] == timeframe])
+            expected = ticks_to_bars(tick_times, tick_bids, tick_asks, seconds).iloc[:-1]  # последняя - формируется
+            same = streamed.index.equals(expected.index) and np.allclose(streamed.to_numpy(), expected.to_numpy())
+            print(f"{timeframe}: закрытых свечей {len(streamed)}, совпадает с ticks_to_bars: {same}")
+
+        # Опоздавшие тики: в пределах допуска исправляют закрытую свечу, старше - отбрасываются
+        late_queue = queue.Queue()
+        late = TickAggregator(args.symbol, {'3m': 180}, bar_queue=late_queue)
+        base = 1_704_700_800_000  # 2024-01-08 08:00 UTC
+        late.on_ticks([base, base + 60_000, base + 180_500], [1.1, 1.1010, 1.1005], [1.1002, 1.1012, 1.1007])
+        late.on_tick(base + 179_000, 1.0990, 1.0992)   # опоздание 1.5 с - исправление low
+        late.on_tick(base + 100_000, 1.0980, 1.0982)   # опоздание 80 с - отброшен
+        late.on_tick(base + 1_080_000, 1.1020, 1.1022)  # пропуск 5 свечей
+        late.flush_metrics()
+        print("События:", [(e['event'], e['time'], round(e['low'], 5)) for e in list(late_queue.queue)])
+        print("Счетчики:", {(name, labels): value for (name, labels), value in metrics.registry.snapshot()['counters'].items()
+                            if name in (TICKS, TICKS_DROPPED, BAR_GAPS)})
@@ -0,0 +1,152 @@
+// front/js/chart_decode.js
+// Декодирование ответов API графика в готовые к отрисовке серии Lightweight Charts.
+// Загружается в Web Worker (chart_worker.js), а в основном потоке - как запасной вариант.
+
+(function (scope) {
+    const BINARY_MAGIC = 'TSB1';
+    const TYPED_ARRAYS = { u4: Uint32Array, i4: Int32Array, f4: Float32Array, f8: Float64Array };
+    const LINE_STYLE_SOLID = 0; // LightweightCharts.LineStyle.Solid
+
+    const MARKER_STYLES = {
+        'HH': { shape: 'circle', color: 'blue', position: 'aboveBar', text: 'HH', size: 0 },
+        'HL': { shape: 'circle', color: 'green', position: 'belowBar', text: 'HL', size: 0 },
+        'LH': { shape: 'circle', color: 'red', position: 'aboveBar', text: 'LH', size: 0 },
+        'LL': { shape: 'circle', color: 'purple', position: 'belowBar', text: 'LL', size: 0 },
+        'H': { shape: 'circle', color: '#808080', position: 'aboveBar', size: 0, text: 'H' },
+        'L': { shape: 'circle', color: '#808080', position: 'belowBar', size: 0, text: 'L' },
+        'F_H_AS': { shape: 'arrowDown', color: 'darkorange', position: 'aboveBar', text: '', size: 0.8 },
+        'F_L_AS': { shape: 'arrowUp', color: 'darkorange', position: 'belowBar', text: '', size: 0.8 },
+        'F_H_NY1': { shape: 'arrowDown', color: 'dodgerblue', position: 'aboveBar', text: '', size: 0.8 },
+        'F_L_NY1': { shape: 'arrowUp', color: 'dodgerblue', position: 'belowBar', text: '', size: 0.8 },
+        'F_H_NY2': { shape: 'arrowDown', color: 'deepskyblue', position: 'aboveBar', text: '', size: 0.8 },
+        'F_L_NY2': { shape: 'arrowUp', color: 'deepskyblue', position: 'belowBar', text: '', size: 0.8 },
+        'SETUP_Resist': { shape: 'square', color: 'black', position: 'aboveBar', text: 'SETUP', size: 1 },
+        'SETUP_Support': { shape: 'square', color: 'black', position: 'belowBar', text: 'SETUP', size: 1 },
+        'UNKNOWN_SETUP': { shape: 'circle', color: '#A9A9A9', position: 'aboveBar', text: '?', size: 1 },
+    };
+
+    // ISO-строка (формат rows) или уже epoch-секунды (columnar)
+    function toEpochSeconds(value) {
+        return typeof value === 'number' ? value : new Date(value).getTime() / 1000;
+    }
+
+    function decodeBinaryPayload(buffer) {
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+        if (magic !== BINARY_MAGIC) throw new Error('Неизвестный бинарный формат ответа');
+        const headerLength = view.getUint32(4, true);
+        const payload = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+        const dataStart = Math.ceil((8 + headerLength) / 8) * 8;
+        payload.ohlcv = {};
+        payload.markers = { types: payload.markers.types };
+        payload.columns.forEach(column => {
+            const [group, name] = column.path.split('.');
+            const ArrayType = TYPED_ARRAYS[column.dtype];
+            payload[group][name] = new ArrayType(buffer, dataStart + column.offset, column.length);
+        });
+        delete payload.columns;
+        return payload;
+    }
+
+    function markerColumnsToList(columns) {
+        const markers = new Array(columns.time.length);
+        for (let i = 0; i < columns.time.length; i++) {
+            const type = columns.types[columns.typeIndex[i]];
+            const time = columns.time[i];
+            markers[i] = { id: `${type}@${time}`, time: time, type: type, price: columns.price[i] };
+        }
+        return markers;
+    }
+
+    // Свечи и диапазон цен за один проход по типизированным массивам
+    function formatOhlcvColumns(columns, priceScale = null) {
+        const count = columns.time.length;
+        const scale = priceScale || 1; // деление, а не умножение на 1/scale - без лишней ошибки округления
+        const candles = new Array(count);
+        let min = Infinity;
+        let max = -Infinity;
+        for (let i = 0; i < count; i++) {
+            const low = columns.low[i] / scale;
+            const high = columns.high[i] / scale;
+            if (low < min) min = low;
+            if (high > max) max = high;
+            candles[i] = {
+                time: columns.time[i],
+                open: columns.open[i] / scale, high: high,
+                low: low, close: columns.close[i] / scale,
+            };
+        }
+        return { candles, stats: { min, max } };
+    }
+
+    function formatOhlcvData(data, priceScale = null) {
+        if (!Array.isArray(data)) return formatOhlcvColumns(data, priceScale);
+        let min = Infinity;
+        let max = -Infinity;
+        const candles = data.map(item => {
+            const candle = {
+                time: new Date(item.time).getTime() / 1000,
+                open: parseFloat(item.open), high: parseFloat(item.high),
+                low: parseFloat(item.low), close: parseFloat(item.close),
+            };
+            if (candle.low < min) min = candle.low;
+            if (candle.high > max) max = candle.high;
+            return candle;
+        });
+        return { candles, stats: { min, max } };
+    }
+
+    function formatMarkerData(data) {
+        const filteredData = data.filter(item => MARKER_STYLES.hasOwnProperty(item.type));
+        const markers = filteredData.map(item => {
+            const markerType = MARKER_STYLES[item.type];
+            return {
+                time: toEpochSeconds(item.time),
+                position: markerType.position, color: markerType.color,
+                shape: markerType.shape, text: markerType.text !== undefined ? markerType.text : item.type,
+                size: markerType.size !== undefined ? markerType.size : 1,
+                id: item.id || markerType.id
+            };
+        });
+        // Lightweight Charts требует маркеры, отсортированные по времени
+        return markers.sort((a, b) => a.time - b.time);
+    }
+
+    function formatTrendLineData(data) {
+        return data.map(line => ({
+            data: [
+                { time: toEpochSeconds(line.start_time), value: line.start_price },
+                { time: toEpochSeconds(line.end_time), value: line.end_price }
+            ],
+            color: line.color || '#000000', lineWidth: 2,
+            lineStyle: line.lineStyle !== undefined && line.lineStyle !== null ? line.lineStyle : LINE_STYLE_SOLID,
+            crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false,
+        }));
+    }
+
+    // Ответ API (rows/columnar) -> candles, stats, маркеры и линии в формате Lightweight Charts
+    function prepareChartPayload(payload) {
+        if (payload.markers && !Array.isArray(payload.markers)) {
+            payload.markers = markerColumnsToList(payload.markers);
+        }
+        const { candles, stats } = formatOhlcvData(payload.ohlcv || [], payload.priceScale);
+        delete payload.ohlcv;
+        payload.candles = candles;
+        payload.stats = stats;
+        payload.markers = formatMarkerData(payload.markers || []);
+        if (payload.trendLines) payload.trendLines = formatTrendLineData(payload.trendLines);
+        return payload;
+    }
+
+    function decodeResponseBody(contentType, buffer) {
+        let payload;
+        if (contentType.startsWith('application/vnd.tsbot.columnar') && !contentType.includes('+json')) {
+            payload = decodeBinaryPayload(buffer);
+        } else {
+            payload = JSON.parse(new TextDecoder().decode(buffer));
+        }
+        return prepareChartPayload(payload);
+    }
+
+    scope.ChartDecode = { decodeResponseBody, prepareChartPayload, toEpochSeconds };
+})(self);
@@ -0,0 +1,18 @@
+// front/js/chart_worker.js
+// Web Worker: загрузка и декодирование ответов API графика вне основного потока.
+// Тело ответа (ArrayBuffer) остаётся в воркере, в основной поток уходят только готовые серии.
+
+importScripts('/js/chart_decode.js');
+
+self.onmessage = async event => {
+    const { id, url, accept } = event.data;
+    try {
+        const response = await fetch(url, { headers: { 'Accept': accept } });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const buffer = await response.arrayBuffer();
+        const result = ChartDecode.decodeResponseBody(response.headers.get('Content-Type') || '', buffer);
+        self.postMessage({ id, result });
+    } catch (error) {
+        self.postMessage({ id, error: String(error) });
+    }
+};
@@ -31,6 +31,56 @@ window.addEventListener('load', () => {
     let serverTrendLineSeries = [];
     let userDrawnLineSeries = [];
     let daySeparatorLineSeries = null;
+    let seriesMarkers = null;
+
+    // Состояние инкрементальных обновлений: cursor последнего снимка сервера,
+    // маркеры по id и диапазон цен для разделителя дня.
+    const CHART_POLL_INTERVAL_MS = 30000;
+    let chartCursor = null;
+    let chartRequestKey = null;
+    let pollTimer = null;
+    let liveSource = null;
+    let markerStore = new Map();
+    let priceRange = { min: Infinity, max: -Infinity };
+    let daySeparatorTime = null;
+
+    // Прореживание на сервере: история длиннее ширины графика приходит корзинами свечей.
+    // Прореженный вид обновляется полным (ограниченным шириной экрана) ответом, а не дельтами.
+    let chartDecimated = false;
+
+    // Колоночный бинарный формат API: epoch-секунды и цены в типизированных массивах
+    const CHART_DATA_ACCEPT = 'application/vnd.tsbot.columnar, application/json;q=0.5';
+
+    // Подгрузка истории окнами при прокрутке влево; окна кэшируются с лимитом по числу свечей
+    const HISTORY_WINDOW_BARS = 500;
+    const HISTORY_PREFETCH_BARS = 50;
+    const HISTORY_CACHE_MAX_BARS = 200000;
+    let currentTimeframe = null;
+    let loadedBars = [];
+    let historyLoading = false;
+    let historyExhausted = false;
+    const historyCache = {
+        windows: new Map(), // key -> { bars, markers }, порядок вставки = LRU
+        totalBars: 0,
+        get(key) {
+            const entry = this.windows.get(key);
+            if (entry) {
+                this.windows.delete(key);
+                this.windows.set(key, entry);
+            }
+            return entry;
+        },
+        put(key, entry) {
+            if (this.windows.has(key)) return;
+            this.windows.set(key, entry);
+            this.totalBars += entry.bars.length;
+            while (this.totalBars > HISTORY_CACHE_MAX_BARS && this.windows.size > 1) {
+                const [oldestKey, oldestEntry] = this.windows.entries().next().value;
+                this.windows.delete(oldestKey);
+                this.totalBars -= oldestEntry.bars.length;
+            }
+        },
+    };
 
     let currentDrawingTool = 'pointer';
     let firstClickPoint = null;
@@ -130,68 +180,88 @@ window.addEventListener('load', () => {
         }
     });
 
-    async function fetchChartData(timeframe, backtestDate = null) {
+    // Загрузка и декодирование ответов в Web Worker (chart_worker.js): основной поток
+    // получает готовые свечи, маркеры, линии и диапазон цен. Без Worker - ChartDecode здесь.
+    const pendingDecodes = new Map();
+    let decodeRequestId = 0;
+    const decodeWorker = createDecodeWorker();
+
+    function createDecodeWorker() {
+        if (typeof Worker === 'undefined') return null;
         try {
-            let url = `/api/chart_data?interval=${timeframe}`;
-            if (backtestDate) url += `&endDate=${backtestDate}`;
-            const response = await fetch(url);
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            return await response.json();
+            const worker = new Worker('/js/chart_worker.js');
+            worker.onmessage = event => {
+                const { id, result, error } = event.data;
+                const pending = pendingDecodes.get(id);
+                if (!pending) return;
+                pendingDecodes.delete(id);
+                if (error) {
+                    pending.reject(new Error(error));
+                } else {
+                    pending.resolve(result);
+                }
+            };
+            return worker;
         } catch (error) {
-            console.error('fetchChartData: Ошибка при получении данных графика:', error);
-            // MODIFIED: analysisSummary is now a list, added fractalCount
-            return { ohlcv: [], markers: [], trendLines: [], analysisSummary: [], fractalCount: 0 };
+            console.error('createDecodeWorker: Web Worker недоступен, декодирование в основном потоке:', error);
+            return null;
         }
     }
 
-    function formatOhlcvData(data) {
-        return data.map(item => ({
-            time: new Date(item.time).getTime() / 1000,
-            open: parseFloat(item.open), high: parseFloat(item.high),
-            low: parseFloat(item.low), close: parseFloat(item.close),
-        }));
+    async function fetchDecoded(url) {
+        if (decodeWorker) {
+            const id = ++decodeRequestId;
+            return new Promise((resolve, reject) => {
+                pendingDecodes.set(id, { resolve, reject });
+                decodeWorker.postMessage({ id, url: new URL(url, window.location.href).href, accept: CHART_DATA_ACCEPT });
+            });
+        }
+        const response = await fetch(url, { headers: { 'Accept': CHART_DATA_ACCEPT } });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        return ChartDecode.decodeResponseBody(response.headers.get('Content-Type') || '', await response.arrayBuffer());
+    }
+
+    function renderWidth() {
+        return Math.round(chartContainer.clientWidth || 0);
     }
 
-    function formatMarkerData(data) {
-         const markerMap = {
-             'HH': { shape: 'circle', color: 'blue', position: 'aboveBar', text: 'HH', size: 0 },
-             'HL': { shape: 'circle', color: 'green', position: 'belowBar', text: 'HL', size: 0 },
-             'LH': { shape: 'circle', color: 'red', position: 'aboveBar', text: 'LH', size: 0 },
-             'LL': { shape: 'circle', color: 'purple', position: 'belowBar', text: 'LL', size: 0 },
-             'H': { shape: 'circle', color: '#808080', position: 'aboveBar', size: 0, text: 'H' },
-             'L': { shape: 'circle', color: '#808080', position: 'belowBar', size: 0, text: 'L' },
-             'F_H_AS': { shape: 'arrowDown', color: 'darkorange', position: 'aboveBar', text: '', size: 0.8 },
-             'F_L_AS': { shape: 'arrowUp', color: 'darkorange', position: 'belowBar', text: '', size: 0.8 },
-             'F_H_NY1': { shape: 'arrowDown', color: 'dodgerblue', position: 'aboveBar', text: '', size: 0.8 },
-             'F_L_NY1': { shape: 'arrowUp', color: 'dodgerblue', position: 'belowBar', text: '', size: 0.8 },
-             'F_H_NY2': { shape: 'arrowDown', color: 'deepskyblue', position: 'aboveBar', text: '', size: 0.8 },
-             'F_L_NY2': { shape: 'arrowUp', color: 'deepskyblue', position: 'belowBar', text: '', size: 0.8 },
-             'UNKNOWN_SETUP': { shape: 'circle', color: '#A9A9A9', position: 'aboveBar', text: '?', size: 1 },
-         };
-         const filteredData = data.filter(item => markerMap.hasOwnProperty(item.type));
-         return filteredData.map(item => {
-             const markerType = markerMap[item.type];
-             return {
-                 time: new Date(item.time).getTime() / 1000,
-                 position: markerType.position, color: markerType.color,
-                 shape: markerType.shape, text: markerType.text !== undefined ? markerType.text : item.type,
-                 size: markerType.size !== undefined ? markerType.size : 1,
-                 id: item.id || markerType.id
-             };
-         });
+    async function fetchChartData(timeframe, backtestDate = null, cursor = null) {
+        try {
+            let url = `/api/chart_data?interval=${timeframe}`;
+            if (backtestDate) url += `&endDate=${backtestDate}`;
+            if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+            else if (renderWidth()) url += `&width=${renderWidth()}`;
+            return await fetchDecoded(url);
+        } catch (error) {
+            console.error('fetchChartData: Ошибка при получении данных графика:', error);
+            return null;
+        }
     }
 
+    async function fetchHistoryWindow(timeframe, toTime) {
+        const width = renderWidth();
+        const cacheKey = `${timeframe}|${toTime}|${width}`;
+        const cached = historyCache.get(cacheKey);
+        if (cached) return cached;
+        try {
+            let url = `/api/chart_history?interval=${timeframe}&to=${toTime}&count=${HISTORY_WINDOW_BARS}`;
+            if (width) url += `&width=${width}`;
+            const payload = await fetchDecoded(url);
+            const entry = { bars: payload.candles, markers: payload.markers };
+            historyCache.put(cacheKey, entry);
+            return entry;
+        } catch (error) {
+            console.error('fetchHistoryWindow: Ошибка при получении окна истории:', error);
+            return null;
+        }
+    }
 
-    function formatTrendLineData(data) {
-        return data.map(line => ({
-            data: [
-                { time: new Date(line.start_time).getTime() / 1000, value: line.start_price },
-                { time: new Date(line.end_time).getTime() / 1000, value: line.end_price }
-            ],
-            color: line.color || '#000000', lineWidth: 2,
-            lineStyle: line.lineStyle !== undefined ? line.lineStyle : LightweightCharts.LineStyle.Solid,
-            crosshairMarkerVisible: false, lastValueVisible: false, priceLineVisible: false,
-        }));
+    function emptyChartData() {
+        // MODIFIED: analysisSummary is now a list, added fractalCount
+        return {
+            full: true, cursor: null, candles: [], stats: { min: Infinity, max: -Infinity },
+            markers: [], trendLines: [], analysisSummary: [], fractalCount: 0,
+        };
     }
 
     // displayAnalysisSummary to handle a list of context items
@@ -247,110 +317,309 @@ window.addEventListener('load', () => {
     }
 
 
-    async function loadChartData(timeframe, backtestDate = null) {
-        const chartData = await fetchChartData(timeframe, backtestDate);
+    function setSeriesMarkers(markers) {
+        if (!candlestickSeries) return;
+        if (typeof LightweightCharts.createSeriesMarkers === 'function') {
+            if (seriesMarkers) {
+                seriesMarkers.setMarkers(markers);
+            } else {
+                seriesMarkers = LightweightCharts.createSeriesMarkers(candlestickSeries, markers);
+            }
+        } else if (typeof candlestickSeries.setMarkers === 'function') {
+            candlestickSeries.setMarkers(markers);
+        }
+    }
+
+    function renderMarkers() {
+        // Маркеры в markerStore уже в формате Lightweight Charts (см. chart_decode.js)
+        setSeriesMarkers(Array.from(markerStore.values()).sort((a, b) => a.time - b.time));
+    }
 
+    function drawTrendLines(trendLines) {
         serverTrendLineSeries.forEach(series => {
             if (chart && series) chart.removeSeries(series);
         });
         serverTrendLineSeries = [];
 
+        if (!trendLines || trendLines.length === 0) return;
+        trendLines.forEach(lineDef => {
+            const lineSeries = chart.addSeries(LightweightCharts.LineSeries, {
+                color: lineDef.color,
+                lineWidth: lineDef.lineWidth,
+                lineStyle: lineDef.lineStyle,
+                crosshairMarkerVisible: lineDef.crosshairMarkerVisible,
+                lastValueVisible: lineDef.lastValueVisible,
+                priceLineVisible: lineDef.priceLineVisible,
+            });
+            lineSeries.setData(lineDef.data);
+            serverTrendLineSeries.push(lineSeries);
+        });
+    }
+
+    // Расширяет диапазон цен статистикой, посчитанной при декодировании;
+    // возвращает true, если диапазон изменился
+    function mergePriceRange(stats) {
+        let changed = false;
+        if (!stats) return changed;
+        if (stats.min < priceRange.min) { priceRange.min = stats.min; changed = true; }
+        if (stats.max > priceRange.max) { priceRange.max = stats.max; changed = true; }
+        return changed;
+    }
+
+    function paddedPriceRange() {
+        let minPrice = priceRange.min;
+        let maxPrice = priceRange.max;
+        if (minPrice === Infinity || maxPrice === -Infinity) {
+            minPrice = candlestickSeries.coordinateToPrice(chart.priceScale('right').height());
+            maxPrice = candlestickSeries.coordinateToPrice(0);
+        } else {
+            const pricePadding = (maxPrice - minPrice) * 0.05;
+            minPrice -= pricePadding;
+            maxPrice += pricePadding;
+        }
+        return { minPrice, maxPrice };
+    }
+
+    function dayStartUTC(timestampSeconds) {
+        const date = new Date(timestampSeconds * 1000);
+        return Date.UTC(date.getUTCFullYear(), date.getUTCMonth(), date.getUTCDate(), 0, 0, 0) / 1000;
+    }
+
+    function drawDaySeparator(todayTimestampUTC) {
         if (daySeparatorLineSeries && chart) {
             chart.removeSeries(daySeparatorLineSeries);
             daySeparatorLineSeries = null;
         }
+        daySeparatorTime = todayTimestampUTC;
+        if (!todayTimestampUTC || !candlestickSeries) return;
+
+        daySeparatorLineSeries = chart.addSeries(LightweightCharts.LineSeries, {
+            color: '#000000',
+            lineWidth: 1,
+            lineStyle: LightweightCharts.LineStyle.Dashed,
+            lastValueVisible: false,
+            priceLineVisible: false,
+            autoscaleInfoProvider: () => {
+                const { minPrice, maxPrice } = paddedPriceRange();
+                return { priceRange: { minValue: minPrice, maxValue: maxPrice } };
+            },
+        });
+        updateDaySeparator();
+    }
+
+    function updateDaySeparator() {
+        if (!daySeparatorLineSeries || !daySeparatorTime) return;
+        const { minPrice, maxPrice } = paddedPriceRange();
+        daySeparatorLineSeries.setData([
+            { time: daySeparatorTime, value: minPrice },
+            { time: daySeparatorTime, value: maxPrice }
+        ]);
+    }
+
+    function mergeLoadedBars(bars) {
+        bars.forEach(bar => {
+            const last = loadedBars[loadedBars.length - 1];
+            if (last && last.time === bar.time) {
+                loadedBars[loadedBars.length - 1] = bar;
+            } else if (!last || bar.time > last.time) {
+                loadedBars.push(bar);
+            }
+        });
+    }
 
-        if (candlestickSeries) {
-             if (typeof LightweightCharts.createSeriesMarkers === 'function') {
-                LightweightCharts.createSeriesMarkers(candlestickSeries, []);
-            } else if (typeof candlestickSeries.setMarkers === 'function') {
-                candlestickSeries.setMarkers([]);
+    async function loadOlderHistory() {
+        if (historyLoading || historyExhausted || loadedBars.length === 0 || !candlestickSeries) return;
+        historyLoading = true;
+        const requestKey = chartRequestKey;
+        const toTime = loadedBars[0].time;
+        try {
+            const historyWindow = await fetchHistoryWindow(currentTimeframe, toTime);
+            if (!historyWindow || requestKey !== chartRequestKey) return;
+            const olderBars = historyWindow.bars.filter(bar => bar.time < toTime);
+            if (olderBars.length === 0) {
+                historyExhausted = true;
+                return;
             }
+            loadedBars = olderBars.concat(loadedBars);
+            candlestickSeries.setData(loadedBars);
+            historyWindow.markers.forEach(marker => {
+                if (!markerStore.has(marker.id)) markerStore.set(marker.id, marker);
+            });
+            renderMarkers();
+        } finally {
+            historyLoading = false;
         }
+    }
+
+    chart.timeScale().subscribeVisibleLogicalRangeChange(range => {
+        if (range && range.from < HISTORY_PREFETCH_BARS) loadOlderHistory();
+    });
+
+    function renderFullChart(chartData, backtestDate = null, fitContent = true) {
+        chartCursor = chartData.cursor || null;
+        chartDecimated = (chartData.barsPerBucket || 1) > 1;
+        markerStore = new Map();
+        loadedBars = [];
+        historyExhausted = false;
+        priceRange = { min: Infinity, max: -Infinity };
+
+        drawTrendLines([]);
+        drawDaySeparator(null);
+        setSeriesMarkers([]);
 
-        if (chartData && chartData.ohlcv && chartData.ohlcv.length > 0) {
-            const formattedOhlcv = formatOhlcvData(chartData.ohlcv);
+        if (chartData.candles && chartData.candles.length > 0) {
+            const formattedOhlcv = chartData.candles;
             if (candlestickSeries) candlestickSeries.setData(formattedOhlcv);
+            loadedBars = formattedOhlcv;
+            mergePriceRange(chartData.stats);
 
             let todayTimestampUTC;
             if (backtestDate) {
                 const [year, month, day] = backtestDate.split('-').map(Number);
                 todayTimestampUTC = new Date(Date.UTC(year, month - 1, day, 0, 0, 0)).getTime() / 1000;
             } else {
-                const lastCandleTime = new Date(formattedOhlcv[formattedOhlcv.length - 1].time * 1000);
-                todayTimestampUTC = new Date(Date.UTC(lastCandleTime.getUTCFullYear(), lastCandleTime.getUTCMonth(), lastCandleTime.getUTCDate(), 0, 0, 0)).getTime() / 1000;
+                todayTimestampUTC = dayStartUTC(formattedOhlcv[formattedOhlcv.length - 1].time);
             }
+            drawDaySeparator(todayTimestampUTC);
 
-            if (todayTimestampUTC && candlestickSeries) {
-                let minPrice = Infinity;
-                let maxPrice = -Infinity;
-                formattedOhlcv.forEach(candle => {
-                    if (candle.low < minPrice) minPrice = candle.low;
-                    if (candle.high > maxPrice) maxPrice = candle.high;
-                });
-
-                const pricePadding = (maxPrice - minPrice) * 0.05;
-                minPrice -= pricePadding;
-                maxPrice += pricePadding;
+            (chartData.markers || []).forEach(marker => markerStore.set(marker.id, marker));
+            renderMarkers();
 
-                if (minPrice === Infinity || maxPrice === -Infinity) {
-                    minPrice = candlestickSeries.coordinateToPrice(chart.priceScale('right').height());
-                    maxPrice = candlestickSeries.coordinateToPrice(0);
-                }
+            drawTrendLines(chartData.trendLines);
+            if (fitContent && chart && chart.timeScale()) chart.timeScale().fitContent();
+        } else {
+            if (candlestickSeries) candlestickSeries.setData([]);
+        }
+        // Pass chartData.analysisSummary (which is now a list)
+        displayAnalysisSummary(chartData.analysisSummary);
+        // MODIFIED: Display fractal count
+        displayFractalCount(chartData.fractalCount);
+    }
 
-                daySeparatorLineSeries = chart.addSeries(LightweightCharts.LineSeries, {
-                    color: '#000000',
-                    lineWidth: 1,
-                    lineStyle: LightweightCharts.LineStyle.Dashed,
-                    lastValueVisible: false,
-                    priceLineVisible: false,
-                    autoscaleInfoProvider: () => ({
-                        priceRange: {
-                            minValue: minPrice,
-                            maxValue: maxPrice,
-                        },
-                    }),
-                });
-                daySeparatorLineSeries.setData([
-                    { time: todayTimestampUTC, value: minPrice },
-                    { time: todayTimestampUTC, value: maxPrice }
-                ]);
+    // Применяет дельту сервера: только новые/изменённые свечи через series.update(),
+    // добавленные и удалённые маркеры, линии тренда - если изменились.
+    function applyChartDelta(delta, backtestDate = null) {
+        const bars = delta.candles || [];
+        if (bars.length > 0 && candlestickSeries) {
+            bars.forEach(bar => candlestickSeries.update(bar));
+            mergeLoadedBars(bars);
+            const rangeChanged = mergePriceRange(delta.stats);
+            const lastDay = dayStartUTC(bars[bars.length - 1].time);
+            if (!backtestDate && lastDay !== daySeparatorTime) {
+                drawDaySeparator(lastDay);
+            } else if (rangeChanged) {
+                updateDaySeparator();
             }
+        }
 
-            if (chartData.markers && chartData.markers.length > 0) {
-                const serverMarkers = formatMarkerData(chartData.markers);
-                 if (candlestickSeries && serverMarkers.length > 0) {
-                     if (typeof LightweightCharts.createSeriesMarkers === 'function') {
-                        LightweightCharts.createSeriesMarkers(candlestickSeries, serverMarkers);
-                    } else if (typeof candlestickSeries.setMarkers === 'function') {
-                        candlestickSeries.setMarkers(serverMarkers);
-                    }
+        let markersChanged = false;
+        if (delta.markersFrom !== undefined && delta.markersFrom !== null) {
+            markerStore.forEach((marker, id) => {
+                if (marker.time >= delta.markersFrom) {
+                    markerStore.delete(id);
+                    markersChanged = true;
                 }
-            }
+            });
+        }
+        (delta.removedMarkers || []).forEach(id => {
+            if (markerStore.delete(id)) markersChanged = true;
+        });
+        (delta.markers || []).forEach(marker => {
+            markerStore.set(marker.id, marker);
+            markersChanged = true;
+        });
+        if (markersChanged) renderMarkers();
 
-            if (chartData.trendLines && chartData.trendLines.length > 0) {
-                const formattedTrendLines = formatTrendLineData(chartData.trendLines);
-                formattedTrendLines.forEach(lineDef => {
-                    const lineSeries = chart.addSeries(LightweightCharts.LineSeries, {
-                        color: lineDef.color,
-                        lineWidth: lineDef.lineWidth,
-                        lineStyle: lineDef.lineStyle,
-                        crosshairMarkerVisible: lineDef.crosshairMarkerVisible,
-                        lastValueVisible: lineDef.lastValueVisible,
-                        priceLineVisible: lineDef.priceLineVisible,
-                    });
-                    lineSeries.setData(lineDef.data);
-                    serverTrendLineSeries.push(lineSeries);
-                });
+        if (delta.trendLines) drawTrendLines(delta.trendLines);
+        if (delta.analysisSummary !== undefined) displayAnalysisSummary(delta.analysisSummary);
+        if (delta.fractalCount !== undefined) displayFractalCount(delta.fractalCount);
+        chartCursor = delta.cursor || chartCursor;
+    }
+
+    async function loadChartData(timeframe, backtestDate = null) {
+        const requestKey = `${timeframe}|${backtestDate || ''}`;
+        chartRequestKey = requestKey;
+        currentTimeframe = timeframe;
+        const chartData = await fetchChartData(timeframe, backtestDate);
+        if (requestKey !== chartRequestKey) return; // пользователь уже выбрал другой таймфрейм/дату
+        renderFullChart(chartData || emptyChartData(), backtestDate);
+        schedulePolling(timeframe, backtestDate);
+    }
+
+    async function pollChartUpdates(timeframe, backtestDate = null) {
+        const requestKey = chartRequestKey;
+        const delta = await fetchChartData(timeframe, backtestDate, chartDecimated ? null : chartCursor);
+        if (!delta || requestKey !== chartRequestKey) return;
+        if (delta.full) {
+            // cursor устарел на сервере - перерисовываем, сохраняя текущий вид
+            renderFullChart(delta, backtestDate, false);
+        } else {
+            applyChartDelta(delta, backtestDate);
+        }
+    }
+
+    function displaySetupAlert(data) {
+        const ulElement = entryPointsSectionDiv.querySelector('ul');
+        if (!ulElement || !data.marker) return;
+        const marker = data.marker;
+        const listItem = document.createElement('li');
+        const setupTime = new Date(ChartDecode.toEpochSeconds(marker.time) * 1000).toISOString().slice(0, 16).replace('T', ' ');
+        const price = marker.price !== null && marker.price !== undefined ? marker.price.toFixed(5) : '';
+        listItem.textContent = `${marker.type} ${data.symbol} ${price} (${setupTime} UTC)`;
+        ulElement.appendChild(listItem);
+    }
+
+    // Живые обновления через SSE: сервер считает анализ один раз на (символ, таймфрейм)
+    // и рассылает свечи, изменения структуры и новые сетапы всем подписчикам.
+    function connectLiveStream(timeframe) {
+        const requestKey = chartRequestKey;
+        liveSource = new EventSource(`/api/stream?interval=${timeframe}`);
+
+        const resync = data => {
+            if (requestKey !== chartRequestKey) return;
+            if (data.cursor && data.cursor !== chartCursor) pollChartUpdates(timeframe);
+        };
+        const applyLiveEvent = (event, apply) => {
+            if (requestKey !== chartRequestKey) return;
+            const data = JSON.parse(event.data);
+            if (chartDecimated) {
+                if (data.cursor !== chartCursor) pollChartUpdates(timeframe); // сырые свечи не ложатся на корзины
+                if (event.type === 'setup') displaySetupAlert(data);
+                return;
             }
-            if (chart && chart.timeScale()) chart.timeScale().fitContent();
+            if (chartCursor !== data.fromCursor && chartCursor !== data.cursor) {
+                pollChartUpdates(timeframe); // события пропущены - догоняем дельтой по cursor
+                return;
+            }
+            apply(data);
+        };
+
+        liveSource.addEventListener('hello', event => resync(JSON.parse(event.data)));
+        liveSource.addEventListener('reset', event => resync(JSON.parse(event.data)));
+        // События SSE небольшие - декодируем их прямо здесь
+        liveSource.addEventListener('candles', event => applyLiveEvent(event, data => {
+            applyChartDelta(ChartDecode.prepareChartPayload({ ohlcv: data.ohlcv, cursor: data.cursor }));
+        }));
+        liveSource.addEventListener('structure', event => applyLiveEvent(event, data => {
+            applyChartDelta(ChartDecode.prepareChartPayload(data));
+        }));
+        liveSource.addEventListener('setup', event => applyLiveEvent(event, data => {
+            applyChartDelta(ChartDecode.prepareChartPayload({ markers: [data.marker], cursor: data.cursor }));
+            displaySetupAlert(data);
+        }));
+    }
+
+    function schedulePolling(timeframe, backtestDate = null) {
+        if (pollTimer) clearInterval(pollTimer);
+        pollTimer = null;
+        if (liveSource) liveSource.close();
+        liveSource = null;
+        if (backtestDate) return; // история бэктеста не меняется
+        if (typeof EventSource !== 'undefined') {
+            connectLiveStream(timeframe);
         } else {
-            if (candlestickSeries) candlestickSeries.setData([]);
+            pollTimer = setInterval(() => pollChartUpdates(timeframe, backtestDate), CHART_POLL_INTERVAL_MS);
         }
-        // Pass chartData.analysisSummary (which is now a list)
-        displayAnalysisSummary(chartData ? chartData.analysisSummary : []);
-        // MODIFIED: Display fractal count
-        displayFractalCount(chartData ? chartData.fractalCount : 0);
     }
 
     if (timeframeSelect) {
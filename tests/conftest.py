@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Тесты запускаются из корня проекта (python -m pytest) или из tests/ - модули проекта импортируются из корня
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,12 @@
+# tests/test_chart_cache.py
+import pytest
+
+from utils.chart_cache import ChartCache, _ManifestLock
+
+
+def test_manifest_lock_released_when_lock_file_fails(tmp_path):
+    with pytest.raises(OSError):
+        with _ManifestLock(str(tmp_path / 'missing' / 'manifest.lock')):
+            pass
+    assert ChartCache._thread_lock.acquire(timeout=1)
+    ChartCache._thread_lock.release()
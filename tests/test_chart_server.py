@@ -0,0 +1,43 @@
+# tests/test_chart_server.py
+from benchmarks.synthetic import generate_fx_ohlcv
+from configs import settings
+from core.chart_payload import run_chart_analysis
+from core.chart_server import ChartDataService
+from core.scheduler import BarCloseScheduler
+
+
+def test_scheduled_key_uses_scheduler_result_and_unsubscribes_when_idle(monkeypatch):
+    full = generate_fx_ohlcv(600, freq='1h', seed=4)
+    calls = []
+
+    def fetch(symbol, interval, outputsize=None, **kwargs):
+        calls.append(outputsize)
+        return full.iloc[-outputsize:]
+
+    analyses = []
+
+    def job(symbol, timeframe, bar_close):
+        df = fetch(symbol, timeframe, settings.CONTEXT_OUTPUT_SIZE)
+        df = df[df.index < full.index[-1]]
+        analyses.append(bar_close)
+        return {'df': df, 'analysis': run_chart_analysis(df)}
+
+    bar_close = int(full.index[-1].timestamp())
+    scheduler = BarCloseScheduler(job_func=job, clock=lambda: bar_close + 10)
+    service = ChartDataService(fetch_func=fetch, scheduler=scheduler)
+    key = ('EUR/USD', '1h', None)
+    try:
+        service.refresh(*key)
+        service.refresh(*key)
+        frame = service._frames[key]
+        # Закрытые свечи - из запуска планировщика, у API - только формирующаяся свеча
+        assert calls == [settings.CONTEXT_OUTPUT_SIZE, settings.CHART_FORMING_OUTPUT_SIZE]
+        assert len(analyses) == 1
+        assert frame.index[-1] == full.index[-1] and len(frame) == settings.CONTEXT_OUTPUT_SIZE
+
+        monkeypatch.setattr(settings, 'CHART_FOLLOW_IDLE_SECONDS', -1)
+        scheduler.fire(['1h'], bar_close + 3600)[0].result(timeout=5)
+        assert not scheduler._subscriptions
+        assert key not in service._frames and service.store.latest(key) is None
+    finally:
+        scheduler.stop()
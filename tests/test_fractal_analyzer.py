@@ -0,0 +1,82 @@
+# tests/test_fractal_analyzer.py
+from datetime import time, timedelta
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_fx_ohlcv
+from configs import settings
+from ts_logic.fractal_analyzer import analyze_fractal_setups, get_candles_for_session, get_session_fractals
+
+
+def _reference_fractals(df, processing_dt, pip_value):
+    """Эталон: прежний пооконный проход по сессиям (get_candles_for_session + get_session_fractals)."""
+    asian_start = time(settings.ASIAN_SESSION_START_HOUR_UTC, settings.ASIAN_SESSION_START_MINUTE_UTC)
+    asian_end = time(settings.ASIAN_SESSION_END_HOUR_UTC, settings.ASIAN_SESSION_END_MINUTE_UTC)
+    ny_start = time(settings.NY_SESSION_START_HOUR_UTC, settings.NY_SESSION_START_MINUTE_UTC)
+    ny_end = time(settings.NY_SESSION_END_HOUR_UTC, settings.NY_SESSION_END_MINUTE_UTC)
+    today = pd.Timestamp(processing_dt.date(), tz=df.index.tz)
+
+    asian_date = today - timedelta(days=1) if asian_start > asian_end else today
+    asian = get_session_fractals(get_candles_for_session(df, asian_date, asian_start, asian_end),
+                                 settings.SESSION_FRACTAL_N, "Asia", "_AS")
+    ny = []
+    for i in range(1, settings.NY_SESSIONS_TO_CHECK_PREVIOUS_DAYS + 1):
+        candles = get_candles_for_session(df, today - timedelta(days=i), ny_start, ny_end)
+        ny.extend(get_session_fractals(candles, settings.SESSION_FRACTAL_N, f"NY (Day -{i})", f"_NY{i}"))
+
+    setups = []
+    threshold = settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS * pip_value
+    for asian_f in asian:
+        for ny_f in ny:
+            if abs(asian_f['price'] - ny_f['price']) > threshold:
+                continue
+            asian_is_high = "F_H" in asian_f['type']
+            if asian_is_high == ("F_H" in ny_f['type']):
+                setups.append((asian_f['time'], asian_f['price'],
+                               "SETUP_Resist" if asian_is_high else "SETUP_Support", 'Setup'))
+    return asian + ny, setups
+
+
+def _key(point):
+    return point['time'], point['price'], point['type'], point['session']
+
+
+@pytest.mark.parametrize('freq', ['1h', '15min'])
+def test_matches_reference_per_window_loop(freq):
+    pip_value = settings.PIP_VALUE_DEFAULT
+    # Сильный шум - чтобы на синтетике находились и сетапы, а не только фракталы
+    df = generate_fx_ohlcv(24 * 30 * (4 if freq == '15min' else 1), freq=freq, volatility_pips=25.0, seed=11)
+    days = pd.date_range(df.index[0].normalize() + timedelta(days=2), df.index[-1].normalize(), freq='D')
+
+    checked_setups = 0
+    for day in days:
+        processing_dt = day + timedelta(hours=settings.ASIAN_SESSION_END_HOUR_UTC)
+        result = analyze_fractal_setups(df, processing_dt, pip_value)
+        fractals, setups = _reference_fractals(df, processing_dt, pip_value)
+
+        got_setups = sorted(_key(p) for p in result if p['session'] == 'Setup')
+        got_fractals = sorted(_key(p) for p in result if p['session'] != 'Setup')
+        assert got_fractals == sorted(_key(p) for p in fractals), processing_dt
+        assert got_setups == sorted(setups), processing_dt
+        checked_setups += len(setups)
+        assert [p['time'] for p in result] == sorted(p['time'] for p in result)
+
+    assert checked_setups > 0
+
+
+def test_asian_session_crosses_midnight():
+    """Азиатская сессия 22:00-06:00 UTC: фракталы до полуночи относятся к сессии следующего дня."""
+    asian_start = time(settings.ASIAN_SESSION_START_HOUR_UTC, settings.ASIAN_SESSION_START_MINUTE_UTC)
+    asian_end = time(settings.ASIAN_SESSION_END_HOUR_UTC, settings.ASIAN_SESSION_END_MINUTE_UTC)
+    assert asian_start > asian_end
+
+    df = generate_fx_ohlcv(24 * 10, freq='1h', seed=5)
+    processing_dt = pd.Timestamp('2015-01-06 12:00', tz='UTC')
+    result = analyze_fractal_setups(df, processing_dt)
+    fractals, _ = _reference_fractals(df, processing_dt, settings.PIP_VALUE_DEFAULT)
+
+    asia = sorted(_key(p) for p in result if p['session'] == 'Asia')
+    assert asia == sorted(_key(p) for p in fractals if p['session'] == 'Asia')
+    assert any(t.date() < processing_dt.date() for t, _, _, _ in asia)
+    assert any(t.date() == processing_dt.date() for t, _, _, _ in asia)
@@ -0,0 +1,107 @@
+# tests/test_incremental.py
+import json
+import os
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_fx_ohlcv
+from configs import settings
+from core.chart_payload import run_chart_analysis
+from ts_logic.incremental import BarEventRouter, IncrementalAnalyzer, restore_or_build
+
+
+def _source(df):
+    def bars_source(symbol, timeframe, start=None, count=None):
+        return df[df.index >= start] if start is not None else df.iloc[-count:]
+    return bars_source
+
+
+def _empty_source(symbol, timeframe, start=None, count=None):
+    return pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'])
+
+
+def test_restore_from_empty_snapshot_rebuilds(tmp_path):
+    path = str(tmp_path / 'EUR_USD_1h.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(IncrementalAnalyzer('EUR/USD', '1h').to_state(), f)
+    df = generate_fx_ohlcv(settings.CONTEXT_OUTPUT_SIZE, freq='1h', seed=3)
+
+    analyzer, info = restore_or_build('EUR/USD', '1h', _source(df), path=path)
+
+    assert not info['restored']
+    assert info['replayed'] == len(df)
+    assert analyzer.last_time == df.index[-1]
+
+
+def test_empty_source_does_not_persist_snapshot(tmp_path):
+    path = str(tmp_path / 'EUR_USD_1h.json')
+
+    analyzer, info = restore_or_build('EUR/USD', '1h', _empty_source, path=path)
+
+    assert info['replayed'] == 0 and not analyzer.bars
+    assert not os.path.exists(path)
+
+
+def test_empty_source_keeps_existing_snapshot(tmp_path):
+    path = str(tmp_path / 'EUR_USD_1h.json')
+    df = generate_fx_ohlcv(settings.CONTEXT_OUTPUT_SIZE, freq='1h', seed=3)
+    restore_or_build('EUR/USD', '1h', _source(df), path=path)
+
+    analyzer, info = restore_or_build('EUR/USD', '1h', _empty_source, path=path)
+
+    assert info['restored'] and info['replayed'] == 0
+    assert analyzer.last_time == df.index[-1]
+    assert IncrementalAnalyzer.load(path, 'EUR/USD', '1h') is not None
+
+
+def test_bar_events_are_routed_by_symbol_and_timeframe():
+    df = generate_fx_ohlcv(50, freq='1h', seed=3)
+    analyzer = IncrementalAnalyzer('EUR/USD', '1h')
+    analyzer.on_bars(df.iloc[:-1])
+    router = BarEventRouter([analyzer])
+    last = df.iloc[-1]
+    event = {'symbol': 'EUR/USD', 'timeframe': '1h', 'event': 'closed', 'time': int(df.index[-1].timestamp()),
+             'open': last['open'], 'high': last['high'], 'low': last['low'], 'close': last['close'], 'volume': 1}
+
+    assert not router.on_bar_event(dict(event, timeframe='3m'))
+    assert not router.on_bar_event(dict(event, symbol='GBP/USD'))
+    assert not analyzer.on_bar_event(dict(event, timeframe='3m'))
+    assert router.on_bar_event(event)
+    assert not router.on_bar_event(event)  # повтор свечи (например, уже догнанной из источника)
+    assert analyzer.last_time == df.index[-1]
+
+
+def _key(point):
+    return point['time'], round(float(point['price']), 10), point['type'], point.get('session'), point.get('details')
+
+
+def test_sliding_window_matches_batch_analysis():
+    window = settings.CONTEXT_OUTPUT_SIZE
+    for seed in (1, 2, 3):
+        df = generate_fx_ohlcv(window + 500, freq='1h', seed=seed)
+        analyzer = IncrementalAnalyzer('EUR/USD', '1h')
+        for end in range(window, len(df) + 1, 50):
+            analyzer.on_bars(df.iloc[:end])
+            incremental, batch = analyzer.analysis(), run_chart_analysis(df.iloc[end - window:end])
+            assert [_key(p) for p in incremental['structure_points']] == \
+                [_key(p) for p in batch['structure_points']], (seed, end)
+            for side in ('highs', 'lows'):
+                assert [_key(p) for p in incremental['swings'][side]] == [_key(p) for p in batch['swings'][side]]
+            assert sorted(map(_key, incremental['session_points'])) == sorted(map(_key, batch['session_points']))
+            assert incremental['overall_context'] == batch['overall_context']
+            assert incremental['summary'] == batch['summary']
+
+
+def test_restored_snapshot_keeps_window_parity(tmp_path):
+    window = settings.CONTEXT_OUTPUT_SIZE
+    df = generate_fx_ohlcv(window + 300, freq='1h', seed=4)
+    path = str(tmp_path / 'EUR_USD_1h.json')
+    analyzer = IncrementalAnalyzer('EUR/USD', '1h', state_path=path)
+    analyzer.on_bars(df.iloc[:window + 100])
+    analyzer.save()
+
+    restored, info = restore_or_build('EUR/USD', '1h', _source(df), path=path)
+
+    assert info['restored'] and info['replayed'] == 200
+    batch = run_chart_analysis(df.iloc[-window:])
+    assert [_key(p) for p in restored.analysis()['structure_points']] == [_key(p) for p in batch['structure_points']]
@@ -0,0 +1,38 @@
+# tests/test_kernels.py
+import pandas as pd
+import pytest
+
+from ts_logic import kernels
+from ts_logic.context_analyzer_1h import (_analyze_market_structure_points_loop, analyze_market_structure_points,
+                                          find_swing_points)
+
+BACKENDS = [kernels.BACKEND_NUMPY,
+            pytest.param(kernels.BACKEND_NUMBA,
+                         marks=pytest.mark.skipif(not kernels.NUMBA_AVAILABLE, reason='numba не установлена'))]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_check_parity(backend):
+    result = kernels.check_parity(bars=5000)
+    assert result[backend] == {'swings': True, 'structure': True, 'fills': True}
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_analyzer_uses_selected_backend(backend, monkeypatch):
+    monkeypatch.setattr(kernels, 'BACKEND', backend)
+    monkeypatch.setattr(kernels, 'SWING_BACKEND', backend)
+    used = []
+    original = kernels._kernel
+    monkeypatch.setattr(kernels, '_kernel', lambda name, b=None: used.append(b or kernels.BACKEND) or original(name, b))
+
+    index = pd.date_range('2024-01-01', periods=9, freq='h', tz='UTC')
+    # Равные цены и максимум/минимум на одной свече - ветки слияния, где легко разойтись с эталоном
+    df = pd.DataFrame({'high': [1, 2, 3, 2, 1, 3, 1, 2, 1.0], 'low': [1, 0.5, 0.2, 0.5, 1, 0.2, 1, 0.5, 1.0]},
+                      index=index)
+    highs, lows = find_swing_points(df, n=1)
+    assert analyze_market_structure_points(highs, lows) == _analyze_market_structure_points_loop(highs, lows)
+    assert used == [backend, backend]
+
+
+def test_empty_swings():
+    assert analyze_market_structure_points([], []) == []
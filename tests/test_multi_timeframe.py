@@ -0,0 +1,48 @@
+# tests/test_multi_timeframe.py
+import pandas as pd
+
+from benchmarks.synthetic import generate_fx_ohlcv
+from configs import settings
+from core import scheduler
+from ts_logic.multi_timeframe import BIAS_LONG, MultiTimeframeContext
+
+
+def test_levels_without_structure_do_not_dilute_bias():
+    # Сразу после запуска: у 4h и 1D нет ни одной закрытой свечи
+    context = MultiTimeframeContext('EUR/USD')
+    result = context.bias("LONG (HH после HL)")
+    assert result['bias'] == BIAS_LONG and result['score'] == 1.0
+    assert result['levels']['1h']['counted']
+    assert not result['levels']['4h']['counted'] and not result['levels']['1D']['counted']
+
+
+def test_partial_first_higher_bar_is_dropped():
+    df = generate_fx_ohlcv(48, freq='1h', seed=5)
+    df = df[df.index >= df.index[0].normalize() + pd.Timedelta(hours=2)]  # поток начинается в 02:00
+    context = MultiTimeframeContext.from_dataframe(df, 'EUR/USD')
+    bars = context.levels['4h'].bars
+    # Свеча 00:00-04:00 собрана только из двух часов - в окно не попадает
+    assert bars and pd.Timestamp(bars[0][0], unit='s', tz='UTC').hour == 4
+    expected = df[df.index >= pd.Timestamp(bars[0][0], unit='s', tz='UTC')]['high'].resample('4h').max()
+    assert [bar[2] for bar in bars] == expected.iloc[:len(bars)].tolist()
+
+
+def test_scheduler_seeds_higher_timeframes_from_history(monkeypatch):
+    monkeypatch.setattr(scheduler, '_mtf_contexts', {})
+    history = generate_fx_ohlcv(24 * 130, freq='1h', seed=11)
+    window = history.iloc[-settings.CONTEXT_OUTPUT_SIZE:]
+    requests = []
+
+    def bars_source(symbol, timeframe, start=None, count=None):
+        requests.append((timeframe, count))
+        return history.iloc[-count:]
+
+    context = scheduler.mtf_context_for('EUR/USD', window, bars_source)
+    context.update_from_dataframe(window)
+    assert requests == [(settings.CONTEXT_TIMEFRAME, context.history_bars())]
+    assert len(context.levels['1D'].bars) >= settings.MTF_WINDOW_BARS - 10
+    assert context.bias()['levels']['1D']['counted']
+
+    # Повторный запуск без пропуска история не запрашивается
+    assert scheduler.mtf_context_for('EUR/USD', window.iloc[1:], bars_source) is context
+    assert len(requests) == 1
@@ -0,0 +1,27 @@
+# tests/test_scanner.py
+from benchmarks.synthetic import generate_fx_ohlcv
+from core.chart_payload import run_chart_analysis
+from core.scanner import MarketScanner
+from core.scheduler import BarCloseScheduler
+
+
+def test_scan_uses_scheduler_analysis_once_per_symbol():
+    runs = []
+
+    def job(symbol, timeframe, bar_close):
+        runs.append(symbol)
+        df = generate_fx_ohlcv(240, freq='1h', seed=len(runs))
+        return {'df': df, 'analysis': run_chart_analysis(df)}
+
+    scheduler = BarCloseScheduler(job_func=job)
+    scanner = MarketScanner(['EUR/USD', 'USD/JPY'])
+    scanner.scheduler = scheduler
+    try:
+        report = scanner.run()
+        assert sorted(runs) == ['EUR/USD', 'USD/JPY']
+        assert report['failed'] == 0
+        # Анализ уже сделан в запуске планировщика - в пул процессов ничего не отправлялось
+        assert not scanner._process_pool._processes
+    finally:
+        scanner.shutdown()
+        scheduler.stop()
@@ -0,0 +1,29 @@
+# tests/test_scheduler.py
+from benchmarks.synthetic import generate_fx_ohlcv
+from configs import settings
+from core import scheduler
+
+
+def test_liquidity_index_seeded_from_history_and_restored(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'ANALYZER_STATE_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(scheduler, '_liquidity_indexes', {})
+    history = generate_fx_ohlcv(24 * 80, freq='1h', seed=7)
+    window = history.iloc[-settings.CONTEXT_OUTPUT_SIZE:]
+    requests = []
+
+    def bars_source(symbol, timeframe, start=None, count=None):
+        requests.append(count)
+        return history.iloc[-count:]
+
+    index = scheduler.liquidity_index_for('EUR/USD', '1h', window, bars_source)
+    index.update_from_dataframe(window)
+    scheduler._save_liquidity_index('EUR/USD', '1h', index)
+    assert requests == [settings.LIQUIDITY_LOOKBACK_DAYS * 24]
+    # Уровни из истории старше окна загрузки
+    assert index.levels_between(history.index[0], window.index[0])
+
+    # "Перезапуск": состояние читается с диска, история не запрашивается повторно
+    monkeypatch.setattr(scheduler, '_liquidity_indexes', {})
+    restored = scheduler.liquidity_index_for('EUR/USD', '1h', window, bars_source)
+    assert len(requests) == 1
+    assert restored.last_time == index.last_time and restored.to_state() == index.to_state()
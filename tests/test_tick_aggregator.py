@@ -0,0 +1,18 @@
+# tests/test_tick_aggregator.py
+from core.tick_aggregator import parse_tick_lines
+
+
+def test_malformed_lines_are_skipped_without_shifting_fields():
+    lines = (b"1704672000000,1.10000,1.10020\n"
+             b"1704672000100,1.10010\n"          # не хватает поля
+             b"abc,1.1,1.1\n"
+             b"1704672000200,1.10030,1.10050\r\n"
+             b"\n"
+             b"1704672000300,nan,1.1\n")
+
+    times, bids, asks, malformed = parse_tick_lines(lines)
+
+    assert times.tolist() == [1704672000000, 1704672000200]
+    assert bids.tolist() == [1.1, 1.1003]
+    assert asks.tolist() == [1.1002, 1.1005]
+    assert malformed == 3
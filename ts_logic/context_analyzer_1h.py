@@ -3,6 +3,10 @@ import pandas as pd
 from configs import settings 
 from datetime import time, timedelta, datetime as dt_datetime 
 import numpy as np 
+from ts_logic.kernels import market_structure_points, swing_flags
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 # Соответствие стилей линий числовым значениям Lightweight Charts
 LINE_STYLE_SOLID = 0
@@ -26,36 +30,32 @@ def find_swing_points(df: pd.DataFrame, n: int = settings.SWING_POINT_N):
 
     required_cols = ['high', 'low']
     if not all(col in df.columns for col in required_cols):
-        print(f"context_analyzer: DataFrame должен содержать колонки {required_cols}.")
+        logger.error("DataFrame должен содержать колонки %s.", required_cols, extra={'stage': 'swings'})
         return swing_highs, swing_lows
 
     high_prices = df['high'].values
     low_prices = df['low'].values
     datetimes = df.index 
 
-    for i in range(n, len(df) - n):
-        is_swing_high = True
-        current_high = high_prices[i]
-        for j in range(1, n + 1):
-            if current_high <= high_prices[i-j] or current_high <= high_prices[i+j]:
-                is_swing_high = False
-                break
-        if is_swing_high:
-            swing_highs.append({'time': datetimes[i], 'price': current_high, 'type': 'H_SWING'})
-
-        is_swing_low = True
-        current_low = low_prices[i]
-        for j in range(1, n + 1):
-            if current_low >= low_prices[i-j] or current_low >= low_prices[i+j]:
-                is_swing_low = False
-                break
-        if is_swing_low:
-            swing_lows.append({'time': datetimes[i], 'price': current_low, 'type': 'L_SWING'})
+    # Сравнения с соседями - в ts_logic/kernels.py (сдвиги массивов вместо вложенного цикла по свечам)
+    is_swing_high, is_swing_low = swing_flags(high_prices, low_prices, n)
+    rows = np.flatnonzero(is_swing_high)
+    swing_highs.extend({'time': t, 'price': high_prices[i], 'type': 'H_SWING'} for i, t in zip(rows, datetimes[rows]))
+    rows = np.flatnonzero(is_swing_low)
+    swing_lows.extend({'time': t, 'price': low_prices[i], 'type': 'L_SWING'} for i, t in zip(rows, datetimes[rows]))
     return swing_highs, swing_lows
 
 def analyze_market_structure_points(swing_highs: list, swing_lows: list):
     """
     Анализирует последовательность свингов для определения HH, HL, LH, LL.
+    Слияние точек - ядро ts_logic/kernels.py (бэкенд по KERNELS_BACKEND); результат совпадает
+    с _analyze_market_structure_points_loop.
+    """
+    return market_structure_points(swing_highs, swing_lows)
+
+def _analyze_market_structure_points_loop(swing_highs: list, swing_lows: list):
+    """
+    Исходный цикл на словарях - эталон для kernels.check_parity().
     """
     structure_points = []
     if not swing_highs and not swing_lows:
@@ -226,7 +226,7 @@ def determine_trend_channel_context(trend_lines_data: list):
         r_start_time = pd.Timestamp(resistance_line['start_time'])
         r_end_time = pd.Timestamp(resistance_line['end_time'])
     except Exception as e:
-        print(f"Ошибка конвертации времени для линий тренда: {e}")
+        logger.error("Ошибка конвертации времени для линий тренда: %s", e, extra={'stage': 'trend_lines'})
         return "Ошибка времени в линиях"
 
     slope_support = get_line_slope(s_start_time, support_line['start_price'], 
@@ -439,6 +439,8 @@ def summarize_analysis(market_data_df: pd.DataFrame, structure_points: list,
 
 
 if __name__ == '__main__':
+    from utils.logger import setup_logger
+    setup_logger()
     print("Тестирование context_analyzer_1h.py...")
     settings.SWING_POINT_N = 2 
     settings.TRENDLINE_POINTS_WINDOW_SIZE = 5 
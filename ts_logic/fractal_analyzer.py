@@ -1,8 +1,13 @@
 # ts_logic/fractal_analyzer.py
+import numpy as np
 import pandas as pd
 from datetime import time, timedelta, datetime as dt_datetime, timezone
 from configs import settings
 from ts_logic.context_analyzer_1h import find_swing_points # find_swing_points теперь будет вызываться с разным N
+from ts_logic.liquidity_index import SESSION_ASIA, SESSION_NY, default_sessions
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 def get_candles_for_session(df: pd.DataFrame, target_date: pd.Timestamp,
                             session_start_time: time, session_end_time: time) -> pd.DataFrame:
@@ -76,9 +81,111 @@ def get_session_fractals(candles: pd.DataFrame, n_swing_for_session: int, sessio
         fractals.append({'time': sl['time'], 'price': sl['price'], 'type': f'F_L{point_type_suffix}', 'session': session_tag})
     return fractals
 
-def analyze_fractal_setups(full_df: pd.DataFrame, current_processing_dt: dt_datetime):
+def session_ids(index: pd.DatetimeIndex, sessions: dict = None) -> tuple:
+    """
+    Для каждой свечи - номер сессии из sessions (по порядку ключей, -1 вне сессий) и дата ее
+    начала (datetime64[D]). Время - в часовом поясе индекса, границы включительно, сессия через
+    полночь относится к дате начала - те же свечи, что отбирает get_candles_for_session.
+    """
+    sessions = sessions or default_sessions()
+    wall = index.tz_localize(None) if index.tz is not None else index
+    nanos = wall.asi8
+    days = nanos // 86_400_000_000_000
+    seconds_of_day = (nanos - days * 86_400_000_000_000) / 1e9
+    codes = np.full(len(index), -1, dtype=np.int64)
+    session_days = days.copy()
+    for code, (start, end) in enumerate(sessions.values()):
+        start_s = start.hour * 3600 + start.minute * 60 + start.second
+        end_s = end.hour * 3600 + end.minute * 60 + end.second
+        if start_s <= end_s:
+            codes[(seconds_of_day >= start_s) & (seconds_of_day <= end_s)] = code
+        else:
+            codes[seconds_of_day >= start_s] = code
+            early = seconds_of_day <= end_s
+            codes[early] = code
+            session_days[early] -= 1
+    return codes, session_days.astype('datetime64[D]')
+
+
+def _session_fractal_rows(df: pd.DataFrame, n: int, sessions: dict) -> tuple:
+    """
+    (строки фракталов, стороны 'H'/'L', номера сессий, даты сессий) - numpy-массивы по времени,
+    на одной свече максимум раньше минимума. Свеча - фрактал, если она строго выше (ниже) n соседей
+    с каждой стороны и все соседи из той же сессии того же дня.
+    """
+    codes, session_days = session_ids(df.index, sessions)
+    # Один ключ на (сессия, день): соседи сравниваются только внутри своего ключа
+    keys = np.where(codes >= 0, session_days.astype(np.int64) * len(sessions) + codes, -1)
+    high = df['high'].to_numpy(dtype=np.float64)
+    low = df['low'].to_numpy(dtype=np.float64)
+    size = len(df)
+    is_high = keys >= 0
+    is_low = is_high.copy()
+    for j in range(1, n + 1):
+        inner = np.zeros(size, dtype=bool)
+        inner[j:-j] = (keys[j:-j] == keys[:-2 * j]) & (keys[j:-j] == keys[2 * j:])
+        higher = np.zeros(size, dtype=bool)
+        lower = np.zeros(size, dtype=bool)
+        higher[j:-j] = (high[j:-j] > high[:-2 * j]) & (high[j:-j] > high[2 * j:])
+        lower[j:-j] = (low[j:-j] < low[:-2 * j]) & (low[j:-j] < low[2 * j:])
+        is_high &= inner & higher
+        is_low &= inner & lower
+
+    high_rows = np.flatnonzero(is_high)
+    low_rows = np.flatnonzero(is_low)
+    rows = np.concatenate([high_rows, low_rows])
+    sides = np.repeat(np.array(['H', 'L'], dtype=object), [len(high_rows), len(low_rows)])
+    order = np.lexsort((sides == 'L', rows))
+    rows = rows[order]
+    return rows, sides[order], codes[rows], session_days[rows]
+
+
+def find_all_session_fractals(df: pd.DataFrame, n: int = None, sessions: dict = None) -> pd.DataFrame:
+    """
+    Фракталы всех сессий всех дней за один проход по массиву свечей: сравнения с соседями
+    маскируются номером сессии, поэтому не выходят за ее границы. Свечи одной сессии в индексе
+    идут подряд - результат совпадает с get_session_fractals по каждому срезу
+    get_candles_for_session, без нарезки DataFrame и вызова find_swing_points на каждый день.
+    Колонки: time, price, side ('H'/'L'), session (имя из sessions), session_date (datetime64[D]).
+    """
+    n = settings.SESSION_FRACTAL_N if n is None else n
+    sessions = sessions or default_sessions()
+    columns = ['time', 'price', 'side', 'session', 'session_date']
+    if df is None or len(df) < 2 * n + 1:
+        return pd.DataFrame(columns=columns)
+    rows, sides, codes, days = _session_fractal_rows(df, n, sessions)
+    prices = np.where(sides == 'H', df['high'].to_numpy(dtype=np.float64)[rows], df['low'].to_numpy(dtype=np.float64)[rows])
+    return pd.DataFrame({
+        'time': df.index[rows],
+        'price': prices,
+        'side': sides,
+        'session': np.array(list(sessions.keys()), dtype=object)[codes],
+        'session_date': days,
+    }, columns=columns)
+
+
+def _session_points(df: pd.DataFrame, found: tuple, session_code: int, session_date, session_tag: str,
+                    point_type_suffix: str) -> list:
+    """Фракталы одной сессии одного дня из _session_fractal_rows в формате get_session_fractals."""
+    rows, sides, codes, days = found
+    selected = (codes == session_code) & (days == np.datetime64(pd.Timestamp(session_date).date(), 'D'))
+    points = []
+    for side, column in (('H', 'high'), ('L', 'low')):
+        side_rows = rows[selected & (sides == side)]
+        prices = df[column].to_numpy()[side_rows]
+        points.extend({'time': df.index[row], 'price': price, 'type': f'F_{side}{point_type_suffix}', 'session': session_tag}
+                      for row, price in zip(side_rows, prices))
+    return points
+
+
+def analyze_fractal_setups(full_df: pd.DataFrame, current_processing_dt: dt_datetime,
+                           pip_value: float = settings.PIP_VALUE_DEFAULT, liquidity_index=None):
     """
     Основная функция для анализа фракталов сессий и поиска сетапов.
+    pip_value - размер пипса пары (settings.get_pip_value(symbol)): порог близости
+    FRACTAL_PROXIMITY_THRESHOLD_PIPS переводится в цену с его помощью.
+    liquidity_index (ts_logic/liquidity_index.py), если передан, дополнительно сопоставляет
+    азиатские фракталы со всеми нетронутыми NY-уровнями за LIQUIDITY_LOOKBACK_DAYS.
     """
     all_identified_fractals = []
     setup_points = []
@@ -105,28 +212,26 @@ def analyze_fractal_setups(full_df: pd.DataFrame, current_processing_dt: dt_date
          asian_session_target_date = today_date - timedelta(days=1) # Start searching from the previous day
 
 
-    asian_candles_today = get_candles_for_session(full_df, asian_session_target_date, asian_start_time, asian_end_time)
-
-
-    if not asian_candles_today.empty:
-        # Use settings.SESSION_FRACTAL_N for Asian fractals
-        todays_asian_fractals = get_session_fractals(asian_candles_today, settings.SESSION_FRACTAL_N, "Asia", "_AS")
-        all_identified_fractals.extend(todays_asian_fractals)
+    # Фракталы всех сессий окна за один проход; дальше - выбор нужных дней
+    # Use settings.SESSION_FRACTAL_N for Asian and New York fractals
+    if len(full_df) >= 2 * settings.SESSION_FRACTAL_N + 1:
+        session_fractals = _session_fractal_rows(full_df, settings.SESSION_FRACTAL_N, {
+            SESSION_ASIA: (asian_start_time, asian_end_time), SESSION_NY: (ny_start_time, ny_end_time)})
     else:
-        todays_asian_fractals = []
+        session_fractals = (np.empty(0, dtype=np.int64),) * 4
+
+    todays_asian_fractals = _session_points(full_df, session_fractals, 0, asian_session_target_date, "Asia", "_AS")
+    all_identified_fractals.extend(todays_asian_fractals)
 
     past_ny_fractals = []
     for i in range(1, settings.NY_SESSIONS_TO_CHECK_PREVIOUS_DAYS + 1):
         prev_date = today_date - timedelta(days=i)
-        ny_candles_past = get_candles_for_session(full_df, prev_date, ny_start_time, ny_end_time)
-        if not ny_candles_past.empty:
-            # Use settings.SESSION_FRACTAL_N for New York fractals
-            ny_fractals_on_date = get_session_fractals(ny_candles_past, settings.SESSION_FRACTAL_N, f"NY (Day -{i})", f"_NY{i}")
-            past_ny_fractals.extend(ny_fractals_on_date)
-            all_identified_fractals.extend(ny_fractals_on_date)
+        ny_fractals_on_date = _session_points(full_df, session_fractals, 1, prev_date, f"NY (Day -{i})", f"_NY{i}")
+        past_ny_fractals.extend(ny_fractals_on_date)
+        all_identified_fractals.extend(ny_fractals_on_date)
 
     if todays_asian_fractals and past_ny_fractals:
-        price_threshold = settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS * settings.PIP_VALUE_DEFAULT
+        price_threshold = settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS * pip_value
 
         for asian_f in todays_asian_fractals:
             for ny_f in past_ny_fractals:
@@ -154,12 +259,26 @@ def analyze_fractal_setups(full_df: pd.DataFrame, current_processing_dt: dt_date
                         }
                         setup_points.append(setup_point)
                         all_identified_fractals.append(setup_point)
-                        print(f"fractal_analyzer: SETUP FOUND! {setup_type} at {asian_f['time'].strftime('%Y-%m-%d %H:%M')} price {asian_f['price']:.5f}")
+                        logger.info("SETUP FOUND! %s at %s price %.5f", setup_type, asian_f['time'], asian_f['price'],
+                                    extra={'stage': 'setups'})
+
+    if todays_asian_fractals and liquidity_index is not None:
+        # NY-фракталы предыдущих дней уже сопоставлены выше - из индекса берем только более старые уровни
+        checked_ny_times = {f['time'] for f in past_ny_fractals}
+        for asian_f in todays_asian_fractals:
+            for setup_point in liquidity_index.setups_for(asian_f, settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS,
+                                                          exclude_times=checked_ny_times):
+                setup_points.append(setup_point)
+                all_identified_fractals.append(setup_point)
+                logger.info("SETUP FOUND (liquidity index)! %s at %s price %.5f", setup_point['type'],
+                            asian_f['time'], asian_f['price'], extra={'stage': 'setups'})
 
     all_identified_fractals.sort(key=lambda x: x['time'])
     return all_identified_fractals
 
 if __name__ == '__main__':
+    from utils.logger import setup_logger
+    setup_logger()
     print("Тестирование fractal_analyzer.py (с SESSION_FRACTAL_N)...")
 
     # Set test values for settings if they differ from the main ones
@@ -191,12 +310,12 @@ if __name__ == '__main__':
 
 
     # Create data to cover multiple days and sessions
-    rng = pd.date_range(start='2023-10-01 00:00', end='2023-10-04 23:59', freq='1H', tz='UTC')
+    rng = pd.date_range(start='2023-10-01 00:00', end='2023-10-04 23:59', freq='1h', tz='UTC')
     data = { # Data to guarantee fractals at n=1
-        'open': [1.0500, 1.0510, 1.0490, 1.0520, 1.0480] * (len(rng)//5 + 1) [:len(rng)],
-        'high': [1.0505, 1.0515, 1.0530, 1.0525, 1.0540] * (len(rng)//5 + 1) [:len(rng)], # Clear high on the 3rd candle
-        'low':  [1.0495, 1.0485, 1.0490, 1.0470, 1.0480] * (len(rng)//5 + 1) [:len(rng)], # Clear low on the 4th candle
-        'close':[1.0503, 1.0500, 1.0510, 1.0490, 1.0500] * (len(rng)//5 + 1) [:len(rng)],
+        'open': ([1.0500, 1.0510, 1.0490, 1.0520, 1.0480] * (len(rng)//5 + 1))[:len(rng)],
+        'high': ([1.0505, 1.0515, 1.0530, 1.0525, 1.0540] * (len(rng)//5 + 1))[:len(rng)], # Clear high on the 3rd candle
+        'low':  ([1.0495, 1.0485, 1.0490, 1.0470, 1.0480] * (len(rng)//5 + 1))[:len(rng)], # Clear low on the 4th candle
+        'close':([1.0503, 1.0500, 1.0510, 1.0490, 1.0500] * (len(rng)//5 + 1))[:len(rng)],
         'volume':[100 + i*10 for i in range(len(rng))]
     }
     test_df_full = pd.DataFrame(data, index=rng)
@@ -277,3 +396,27 @@ if __name__ == '__main__':
     settings.NY_SESSION_START_MINUTE_UTC = original_ny_start_m
     settings.NY_SESSION_END_HOUR_UTC = original_ny_end_h
     settings.NY_SESSION_END_MINUTE_UTC = original_ny_end_m
+
+    print("\nСверка find_all_session_fractals с get_session_fractals по срезам каждого дня...")
+    import time as time_module
+    from benchmarks.synthetic import generate_fx_ohlcv
+    history_df = generate_fx_ohlcv(24 * 365, freq='1h', seed=7)
+    sessions_for_check = default_sessions()
+
+    started = time_module.perf_counter()
+    vectorized = find_all_session_fractals(history_df, settings.SESSION_FRACTAL_N, sessions_for_check)
+    vectorized_seconds = time_module.perf_counter() - started
+
+    started = time_module.perf_counter()
+    per_slice = []
+    for day in pd.date_range(history_df.index[0].normalize() - timedelta(days=1), history_df.index[-1].normalize(), freq='D'):
+        for session_name, (session_start, session_end) in sessions_for_check.items():
+            candles = get_candles_for_session(history_df, day, session_start, session_end)
+            per_slice.extend((f['time'], f['type'][2], session_name, float(f['price']))
+                             for f in get_session_fractals(candles, settings.SESSION_FRACTAL_N, session_name, ''))
+    per_slice_seconds = time_module.perf_counter() - started
+
+    vectorized_set = set(zip(vectorized['time'], vectorized['side'], vectorized['session'], vectorized['price'].astype(float)))
+    print(f"Фракталов: {len(vectorized)} (по срезам: {len(per_slice)}), совпадают: {vectorized_set == set(per_slice)}")
+    print(f"Один проход: {vectorized_seconds * 1000:.1f} мс, по срезам: {per_slice_seconds * 1000:.0f} мс "
+          f"({per_slice_seconds / vectorized_seconds:.0f}x)")
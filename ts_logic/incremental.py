@@ -0,0 +1,668 @@
+# ts_logic/incremental.py
+"""
+Инкрементальный анализ по закрытым свечам и снимок его состояния на диск.
+
+IncrementalAnalyzer получает свечи по одной (on_bar, события core/tick_aggregator.py) и
+обновляет только то, что изменила новая свеча:
+    окно свечей       - последние CONTEXT_OUTPUT_SIZE свечей (буфер свингов и база для линий тренда)
+    свинги            - подтверждается свеча, у которой набралось SWING_POINT_N свечей справа
+    структура         - HH/HL/LH/LL: тот же двухпроходный разбор, что в analyze_market_structure_points,
+                        но по одному свингу; при сдвиге окна пересобирается по свингам окна
+    сессионные фракталы и их снятие - ts_logic/liquidity_index.py
+    сетапы            - азиатский фрактал сверяется с NY-фракталами предыдущих дней в момент подтверждения
+Линии тренда, контекст и сводка пересчитываются из этого состояния в analysis() (доли миллисекунды).
+analysis() совпадает с run_chart_analysis по текущему окну свечей и после его сдвига: свинги
+и фракталы у левого края окна, найденные по свечам до окна, в результат не попадают.
+
+Снимок (save / load) - JSON с версией формата, отпечатком настроек анализа и отпечатком
+данных (хэш последних ANALYZER_STATE_FINGERPRINT_BARS свечей в пипеттах). При запуске
+restore_or_build загружает снимок, сверяет отпечаток с источником свечей и догоняет только
+свечи, закрывшиеся за время простоя; при несовпадении строит состояние заново.
+"""
+import hashlib
+import json
+import os
+import time as time_module
+from collections import deque
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from configs import settings
+from ts_logic.context_analyzer_1h import (
+    determine_overall_market_context,
+    determine_trend_lines_v2,
+    summarize_analysis,
+)
+from ts_logic.liquidity_index import LiquidityIndex, SESSION_ASIA, SESSION_NY, SIDE_HIGH, session_of
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATE_VERSION = 2
+PIPETTES_PER_PIP = 10
+
+
+class StructureTracker:
+    """
+    analyze_market_structure_points по одному свингу: первый проход (тип точки относительно
+    предыдущего максимума/минимума) и второй (слияние подряд идущих однотипных точек)
+    зависят только от последних точек. Когда свинг уходит из окна (trim), точки пересобираются
+    по оставшимся свингам окна - результат совпадает с пакетным разбором свингов окна,
+    а не тянет метки HH/LL от свингов до его начала.
+    """
+
+    def __init__(self):
+        self.last_h = None
+        self.last_l = None
+        self.points = []
+        self.swings = []  # (time, price, 'high'|'low') в порядке подачи
+
+    def add_swing(self, swing_time: pd.Timestamp, price: float, swing_type: str):
+        self.swings.append((swing_time, price, swing_type))
+        self._merge(swing_time, price, swing_type)
+
+    def _merge(self, swing_time: pd.Timestamp, price: float, swing_type: str):
+        if swing_type == 'high':
+            if self.last_h:
+                if price > self.last_h['price']: point_type = "HH"
+                elif price < self.last_h['price']: point_type = "LH"
+                else: point_type = "H"
+            else:
+                point_type = "H"
+            self.last_h = current_sp = {'time': swing_time, 'price': price, 'type': point_type}
+        else:
+            if self.last_l:
+                if price < self.last_l['price']: point_type = "LL"
+                elif price > self.last_l['price']: point_type = "HL"
+                else: point_type = "L"
+            else:
+                point_type = "L"
+            self.last_l = current_sp = {'time': swing_time, 'price': price, 'type': point_type}
+
+        if not self.points:
+            self.points.append(current_sp)
+            return
+        prev_sp = self.points[-1]
+        # Те же проверки, что во втором проходе analyze_market_structure_points ('HL' и 'LH' содержат 'H')
+        is_prev_high_type = 'H' in prev_sp['type']
+        is_curr_high_type = 'H' in current_sp['type']
+        is_prev_low_type = 'L' in prev_sp['type'] and not is_prev_high_type
+        is_curr_low_type = 'L' in current_sp['type'] and not is_curr_high_type
+        if (is_prev_high_type and is_curr_high_type) or (is_prev_low_type and is_curr_low_type):
+            if (is_curr_high_type and current_sp['price'] >= prev_sp['price']) or \
+               (is_curr_low_type and current_sp['price'] <= prev_sp['price']):
+                self.points[-1] = current_sp
+            elif current_sp['time'] > prev_sp['time'] and prev_sp['type'] != current_sp['type']:
+                self.points.append(current_sp)
+        else:
+            self.points.append(current_sp)
+
+    def trim(self, before: pd.Timestamp):
+        """Свинги старше before уходят из окна: точки пересобираются по оставшимся (десятки свингов)."""
+        keep_from = 0
+        while keep_from < len(self.swings) and self.swings[keep_from][0] < before:
+            keep_from += 1
+        if not keep_from:
+            return
+        del self.swings[:keep_from]
+        self.last_h = self.last_l = None
+        self.points = []
+        for swing in self.swings:
+            self._merge(*swing)
+
+    def to_state(self) -> dict:
+        return {'swings': [[_epoch(t), price, swing_type] for t, price, swing_type in self.swings]}
+
+    @classmethod
+    def from_state(cls, state: dict):
+        tracker = cls()
+        for t, price, swing_type in state['swings']:
+            tracker.add_swing(_timestamp(t), price, swing_type)
+        return tracker
+
+
+def confirm_swing(bars, n: int) -> tuple:
+    """
+    (is_high, is_low) для свечи в n позициях от конца bars (кортежи epoch, o, h, l, c, v):
+    свинг, если она строго выше (ниже) n соседей с каждой стороны - как find_swing_points.
+    """
+    if len(bars) < 2 * n + 1:
+        return False, False
+    center = bars[-n - 1]
+    neighbours = [bars[-k] for k in range(1, 2 * n + 2) if k != n + 1]
+    return all(center[2] > b[2] for b in neighbours), all(center[3] < b[3] for b in neighbours)
+
+
+def trim_points(points: list, before: pd.Timestamp) -> list:
+    """Точки (по возрастанию времени) не старше before."""
+    if not points or points[0]['time'] >= before:
+        return points
+    return [p for p in points if p['time'] >= before]
+
+
+def bars_frame(bars) -> pd.DataFrame:
+    """Свечи (кортежи epoch, o, h, l, c, v) в DataFrame формата get_forex_data."""
+    records = np.array(bars, dtype=np.float64).reshape(-1, 6)
+    index = pd.DatetimeIndex(pd.to_datetime(records[:, 0].astype(np.int64), unit='s', utc=True), name='datetime')
+    return pd.DataFrame(records[:, 1:], index=index, columns=['open', 'high', 'low', 'close', 'volume'])
+
+
+def settings_fingerprint(pip_value: float, window: int) -> str:
+    """Отпечаток настроек, от которых зависит состояние: при их изменении снимок недействителен."""
+    relevant = {
+        'swing_n': settings.SWING_POINT_N, 'session_n': settings.SESSION_FRACTAL_N,
+        'asia': [settings.ASIAN_SESSION_START_HOUR_UTC, settings.ASIAN_SESSION_START_MINUTE_UTC,
+                 settings.ASIAN_SESSION_END_HOUR_UTC, settings.ASIAN_SESSION_END_MINUTE_UTC],
+        'ny': [settings.NY_SESSION_START_HOUR_UTC, settings.NY_SESSION_START_MINUTE_UTC,
+               settings.NY_SESSION_END_HOUR_UTC, settings.NY_SESSION_END_MINUTE_UTC],
+        'ny_days': settings.NY_SESSIONS_TO_CHECK_PREVIOUS_DAYS,
+        'proximity_pips': settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS,
+        'lookback_days': settings.LIQUIDITY_LOOKBACK_DAYS,
+        'pip_value': pip_value, 'window': window,
+    }
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def data_fingerprint(times, highs, lows, closes, pip_value: float) -> str:
+    """Хэш свечей (время + high/low/close в пипеттах): не зависит от формата float источника."""
+    scale = PIPETTES_PER_PIP / pip_value
+    rows = np.column_stack([np.asarray(times, dtype=np.int64),
+                            np.rint(np.asarray(highs, dtype=np.float64) * scale).astype(np.int64),
+                            np.rint(np.asarray(lows, dtype=np.float64) * scale).astype(np.int64),
+                            np.rint(np.asarray(closes, dtype=np.float64) * scale).astype(np.int64)])
+    return hashlib.sha1(np.ascontiguousarray(rows).tobytes()).hexdigest()
+
+
+class IncrementalAnalyzer:
+    """Живое состояние анализа одного (символ, таймфрейм); свечи подаются закрытые и по времени."""
+
+    def __init__(self, symbol: str, timeframe: str, pip_value: float = None,
+                 window: int = settings.CONTEXT_OUTPUT_SIZE, state_path: str = None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.pip_value = pip_value or settings.get_pip_value(symbol)
+        self.window = window
+        self.swing_n = settings.SWING_POINT_N
+        self.state_path = state_path
+        self.bars = deque(maxlen=window)  # (epoch, open, high, low, close, volume)
+        self.swing_highs = []
+        self.swing_lows = []
+        self.structure = StructureTracker()
+        self.liquidity = LiquidityIndex(self.pip_value)
+        self.setups = []
+        self.last_time = None
+
+    @property
+    def log_fields(self) -> dict:
+        return {'symbol': self.symbol, 'timeframe': self.timeframe, 'stage': 'incremental'}
+
+    # --- свечи ---
+
+    def on_bar(self, ts: pd.Timestamp, open_: float, high: float, low: float, close: float, volume: float = 0.0):
+        """Одна закрытая свеча."""
+        ts = pd.Timestamp(ts)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize('UTC')
+        if self.last_time is not None and ts <= self.last_time:
+            raise ValueError(f"свечи должны идти по времени: {ts} <= {self.last_time}")
+        self.bars.append((int(ts.timestamp()), float(open_), float(high), float(low), float(close), float(volume)))
+        self.last_time = ts
+        self._confirm_swing()
+
+        self.liquidity.update(ts, high, low)
+        for level in self.liquidity.confirmed:
+            if level['session'] == SESSION_ASIA:
+                self._match_setups(level)
+
+        window_start = _timestamp(self.bars[0][0])
+        # Свинг в первых n свечах окна пакетный анализ окна не находит (слева меньше n свечей)
+        swing_start = self._window_time(self.swing_n)
+        self.swing_highs = trim_points(self.swing_highs, swing_start)
+        self.swing_lows = trim_points(self.swing_lows, swing_start)
+        self.structure.trim(swing_start)
+        self.setups = trim_points(self.setups, window_start)
+
+    def on_bars(self, df: pd.DataFrame) -> int:
+        """Свечи df новее last_time; возвращает число поданных свечей."""
+        if df is None or df.empty:
+            return 0
+        if self.last_time is not None:
+            df = df[df.index > self.last_time]
+        for row in zip(df.index, df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(),
+                       df['close'].to_numpy(),
+                       df['volume'].to_numpy() if 'volume' in df.columns else np.zeros(len(df))):
+            self.on_bar(*row)
+        return len(df)
+
+    def on_bar_event(self, event: dict) -> bool:
+        """
+        Обработчик событий core/tick_aggregator.py. closed - свеча и снимок состояния (если задан
+        state_path); forming игнорируется; revised меняет свечу в окне, но не пересматривает уже
+        подтвержденные по ней свинги и фракталы (исправление приходит в пределах секунд).
+        События другого символа или таймфрейма (очередь агрегатора общая для 3m и 1h) и свечи,
+        уже полученные из источника при восстановлении, пропускаются. True - событие применено.
+        """
+        if event.get('timeframe') != self.timeframe or event.get('symbol', self.symbol) != self.symbol:
+            return False
+        if event['event'] == 'closed':
+            if self.last_time is not None and event['time'] <= _epoch(self.last_time):
+                return False
+            self.on_bar(pd.Timestamp(event['time'], unit='s', tz='UTC'), event['open'], event['high'],
+                        event['low'], event['close'], event['volume'])
+            if self.state_path:
+                self.save()
+            return True
+        if event['event'] == 'revised':
+            for i in range(len(self.bars) - 1, -1, -1):
+                if self.bars[i][0] == event['time']:
+                    self.bars[i] = (event['time'], float(event['open']), float(event['high']), float(event['low']),
+                                    float(event['close']), float(event['volume']))
+                    return True
+        return False
+
+    def _window_time(self, offset: int) -> pd.Timestamp:
+        """Время свечи окна с индексом offset (последней, если окно короче)."""
+        return _timestamp(self.bars[min(offset, len(self.bars) - 1)][0])
+
+    def _confirm_swing(self):
+        is_high, is_low = confirm_swing(self.bars, self.swing_n)
+        center = self.bars[-self.swing_n - 1] if is_high or is_low else None
+        if is_high:
+            self.swing_highs.append({'time': _timestamp(center[0]), 'price': center[2], 'type': 'H_SWING'})
+            self.structure.add_swing(self.swing_highs[-1]['time'], center[2], 'high')
+        if is_low:
+            self.swing_lows.append({'time': _timestamp(center[0]), 'price': center[3], 'type': 'L_SWING'})
+            self.structure.add_swing(self.swing_lows[-1]['time'], center[3], 'low')
+
+    def _asian_day(self, asian_time: pd.Timestamp):
+        """'Сегодня' для азиатского фрактала: день окончания его сессии (как today в analyze_fractal_setups)."""
+        start, end = self.liquidity.sessions[SESSION_ASIA]
+        session_date = session_of(asian_time, self.liquidity.sessions)[1]
+        return session_date + timedelta(days=1) if start > end else session_date
+
+    def _ny_fractals(self, ny_date) -> list:
+        start = pd.Timestamp(ny_date, tz='UTC')
+        return [level for level in self.liquidity.levels_between(start, start + pd.Timedelta(days=2), SESSION_NY)
+                if session_of(level['time'], self.liquidity.sessions)[1] == ny_date]
+
+    def _match_setups(self, asian_level: dict):
+        """Сетапы нового азиатского фрактала против NY-фракталов предыдущих дней - как в analyze_fractal_setups."""
+        today = self._asian_day(asian_level['time'])
+        for i in range(1, settings.NY_SESSIONS_TO_CHECK_PREVIOUS_DAYS + 1):
+            for ny_level in self._ny_fractals(today - timedelta(days=i)):
+                setup = self._setup_point(asian_level, ny_level, i)
+                if setup is not None:
+                    self.setups.append(setup)
+                    logger.info("SETUP FOUND! %s at %s price %.5f", setup['type'], asian_level['time'],
+                                asian_level['price'], extra=dict(self.log_fields, stage='setups'))
+
+    def _setup_point(self, asian_level: dict, ny_level: dict, i: int):
+        """Точка сетапа пары азиатский / NY-фрактал (i - сколько дней назад NY) или None."""
+        price_diff = abs(asian_level['price'] - ny_level['price'])
+        if ny_level['side'] != asian_level['side'] or \
+                price_diff > settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS * self.pip_value:
+            return None
+        asian_type = f"F_{asian_level['side']}_AS"
+        ny_type = f"F_{ny_level['side']}_NY{i}"
+        return {
+            'time': asian_level['time'],
+            'price': asian_level['price'],
+            'type': "SETUP_Resist" if asian_level['side'] == SIDE_HIGH else "SETUP_Support",
+            'session': 'Setup',
+            'details': f"Asian {asian_type} at {asian_level['price']:.5f} ({asian_level['time'].strftime('%H:%M')}) "
+                       f"near NY {ny_type} at {ny_level['price']:.5f} ({ny_level['time'].strftime('%Y-%m-%d %H:%M')}), "
+                       f"Diff: {price_diff:.5f}",
+        }
+
+    # --- результат ---
+
+    def window_frame(self) -> pd.DataFrame:
+        """Окно свечей в формате get_forex_data."""
+        return bars_frame(self.bars)
+
+    def session_points(self) -> list:
+        """
+        Фракталы текущего дня Азии, NY предыдущих дней и сетапы - как analyze_fractal_setups на окне:
+        фракталы, которым в окне не хватает свечей слева, и NY-дни до начала окна не учитываются.
+        """
+        if self.last_time is None:
+            return []
+        today = self.last_time.date()
+        fractal_start = self._window_time(self.liquidity.n)
+        start, end = self.liquidity.sessions[SESSION_ASIA]
+        asian_date = today - timedelta(days=1) if start > end else today
+        asian_levels = [level for level in self.liquidity.levels_between(pd.Timestamp(asian_date, tz='UTC'), None,
+                                                                         SESSION_ASIA)
+                        if level['time'] >= fractal_start and
+                        session_of(level['time'], self.liquidity.sessions)[1] == asian_date]
+        points = [{'time': level['time'], 'price': level['price'], 'type': f"F_{level['side']}_AS", 'session': 'Asia'}
+                  for level in asian_levels]
+        setups = []
+        for i in range(1, settings.NY_SESSIONS_TO_CHECK_PREVIOUS_DAYS + 1):
+            for level in self._ny_fractals(today - timedelta(days=i)):
+                if level['time'] < fractal_start:
+                    continue
+                points.append({'time': level['time'], 'price': level['price'],
+                               'type': f"F_{level['side']}_NY{i}", 'session': f"NY (Day -{i})"})
+                setups.extend(setup for setup in (self._setup_point(asian, level, i) for asian in asian_levels)
+                              if setup is not None)
+        points.extend(setups)
+        points.sort(key=lambda x: x['time'])
+        return points
+
+    def pending_setups(self) -> list:
+        """Сетапы текущего дня, чей азиатский уровень еще не снят."""
+        pending = []
+        for setup in self.setups:
+            if self._asian_day(setup['time']) != self.last_time.date():
+                continue
+            side = SIDE_HIGH if setup['type'] == 'SETUP_Resist' else 'L'
+            levels = self.liquidity.levels_in_range(setup['price'], setup['price'], side=side, untouched=True)
+            if any(level['time'] == setup['time'] for level in levels):
+                pending.append(setup)
+        return pending
+
+    def analysis(self) -> dict:
+        """Результат в формате core/chart_payload.run_chart_analysis."""
+        analysis = {'structure_points': [], 'session_points': [], 'trend_lines': [], 'overall_context': None,
+                    'summary': [], 'swings': {'n': self.swing_n, 'highs': [], 'lows': []}}
+        if not self.bars:
+            return analysis
+        frame = self.window_frame()
+        structure_points = list(self.structure.points)
+        overall_context = determine_overall_market_context(structure_points)
+        trend_lines = determine_trend_lines_v2(self.swing_highs, self.swing_lows, self.last_time,
+                                               frame[['high', 'low', 'close']],
+                                               points_window_size=settings.TRENDLINE_POINTS_WINDOW_SIZE)
+        session_points = self.session_points()
+        analysis.update({
+            'swings': {'n': self.swing_n, 'highs': list(self.swing_highs), 'lows': list(self.swing_lows)},
+            'structure_points': structure_points,
+            'session_points': session_points,
+            'trend_lines': trend_lines,
+            'overall_context': overall_context,
+            'summary': summarize_analysis(frame, structure_points, session_points, overall_context, trend_lines),
+        })
+        return analysis
+
+    # --- снимок ---
+
+    def fingerprint(self) -> str:
+        tail = list(self.bars)[-settings.ANALYZER_STATE_FINGERPRINT_BARS:]
+        return data_fingerprint([b[0] for b in tail], [b[2] for b in tail], [b[3] for b in tail],
+                                [b[4] for b in tail], self.pip_value)
+
+    def to_state(self) -> dict:
+        return {
+            'version': STATE_VERSION,
+            'symbol': self.symbol,
+            'timeframe': self.timeframe,
+            'settings': settings_fingerprint(self.pip_value, self.window),
+            'saved_at': int(time_module.time()),
+            'last_time': _epoch(self.last_time),
+            'fingerprint': self.fingerprint(),
+            'fingerprint_times': [b[0] for b in list(self.bars)[-settings.ANALYZER_STATE_FINGERPRINT_BARS:]],
+            'bars': [list(b) for b in self.bars],
+            'swing_highs': [[_epoch(p['time']), p['price']] for p in self.swing_highs],
+            'swing_lows': [[_epoch(p['time']), p['price']] for p in self.swing_lows],
+            'structure': self.structure.to_state(),
+            'liquidity': self.liquidity.to_state(),
+            'setups': [_point_state(p) for p in self.setups],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict, state_path: str = None):
+        analyzer = cls(state['symbol'], state['timeframe'], state['liquidity']['pip_value'],
+                       window=len(state['bars']) if len(state['bars']) > settings.CONTEXT_OUTPUT_SIZE
+                       else settings.CONTEXT_OUTPUT_SIZE, state_path=state_path)
+        analyzer.bars.extend(tuple(b) for b in state['bars'])
+        analyzer.last_time = _timestamp(state['last_time'])
+        analyzer.swing_highs = [{'time': _timestamp(t), 'price': p, 'type': 'H_SWING'} for t, p in state['swing_highs']]
+        analyzer.swing_lows = [{'time': _timestamp(t), 'price': p, 'type': 'L_SWING'} for t, p in state['swing_lows']]
+        analyzer.structure = StructureTracker.from_state(state['structure'])
+        analyzer.liquidity = LiquidityIndex.from_state(state['liquidity'])
+        analyzer.setups = [_point_from_state(p) for p in state['setups']]
+        return analyzer
+
+    def save(self, path: str = None) -> str:
+        """Атомарная запись снимка (временный файл + os.replace). Без свечей снимок не пишется - возвращает None."""
+        if not self.bars:
+            return None
+        path = path or self.state_path or state_path_for(self.symbol, self.timeframe)
+        started = time_module.perf_counter()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_state(), f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        metrics.observe(metrics.STAGE_SECONDS, time_module.perf_counter() - started, stage='state_save')
+        return path
+
+    @classmethod
+    def load(cls, path: str, symbol: str = None, timeframe: str = None):
+        """Снимок из файла или None (нет файла, другая версия формата, символ или настройки анализа)."""
+        if not os.path.exists(path):
+            return None
+        log_fields = {'symbol': symbol, 'timeframe': timeframe, 'stage': 'incremental'}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Снимок состояния не прочитан (%s): %s", path, e, extra=log_fields)
+            return None
+        if state.get('version') != STATE_VERSION:
+            logger.info("Снимок другой версии формата (%s), пропущен", state.get('version'), extra=log_fields)
+            return None
+        if (symbol and state['symbol'] != symbol) or (timeframe and state['timeframe'] != timeframe):
+            logger.warning("Снимок %s относится к %s %s", path, state['symbol'], state['timeframe'], extra=log_fields)
+            return None
+        if not state['bars'] or not state['fingerprint_times']:
+            logger.info("Снимок без свечей, состояние будет построено заново", extra=log_fields)
+            return None
+        if state['settings'] != settings_fingerprint(state['liquidity']['pip_value'], len(state['bars'])) and \
+                state['settings'] != settings_fingerprint(state['liquidity']['pip_value'], settings.CONTEXT_OUTPUT_SIZE):
+            logger.info("Настройки анализа изменились с момента снимка, состояние будет построено заново",
+                        extra=log_fields)
+            return None
+        analyzer = cls.from_state(state, state_path=path)
+        analyzer._saved_fingerprint = (state['fingerprint'], state['fingerprint_times'])
+        return analyzer
+
+    def catch_up(self, df: pd.DataFrame):
+        """
+        Сверяет отпечаток последних свечей снимка со свечами источника df и подает свечи новее
+        last_time. Возвращает число поданных свечей или None, если данные разошлись.
+        """
+        fingerprint, times = getattr(self, '_saved_fingerprint', (self.fingerprint(), [b[0] for b in
+                                     list(self.bars)[-settings.ANALYZER_STATE_FINGERPRINT_BARS:]]))
+        if df is None:
+            return None
+        source_times = _index_epochs(df.index)
+        overlap = np.isin(source_times, times)
+        if overlap.sum() != len(times) or data_fingerprint(
+                source_times[overlap], df['high'].to_numpy()[overlap], df['low'].to_numpy()[overlap],
+                df['close'].to_numpy()[overlap], self.pip_value) != fingerprint:
+            logger.warning("Отпечаток данных снимка не совпал с источником", extra=self.log_fields)
+            return None
+        return self.on_bars(df)
+
+
+def state_path_for(symbol: str, timeframe: str) -> str:
+    directory = settings.ANALYZER_STATE_DIRECTORY
+    if not os.path.isabs(directory):
+        directory = os.path.join(PROJECT_ROOT, directory)
+    return os.path.join(directory, f"{symbol.replace('/', '_')}_{timeframe}.json")
+
+
+def default_bars_source(symbol: str, timeframe: str, start: pd.Timestamp = None, count: int = None) -> pd.DataFrame:
+    """
+    Закрытые свечи из локального хранилища (core/ohlcv_store.py), если есть файл пары,
+    иначе из Twelve Data (3m собирается из 1min, как в планировщике).
+    """
+    from core.ohlcv_store import OhlcvStore
+    from core.scheduler import API_INTERVALS, last_bar_close, resample_ohlcv
+
+    seconds = settings.SCHEDULER_TIMEFRAMES.get(timeframe)
+    store = OhlcvStore()
+    if store.exists(symbol, timeframe):
+        df = store.open(symbol, timeframe).to_dataframe(start=start)
+        if start is None and count:
+            df = df.iloc[-count:]
+    else:
+        from core.data_fetcher import get_forex_data
+        api_interval, rule = API_INTERVALS.get(timeframe, (timeframe, None))
+        factor = int(pd.Timedelta(rule) / pd.Timedelta(api_interval)) if rule else 1
+        if start is not None:
+            # Twelve Data принимает диапазон только с обеими датами
+            df = get_forex_data(symbol, api_interval, start_date=start.to_pydatetime(),
+                                end_date=pd.Timestamp.now(tz='UTC').to_pydatetime())
+        else:
+            # Больше CHART_HISTORY_MAX_WINDOW_SIZE Twelve Data за один запрос не отдает
+            df = get_forex_data(symbol, api_interval, outputsize=min((count or settings.CONTEXT_OUTPUT_SIZE) * factor,
+                                                                     settings.CHART_HISTORY_MAX_WINDOW_SIZE))
+        if rule and not df.empty:
+            df = resample_ohlcv(df, rule)
+    if seconds and not df.empty:
+        df = df[df.index < pd.Timestamp(last_bar_close(time_module.time(), seconds), unit='s', tz='UTC')]
+    return df
+
+
+def restore_or_build(symbol: str, timeframe: str, bars_source=default_bars_source, path: str = None) -> tuple:
+    """
+    Готовый к работе анализатор: снимок + свечи за время простоя или, если снимка нет или он
+    не совпал с данными, построение с нуля по CONTEXT_OUTPUT_SIZE свечам. Пустой ответ источника
+    (API недоступен) при наличии снимка - работа со снимком без догона; пустое состояние не сохраняется.
+    Возвращает (analyzer, {'restored', 'replayed', 'seconds'}).
+    """
+    started = time_module.perf_counter()
+    path = path or state_path_for(symbol, timeframe)
+    log_fields = {'symbol': symbol, 'timeframe': timeframe, 'stage': 'incremental'}
+    analyzer = IncrementalAnalyzer.load(path, symbol, timeframe)
+    replayed = None
+    if analyzer is not None:
+        first_checked = _timestamp(analyzer._saved_fingerprint[1][0])
+        source = bars_source(symbol, timeframe, start=first_checked)
+        if source is None or source.empty:
+            logger.warning("Источник свечей пуст, анализатор работает со снимком без догона", extra=log_fields)
+            replayed = 0
+        else:
+            replayed = analyzer.catch_up(source)
+    restored = replayed is not None
+    if not restored:
+        analyzer = IncrementalAnalyzer(symbol, timeframe, state_path=path)
+        replayed = analyzer.on_bars(bars_source(symbol, timeframe, count=settings.CONTEXT_OUTPUT_SIZE))
+    if analyzer.save() is None:
+        logger.warning("Источник свечей пуст, снимок не сохранен", extra=log_fields)
+    info = {'restored': restored, 'replayed': replayed, 'seconds': round(time_module.perf_counter() - started, 4)}
+    logger.info("Анализатор готов: %s, свечей подано %d, %.4f с",
+                "снимок восстановлен" if restored else "построен заново", replayed, info['seconds'], extra=log_fields)
+    return analyzer, info
+
+
+class BarEventRouter:
+    """
+    Потребитель очереди core/tick_aggregator.py: событие уходит анализатору своего (символ, таймфрейм),
+    события без анализатора (например, 3m при анализе только 1h) пропускаются.
+    """
+
+    def __init__(self, analyzers=()):
+        self.analyzers = {(analyzer.symbol, analyzer.timeframe): analyzer for analyzer in analyzers}
+
+    @classmethod
+    def restore(cls, symbols: list, timeframes: list, bars_source=default_bars_source):
+        """Анализаторы для запуска: снимок с догоном (restore_or_build) для каждой пары и таймфрейма."""
+        return cls(restore_or_build(symbol, timeframe, bars_source)[0] for symbol in symbols for timeframe in timeframes)
+
+    def on_bar_event(self, event: dict) -> bool:
+        analyzer = self.analyzers.get((event.get('symbol'), event.get('timeframe')))
+        return analyzer is not None and analyzer.on_bar_event(event)
+
+
+def _epoch(ts):
+    return int(ts.timestamp()) if ts is not None else None
+
+
+def _timestamp(epoch):
+    return pd.Timestamp(epoch, unit='s', tz='UTC') if epoch is not None else None
+
+
+def _index_epochs(index: pd.DatetimeIndex) -> np.ndarray:
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.values.astype('datetime64[s]').astype(np.int64)
+
+
+def _point_state(point):
+    if point is None:
+        return None
+    return dict(point, time=_epoch(point['time']))
+
+
+def _point_from_state(state):
+    if state is None:
+        return None
+    return dict(state, time=_timestamp(state['time']))
+
+
+if __name__ == '__main__':
+    import tempfile
+    from benchmarks.synthetic import generate_fx_ohlcv
+    from core.chart_payload import run_chart_analysis
+    from utils.logger import setup_logger
+
+    setup_logger()
+    print("Тестирование incremental.py...")
+    df = generate_fx_ohlcv(settings.CONTEXT_OUTPUT_SIZE + 60, freq='1h', seed=11)
+    window = df.iloc[:settings.CONTEXT_OUTPUT_SIZE]
+
+    # Сверка с пакетным анализом на том же окне
+    analyzer = IncrementalAnalyzer('EUR/USD', '1h')
+    analyzer.on_bars(window)
+    incremental, batch = analyzer.analysis(), run_chart_analysis(window)
+
+    def as_set(points):
+        return {(p['time'], round(float(p['price']), 10), p['type']) for p in points}
+
+    for key in ('structure_points', 'session_points'):
+        print(f"{key}: {len(incremental[key])} / пакетно {len(batch[key])}, "
+              f"совпадает: {as_set(incremental[key]) == as_set(batch[key])}")
+    print("swings совпадают:", as_set(incremental['swings']['highs'] + incremental['swings']['lows']) ==
+          as_set(batch['swings']['highs'] + batch['swings']['lows']))
+    lines_match = len(incremental['trend_lines']) == len(batch['trend_lines']) and all(
+        a['start_time'] == b['start_time'] and np.isclose(a['end_price'], b['end_price'])
+        for a, b in zip(incremental['trend_lines'], batch['trend_lines']))
+    print("trend_lines совпадают:", lines_match, "| контекст:", incremental['overall_context'] == batch['overall_context'])
+
+    # После сдвига окна на 60 свечей - то же сравнение с пакетным анализом нового окна
+    slid = IncrementalAnalyzer('EUR/USD', '1h')
+    slid.on_bars(df)
+    slid_batch = run_chart_analysis(df.iloc[-settings.CONTEXT_OUTPUT_SIZE:])
+    print("После сдвига окна совпадает:", all(as_set(slid.analysis()[key]) == as_set(slid_batch[key])
+                                              for key in ('structure_points', 'session_points')))
+
+    # Снимок -> "простой" 60 свечей -> восстановление с догоном только пропущенных
+    state_file = os.path.join(tempfile.mkdtemp(prefix='incremental_'), 'EUR_USD_1h.json')
+    analyzer.save(state_file)
+    print(f"Снимок: {os.path.getsize(state_file) / 1024:.1f} КБ")
+
+    def bars_source(symbol, timeframe, start=None, count=None):
+        return df[df.index >= start] if start is not None else df.iloc[-count:]
+
+    restored, info = restore_or_build('EUR/USD', '1h', bars_source, path=state_file)
+    print("Восстановление:", info)
+    continuous = IncrementalAnalyzer('EUR/USD', '1h')
+    continuous.on_bars(df)
+    print("Состояние после догона совпадает с непрерывной работой:",
+          as_set(restored.analysis()['structure_points']) == as_set(continuous.analysis()['structure_points']) and
+          as_set(restored.analysis()['session_points']) == as_set(continuous.analysis()['session_points']))
+
+    shifted = df.copy()
+    shifted[['high', 'low', 'close']] += 0.0005
+    _, info = restore_or_build('EUR/USD', '1h', lambda s, t, start=None, count=None: (
+        shifted[shifted.index >= start] if start is not None else shifted.iloc[-count:]), path=state_file)
+    print("Другие данные в источнике - построение заново:", not info['restored'])
@@ -0,0 +1,499 @@
+# ts_logic/kernels.py
+"""
+Ядра для участков с последовательным состоянием: поиск свингов (вложенные сравнения с
+соседями), слияние точек структуры (analyze_market_structure_points) и побарная симуляция
+исполнения лимитных ордеров для бэктеста.
+
+Бэкенд выбирается при импорте (KERNELS_BACKEND): numba, если пакет установлен, иначе numpy.
+Для numba исходные циклы компилируются как есть (cache=True - компиляция сохраняется между
+запусками); без нее исполнение ордеров - поиск по массивам для каждого ордера, слияние
+структуры - тот же цикл на Python (векторизовать его нельзя: каждая точка зависит от последней
+оставленной). Свинги при auto считаются сдвигами массивов - это быстрее и цикла numba; цикл numba
+для них включается только явным KERNELS_BACKEND=numba.
+Результаты бэкендов совпадают - проверка в check_parity() (python -m ts_logic.kernels).
+"""
+import importlib.util
+import threading
+
+import numpy as np
+import pandas as pd
+
+from configs import settings
+from utils.logger import get_logger
+
+# numba импортируется при первом вызове ядра numba (~0.2 с), а не при импорте модуля
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+logger = get_logger(__name__)
+
+BACKEND_NUMBA = 'numba'
+BACKEND_NUMPY = 'numpy'
+
+# Коды типов точек структуры: 'H' в названии (H, HH, LH, HL) - "максимумы" для слияния,
+# как проверка 'H' in type в analyze_market_structure_points
+STRUCTURE_TYPES = ('H', 'HH', 'LH', 'HL', 'L', 'LL')
+_LAST_HIGH_TYPE_CODE = 3
+
+OUTCOME_NOT_FILLED = 0
+OUTCOME_TAKE = 1
+OUTCOME_STOP = 2
+OUTCOME_OPEN = 3
+OUTCOMES = ('not_filled', 'take', 'stop', 'open')
+
+_EXIT_SEARCH_WINDOW = 64
+
+
+def available_backends() -> list:
+    return [BACKEND_NUMPY] + ([BACKEND_NUMBA] if NUMBA_AVAILABLE else [])
+
+
+def _select_backend(requested: str) -> str:
+    if requested == BACKEND_NUMBA and not NUMBA_AVAILABLE:
+        logger.warning("KERNELS_BACKEND=numba, но пакет numba не установлен - используется numpy",
+                       extra={'stage': 'kernels'})
+    if requested in ('auto', BACKEND_NUMBA) and NUMBA_AVAILABLE:
+        return BACKEND_NUMBA
+    return BACKEND_NUMPY
+
+
+BACKEND = _select_backend(settings.KERNELS_BACKEND)
+# Свинги: сдвиги numpy быстрее цикла numba, поэтому цикл - только по явному выбору numba
+SWING_BACKEND = BACKEND if settings.KERNELS_BACKEND == BACKEND_NUMBA else BACKEND_NUMPY
+
+
+# --- циклы (исходник для numba и эталон для проверки) ---
+
+def _swing_flags_loop(high, low, n):
+    size = high.shape[0]
+    is_high = np.zeros(size, dtype=np.bool_)
+    is_low = np.zeros(size, dtype=np.bool_)
+    for i in range(n, size - n):
+        current = high[i]
+        swing = True
+        for j in range(1, n + 1):
+            if current <= high[i - j] or current <= high[i + j]:
+                swing = False
+                break
+        is_high[i] = swing
+        current = low[i]
+        swing = True
+        for j in range(1, n + 1):
+            if current >= low[i - j] or current >= low[i + j]:
+                swing = False
+                break
+        is_low[i] = swing
+    return is_high, is_low
+
+
+def _structure_merge_loop(times, prices, is_high):
+    """Свинги по времени (на одной свече максимум первым) -> (индексы оставленных точек, коды типов всех)."""
+    count = prices.shape[0]
+    codes = np.empty(count, dtype=np.int8)
+    last_h = 0.0
+    last_l = 0.0
+    have_h = False
+    have_l = False
+    for i in range(count):
+        price = prices[i]
+        if is_high[i]:
+            if not have_h or price == last_h:
+                codes[i] = 0
+            elif price > last_h:
+                codes[i] = 1
+            elif price < last_h:
+                codes[i] = 2
+            else:
+                codes[i] = 0
+            last_h = price
+            have_h = True
+        else:
+            if not have_l or price == last_l:
+                codes[i] = 4
+            elif price < last_l:
+                codes[i] = 5
+            elif price > last_l:
+                codes[i] = 3
+            else:
+                codes[i] = 4
+            last_l = price
+            have_l = True
+
+    kept = np.empty(count, dtype=np.int64)
+    if count == 0:
+        return kept, codes
+    kept[0] = 0
+    k = 1
+    for i in range(1, count):
+        p = kept[k - 1]
+        prev_high = codes[p] <= _LAST_HIGH_TYPE_CODE
+        curr_high = codes[i] <= _LAST_HIGH_TYPE_CODE
+        if prev_high == curr_high:
+            if (curr_high and prices[i] >= prices[p]) or (not curr_high and prices[i] <= prices[p]):
+                kept[k - 1] = i
+            elif times[i] > times[p] and codes[p] != codes[i]:
+                kept[k] = i
+                k += 1
+        else:
+            kept[k] = i
+            k += 1
+    return kept[:k], codes
+
+
+def _simulate_fills_loop(open_, high, low, start, side, entry, stop, take, expiry):
+    """
+    Лимитные ордера по свечам: вход, когда цена дошла до entry (гэп через уровень - по open),
+    затем выход по stop или take. Если на одной свече задеты оба уровня - считается стоп
+    (консервативно); на свече входа гэп по open для выхода не учитывается.
+    """
+    count = start.shape[0]
+    size = high.shape[0]
+    fill_index = np.full(count, -1, dtype=np.int64)
+    fill_price = np.full(count, np.nan)
+    exit_index = np.full(count, -1, dtype=np.int64)
+    exit_price = np.full(count, np.nan)
+    outcome = np.zeros(count, dtype=np.int8)
+    for k in range(count):
+        last_entry_bar = size - 1
+        if expiry[k] > 0:
+            last_entry_bar = min(size - 1, start[k] + expiry[k] - 1)
+        filled = False
+        for i in range(start[k], size):
+            if not filled:
+                if i > last_entry_bar:
+                    break
+                if side[k] > 0 and low[i] <= entry[k]:
+                    fill_price[k] = open_[i] if open_[i] <= entry[k] else entry[k]
+                elif side[k] < 0 and high[i] >= entry[k]:
+                    fill_price[k] = open_[i] if open_[i] >= entry[k] else entry[k]
+                else:
+                    continue
+                filled = True
+                fill_index[k] = i
+                outcome[k] = OUTCOME_OPEN
+            gap = i > fill_index[k]
+            if side[k] > 0:
+                if low[i] <= stop[k]:
+                    exit_price[k] = open_[i] if gap and open_[i] <= stop[k] else stop[k]
+                    outcome[k] = OUTCOME_STOP
+                elif high[i] >= take[k]:
+                    exit_price[k] = open_[i] if gap and open_[i] >= take[k] else take[k]
+                    outcome[k] = OUTCOME_TAKE
+            else:
+                if high[i] >= stop[k]:
+                    exit_price[k] = open_[i] if gap and open_[i] >= stop[k] else stop[k]
+                    outcome[k] = OUTCOME_STOP
+                elif low[i] <= take[k]:
+                    exit_price[k] = open_[i] if gap and open_[i] <= take[k] else take[k]
+                    outcome[k] = OUTCOME_TAKE
+            if outcome[k] != OUTCOME_OPEN:
+                exit_index[k] = i
+                break
+    return fill_index, fill_price, exit_index, exit_price, outcome
+
+
+# --- numpy-варианты ---
+
+def _swing_flags_numpy(high, low, n):
+    size = high.shape[0]
+    is_high = np.zeros(size, dtype=np.bool_)
+    is_low = np.zeros(size, dtype=np.bool_)
+    if size < 2 * n + 1:
+        return is_high, is_low
+    center = slice(n, size - n)
+    swing_high = np.ones(size - 2 * n, dtype=np.bool_)
+    swing_low = np.ones(size - 2 * n, dtype=np.bool_)
+    for j in range(1, n + 1):
+        before = slice(n - j, size - n - j)
+        after = slice(n + j, size - n + j)
+        # ~(a <= b), а не a > b: NaN у соседа свинг не отменяет - как в цикле find_swing_points
+        swing_high &= ~(high[center] <= high[before]) & ~(high[center] <= high[after])
+        swing_low &= ~(low[center] >= low[before]) & ~(low[center] >= low[after])
+    is_high[center] = swing_high
+    is_low[center] = swing_low
+    return is_high, is_low
+
+
+def _structure_merge_python(times, prices, is_high):
+    # Тот же цикл на списках Python: поэлементный доступ к ним быстрее, чем к массивам numpy
+    kept, codes = _structure_merge_lists(times.tolist(), prices.tolist(), is_high.tolist())
+    return np.asarray(kept, dtype=np.int64), np.asarray(codes, dtype=np.int8)
+
+
+def _structure_merge_lists(times, prices, is_high):
+    codes = []
+    last_h = last_l = None
+    for price, high_swing in zip(prices, is_high):
+        if high_swing:
+            if last_h is None or price == last_h: code = 0
+            elif price > last_h: code = 1
+            elif price < last_h: code = 2
+            else: code = 0
+            last_h = price
+        else:
+            if last_l is None or price == last_l: code = 4
+            elif price < last_l: code = 5
+            elif price > last_l: code = 3
+            else: code = 4
+            last_l = price
+        codes.append(code)
+    if not codes:
+        return [], codes
+    kept = [0]
+    for i in range(1, len(codes)):
+        p = kept[-1]
+        prev_high = codes[p] <= _LAST_HIGH_TYPE_CODE
+        curr_high = codes[i] <= _LAST_HIGH_TYPE_CODE
+        if prev_high == curr_high:
+            if (curr_high and prices[i] >= prices[p]) or (not curr_high and prices[i] <= prices[p]):
+                kept[-1] = i
+            elif times[i] > times[p] and codes[p] != codes[i]:
+                kept.append(i)
+        else:
+            kept.append(i)
+    return kept, codes
+
+
+def _simulate_fills_numpy(open_, high, low, start, side, entry, stop, take, expiry):
+    count = start.shape[0]
+    size = high.shape[0]
+    fill_index = np.full(count, -1, dtype=np.int64)
+    fill_price = np.full(count, np.nan)
+    exit_index = np.full(count, -1, dtype=np.int64)
+    exit_price = np.full(count, np.nan)
+    outcome = np.zeros(count, dtype=np.int8)
+    for k in range(count):
+        first = start[k]
+        last = size if expiry[k] <= 0 else min(size, first + expiry[k])
+        if first >= last:
+            continue
+        long_side = side[k] > 0
+        touched = low[first:last] <= entry[k] if long_side else high[first:last] >= entry[k]
+        hits = np.flatnonzero(touched)
+        if not len(hits):
+            continue
+        f = first + hits[0]
+        gapped = open_[f] <= entry[k] if long_side else open_[f] >= entry[k]
+        fill_index[k] = f
+        fill_price[k] = open_[f] if gapped else entry[k]
+        outcome[k] = OUTCOME_OPEN
+        stop_at = take_at = size
+        # Выход ищется окнами растущей длины: сделка обычно закрывается за десятки свечей,
+        # а просмотр всего хвоста истории на каждый ордер делает бэктест квадратичным
+        window_start, window = f, _EXIT_SEARCH_WINDOW
+        while window_start < size and stop_at == size and take_at == size:
+            window_end = min(size, window_start + window)
+            if long_side:
+                stop_hits = np.flatnonzero(low[window_start:window_end] <= stop[k])
+                take_hits = np.flatnonzero(high[window_start:window_end] >= take[k])
+            else:
+                stop_hits = np.flatnonzero(high[window_start:window_end] >= stop[k])
+                take_hits = np.flatnonzero(low[window_start:window_end] <= take[k])
+            if len(stop_hits):
+                stop_at = window_start + stop_hits[0]
+            if len(take_hits):
+                take_at = window_start + take_hits[0]
+            window_start, window = window_end, window * 2
+        if stop_at == size and take_at == size:
+            continue
+        i = min(stop_at, take_at)
+        level = stop[k] if stop_at <= take_at else take[k]
+        outcome[k] = OUTCOME_STOP if stop_at <= take_at else OUTCOME_TAKE
+        if i > f:
+            beyond = (open_[i] <= level) if long_side == (outcome[k] == OUTCOME_STOP) else (open_[i] >= level)
+            exit_price[k] = open_[i] if beyond else level
+        else:
+            exit_price[k] = level
+        exit_index[k] = i
+    return fill_index, fill_price, exit_index, exit_price, outcome
+
+
+_KERNELS = {
+    BACKEND_NUMPY: {'swing_flags': _swing_flags_numpy, 'structure_merge': _structure_merge_python,
+                    'simulate_fills': _simulate_fills_numpy},
+}
+_kernels_lock = threading.Lock()
+
+
+def _compile_numba() -> dict:
+    import numba
+    jit = numba.njit(cache=settings.KERNELS_NUMBA_CACHE, nogil=True)
+    return {'swing_flags': jit(_swing_flags_loop),
+            'structure_merge': jit(_structure_merge_loop),
+            'simulate_fills': jit(_simulate_fills_loop)}
+
+
+def _kernel(name: str, backend: str = None):
+    backend = backend or BACKEND
+    if backend not in _KERNELS:
+        with _kernels_lock:
+            if backend not in _KERNELS:
+                _KERNELS[backend] = _compile_numba()
+    return _KERNELS[backend][name]
+
+
+# --- интерфейс ---
+
+def swing_flags(high, low, n: int = settings.SWING_POINT_N, backend: str = None) -> tuple:
+    """
+    (is_high, is_low): свеча строго выше (ниже) n соседей с каждой стороны - как find_swing_points.
+    По умолчанию - SWING_BACKEND: при auto numpy и с установленной numba (2n сдвигов массива
+    быстрее скомпилированного цикла: на 1 млн свечей ~11 мс против ~26 мс), цикл numba - при
+    KERNELS_BACKEND=numba или backend='numba'.
+    """
+    high = np.ascontiguousarray(high, dtype=np.float64)
+    low = np.ascontiguousarray(low, dtype=np.float64)
+    return _kernel('swing_flags', backend or SWING_BACKEND)(high, low, n)
+
+
+def market_structure_points(swing_highs: list, swing_lows: list, backend: str = None) -> list:
+    """Результат analyze_market_structure_points (те же словари time/price/type) через ядро слияния."""
+    swings = swing_highs + swing_lows
+    if not swings:
+        return []
+    times = pd.DatetimeIndex([s['time'] for s in swings]).asi8
+    # Устойчивая сортировка по времени: на одной свече максимум раньше минимума, как в исходнике
+    order = np.argsort(times, kind='stable')
+    is_high = np.zeros(len(swings), dtype=np.bool_)
+    is_high[:len(swing_highs)] = True
+    prices = np.array([s['price'] for s in swings], dtype=np.float64)
+    kept, codes = _kernel('structure_merge', backend)(times[order], prices[order], is_high[order])
+    return [{'time': swings[order[i]]['time'], 'price': swings[order[i]]['price'], 'type': STRUCTURE_TYPES[codes[i]]}
+            for i in kept]
+
+
+def simulate_fills(df: pd.DataFrame, orders: list, pip_value: float = settings.PIP_VALUE_DEFAULT,
+                   backend: str = None) -> list:
+    """
+    Исполнение лимитных ордеров по свечам df. Ордер: time (активен с первой свечи с этим временем
+    или позже), side ('long'/'short'), entry, stop, take, expiry_bars (0 - без срока).
+    Возвращает на ордер: fill_time, fill_price, exit_time, exit_price, outcome, pnl_pips.
+    """
+    if not orders or df is None or df.empty:
+        return [dict(order, fill_time=None, fill_price=None, exit_time=None, exit_price=None,
+                     outcome=OUTCOMES[OUTCOME_NOT_FILLED], pnl_pips=None) for order in orders or []]
+    start = df.index.searchsorted(pd.DatetimeIndex([order['time'] for order in orders]), side='left').astype(np.int64)
+    side = np.array([1 if order['side'] == 'long' else -1 for order in orders], dtype=np.int64)
+    arrays = [np.array([order[key] for order in orders], dtype=np.float64) for key in ('entry', 'stop', 'take')]
+    expiry = np.array([order.get('expiry_bars', 0) for order in orders], dtype=np.int64)
+    fill_index, fill_price, exit_index, exit_price, outcome = _kernel('simulate_fills', backend)(
+        np.ascontiguousarray(df['open'].to_numpy(dtype=np.float64)),
+        np.ascontiguousarray(df['high'].to_numpy(dtype=np.float64)),
+        np.ascontiguousarray(df['low'].to_numpy(dtype=np.float64)),
+        start, side, *arrays, expiry)
+    results = []
+    for k, order in enumerate(orders):
+        closed = exit_index[k] >= 0
+        results.append(dict(
+            order,
+            fill_time=df.index[fill_index[k]] if fill_index[k] >= 0 else None,
+            fill_price=float(fill_price[k]) if fill_index[k] >= 0 else None,
+            exit_time=df.index[exit_index[k]] if closed else None,
+            exit_price=float(exit_price[k]) if closed else None,
+            outcome=OUTCOMES[outcome[k]],
+            pnl_pips=round(float((exit_price[k] - fill_price[k]) * side[k] / pip_value), 1) if closed else None,
+        ))
+    return results
+
+
+def setup_orders(session_points: list, activate_at: pd.Timestamp, pip_value: float = settings.PIP_VALUE_DEFAULT,
+                 stop_pips: float = settings.BACKTEST_STOP_PIPS, reward_risk: float = settings.BACKTEST_REWARD_RISK,
+                 expiry_bars: int = settings.BACKTEST_ORDER_EXPIRY_BARS) -> list:
+    """
+    Лимитные ордера от уровней сетапов: SETUP_Resist - продажа от уровня, SETUP_Support - покупка;
+    стоп за уровнем на stop_pips, тейк - reward_risk стопов. activate_at - время первой свечи
+    после анализа, нашедшего сетап (раньше сетап неизвестен).
+    """
+    orders = []
+    for point in session_points:
+        if point.get('session') != 'Setup':
+            continue
+        direction = -1 if point['type'] == 'SETUP_Resist' else 1
+        risk = stop_pips * pip_value
+        orders.append({
+            'time': activate_at,
+            'setup_time': point['time'],
+            'type': point['type'],
+            'side': 'short' if direction < 0 else 'long',
+            'entry': float(point['price']),
+            'stop': float(point['price']) - direction * risk,
+            'take': float(point['price']) + direction * risk * reward_risk,
+            'expiry_bars': expiry_bars,
+        })
+    return orders
+
+
+def check_parity(bars: int = 20000, seed: int = 3) -> dict:
+    """Сверка бэкендов между собой и с исходными find_swing_points / analyze_market_structure_points."""
+    from benchmarks.synthetic import generate_fx_ohlcv
+    from ts_logic.context_analyzer_1h import _analyze_market_structure_points_loop
+
+    df = generate_fx_ohlcv(bars, freq='1h', seed=seed)
+    high, low = df['high'].to_numpy(), df['low'].to_numpy()
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.integers(0, bars - 10, 500))
+    orders = []
+    for s in starts:
+        price = float(df['close'].iloc[s])
+        direction = 1 if rng.random() < 0.5 else -1
+        entry = price - direction * rng.uniform(0, 20) * settings.PIP_VALUE_DEFAULT
+        orders.append({'time': df.index[s], 'side': 'long' if direction > 0 else 'short', 'entry': entry,
+                       'stop': entry - direction * 15 * settings.PIP_VALUE_DEFAULT,
+                       'take': entry + direction * 30 * settings.PIP_VALUE_DEFAULT,
+                       'expiry_bars': int(rng.integers(0, 48))})
+
+    reference_flags = _swing_flags_loop(np.asarray(high, dtype=np.float64), np.asarray(low, dtype=np.float64),
+                                        settings.SWING_POINT_N)
+    reference_fills = _simulate_fills_loop(df['open'].to_numpy(), high, low,
+                                           df.index.searchsorted(pd.DatetimeIndex([o['time'] for o in orders])).astype(np.int64),
+                                           np.array([1 if o['side'] == 'long' else -1 for o in orders]),
+                                           *[np.array([o[key] for o in orders]) for key in ('entry', 'stop', 'take')],
+                                           np.array([o['expiry_bars'] for o in orders]))
+    results = {}
+    for backend in available_backends():
+        flags = swing_flags(high, low, settings.SWING_POINT_N, backend=backend)
+        swing_highs = [{'time': df.index[i], 'price': high[i], 'type': 'H_SWING'} for i in np.flatnonzero(flags[0])]
+        swing_lows = [{'time': df.index[i], 'price': low[i], 'type': 'L_SWING'} for i in np.flatnonzero(flags[1])]
+        structure = market_structure_points(swing_highs, swing_lows, backend=backend)
+        fills = simulate_fills(df, orders, backend=backend)
+        results[backend] = {
+            'swings': all(np.array_equal(a, b) for a, b in zip(flags, reference_flags)),
+            'structure': structure == _analyze_market_structure_points_loop(swing_highs, swing_lows),
+            'fills': [r['outcome'] for r in fills] == [OUTCOMES[o] for o in reference_fills[4]] and
+                     np.allclose([r['exit_price'] or np.nan for r in fills], reference_fills[3], equal_nan=True),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    import time as time_module
+    from benchmarks.synthetic import generate_fx_ohlcv
+    from ts_logic.context_analyzer_1h import _analyze_market_structure_points_loop
+    from utils.logger import setup_logger
+
+    setup_logger()
+    print(f"Тестирование kernels.py (бэкенд по умолчанию: {BACKEND}, доступны: {', '.join(available_backends())})...")
+    print("Совпадение с эталоном:", check_parity())
+
+    df = generate_fx_ohlcv(1000000, freq='1h', seed=1)
+    high, low = df['high'].to_numpy(), df['low'].to_numpy()
+    flags = swing_flags(high, low)
+    swing_highs = [{'time': df.index[i], 'price': high[i], 'type': 'H_SWING'} for i in np.flatnonzero(flags[0])]
+    swing_lows = [{'time': df.index[i], 'price': low[i], 'type': 'L_SWING'} for i in np.flatnonzero(flags[1])]
+    rng = np.random.default_rng(1)
+    orders = [{'time': df.index[s], 'side': 'long', 'entry': float(df['close'].iloc[s]) - 0.0005,
+               'stop': float(df['close'].iloc[s]) - 0.0020, 'take': float(df['close'].iloc[s]) + 0.0025,
+               'expiry_bars': 24} for s in np.sort(rng.integers(0, len(df) - 1, 20000))]
+
+    def timed(func, *args, **kwargs):
+        func(*args, **kwargs)  # прогрев (компиляция numba)
+        started = time_module.perf_counter()
+        func(*args, **kwargs)
+        return (time_module.perf_counter() - started) * 1000
+
+    print(f"1 000 000 свечей, {len(swing_highs) + len(swing_lows)} свингов, {len(orders)} ордеров:")
+    print(f"  исходные циклы: свинги {timed(_swing_flags_loop, high, low, settings.SWING_POINT_N):.0f} мс, "
+          f"структура {timed(_analyze_market_structure_points_loop, swing_highs, swing_lows):.0f} мс")
+    for backend in available_backends():
+        print(f"  {backend}: свинги {timed(swing_flags, high, low, backend=backend):.1f} мс, "
+              f"структура {timed(market_structure_points, swing_highs, swing_lows, backend=backend):.0f} мс, "
+              f"ордера {timed(simulate_fills, df, orders, backend=backend):.0f} мс")
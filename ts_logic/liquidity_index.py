@@ -0,0 +1,392 @@
+# ts_logic/liquidity_index.py
+"""
+Индекс уровней ликвидности: сессионные фракталы (Азия, NY) за длинный период в массивах,
+отсортированных по цене, с состоянием "снят / не тронут".
+
+Индекс обновляется по одной закрытой свече (update): свеча снимает нетронутые уровни,
+до которых дошла (high >= цены фрактала максимума, low <= цены фрактала минимума), и
+подтверждает фрактал сессии, если справа набралось SESSION_FRACTAL_N свечей той же сессии
+(как find_swing_points на свечах сессии). Нетронутые максимумы отсортированы по цене, поэтому
+снятые свечой - это префикс массива, а нетронутые минимумы - суффикс: стоимость свечи
+O(log n + k), где k - число снятых уровней.
+
+Запросы по цене (levels_in_range, levels_near, confluence) - bisect по отсортированному
+массиву и проход по k найденным уровням: O(log n + k).
+"""
+import bisect
+import json
+import os
+from datetime import time, timedelta
+
+import pandas as pd
+
+from configs import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Параметры индекса, при смене которых сохраненное состояние не годится
+_STATE_PARAMETERS = ('pip_value', 'n', 'lookback_days', 'sessions')
+
+SIDE_HIGH = 'H'
+SIDE_LOW = 'L'
+SESSION_ASIA = 'Asia'
+SESSION_NY = 'NY'
+_TYPE_SUFFIXES = {SESSION_ASIA: '_AS', SESSION_NY: '_NY'}
+
+
+def default_sessions() -> dict:
+    """Сессии из settings (UTC): имя -> (начало, конец), границы включительно, как в get_candles_for_session."""
+    return {
+        SESSION_ASIA: (time(settings.ASIAN_SESSION_START_HOUR_UTC, settings.ASIAN_SESSION_START_MINUTE_UTC),
+                       time(settings.ASIAN_SESSION_END_HOUR_UTC, settings.ASIAN_SESSION_END_MINUTE_UTC)),
+        SESSION_NY: (time(settings.NY_SESSION_START_HOUR_UTC, settings.NY_SESSION_START_MINUTE_UTC),
+                     time(settings.NY_SESSION_END_HOUR_UTC, settings.NY_SESSION_END_MINUTE_UTC)),
+    }
+
+
+def session_of(ts: pd.Timestamp, sessions: dict) -> tuple:
+    """
+    (сессия, дата начала сессии) для свечи или (None, None). Сессия через полночь
+    (22:00-06:00) относится к дате своего начала.
+    """
+    moment = ts.time()
+    for name, (start, end) in sessions.items():
+        if start <= end:
+            if start <= moment <= end:
+                return name, ts.date()
+        elif moment >= start:
+            return name, ts.date()
+        elif moment <= end:
+            return name, ts.date() - timedelta(days=1)
+    return None, None
+
+
+class _SortedLevels:
+    """Уровни одной стороны, отсортированные по цене: параллельные списки цен и словарей уровней."""
+
+    __slots__ = ('prices', 'levels')
+
+    def __init__(self):
+        self.prices = []
+        self.levels = []
+
+    def __len__(self):
+        return len(self.prices)
+
+    def insert(self, level: dict):
+        i = bisect.bisect_right(self.prices, level['price'])
+        self.prices.insert(i, level['price'])
+        self.levels.insert(i, level)
+
+    def bounds(self, low: float, high: float) -> tuple:
+        return bisect.bisect_left(self.prices, low), bisect.bisect_right(self.prices, high)
+
+    def pop_range(self, i: int, j: int) -> list:
+        popped = self.levels[i:j]
+        del self.prices[i:j]
+        del self.levels[i:j]
+        return popped
+
+    def keep(self, predicate):
+        kept = [level for level in self.levels if predicate(level)]
+        self.levels = kept
+        self.prices = [level['price'] for level in kept]
+
+
+class LiquidityIndex:
+    """
+    Сессионные фракталы за lookback_days с состоянием снятия. Уровень - словарь в формате
+    точек analyze_fractal_setups плюс сторона и время снятия:
+        {'time', 'price', 'type': 'F_H_AS'|'F_L_NY'..., 'session': 'Asia'|'NY', 'side': 'H'|'L',
+         'swept_at': pd.Timestamp | None}
+    Свечи подаются строго по времени и только закрытые.
+    """
+
+    def __init__(self, pip_value: float = settings.PIP_VALUE_DEFAULT, n: int = None,
+                 lookback_days: float = settings.LIQUIDITY_LOOKBACK_DAYS, sessions: dict = None):
+        self.pip_value = pip_value
+        self.n = n if n is not None else settings.SESSION_FRACTAL_N
+        self.lookback = pd.Timedelta(days=lookback_days) if lookback_days else None
+        self.sessions = sessions or default_sessions()
+        self.last_time = None
+        self._all = {SIDE_HIGH: _SortedLevels(), SIDE_LOW: _SortedLevels()}
+        self._untouched = {SIDE_HIGH: _SortedLevels(), SIDE_LOW: _SortedLevels()}
+        self._by_time = []  # все уровни в порядке образования (для выборки по дням)
+        self._times = []
+        self._session_key = None
+        self._session_bars = []  # (time, high, low) свечей текущей сессии, не больше 2n+1
+        self.confirmed = []  # уровни, подтвержденные последней свечой
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, pip_value: float = settings.PIP_VALUE_DEFAULT, **kwargs):
+        """Индекс по истории df (все свечи закрытые)."""
+        index = cls(pip_value, **kwargs)
+        index.update_from_dataframe(df)
+        return index
+
+    def __len__(self):
+        return len(self._all[SIDE_HIGH]) + len(self._all[SIDE_LOW])
+
+    def untouched_count(self) -> int:
+        return len(self._untouched[SIDE_HIGH]) + len(self._untouched[SIDE_LOW])
+
+    def update_from_dataframe(self, df: pd.DataFrame) -> int:
+        """Подает свечи df новее last_time; возвращает число обработанных свечей."""
+        if df is None or df.empty:
+            return 0
+        if self.last_time is not None:
+            df = df[df.index > self.last_time]
+        for ts, high, low in zip(df.index, df['high'].to_numpy(), df['low'].to_numpy()):
+            self.update(ts, high, low)
+        return len(df)
+
+    def update(self, ts: pd.Timestamp, high: float, low: float) -> list:
+        """Одна закрытая свеча: снятие уровней и подтверждение фрактала. Возвращает снятые уровни."""
+        if self.last_time is not None and ts <= self.last_time:
+            raise ValueError(f"свечи должны идти по времени: {ts} <= {self.last_time}")
+        if self.last_time is not None and self.lookback is not None and ts.date() != self.last_time.date():
+            self.prune(ts - self.lookback)
+        self.last_time = ts
+        self.confirmed = []
+        swept = self._sweep(ts, float(high), float(low))
+
+        session, session_date = session_of(ts, self.sessions)
+        if session is None:
+            self._session_key, self._session_bars = None, []
+            return swept
+        if (session, session_date) != self._session_key:
+            self._session_key, self._session_bars = (session, session_date), []
+        self._session_bars.append((ts, float(high), float(low)))
+        if len(self._session_bars) > 2 * self.n + 1:
+            del self._session_bars[0]
+        if len(self._session_bars) == 2 * self.n + 1:
+            self._confirm_fractal(session)
+        return swept
+
+    def _sweep(self, ts: pd.Timestamp, high: float, low: float) -> list:
+        highs, lows = self._untouched[SIDE_HIGH], self._untouched[SIDE_LOW]
+        swept = highs.pop_range(0, bisect.bisect_right(highs.prices, high))
+        swept += lows.pop_range(bisect.bisect_left(lows.prices, low), len(lows))
+        for level in swept:
+            level['swept_at'] = ts
+        return swept
+
+    def _confirm_fractal(self, session: str):
+        """Средняя свеча окна 2n+1 строго выше (ниже) соседей - фрактал, как в find_swing_points."""
+        center_time, center_high, center_low = self._session_bars[self.n]
+        neighbours = self._session_bars[:self.n] + self._session_bars[self.n + 1:]
+        suffix = _TYPE_SUFFIXES.get(session, '')
+        if all(center_high > h for _, h, _ in neighbours):
+            self._add({'time': center_time, 'price': center_high, 'type': f'F_H{suffix}', 'session': session,
+                       'side': SIDE_HIGH, 'swept_at': None})
+        if all(center_low < l for _, _, l in neighbours):
+            self._add({'time': center_time, 'price': center_low, 'type': f'F_L{suffix}', 'session': session,
+                       'side': SIDE_LOW, 'swept_at': None})
+
+    def _add(self, level: dict):
+        self._all[level['side']].insert(level)
+        if level['swept_at'] is None:
+            self._untouched[level['side']].insert(level)
+        self._by_time.append(level)
+        self._times.append(level['time'])
+        self.confirmed.append(level)
+
+    def prune(self, before: pd.Timestamp):
+        """Удаляет уровни, образованные раньше before (O(n), вызывается раз в день)."""
+        for side in (SIDE_HIGH, SIDE_LOW):
+            self._all[side].keep(lambda level: level['time'] >= before)
+            self._untouched[side].keep(lambda level: level['time'] >= before)
+        i = bisect.bisect_left(self._times, before)
+        del self._by_time[:i]
+        del self._times[:i]
+
+    def levels_between(self, start: pd.Timestamp, end: pd.Timestamp = None, session: str = None) -> list:
+        """Уровни, образованные в [start, end), в порядке времени: O(log n + k)."""
+        i = bisect.bisect_left(self._times, start)
+        j = len(self._times) if end is None else bisect.bisect_left(self._times, end)
+        return [level for level in self._by_time[i:j] if session is None or level['session'] == session]
+
+    def to_state(self) -> dict:
+        """Состояние для JSON (ts_logic/incremental.py: снимок анализатора): время - epoch-секунды."""
+        return {
+            'pip_value': self.pip_value,
+            'n': self.n,
+            'lookback_days': self.lookback / pd.Timedelta(days=1) if self.lookback is not None else None,
+            'sessions': {name: [start.strftime('%H:%M'), end.strftime('%H:%M')]
+                         for name, (start, end) in self.sessions.items()},
+            'last_time': _epoch(self.last_time),
+            'levels': [dict(level, time=_epoch(level['time']), swept_at=_epoch(level['swept_at']))
+                       for level in self._by_time],
+            'session_key': [self._session_key[0], self._session_key[1].isoformat()] if self._session_key else None,
+            'session_bars': [[_epoch(t), h, l] for t, h, l in self._session_bars],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        sessions = {name: (time.fromisoformat(start), time.fromisoformat(end))
+                    for name, (start, end) in state['sessions'].items()}
+        index = cls(state['pip_value'], n=state['n'], lookback_days=state['lookback_days'], sessions=sessions)
+        index.last_time = _timestamp(state['last_time'])
+        for level in state['levels']:
+            index._add(dict(level, time=_timestamp(level['time']), swept_at=_timestamp(level['swept_at'])))
+        index.confirmed = []
+        if state['session_key']:
+            index._session_key = (state['session_key'][0], pd.Timestamp(state['session_key'][1]).date())
+        index._session_bars = [(_timestamp(t), h, l) for t, h, l in state['session_bars']]
+        return index
+
+    def save(self, path: str) -> str:
+        """Атомарная запись состояния (временный файл + os.replace), как снимок ts_logic/incremental.py."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_state(), f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str, pip_value: float = settings.PIP_VALUE_DEFAULT, **kwargs):
+        """Индекс из файла или None (нет файла, файл поврежден, изменились пипс, N, сессии или глубина)."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Состояние индекса ликвидности не прочитано (%s): %s", path, e, extra={'stage': 'liquidity'})
+            return None
+        expected = cls(pip_value, **kwargs).to_state()
+        if any(state.get(name) != expected[name] for name in _STATE_PARAMETERS):
+            logger.info("Настройки индекса ликвидности изменились, состояние %s не используется", path,
+                        extra={'stage': 'liquidity'})
+            return None
+        return cls.from_state(state)
+
+    def levels_in_range(self, low: float, high: float, side: str = None, session: str = None,
+                        untouched: bool = True, as_of: pd.Timestamp = None) -> list:
+        """
+        Уровни с ценой в [low, high], по возрастанию цены. untouched=True - только нетронутые:
+        без as_of - на последнюю свечу; с as_of - образованные до as_of и не снятые раньше as_of
+        (состояние на момент as_of, для оценки сетапа в прошлом).
+        """
+        found = []
+        for s in ((side,) if side else (SIDE_HIGH, SIDE_LOW)):
+            levels = self._untouched[s] if untouched and as_of is None else self._all[s]
+            i, j = levels.bounds(low, high)
+            for level in levels.levels[i:j]:
+                if session is not None and level['session'] != session:
+                    continue
+                if as_of is not None:
+                    if level['time'] >= as_of:
+                        continue
+                    if untouched and level['swept_at'] is not None and level['swept_at'] < as_of:
+                        continue
+                found.append(level)
+        if side is None:
+            found.sort(key=lambda level: level['price'])
+        return found
+
+    def levels_near(self, price: float, within_pips: float = settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS,
+                    **filters) -> list:
+        """Уровни в пределах within_pips от price, ближайшие первыми."""
+        distance = within_pips * self.pip_value
+        levels = self.levels_in_range(price - distance, price + distance, **filters)
+        return sorted(levels, key=lambda level: abs(level['price'] - price))
+
+    def confluence(self, price: float, within_pips: float = settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS,
+                   **filters) -> dict:
+        """Сколько уровней сходится у цены: всего, по сессиям и сторонам, плюс сами уровни."""
+        levels = self.levels_near(price, within_pips, **filters)
+        by_session, by_side = {}, {}
+        for level in levels:
+            by_session[level['session']] = by_session.get(level['session'], 0) + 1
+            by_side[level['side']] = by_side.get(level['side'], 0) + 1
+        return {'price': price, 'count': len(levels), 'sessions': by_session, 'sides': by_side, 'levels': levels}
+
+    def setups_for(self, asian_fractal: dict, within_pips: float = settings.FRACTAL_PROXIMITY_THRESHOLD_PIPS,
+                   exclude_times: set = None) -> list:
+        """
+        Точки сетапов для азиатского фрактала (формат analyze_fractal_setups) против всех
+        нетронутых на момент фрактала уровней NY той же стороны за lookback. exclude_times -
+        время NY-фракталов, уже сопоставленных обычным проходом (предыдущие дни).
+        """
+        side = SIDE_HIGH if 'F_H' in asian_fractal['type'] else SIDE_LOW
+        setup_type = 'SETUP_Resist' if side == SIDE_HIGH else 'SETUP_Support'
+        levels = self.levels_near(asian_fractal['price'], within_pips, side=side, session=SESSION_NY,
+                                  as_of=asian_fractal['time'])
+        points = []
+        for level in levels:
+            if exclude_times and level['time'] in exclude_times:
+                continue
+            price_diff = abs(asian_fractal['price'] - level['price'])
+            points.append({
+                'time': asian_fractal['time'],
+                'price': asian_fractal['price'],
+                'type': setup_type,
+                'session': 'Setup',
+                'details': f"Asian {asian_fractal['type']} at {asian_fractal['price']:.5f} "
+                           f"({asian_fractal['time'].strftime('%H:%M')}) near untouched NY {level['type']} "
+                           f"at {level['price']:.5f} ({level['time'].strftime('%Y-%m-%d %H:%M')}), "
+                           f"Diff: {price_diff:.5f}",
+            })
+        return points
+
+
+def state_path_for(symbol: str, timeframe: str) -> str:
+    """Файл состояния индекса пары рядом со снимками анализаторов (ANALYZER_STATE_DIRECTORY)."""
+    directory = settings.ANALYZER_STATE_DIRECTORY
+    if not os.path.isabs(directory):
+        directory = os.path.join(PROJECT_ROOT, directory)
+    return os.path.join(directory, f"{symbol.replace('/', '_')}_{timeframe}_liquidity.json")
+
+
+def _epoch(ts):
+    return int(ts.timestamp()) if ts is not None else None
+
+
+def _timestamp(epoch):
+    return pd.Timestamp(epoch, unit='s', tz='UTC') if epoch is not None else None
+
+
+if __name__ == '__main__':
+    import time as time_module
+    from benchmarks.synthetic import generate_fx_ohlcv
+    from utils.logger import setup_logger
+
+    setup_logger()
+    print("Тестирование liquidity_index.py...")
+    df = generate_fx_ohlcv(24 * 260, freq='1h')  # ~год 1h-свечей
+
+    started = time_module.perf_counter()
+    index = LiquidityIndex.from_dataframe(df, lookback_days=365)
+    elapsed = time_module.perf_counter() - started
+    print(f"Свечей: {len(df)}, уровней: {len(index)}, нетронутых: {index.untouched_count()}, "
+          f"построение {elapsed * 1e6 / len(df):.1f} мкс/свеча")
+
+    # Сверка с find_swing_points по свечам сессий (get_candles_for_session) за последние дни
+    from ts_logic.fractal_analyzer import get_candles_for_session, get_session_fractals
+    asia_start, asia_end = index.sessions[SESSION_ASIA]
+    mismatches = 0
+    for day in pd.date_range(df.index[-1].normalize() - pd.Timedelta(days=20), periods=18, freq='D'):
+        candles = get_candles_for_session(df, day, asia_start, asia_end)
+        expected = {(f['time'], f['type'][:3]) for f in get_session_fractals(candles, index.n, SESSION_ASIA, '_AS')}
+        actual = {(l['time'], l['type'][:3]) for side in (SIDE_HIGH, SIDE_LOW) for l in index._all[side].levels
+                  if l['session'] == SESSION_ASIA and day.date() == session_of(l['time'], index.sessions)[1]}
+        mismatches += len(expected ^ actual)
+    print("Расхождений с get_session_fractals (Азия, 18 дней):", mismatches)
+
+    # Свеча, дошедшая до ближайшего нетронутого максимума, снимает его
+    last_close = float(df['close'].iloc[-1])
+    above = index.levels_in_range(last_close, last_close + 1, side=SIDE_HIGH)
+    if above:
+        next_time = df.index[-1] + pd.Timedelta(hours=1)
+        swept = index.update(next_time, above[0]['price'], last_close)
+        print(f"Свеча до {above[0]['price']:.5f}: снято {len(swept)}, ближайший снят: {above[0]['swept_at'] is not None}")
+
+    started = time_module.perf_counter()
+    for _ in range(1000):
+        zone = index.confluence(last_close, 30)
+    print(f"Конфлюенция в 30 пипсах от {last_close:.5f}: {zone['count']} ({zone['sessions']}), "
+          f"{(time_module.perf_counter() - started) * 1000:.3f} мкс/запрос")
@@ -0,0 +1,277 @@
+# ts_logic/multi_timeframe.py
+"""
+Контекст старших таймфреймов (4h, 1D) поверх часового анализа.
+
+Свечи старших таймфреймов собираются из потока закрытых 1h-свечей (границы - от полуночи UTC,
+как resample), без отдельных запросов к API. На каждом уровне работает та же логика, что
+на 1h: свинги (find_swing_points), структура (analyze_market_structure_points, по одному
+свингу - ts_logic/incremental.StructureTracker), линии тренда и контекст канала. Пересчет
+уровня выполняется только при закрытии его свечи (раз в 4 или 24 часовые свечи), так что
+часовая свеча обходится в сложение в формирующуюся свечу и сборку итогового смещения.
+
+Итог bias(): направление каждого уровня (+1 LONG, -1 SHORT, 0 - нейтрально) по структуре,
+а при нейтральной структуре - по наклону канала; взвешенная сумма по MTF_BIAS_WEIGHTS
+дает общее смещение LONG / SHORT / NEUTRAL. Уровни, где структуры еще нет (мало свечей
+после запуска), в сумме не учитываются. Старший уровень учитывает только закрытые
+свечи - формирующаяся 4h/1D свеча в решение не попадает, как и неполная первая свеча потока.
+"""
+from collections import deque
+
+import pandas as pd
+
+from configs import settings
+from ts_logic.context_analyzer_1h import (
+    determine_overall_market_context,
+    determine_trend_channel_context,
+    determine_trend_lines_v2,
+)
+from ts_logic.incremental import StructureTracker, bars_frame, confirm_swing, trim_points
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
+
+BIAS_LONG = 'LONG'
+BIAS_SHORT = 'SHORT'
+BIAS_NEUTRAL = 'NEUTRAL'
+
+UP_CHANNELS = ("Восходящий", "Восходящий треугольник")
+DOWN_CHANNELS = ("Нисходящий", "Нисходящий треугольник")
+# Контексты determine_overall_market_context, когда структуры еще нет (мало свечей или свингов):
+# такой уровень не голосует за NEUTRAL, а не учитывается в смещении
+NO_STRUCTURE_CONTEXTS = ("NEUTRAL (нет данных о структуре)", "NEUTRAL (недостаточно трендовых точек)")
+
+
+def context_direction(overall_context: str, channel_context: str = None) -> int:
+    """+1 / -1 / 0 по строке контекста структуры; при нейтральной структуре - по контексту канала."""
+    if overall_context:
+        if 'LONG' in overall_context:
+            return 1
+        if 'SHORT' in overall_context:
+            return -1
+    if channel_context in UP_CHANNELS:
+        return 1
+    if channel_context in DOWN_CHANNELS:
+        return -1
+    return 0
+
+
+def has_structure(level: dict) -> bool:
+    """Уровень участвует в смещении: есть направление или структура, которая показывает нейтральность."""
+    return bool(level['direction']) or (level.get('context') is not None and
+                                       level['context'] not in NO_STRUCTURE_CONTEXTS)
+
+
+class HigherTimeframeContext:
+    """Один старший таймфрейм: сборка свечей из 1h и анализ по закрытию каждой."""
+
+    def __init__(self, timeframe: str, period_seconds: int, base_seconds: int,
+                 window: int = settings.MTF_WINDOW_BARS, swing_n: int = settings.MTF_SWING_POINT_N):
+        self.timeframe = timeframe
+        self.period = period_seconds
+        self.base_seconds = base_seconds
+        self.swing_n = swing_n
+        self.bars = deque(maxlen=window)  # закрытые свечи (epoch, open, high, low, close, volume)
+        self.forming = None  # [epoch начала, open, high, low, close, volume]
+        self._forming_partial = False  # первая свеча начата не с начала периода - не закрывается в bars
+        self.swing_highs = []
+        self.swing_lows = []
+        self.structure = StructureTracker()
+        self.overall_context = None
+        self.channel_context = None
+        self.trend_lines = []
+
+    def add(self, epoch: int, open_: float, high: float, low: float, close: float, volume: float) -> bool:
+        """Часовая свеча; True, если по ней закрылась свеча уровня (и уровень пересчитан)."""
+        start = epoch - epoch % self.period
+        closed = False
+        if self.forming is not None and self.forming[0] != start:
+            # Пропуск (выходные, нет данных): предыдущая свеча закрывается по первой свече следующей
+            self._close()
+            closed = True
+        if self.forming is None:
+            self.forming = [start, open_, high, low, close, volume]
+            # Поток начался посреди периода (запуск, засев историей): у первой свечи нет начала
+            self._forming_partial = not self.bars and epoch > start
+        else:
+            forming = self.forming
+            forming[2] = max(forming[2], high)
+            forming[3] = min(forming[3], low)
+            forming[4] = close
+            forming[5] += volume
+        if epoch + self.base_seconds >= start + self.period:
+            self._close()
+            closed = True
+        return closed
+
+    def _close(self):
+        forming, self.forming = self.forming, None
+        if self._forming_partial:
+            self._forming_partial = False
+            return
+        self.bars.append(tuple(forming))
+        is_high, is_low = confirm_swing(self.bars, self.swing_n)
+        if is_high or is_low:
+            center = self.bars[-self.swing_n - 1]
+            center_time = pd.Timestamp(center[0], unit='s', tz='UTC')
+            if is_high:
+                self.swing_highs.append({'time': center_time, 'price': center[2], 'type': 'H_SWING'})
+                self.structure.add_swing(center_time, center[2], 'high')
+            if is_low:
+                self.swing_lows.append({'time': center_time, 'price': center[3], 'type': 'L_SWING'})
+                self.structure.add_swing(center_time, center[3], 'low')
+        window_start = pd.Timestamp(self.bars[0][0], unit='s', tz='UTC')
+        self.swing_highs = trim_points(self.swing_highs, window_start)
+        self.swing_lows = trim_points(self.swing_lows, window_start)
+        self.structure.trim(window_start)
+
+        with metrics.stage_timer(f'mtf_{self.timeframe}'):
+            # Для отступа линий determine_trend_lines_v2 берет только средние high/low окна
+            prices = pd.DataFrame({'high': [b[2] for b in self.bars], 'low': [b[3] for b in self.bars]})
+            self.overall_context = determine_overall_market_context(self.structure.points)
+            self.trend_lines = determine_trend_lines_v2(self.swing_highs, self.swing_lows, self.last_closed_time,
+                                                        prices, points_window_size=settings.TRENDLINE_POINTS_WINDOW_SIZE)
+            self.channel_context = determine_trend_channel_context(self.trend_lines)
+
+    @property
+    def last_closed_time(self):
+        return pd.Timestamp(self.bars[-1][0], unit='s', tz='UTC') if self.bars else None
+
+    def state(self) -> dict:
+        return {
+            'timeframe': self.timeframe,
+            'bar_time': self.last_closed_time,
+            'bars': len(self.bars),
+            'context': self.overall_context,
+            'channel': self.channel_context,
+            'direction': context_direction(self.overall_context, self.channel_context) if self.bars else 0,
+            'structure_points': list(self.structure.points),
+            'trend_lines': list(self.trend_lines),
+        }
+
+
+class MultiTimeframeContext:
+    """Старшие таймфреймы одного символа поверх потока закрытых свечей CONTEXT_TIMEFRAME."""
+
+    def __init__(self, symbol: str = None, timeframes: dict = None, base_timeframe: str = settings.CONTEXT_TIMEFRAME,
+                 window: int = settings.MTF_WINDOW_BARS):
+        self.symbol = symbol
+        self.base_timeframe = base_timeframe
+        base_seconds = settings.SCHEDULER_TIMEFRAMES[base_timeframe]
+        self.levels = {tf: HigherTimeframeContext(tf, seconds, base_seconds, window)
+                       for tf, seconds in (timeframes or settings.MTF_HIGHER_TIMEFRAMES).items()}
+        self.last_time = None
+
+    def history_bars(self) -> int:
+        """Свечей базового таймфрейма, чтобы заполнить окна всех уровней (засев при запуске)."""
+        return max((level.bars.maxlen + 1) * level.period // level.base_seconds for level in self.levels.values())
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, symbol: str = None, **kwargs):
+        context = cls(symbol, **kwargs)
+        context.update_from_dataframe(df)
+        return context
+
+    def on_bar(self, ts: pd.Timestamp, open_: float, high: float, low: float, close: float,
+               volume: float = 0.0) -> list:
+        """Закрытая свеча базового таймфрейма; возвращает таймфреймы, чьи свечи закрылись."""
+        ts = pd.Timestamp(ts)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize('UTC')
+        if self.last_time is not None and ts <= self.last_time:
+            return []
+        self.last_time = ts
+        epoch = int(ts.timestamp())
+        return [tf for tf, level in self.levels.items()
+                if level.add(epoch, float(open_), float(high), float(low), float(close), float(volume))]
+
+    def update_from_dataframe(self, df: pd.DataFrame) -> int:
+        """Свечи df новее последней обработанной; возвращает их число."""
+        if df is None or df.empty:
+            return 0
+        if self.last_time is not None:
+            df = df[df.index > self.last_time]
+        volumes = df['volume'].to_numpy() if 'volume' in df.columns else [0.0] * len(df)
+        for row in zip(df.index, df['open'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy(),
+                       df['close'].to_numpy(), volumes):
+            self.on_bar(*row)
+        return len(df)
+
+    def bias(self, base_context: str = None, base_channel: str = None) -> dict:
+        """
+        Общее смещение на последней свече. base_context / base_channel - контекст самого 1h
+        (overall_context и контекст канала из run_chart_analysis); без них учитываются только старшие уровни.
+        """
+        levels = {tf: level.state() for tf, level in self.levels.items()}
+        if base_context is not None:
+            levels[self.base_timeframe] = {'timeframe': self.base_timeframe, 'bar_time': self.last_time,
+                                           'context': base_context, 'channel': base_channel,
+                                           'direction': context_direction(base_context, base_channel)}
+        weights = settings.MTF_BIAS_WEIGHTS
+        for level in levels.values():
+            level['counted'] = has_structure(level)
+        counted = [(tf, level) for tf, level in levels.items() if level['counted']]
+        total_weight = sum(weights.get(tf, 1) for tf, _ in counted)
+        score = sum(weights.get(tf, 1) * level['direction'] for tf, level in counted) / total_weight \
+            if total_weight else 0.0
+        if score >= settings.MTF_BIAS_THRESHOLD:
+            bias = BIAS_LONG
+        elif score <= -settings.MTF_BIAS_THRESHOLD:
+            bias = BIAS_SHORT
+        else:
+            bias = BIAS_NEUTRAL
+        directions = {level['direction'] for _, level in counted}
+        return {
+            'time': self.last_time,
+            'bias': bias,
+            'score': round(score, 4),
+            'aligned': len(directions) == 1 and 0 not in directions,
+            'levels': levels,
+        }
+
+    def allows(self, direction: str, base_context: str = None) -> bool:
+        """Фильтр сигнала: LONG/SHORT не против общего смещения старших таймфреймов."""
+        bias = self.bias(base_context)['bias']
+        return bias == BIAS_NEUTRAL or bias == direction
+
+
+if __name__ == '__main__':
+    import time as time_module
+    from benchmarks.synthetic import generate_fx_ohlcv
+    from core.chart_payload import run_chart_analysis
+    from core.scheduler import resample_ohlcv
+    from ts_logic.context_analyzer_1h import analyze_market_structure_points, find_swing_points
+    from utils.logger import setup_logger
+
+    setup_logger()
+    print("Тестирование multi_timeframe.py...")
+    df = generate_fx_ohlcv(24 * 200, freq='1h', seed=5)
+
+    started = time_module.perf_counter()
+    mtf = MultiTimeframeContext('EUR/USD')
+    for row in zip(df.index, df['open'], df['high'], df['low'], df['close'], df['volume']):
+        mtf.on_bar(*row)
+    mtf_seconds = (time_module.perf_counter() - started) / len(df)
+
+    # Сверка с пакетной структурой по пересобранным свечам последнего окна
+    for tf, level in mtf.levels.items():
+        resampled = resample_ohlcv(df, tf.lower())
+        resampled = resampled[resampled.index <= level.last_closed_time].iloc[-settings.MTF_WINDOW_BARS:]
+        highs, lows = find_swing_points(resampled, n=level.swing_n)
+        batch = analyze_market_structure_points(highs, lows)
+        as_set = lambda points: {(p['time'], round(p['price'], 10), p['type']) for p in points}
+        incremental = [p for p in level.structure.points if p['time'] >= resampled.index[0]]
+        tail = [p for p in batch if p['time'] >= incremental[0]['time']] if incremental else batch
+        print(f"{tf}: свечей {len(level.bars)}, свечи совпадают с resample: "
+              f"{bool((bars_frame(level.bars)[['open', 'high', 'low', 'close']].values == resampled[['open', 'high', 'low', 'close']].values).all())}, "
+              f"структура совпадает: {as_set(incremental[-5:]) == as_set(tail[-5:])}, контекст: {level.overall_context}")
+
+    window = df.iloc[-settings.CONTEXT_OUTPUT_SIZE:]
+    started = time_module.perf_counter()
+    analysis = run_chart_analysis(window)
+    analysis_seconds = time_module.perf_counter() - started
+    result = mtf.bias(analysis['overall_context'], determine_trend_channel_context(analysis['trend_lines']))
+    print(f"Смещение: {result['bias']} (score {result['score']}, согласовано: {result['aligned']}), "
+          + ", ".join(f"{tf}: {level['direction']:+d}" for tf, level in result['levels'].items()))
+    print(f"Старшие таймфреймы: {mtf_seconds * 1e6:.1f} мкс на 1h-свечу, "
+          f"{mtf_seconds / analysis_seconds * 100:.2f}% от полного анализа 1h ({analysis_seconds * 1000:.1f} мс)")
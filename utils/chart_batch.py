@@ -0,0 +1,169 @@
+# utils/chart_batch.py
+import multiprocessing
+import os
+import threading
+import time as time_module
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from configs import settings
+from utils.logger import get_logger, setup_worker_logger, worker_log_queue
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Стиль mplfinance процесса-воркера: строится один раз в _init_render_worker
+_worker_style = None
+
+
+def _init_render_worker(log_queue=None):
+    """
+    Инициализатор процесса пула: логгер (записи уходят в родителя), headless-бэкенд Agg,
+    импорт mplfinance и стиль - один раз на процесс. Родительский процесс matplotlib/mplfinance не импортирует вовсе.
+    """
+    global _worker_style
+    if log_queue is not None:
+        setup_worker_logger(log_queue)
+    import matplotlib
+    matplotlib.use('Agg')
+    from utils.plotter import make_chart_style
+    _worker_style = make_chart_style()
+
+
+def _render_job(job: dict) -> dict:
+    """Рендер одного задания в процессе пула. Исключения не пробрасываются - попадают в отчет."""
+    from utils.plotter import plot_market_structure
+    from utils import profiling
+    started = time_module.perf_counter()
+    filepath, error = None, None
+    try:
+        # TSBOT_PROFILE наследуется воркером: отчеты - в profiles/ рядом с графиком
+        with profiling.profile_run('plot', directory=os.path.join(job['charts_directory'], settings.PROFILING_DIRECTORY_NAME),
+                                   symbol=job['symbol'], timeframe=job['timeframe']):
+            filepath = plot_market_structure(job['df'], job['structure_points'], job['symbol'], job['timeframe'],
+                                             job['charts_directory'], job['filename'], style=_worker_style)
+        if filepath is None:
+            error = "график не построен (подробности в выводе воркера)"
+    except Exception as e:
+        error = str(e)
+    return {
+        'symbol': job['symbol'], 'timeframe': job['timeframe'], 'filepath': filepath, 'error': error,
+        'seconds': round(time_module.perf_counter() - started, 3), 'pid': os.getpid(),
+    }
+
+
+def make_chart_job(df: 'pd.DataFrame', structure_points: list, symbol: str, timeframe: str,
+                   charts_directory: str = None, filename: str = None) -> dict:
+    """Задание на рендер; имя файла по умолчанию - как у графиков в charts/ (*_FULL_ANALYSIS_<время>.png)."""
+    if charts_directory is None:
+        charts_directory = os.path.join(PROJECT_ROOT, settings.CHARTS_DIRECTORY_NAME)
+    if filename is None:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"{symbol.replace('/', '_')}_{timeframe}_FULL_ANALYSIS_{timestamp}.png"
+    return {'df': df, 'structure_points': structure_points, 'symbol': symbol, 'timeframe': timeframe,
+            'charts_directory': charts_directory, 'filename': filename}
+
+
+class ChartBatchRenderer:
+    """
+    Пакетный рендеринг графиков в пуле процессов. Каждый воркер прогревается один раз
+    (Agg, mplfinance, стиль), PNG записываются атомарно. submit_batch не блокирует
+    вызывающий поток: отчет с временем по каждому заданию приходит в Future / callback.
+    """
+
+    def __init__(self, max_workers: int = settings.CHART_RENDER_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: воркеры не наследуют потоки и блокировки анализа/сервера родителя
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_render_worker,
+                                                     initargs=(worker_log_queue(),))
+            return self._executor
+
+    def submit_batch(self, jobs: list, on_complete=None) -> Future:
+        """
+        Ставит задания в пул и сразу возвращает Future с итоговым отчетом.
+        on_complete(report), если передан, вызывается из фонового потока после завершения пакета.
+        """
+        started = time_module.perf_counter()
+        executor = self._get_executor()
+        job_futures = [executor.submit(_render_job, job) for job in jobs]
+        batch_future = Future()
+        threading.Thread(target=self._collect, args=(jobs, job_futures, started, batch_future, on_complete),
+                         name="chart-batch-collector", daemon=True).start()
+        return batch_future
+
+    def render_batch(self, jobs: list) -> dict:
+        """Блокирующий вариант submit_batch."""
+        return self.submit_batch(jobs).result()
+
+    def _collect(self, jobs, job_futures, started, batch_future, on_complete):
+        wait(job_futures)
+        results = []
+        for job, job_future in zip(jobs, job_futures):
+            try:
+                results.append(job_future.result())
+            except Exception as e:  # например, упавший процесс пула
+                results.append({'symbol': job['symbol'], 'timeframe': job['timeframe'], 'filepath': None,
+                                'error': str(e), 'seconds': None, 'pid': None})
+        failed = sum(1 for r in results if r['error'])
+        report = {
+            'jobs': results,
+            'rendered': len(results) - failed,
+            'failed': failed,
+            'wall_seconds': round(time_module.perf_counter() - started, 3),
+            'render_seconds_total': round(sum(r['seconds'] or 0 for r in results), 3),
+        }
+        logger.info("Пакет завершен: %d графиков, ошибок: %d, %.3f с (суммарно рендер %.3f с)",
+                    report['rendered'], failed, report['wall_seconds'], report['render_seconds_total'],
+                    extra={'stage': 'render'})
+        batch_future.set_result(report)
+        if on_complete is not None:
+            try:
+                on_complete(report)
+            except Exception as e:
+                logger.exception("Ошибка в on_complete: %s", e)
+
+    def shutdown(self, wait_for_jobs: bool = True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait_for_jobs)
+                self._executor = None
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    import tempfile
+
+    from utils.logger import setup_logger
+    setup_logger()
+    print("Тестирование chart_batch.py...")
+    rng = np.random.default_rng(7)
+    jobs = []
+    output_directory = tempfile.mkdtemp(prefix="chart_batch_")
+    for symbol in ["EUR/USD", "GBP/USD", "AUD/USD", "USD/CAD"]:
+        times = pd.date_range('2024-01-01', periods=300, freq='h', tz='UTC')
+        close = 1.1 + np.cumsum(rng.normal(0, 0.0008, len(times)))
+        open_ = np.concatenate([[close[0]], close[:-1]])
+        df = pd.DataFrame({'open': open_, 'close': close,
+                           'high': np.maximum(open_, close) + 0.0004, 'low': np.minimum(open_, close) - 0.0004,
+                           'volume': 100}, index=times)
+        points = [{'time': times[i], 'price': df['high'].iloc[i], 'type': 'HH'} for i in range(20, 300, 40)]
+        jobs.append(make_chart_job(df, points, symbol, '1h', charts_directory=output_directory))
+
+    renderer = ChartBatchRenderer()
+    batch = renderer.submit_batch(jobs)
+    print("Пакет поставлен в очередь, основной поток свободен...")
+    report = batch.result()
+    for job_report in report['jobs']:
+        print(f"  {job_report['symbol']}: {job_report['seconds']} с, pid={job_report['pid']}, "
+              f"файл={job_report['filepath']}, ошибка={job_report['error']}")
+    renderer.shutdown()
@@ -0,0 +1,179 @@
+# utils/chart_cache.py
+import hashlib
+import json
+import os
+import threading
+import time as time_module
+
+import pandas as pd
+from configs import settings
+from utils.logger import get_logger
+from utils import metrics
+
+try:
+    import fcntl  # межпроцессная блокировка манифеста (пул рендеринга); на Windows недоступен
+except ImportError:
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# Увеличить при изменении внешнего вида графиков, чтобы старые картинки не считались совпадающими
+CHART_RENDER_VERSION = 1
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def chart_content_hash(df: pd.DataFrame, structure_points: list, symbol: str, timeframe: str, style) -> str:
+    """
+    sha256 всего, что влияет на картинку: свечи (индекс + OHLCV), точки, заголовок и стиль.
+    Одинаковые входные данные дают одинаковый хэш независимо от времени запуска анализа.
+    """
+    digest = hashlib.sha256()
+    header = {
+        'render_version': CHART_RENDER_VERSION,
+        'symbol': symbol, 'timeframe': timeframe,
+        'max_point_labels': settings.PLOT_MAX_POINT_LABELS,
+        'style': style,
+    }
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode('utf-8'))
+
+    columns = [c for c in OHLCV_COLUMNS if c in df.columns]
+    digest.update(','.join(columns).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df[columns], index=True).to_numpy().tobytes())
+
+    points = [(str(pd.Timestamp(p.get('time'))) if p.get('time') is not None else None, p.get('price'), p.get('type'))
+              for p in structure_points]
+    digest.update(json.dumps(points, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """
+    Контентно-адресуемый кэш графиков в директории charts: картинка хранится как <hash>.png,
+    manifest.json связывает логические имена файлов с хэшами. Повторный анализ неизменных
+    данных возвращает уже готовую картинку вместо нового рендера.
+    Хранение ограничено возрастом (с последнего использования) и суммарным размером.
+    """
+
+    _thread_lock = threading.Lock()
+
+    def __init__(self, directory: str,
+                 max_age_seconds: float = settings.CHART_CACHE_MAX_AGE_DAYS * 86400,
+                 max_total_bytes: int = settings.CHART_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.manifest_path = os.path.join(directory, settings.CHART_CACHE_MANIFEST)
+        self._lock_path = self.manifest_path + '.lock'
+
+    def object_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.png")
+
+    def _locked(self):
+        return _ManifestLock(self._lock_path)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        except (OSError, ValueError) as e:
+            logger.warning("Манифест %s не прочитан (%s), создается заново.", self.manifest_path, e)
+            manifest = {}
+        manifest.setdefault('names', {})    # логическое имя -> хэш
+        manifest.setdefault('objects', {})  # хэш -> {size, created, last_used}
+        return manifest
+
+    def _write_manifest(self, manifest: dict):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def lookup(self, content_hash: str, logical_name: str = None):
+        """Путь к готовой картинке с этим хэшем (и запись имени в манифест) или None."""
+        path = self.object_path(content_hash)
+        with self._locked():
+            manifest = self._read_manifest()
+            entry = manifest['objects'].get(content_hash)
+            hit = entry is not None and os.path.exists(path)
+            metrics.record_cache('chart_png', hit)
+            if not hit:
+                return None
+            entry['last_used'] = time_module.time()
+            if logical_name:
+                manifest['names'][logical_name] = content_hash
+            self._write_manifest(manifest)
+        return path
+
+    def store(self, content_hash: str, logical_name: str = None):
+        """Регистрирует уже сохраненный <hash>.png и применяет политику хранения."""
+        path = self.object_path(content_hash)
+        now = time_module.time()
+        with self._locked():
+            manifest = self._read_manifest()
+            manifest['objects'][content_hash] = {'size': os.path.getsize(path), 'created': now, 'last_used': now}
+            if logical_name:
+                manifest['names'][logical_name] = content_hash
+            self._evict(manifest, now, keep=content_hash)
+            self._write_manifest(manifest)
+        return path
+
+    def resolve(self, logical_name: str):
+        """Путь к картинке по логическому имени (например, EUR_USD_1h_FULL_ANALYSIS_...png) или None."""
+        with self._locked():
+            content_hash = self._read_manifest()['names'].get(logical_name)
+        return self.object_path(content_hash) if content_hash else None
+
+    def _evict(self, manifest: dict, now: float, keep: str = None):
+        objects = manifest['objects']
+        expired = [h for h, entry in objects.items() if h != keep and now - entry['last_used'] > self.max_age_seconds]
+        by_last_used = sorted((h for h in objects if h != keep and h not in expired), key=lambda h: objects[h]['last_used'])
+        total_bytes = sum(entry['size'] for h, entry in objects.items() if h not in expired)
+        evicted = list(expired)
+        for content_hash in by_last_used:
+            if total_bytes <= self.max_total_bytes:
+                break
+            total_bytes -= objects[content_hash]['size']
+            evicted.append(content_hash)
+
+        for content_hash in evicted:
+            del objects[content_hash]
+            try:
+                os.remove(self.object_path(content_hash))
+            except FileNotFoundError:
+                pass
+        if evicted:
+            evicted_set = set(evicted)
+            manifest['names'] = {name: h for name, h in manifest['names'].items() if h not in evicted_set}
+            logger.info("Удалено из кэша графиков: %d", len(evicted))
+
+
+class _ManifestLock:
+    """Блокировка манифеста: между потоками процесса и (где есть fcntl) между процессами."""
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._file = None
+
+    def __enter__(self):
+        ChartCache._thread_lock.acquire()
+        if fcntl is not None:
+            try:
+                self._file = open(self.lock_path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                # __exit__ не вызовется: без освобождения здесь все следующие записи в кэш повиснут
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                ChartCache._thread_lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        ChartCache._thread_lock.release()
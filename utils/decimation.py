@@ -0,0 +1,112 @@
+# utils/decimation.py
+import numpy as np
+import pandas as pd
+from configs import settings
+
+
+def bars_per_bucket_for(bar_count: int, width: int = None, bars_per_bucket: int = None,
+                        pixels_per_bar: int = settings.DECIMATION_PIXELS_PER_BAR) -> int:
+    """
+    Сколько свечей объединять в одну: явный уровень масштаба (bars_per_bucket) или
+    по ширине области отрисовки в пикселях - не больше width / pixels_per_bar свечей на экран.
+    1 - прореживание не нужно.
+    """
+    if bars_per_bucket:
+        return max(1, int(bars_per_bucket))
+    if not width or bar_count == 0:
+        return 1
+    max_bars = max(1, int(width) // max(1, pixels_per_bar))
+    return max(1, -(-bar_count // max_bars))  # ceil
+
+
+def bucket_starts(bar_times: np.ndarray, bars_per_bucket: int) -> np.ndarray:
+    """
+    Позиции первых свечей корзин. Корзины выровнены по времени (epoch // длительность корзины),
+    а не по номеру свечи: при добавлении новых свечей и подгрузке истории старые корзины
+    не сдвигаются. Пропуски (выходные) просто дают неполные корзины.
+    """
+    if len(bar_times) == 0:
+        return np.empty(0, dtype=np.int64)
+    if bars_per_bucket <= 1 or len(bar_times) == 1:
+        return np.arange(len(bar_times))
+    bar_seconds = max(1, int(np.median(np.diff(bar_times))))
+    bucket_keys = bar_times // (bar_seconds * bars_per_bucket)
+    return np.concatenate([[0], np.flatnonzero(np.diff(bucket_keys)) + 1])
+
+
+def aggregate_ohlcv(df: pd.DataFrame, starts: np.ndarray) -> pd.DataFrame:
+    """OHLC корзин: open первой свечи, max high, min low, close последней, сумма объема."""
+    if len(starts) == len(df):
+        return df
+    ends = np.append(starts[1:], len(df)) - 1
+    data = {
+        'open': df['open'].to_numpy()[starts],
+        'high': np.maximum.reduceat(df['high'].to_numpy(), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(), starts),
+        'close': df['close'].to_numpy()[ends],
+    }
+    if 'volume' in df.columns:
+        data['volume'] = np.add.reduceat(df['volume'].to_numpy(), starts)
+    return pd.DataFrame(data, index=df.index[starts])
+
+
+def pin_epochs(epochs, bucket_epochs: np.ndarray) -> np.ndarray:
+    """Время (epoch-секунды) -> начало корзины, в которую попадает свеча с этим временем."""
+    positions = np.searchsorted(bucket_epochs, np.asarray(epochs, dtype=np.int64), side='right') - 1
+    return bucket_epochs[np.clip(positions, 0, len(bucket_epochs) - 1)]
+
+
+def decimate_ohlcv(df: pd.DataFrame, width: int = None, bars_per_bucket: int = None):
+    """
+    Прореживание с сохранением OHLC: свечи объединяются в корзины по ширине экрана
+    (width, пиксели) или по уровню масштаба (bars_per_bucket).
+    Возвращает (DataFrame корзин, bars_per_bucket); при bars_per_bucket == 1 df не меняется.
+    """
+    factor = bars_per_bucket_for(len(df), width, bars_per_bucket)
+    if factor <= 1 or df.empty:
+        return df, 1
+    bar_times = _index_epochs(df.index)
+    return aggregate_ohlcv(df, bucket_starts(bar_times, factor)), factor
+
+
+def pin_points(points: list, decimated_index: pd.DatetimeIndex) -> list:
+    """Точки структуры/сетапов (time - pd.Timestamp) переносятся на начало своей корзины."""
+    if not points or len(decimated_index) == 0:
+        return points
+    valid = [p for p in points if p.get('time') is not None]
+    bucket_epochs = _index_epochs(decimated_index)
+    point_epochs = _index_epochs(pd.DatetimeIndex([pd.Timestamp(p['time']) for p in valid]))
+    positions = np.clip(np.searchsorted(bucket_epochs, point_epochs, side='right') - 1, 0, len(bucket_epochs) - 1)
+    pinned = [dict(p, time=decimated_index[pos]) for p, pos in zip(valid, positions)]
+    return pinned + [p for p in points if p.get('time') is None]
+
+
+def _index_epochs(index: pd.DatetimeIndex) -> np.ndarray:
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.values.astype('datetime64[s]').astype(np.int64)
+
+
+if __name__ == '__main__':
+    print("Тестирование decimation.py...")
+    rng = np.random.default_rng(3)
+    times = pd.date_range('2024-01-01', periods=20000, freq='h', tz='UTC')
+    close = 1.1 + np.cumsum(rng.normal(0, 0.0005, len(times)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    test_df = pd.DataFrame({'open': open_, 'close': close,
+                            'high': np.maximum(open_, close) + 0.0003, 'low': np.minimum(open_, close) - 0.0003,
+                            'volume': 1.0}, index=times)
+
+    decimated, factor = decimate_ohlcv(test_df, width=1600)
+    print(f"{len(test_df)} свечей -> {len(decimated)} корзин по {factor} (ширина 1600px)")
+    # Проверка OHLC против groupby по тем же корзинам
+    keys = _index_epochs(test_df.index) // (3600 * factor)
+    expected = test_df.groupby(keys).agg({'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'})
+    assert np.allclose(expected.to_numpy(), decimated[['open', 'high', 'low', 'close', 'volume']].to_numpy())
+    assert decimated['high'].max() == test_df['high'].max() and decimated['low'].min() == test_df['low'].min()
+
+    swing = {'time': test_df.index[12345], 'price': test_df['high'].iloc[12345], 'type': 'HH'}
+    pinned = pin_points([swing], decimated.index)[0]
+    bucket_pos = decimated.index.get_loc(pinned['time'])
+    assert decimated['high'].iloc[bucket_pos] >= swing['price']
+    print(f"Точка {swing['time']} -> корзина {pinned['time']}. OK")
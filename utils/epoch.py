@@ -0,0 +1,36 @@
+# utils/epoch.py
+"""
+Время и цены в компактном виде: epoch-секунды UTC и целочисленные цены в пипеттах.
+Без зависимостей от модулей анализа - импортируется хранилищами свечей и воркерами
+(core/ohlcv_store.py), которым не нужен стек ts_logic.
+"""
+import numpy as np
+import pandas as pd
+from configs import settings
+
+# Целочисленные цены - в пипеттах (1/10 пипса): 5 знаков EUR/USD, 3 знака USD/JPY
+PIPETTES_PER_PIP = 10
+
+
+def to_epoch_seconds(ts) -> int:
+    """Переводит pd.Timestamp/datetime в epoch-секунды (UTC)."""
+    return int(pd.Timestamp(ts).timestamp())
+
+
+def index_to_epoch_seconds(index: pd.DatetimeIndex) -> np.ndarray:
+    """DatetimeIndex (любая точность, с таймзоной или без) -> int64 epoch-секунды UTC."""
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.values.astype('datetime64[s]').astype(np.int64)
+
+
+def price_scale_for(pip_value: float = settings.PIP_VALUE_DEFAULT) -> int:
+    """Множитель для целочисленных цен: price_int = round(price * scale)."""
+    return int(round(PIPETTES_PER_PIP / pip_value))
+
+
+if __name__ == '__main__':
+    print("Тестирование epoch.py...")
+    index = pd.date_range('2024-01-01', periods=3, freq='h', tz='Europe/Moscow')
+    print("epoch-секунды:", index_to_epoch_seconds(index), to_epoch_seconds(index[0]))
+    print("Множитель цен EUR/USD, USD/JPY:", price_scale_for(0.0001), price_scale_for(0.01))
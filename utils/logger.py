@@ -1,30 +1,263 @@
 """
 Module for logging configuration and utilities.
+
+Modules log through get_logger(__name__); records go into a bounded in-memory queue
+(QueueHandler) and are formatted and written by a QueueListener thread, so the analysis
+loop never blocks on stdout or disk. Records carry structured fields (symbol, timeframe,
+stage), either passed via `extra=` or set for a block of code with log_context().
+Repetitive messages are rate-limited before they are even queued.
 """
+import atexit
+import contextvars
 import logging
-from logging.handlers import RotatingFileHandler
-
-def setup_logger():
-    """
-    Configure the logger.
-    """
-    logger = logging.getLogger('1h3mtsbot')
-    logger.setLevel(logging.INFO)
-    
-    # Create rotating file handler
-    handler = RotatingFileHandler(
-        'data/logs/bot.log',
-        maxBytes=1024*1024*5,  # 5MB
-        backupCount=5
-    )
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    handler.setFormatter(formatter)
-    
-    # Add handler to logger
-    logger.addHandler(handler)
-    
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time as time_module
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from configs import settings
+
+LOGGER_NAME = '1h3mtsbot'
+STRUCTURED_FIELDS = ('symbol', 'timeframe', 'stage')
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_log_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+_queue_handler = None
+_worker_queue = None
+_worker_listener = None
+_setup_lock = threading.Lock()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger for a module: get_logger(__name__) -> '1h3mtsbot.core.data_fetcher'.
+    """
+    return logging.getLogger(LOGGER_NAME).getChild(name)
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach structured fields (symbol, timeframe, stage) to every record logged
+    inside the block, including records from nested calls.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the current log_context() fields onto the record. Runs on the calling
+    thread (before the record is queued), because the context is per-thread.
+    """
+
+    def filter(self, record):
+        context = _log_context.get()
+        for field in STRUCTURED_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per `interval_seconds` for each distinct
+    message (logger + level + formatted text): a scan that logs one "SETUP FOUND!"
+    line per pair is not throttled, the same line repeated in a loop is. The next
+    record let through after a quiet period reports how many repeats were suppressed.
+    """
+
+    def __init__(self, interval_seconds: float = settings.LOG_RATE_LIMIT_SECONDS,
+                 burst: int = settings.LOG_RATE_LIMIT_BURST):
+        super().__init__()
+        self.interval_seconds = interval_seconds
+        self.burst = burst
+        self._windows = {}  # key -> [window_start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time_module.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval_seconds:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 10000:  # keep the key table bounded
+                    self._windows = {key: self._windows[key]}
+                record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                record.suppressed = 0
+                return True
+            window[2] += 1
+            return False
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Standard text line plus the non-empty structured fields:
+    '... - INFO - message [symbol=EUR/USD timeframe=1h stage=fetch]'.
+    """
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [f"{field}={getattr(record, field)}" for field in STRUCTURED_FIELDS
+                  if getattr(record, field, None) is not None]
+        if fields:
+            line += f" [{' '.join(fields)}]"
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            line += f" (suppressed {suppressed} repeats)"
+        return line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the record
+    is dropped and counted. The message is merged with its args on the calling thread
+    (mutable args may change before the listener gets to the record); the line itself
+    is formatted by the listener. With pickle_ready=True (worker processes) the
+    traceback is rendered to text as well, since exc_info cannot cross processes.
+    """
+
+    def __init__(self, log_queue, pickle_ready: bool = False):
+        super().__init__(log_queue)
+        self.pickle_ready = pickle_ready
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if self.pickle_ready and record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logger(log_directory: str = None, level=None, console: bool = settings.LOG_TO_CONSOLE):
+    """
+    Configure the logger (idempotent: repeated calls return the configured logger).
+    Log directory: argument, else settings.LOG_DIRECTORY (TSBOT_LOG_DIR), relative
+    paths resolved from the project root.
+    """
+    global _listener, _queue_handler
+    logger = logging.getLogger(LOGGER_NAME)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+
+        logger.setLevel(level or settings.LOG_LEVEL)
+        logger.propagate = False
+
+        log_directory = log_directory or settings.LOG_DIRECTORY
+        if not os.path.isabs(log_directory):
+            log_directory = os.path.join(PROJECT_ROOT, log_directory)
+        os.makedirs(log_directory, exist_ok=True)
+
+        # Create formatter
+        formatter = StructuredFormatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+
+        # Create rotating file handler
+        file_handler = RotatingFileHandler(
+            os.path.join(log_directory, 'bot.log'),
+            maxBytes=1024*1024*5,  # 5MB
+            backupCount=5,
+            encoding='utf-8',
+        )
+        file_handler.setFormatter(formatter)
+        handlers = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+
+        # The calling thread only filters and enqueues; I/O happens in the listener thread
+        log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(RateLimitFilter())
+        logger.addHandler(queue_handler)
+        _queue_handler = queue_handler
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logger)
+    return logger
+
+
+class _ForwardHandler(logging.Handler):
+    """Passes records from worker processes to this process' queue (already filtered by the worker)."""
+
+    def emit(self, record):
+        if _queue_handler is not None:
+            _queue_handler.enqueue(record)
+
+
+def worker_log_queue():
+    """
+    Queue for spawn pool workers: pass it through initargs to setup_worker_logger().
+    Worker records end up in this process' handlers, so only one process writes
+    (and rotates) bot.log.
+    """
+    global _worker_queue, _worker_listener
+    setup_logger()
+    with _setup_lock:
+        if _worker_queue is None:
+            _worker_queue = multiprocessing.get_context('spawn').Queue(settings.LOG_QUEUE_SIZE)
+            _worker_listener = QueueListener(_worker_queue, _ForwardHandler())
+            _worker_listener.start()
+    return _worker_queue
+
+
+def setup_worker_logger(log_queue, level=None):
+    """Logger of a pool worker process: records go to the parent through worker_log_queue()."""
+    global _queue_handler
+    logger = logging.getLogger(LOGGER_NAME)
+    with _setup_lock:
+        if _queue_handler is not None:
+            return logger
+        logger.setLevel(level or settings.LOG_LEVEL)
+        logger.propagate = False
+        queue_handler = NonBlockingQueueHandler(log_queue, pickle_ready=True)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(RateLimitFilter())
+        logger.addHandler(queue_handler)
+        _queue_handler = queue_handler
     return logger
+
+
+def shutdown_logger():
+    """Flush queued records and stop the listener threads."""
+    global _listener, _queue_handler, _worker_queue, _worker_listener
+    with _setup_lock:
+        if _worker_listener is not None:
+            _worker_listener.stop()
+            _worker_listener = None
+            _worker_queue = None
+        if _listener is not None:
+            logging.getLogger(LOGGER_NAME).removeHandler(_queue_handler)
+            _listener.stop()
+            _listener = None
+            _queue_handler = None
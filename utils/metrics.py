@@ -0,0 +1,284 @@
+# utils/metrics.py
+"""
+Встроенный реестр метрик конвейера анализа: счетчики, gauge и гистограммы времени этапов.
+Публикация - текст в формате Prometheus (/metrics сервера графиков) и периодическая
+сводка в лог. При METRICS_ENABLED = False все вызовы сводятся к одной проверке флага.
+"""
+import bisect
+import threading
+import time as time_module
+
+from configs import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+STAGE_SECONDS = 'tsbot_stage_seconds'
+CACHE_REQUESTS = 'tsbot_cache_requests_total'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя ячейка - +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+class MetricsRegistry:
+    """Потокобезопасный реестр: (имя, метки) -> значение счетчика / gauge / гистограмма."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets=TIME_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """Копия текущих значений: counters/gauges - {(имя, метки): значение}, histograms - count/sum/max."""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': {key: {'count': h.count, 'sum': h.total, 'max': h.max}
+                               for key, h in self._histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, (h.buckets, list(h.counts), h.count, h.total))
+                                for key, h in self._histograms.items())
+        lines = []
+        typed = set()
+
+        def header(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in gauges:
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+registry.describe(STAGE_SECONDS, "Длительность этапов конвейера анализа")
+registry.describe(CACHE_REQUESTS, "Обращения к кэшам (result=hit|miss)")
+
+_enabled = settings.METRICS_ENABLED
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(value: bool):
+    global _enabled
+    _enabled = bool(value)
+
+
+def inc(name: str, value: float = 1, **labels):
+    if _enabled:
+        registry.inc(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if _enabled:
+        registry.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, buckets=TIME_BUCKETS, **labels):
+    if _enabled:
+        registry.observe(name, value, buckets, **labels)
+
+
+def record_cache(cache: str, hit: bool):
+    if _enabled:
+        registry.inc(CACHE_REQUESTS, cache=cache, result='hit' if hit else 'miss')
+
+
+class _StageTimer:
+    __slots__ = ('stage', 'labels', 'started')
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time_module.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe(STAGE_SECONDS, time_module.perf_counter() - self.started, stage=self.stage, **self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def stage_timer(stage: str, **labels):
+    """
+    with stage_timer('swings'): ... - время этапа в гистограмму tsbot_stage_seconds{stage=...}.
+    Когда метрики выключены, возвращается общий пустой контекстный менеджер.
+    """
+    if not _enabled:
+        return _NOOP_TIMER
+    return _StageTimer(stage, labels)
+
+
+def summary_lines(snapshot: dict = None) -> list:
+    """Строки сводки для лога: этапы (count/avg/max), hit rate кэшей, остальные счетчики и gauge."""
+    snapshot = snapshot or registry.snapshot()
+    lines = []
+    for (name, labels), h in sorted(snapshot['histograms'].items()):
+        if h['count']:
+            label_text = ','.join(f"{k}={v}" for k, v in labels)
+            avg = h['sum'] / h['count']
+            if name == STAGE_SECONDS:
+                lines.append(f"{label_text}: n={h['count']} avg={avg * 1000:.1f}ms max={h['max'] * 1000:.1f}ms")
+            else:
+                lines.append(f"{name}{{{label_text}}}: n={h['count']} avg={avg:.0f} max={h['max']:.0f}")
+
+    caches = {}
+    for (name, labels), value in snapshot['counters'].items():
+        if name == CACHE_REQUESTS:
+            label_map = dict(labels)
+            stats = caches.setdefault(label_map.get('cache'), {'hit': 0, 'miss': 0})
+            stats[label_map.get('result')] = stats.get(label_map.get('result'), 0) + value
+    for cache, stats in sorted(caches.items()):
+        total = stats['hit'] + stats['miss']
+        lines.append(f"cache {cache}: hit rate {stats['hit'] / total:.0%} ({int(stats['hit'])}/{int(total)})")
+
+    for (name, labels), value in sorted(list(snapshot['counters'].items()) + list(snapshot['gauges'].items())):
+        if name != CACHE_REQUESTS:
+            label_text = ','.join(f"{k}={v}" for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} = {value:g}")
+    return lines
+
+
+class MetricsReporter:
+    """Фоновый поток: раз в interval_seconds пишет сводку метрик в лог."""
+
+    def __init__(self, interval_seconds: float = settings.METRICS_LOG_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            if _enabled:
+                lines = summary_lines()
+                if lines:
+                    logger.info("Сводка метрик:\n  %s", '\n  '.join(lines), extra={'stage': 'metrics'})
+
+
+if __name__ == '__main__':
+    print("Тестирование metrics.py...")
+    for i in range(100):
+        with stage_timer('swings'):
+            sum(range(1000))
+    record_cache('history', True)
+    record_cache('history', False)
+    observe('tsbot_payload_bytes', 5000, buckets=SIZE_BUCKETS, format='binary')
+    set_gauge('tsbot_api_credits_left', 790)
+    print(registry.render_prometheus())
+    print('\n'.join(summary_lines()))
+
+    set_enabled(False)
+    started = time_module.perf_counter()
+    for i in range(100000):
+        with stage_timer('swings'):
+            pass
+    print(f"Выключенный stage_timer: {(time_module.perf_counter() - started) / 100000 * 1e9:.0f} нс на вызов")
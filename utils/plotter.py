@@ -1,59 +1,131 @@
 # utils/plotter.py
+import numpy as np
 import pandas as pd
-import mplfinance as mpf
-import matplotlib.pyplot as plt
-from matplotlib.dates import date2num # num2date может понадобиться для отладки
 from datetime import datetime
 import os
+import sys
+from configs import settings
+from utils.chart_cache import ChartCache, chart_content_hash
+from utils.decimation import decimate_ohlcv, pin_points
+from utils.logger import get_logger
+from utils import metrics
+
+logger = get_logger(__name__)
 
 # --- МОДУЛЬ ПОСТРОЕНИЯ ГРАФИКА ---
+def _plotting_modules():
+    """
+    mplfinance и matplotlib импортируются при первом построении графика, а не при импорте модуля:
+    процессы, которые графики не рисуют, не платят за этот импорт.
+    """
+    import matplotlib
+    if settings.HEADLESS_PLOTTING and 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import mplfinance as mpf
+    return mpf, plt
+
+
+def make_chart_style():
+    """Стиль mplfinance для графиков анализа (в пуле рендеринга строится один раз на процесс)."""
+    mpf, _ = _plotting_modules()
+    mc = mpf.make_marketcolors(up='g', down='r', inherit=True)
+    return mpf.make_mpf_style(marketcolors=mc, gridstyle=':', y_on_right=False)
+
+
+def save_figure_atomic(fig, filepath: str, **savefig_kwargs):
+    """
+    Сохраняет фигуру во временный файл рядом с целевым и переименовывает его (os.replace),
+    чтобы читатели директории никогда не видели недописанный PNG.
+    """
+    file_format = os.path.splitext(filepath)[1].lstrip('.') or 'png'
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        fig.savefig(tmp_path, format=file_format, **savefig_kwargs)
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def plot_market_structure(df: pd.DataFrame, 
                           structure_points: list, 
                           symbol: str, 
                           timeframe: str, 
                           charts_directory: str, 
-                          filename: str):
+                          filename: str,
+                          style=None,
+                          use_cache: bool = settings.CHART_CACHE_ENABLED,
+                          decimate_width: int = settings.PLOT_DECIMATION_WIDTH):
     """
     Рисует свечной график с отмеченными точками структуры рынка, сессионными фракталами
     и точками сетапов. Сохраняет его в указанную директорию.
+    style - готовый стиль mplfinance (make_chart_style()); если не передан, строится заново.
+    use_cache - контентно-адресуемый кэш (utils/chart_cache.py): картинка сохраняется как <hash>.png,
+    filename становится логическим именем в манифесте, а для неизменных данных рендер пропускается.
+    decimate_width - ширина области свечей в пикселях: более длинная история объединяется
+    в корзины с корректным OHLC, точки переносятся на свои корзины (None - без прореживания).
+    Возвращает путь к сохраненному (или найденному в кэше) файлу или None, если график не построен.
     """
-    print(f"\n--- plot_market_structure: Начало для {symbol} в {charts_directory}/{filename} ---")
+    log_fields = {'symbol': symbol, 'timeframe': timeframe, 'stage': 'plot'}
+    logger.debug("Начало построения графика %s/%s", charts_directory, filename, extra=log_fields)
+    mpf, plt = _plotting_modules()
+    from matplotlib.dates import date2num # num2date может понадобиться для отладки
 
     if df.empty:
-        print("plot_market_structure: DataFrame пуст. График не будет построен.")
+        logger.warning("DataFrame пуст. График не будет построен.", extra=log_fields)
         return
 
     # Диагностика входного DataFrame
-    # print(f"plot_market_structure: Информация о DataFrame (df.info()):")
+    # logger.debug("Информация о DataFrame (df.info()):")
     # df.info()
-    # print(f"\nplot_market_structure: Первые 3 строки DataFrame (df.head(3)):")
-    # print(df.head(3))
+    # logger.debug("Первые 3 строки DataFrame (df.head(3)):\n%s", df.head(3))
     
     if not isinstance(df.index, pd.DatetimeIndex):
-        print("plot_market_structure: КРИТИЧЕСКАЯ ОШИБКА: Индекс DataFrame не является pd.DatetimeIndex!")
+        logger.error("Индекс DataFrame не является pd.DatetimeIndex!", extra=log_fields)
         try:
             df.index = pd.to_datetime(df.index)
-            print("plot_market_structure: Индекс был конвертирован в pd.DatetimeIndex.")
+            logger.info("Индекс был конвертирован в pd.DatetimeIndex.", extra=log_fields)
             if not isinstance(df.index, pd.DatetimeIndex):
-                 print("plot_market_structure: Повторная проверка: Конвертация индекса не удалась. Прерывание.")
+                 logger.error("Повторная проверка: Конвертация индекса не удалась. Прерывание.", extra=log_fields)
                  return
         except Exception as e:
-            print(f"plot_market_structure: Ошибка при попытке конвертации индекса в DatetimeIndex: {e}. Прерывание.")
+            logger.error("Ошибка при попытке конвертации индекса в DatetimeIndex: %s. Прерывание.", e, extra=log_fields)
             return
             
     if not df.index.is_monotonic_increasing:
-        print("plot_market_structure: Предупреждение: Индекс DataFrame не отсортирован по возрастанию. Сортировка...")
+        logger.warning("Индекс DataFrame не отсортирован по возрастанию. Сортировка...", extra=log_fields)
         df = df.sort_index()
-        print("plot_market_structure: Индекс отсортирован.")
+
+    if decimate_width:
+        df, bars_per_bucket = decimate_ohlcv(df, width=decimate_width)
+        if bars_per_bucket > 1:
+            structure_points = pin_points(structure_points, df.index)
+            logger.debug("История прорежена: %d свечей в корзине, %d корзин.", bars_per_bucket, len(df), extra=log_fields)
 
     if not os.path.exists(charts_directory):
         try:
             os.makedirs(charts_directory)
-            print(f"plot_market_structure: Директория создана: {charts_directory}")
+            logger.info("Директория создана: %s", charts_directory, extra=log_fields)
         except OSError as e:
-            print(f"plot_market_structure: Ошибка при создании директории {charts_directory}: {e}")
+            logger.error("Ошибка при создании директории %s: %s", charts_directory, e, extra=log_fields)
             return
 
+    s = style if style is not None else make_chart_style()
+
+    cache, content_hash = None, None
+    if use_cache:
+        try:
+            cache = ChartCache(charts_directory)
+            content_hash = chart_content_hash(df, structure_points, symbol, timeframe, s)
+            cached_path = cache.lookup(content_hash, filename)
+            if cached_path:
+                logger.info("Данные не изменились, график взят из кэша: %s", cached_path, extra=log_fields)
+                return cached_path
+        except Exception as e:
+            logger.warning("Ошибка кэша графиков (%s), рендер без кэша.", e, extra=log_fields)
+            cache = None
+
     # Расширенные цвета и маркеры для новых типов точек
     # F_H_AS: Fractal High Asian Session
     # F_L_AS: Fractal Low Asian Session
@@ -102,9 +174,6 @@ def plot_market_structure(df: pd.DataFrame,
     }
 
 
-    mc = mpf.make_marketcolors(up='g', down='r', inherit=True)
-    s  = mpf.make_mpf_style(marketcolors=mc, gridstyle=':', y_on_right=False)
-
     price_range = df['high'].max() - df['low'].min()
     if price_range == 0: 
         y_offset_factor = 0.01 * df['close'].mean() if not df['close'].empty else 0.01
@@ -113,36 +182,34 @@ def plot_market_structure(df: pd.DataFrame,
 
     fig = None 
     try:
-        print("plot_market_structure: Попытка вызова mpf.plot()...")
-        fig, axlist = mpf.plot(df,
-                               type='candle',
-                               style=s,
-                               title=f'\n{symbol} - {timeframe} - Анализ структуры и сессионных фракталов',
-                               ylabel='Цена',
-                               volume='volume' in df.columns and not df['volume'].empty,
-                               figratio=(18,10), # Увеличил немного для лучшей читаемости
-                               returnfig=True,
-                               figsize=(16, 8), # Размер фигуры
-                               show_nontrading=False 
-                              )
-        print("plot_market_structure: mpf.plot() выполнен успешно.")
+        with metrics.stage_timer('plot_render'):
+            fig, axlist = mpf.plot(df,
+                                   type='candle',
+                                   style=s,
+                                   title=f'\n{symbol} - {timeframe} - Анализ структуры и сессионных фракталов',
+                                   ylabel='Цена',
+                                   volume='volume' in df.columns and not df['volume'].empty,
+                                   figratio=(18,10), # Увеличил немного для лучшей читаемости
+                                   returnfig=True,
+                                   figsize=(16, 8), # Размер фигуры
+                                   show_nontrading=False 
+                                  )
     except Exception as e:
-        print(f"plot_market_structure: КРИТИЧЕСКАЯ ОШИБКА при вызове mpf.plot: {e}")
+        logger.error("Ошибка при вызове mpf.plot: %s", e, extra=log_fields)
         # Попытка нарисовать без объема, если проблема в нем
         if 'volume' in str(e).lower():
             try:
-                print("plot_market_structure: Повторная попытка mpf.plot() без объема...")
+                logger.info("Повторная попытка mpf.plot() без объема...", extra=log_fields)
                 fig, axlist = mpf.plot(df, type='candle', style=s, title=f'\n{symbol} - {timeframe} - Анализ (без объема)',
                                        ylabel='Цена', volume=False, figratio=(18,10), returnfig=True, figsize=(16,8), show_nontrading=False)
-                print("plot_market_structure: mpf.plot() без объема выполнен успешно.")
             except Exception as e2:
-                print(f"plot_market_structure: Вторая попытка mpf.plot() также не удалась: {e2}")
+                logger.error("Вторая попытка mpf.plot() также не удалась: %s", e2, extra=log_fields)
                 return
         else:
             return # Если ошибка не связана с объемом, выходим
         
     if fig is None or not axlist:
-        print("plot_market_structure: Ошибка: mpf.plot() не вернул фигуру или оси. График не будет построен.")
+        logger.error("mpf.plot() не вернул фигуру или оси. График не будет построен.", extra=log_fields)
         return
         
     ax = axlist[0] # Основная панель цен
@@ -151,108 +218,95 @@ def plot_market_structure(df: pd.DataFrame,
     is_ordinal_xaxis = (xlims[1] - xlims[0]) < (len(df) + 50) # Эвристика, может потребовать подстройки
 
     if is_ordinal_xaxis:
-        print("plot_market_structure: Обнаружена порядковая ось X. Аннотации по индексам.")
+        logger.debug("Обнаружена порядковая ось X. Аннотации по индексам.", extra=log_fields)
     else:
-        print("plot_market_structure: Обнаружена ось X на основе дат matplotlib. Аннотации по date2num.")
+        logger.debug("Обнаружена ось X на основе дат matplotlib. Аннотации по date2num.", extra=log_fields)
 
-    print(f"plot_market_structure: Добавление {len(structure_points)} точек на график...")
+    logger.debug("Добавление %d точек на график...", len(structure_points), extra=log_fields)
     valid_points_plotted = 0
-    for i, point in enumerate(structure_points):
+
+    # Собираем корректные точки в массивы
+    point_times, point_prices, point_types = [], [], []
+    for point in structure_points:
         point_time = point.get('time')
         point_price = point.get('price')
         point_type = point.get('type') # Например, 'HH', 'F_H_AS', 'SETUP_Resist'
-        point_session_info = point.get('session', '') # Дополнительная инфо о сессии
-
         if point_time is None or point_price is None or point_type is None:
-            print(f"plot_market_structure: Пропуск некорректной точки: {point}")
+            logger.warning("Пропуск некорректной точки: %s", point, extra=log_fields)
             continue
+        point_times.append(pd.Timestamp(point_time))
+        point_prices.append(point_price)
+        point_types.append(point_type)
 
-        # Поиск ближайшего времени в индексе DataFrame
-        point_time_for_plot = point_time
-        if point_time not in df.index:
-            nearest_time_on_chart = df.index.asof(point_time)
-            if pd.isna(nearest_time_on_chart): # pd.NaT is deprecated, use pd.isna
-                future_times = df.index[df.index > point_time]
-                if not future_times.empty:
-                    nearest_time_on_chart = future_times[0]
-                else: # Если и будущих нет, пробуем найти ближайшую из прошлых (если точка очень старая)
-                    past_times = df.index[df.index < point_time]
-                    if not past_times.empty:
-                        nearest_time_on_chart = past_times[-1]
-                    else:
-                        print(f"plot_market_structure: Предупреждение: Время точки {point_time} (тип {point_type}) вне диапазона данных DataFrame. Пропуск.")
-                        continue
-            point_time_for_plot = nearest_time_on_chart
-        
+    if point_times:
         try:
+            points_index = pd.DatetimeIndex(point_times)
+            if df.index.tz is not None:
+                points_index = points_index.tz_localize(df.index.tz) if points_index.tz is None else points_index.tz_convert(df.index.tz)
+            elif points_index.tz is not None:
+                points_index = points_index.tz_convert(None)
+
+            # Ближайшая свеча на графике одним searchsorted: сама свеча или предыдущая (asof),
+            # для точек раньше начала данных - первая свеча.
+            locs = np.clip(df.index.searchsorted(points_index, side='right') - 1, 0, len(df) - 1)
             if is_ordinal_xaxis:
-                loc = df.index.get_loc(point_time_for_plot)
-                time_num = float(loc)
+                time_nums = locs.astype(float)
             else:
-                # Убедимся, что point_time_for_plot это datetime объект, а не Timestamp с tz для date2num
-                # date2num ожидает datetime.datetime без таймзоны, либо нужно обрабатывать tz отдельно
-                # mplfinance обычно сам разбирается с таймзонами, если они консистентны в df.index
-                if isinstance(point_time_for_plot, pd.Timestamp):
-                     dt_to_convert = point_time_for_plot.to_pydatetime()
-                     # Если есть таймзона, date2num может работать некорректно или требовать ее удаления
-                     # Однако, mplfinance версии >0.12.8 обрабатывают таймзоны лучше.
-                     # Попробуем передать как есть, если df.index имеет таймзону.
-                     if df.index.tzinfo is not None and dt_to_convert.tzinfo is None:
-                         dt_to_convert = dt_to_convert.replace(tzinfo=df.index.tzinfo) # Присваиваем таймзону данных
-                     elif df.index.tzinfo is None and dt_to_convert.tzinfo is not None:
-                         dt_to_convert = dt_to_convert.replace(tzinfo=None) # Удаляем, если данные без tz
-
-                else: # если это уже datetime.datetime
-                    dt_to_convert = point_time_for_plot
-
-                time_num = date2num(dt_to_convert) 
-            
-            current_marker_color = colors.get(point_type, 'grey')
-            current_marker_shape = markers.get(point_type, '.')
-            current_marker_size = marker_sizes.get(point_type, 50)
-
-            ax.scatter(time_num, point_price, 
-                       color=current_marker_color, 
-                       marker=current_marker_shape, 
-                       s=current_marker_size, zorder=5)
-
-            # Текстовая аннотация - выводим тип точки
-            text_label = point_type
-            # Для сетапов можно добавить больше деталей из point['details'] если есть
-            if 'SETUP' in point_type and 'details' in point:
-                # text_label += f"\n({point['details'][:30]}...)" # Сокращаем детали для графика
-                pass # Пока оставим только тип, чтобы не перегружать
-
-            y_text_offset_multiplier = text_y_offsets_factors.get(point_type, 1.0 if 'H' in point_type or 'Resist' in point_type else -1.0)
-            final_y_text_offset = y_offset_factor * y_text_offset_multiplier
-            
-            # Убедимся, что текст не выходит за пределы графика по Y
+                chart_times = df.index[locs]
+                if chart_times.tz is not None:
+                    chart_times = chart_times.tz_convert('UTC').tz_localize(None)
+                time_nums = date2num(chart_times.to_numpy())
+
+            prices = np.asarray(point_prices, dtype=float)
+            types = np.asarray(point_types, dtype=object)
+            unique_types = list(dict.fromkeys(point_types))
+
+            # Один scatter на стиль маркера
+            for point_type in unique_types:
+                mask = types == point_type
+                ax.scatter(time_nums[mask], prices[mask],
+                           color=colors.get(point_type, 'grey'),
+                           marker=markers.get(point_type, '.'),
+                           s=marker_sizes.get(point_type, 50), zorder=5)
+
+            # Позиции подписей считаются векторно, пределы оси Y - один раз
+            multipliers = np.array([
+                text_y_offsets_factors.get(t, 1.0 if 'H' in t or 'Resist' in t else -1.0) for t in point_types
+            ])
+            text_offsets = y_offset_factor * multipliers
             plot_min_y, plot_max_y = ax.get_ylim()
-            text_y_pos = point_price + final_y_text_offset
-            if text_y_pos > plot_max_y: text_y_pos = plot_max_y - y_offset_factor * 0.5
-            if text_y_pos < plot_min_y: text_y_pos = plot_min_y + y_offset_factor * 0.5
-
-
-            ax.text(time_num, text_y_pos, text_label, 
-                    color=current_marker_color,
-                    fontsize=8, # Уменьшил шрифт для компактности
-                    fontweight='bold' if 'SETUP' in point_type else 'normal',
-                    ha='center', 
-                    va='bottom' if final_y_text_offset >= 0 else 'top', # va зависит от направления смещения
-                    bbox=dict(boxstyle='round,pad=0.2', fc='yellow', alpha=0.3 if 'SETUP' not in point_type else 0.5))
-            valid_points_plotted +=1
-        except KeyError:
-             print(f"plot_market_structure: Ключ времени {point_time_for_plot} (исходный {point_time}) не найден в индексе df при get_loc. Пропуск точки {point_type}.")
+            text_y_positions = prices + text_offsets
+            text_y_positions = np.where(text_y_positions > plot_max_y, plot_max_y - y_offset_factor * 0.5, text_y_positions)
+            text_y_positions = np.where(text_y_positions < plot_min_y, plot_min_y + y_offset_factor * 0.5, text_y_positions)
+
+            # На плотных графиках тысячи подписей нечитаемы и дороги в отрисовке:
+            # сверх лимита подписываем только сетапы.
+            label_all = len(point_types) <= settings.PLOT_MAX_POINT_LABELS
+            for point_type in unique_types:
+                is_setup = 'SETUP' in point_type
+                if not label_all and not is_setup:
+                    continue
+                color = colors.get(point_type, 'grey')
+                bbox = dict(boxstyle='round,pad=0.2', fc='yellow', alpha=0.5 if is_setup else 0.3)
+                for idx in np.flatnonzero(types == point_type):
+                    ax.text(time_nums[idx], text_y_positions[idx], point_type,
+                            color=color,
+                            fontsize=8, # Уменьшил шрифт для компактности
+                            fontweight='bold' if is_setup else 'normal',
+                            ha='center',
+                            va='bottom' if text_offsets[idx] >= 0 else 'top', # va зависит от направления смещения
+                            bbox=bbox)
+            valid_points_plotted = len(point_types)
         except Exception as e:
-            print(f"plot_market_structure: Ошибка при нанесении точки {point_type} ({point_time_for_plot}, исходный {point_time}) на график: {e}")
-    
-    print(f"plot_market_structure: Успешно нанесено {valid_points_plotted} точек.")
+            logger.error("Ошибка при нанесении точек на график: %s", e, extra=log_fields)
+
+    logger.debug("Успешно нанесено %d точек.", valid_points_plotted, extra=log_fields)
 
     if not is_ordinal_xaxis:
         try:
             fig.autofmt_xdate(rotation=30)
         except Exception as e_fmt:
-            print(f"plot_market_structure: Ошибка при autofmt_xdate: {e_fmt}")
+            logger.warning("Ошибка при autofmt_xdate: %s", e_fmt, extra=log_fields)
     else: 
         step = max(1, len(df) // 10) # Показывать примерно 10 меток
         tick_indices = range(0, len(df), step)
@@ -260,18 +314,26 @@ def plot_market_structure(df: pd.DataFrame,
         try:
             ax.set_xticklabels([df.index[i].strftime('%m-%d %H:%M') for i in tick_indices], rotation=30, ha='right', fontsize=8)
         except IndexError:
-             print(f"plot_market_structure: Ошибка IndexError при установке xticklabels. Возможно, len(df)={len(df)}, tick_indices={list(tick_indices)}")
+             logger.warning("Ошибка IndexError при установке xticklabels. Возможно, len(df)=%d, tick_indices=%s", len(df), list(tick_indices), extra=log_fields)
         except Exception as e_xtick:
-            print(f"plot_market_structure: Ошибка при установке xticklabels для порядковой оси: {e_xtick}")
+            logger.warning("Ошибка при установке xticklabels для порядковой оси: %s", e_xtick, extra=log_fields)
 
 
-    filepath = os.path.join(charts_directory, filename)
+    filepath = cache.object_path(content_hash) if cache else os.path.join(charts_directory, filename)
+    saved = False
     try:
-        fig.savefig(filepath, bbox_inches='tight', dpi=150) # Увеличил dpi для лучшего качества
-        print(f"plot_market_structure: График УСПЕШНО сохранен в: {filepath}")
+        with metrics.stage_timer('plot_save'):
+            save_figure_atomic(fig, filepath, bbox_inches='tight', dpi=150) # Увеличил dpi для лучшего качества
+        saved = True
+        logger.info("График сохранен в: %s", filepath, extra=log_fields)
     except Exception as e:
-        print(f"plot_market_structure: КРИТИЧЕСКАЯ ОШИБКА при сохранении графика в {filepath}: {e}")
+        logger.error("Ошибка при сохранении графика в %s: %s", filepath, e, extra=log_fields)
+    if saved and cache:
+        try:
+            cache.store(content_hash, filename)
+        except Exception as e:
+            logger.error("Ошибка записи в манифест кэша графиков: %s", e, extra=log_fields)
     
     plt.close(fig) # Закрываем фигуру, чтобы освободить память
-    print(f"--- plot_market_structure: Завершение для {symbol} ---")
+    return filepath if saved else None
 
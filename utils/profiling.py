@@ -0,0 +1,361 @@
+# utils/profiling.py
+"""
+Профилирование по запросу: запуск анализа, рендер графика или запрос API оборачивается
+в profile_run(); при включенном профилировании (TSBOT_PROFILE=1, enabled=True или
+profile=1 в запросе к серверу графиков) собирается профиль CPU (cProfile или выборочный
+стек) и снимки tracemalloc по этапам анализа (stage()). Отчеты пишутся в charts/profiles/:
+
+    <имя>_<символ>_<время>_<pid>.prof        - pstats (snakeviz, flameprof, gprof2dot)     [cprofile]
+    <имя>_<символ>_<время>_<pid>.folded      - свернутые стеки (flamegraph.pl, speedscope)  [sampling]
+    <имя>_<символ>_<время>_<pid>_top.txt     - top-N функций
+    <имя>_<символ>_<время>_<pid>_memory.txt  - память по этапам и top-N мест выделения
+
+Когда профилирование выключено, profile_run() и stage() возвращают общий пустой
+контекстный менеджер и ничего не записывают. Одновременно идет не больше одной сессии
+на процесс (tracemalloc общий для всех потоков); вложенный profile_run() пишет во внешнюю сессию.
+"""
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time as time_module
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from configs import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLING = 'sampling'
+
+_active_session = contextvars.ContextVar('profile_session', default=None)
+_session_lock = threading.Lock()
+
+
+def default_directory() -> str:
+    return os.path.join(PROJECT_ROOT, settings.CHARTS_DIRECTORY_NAME, settings.PROFILING_DIRECTORY_NAME)
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(PROJECT_ROOT):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Выборочный профиль одного потока: фоновый поток раз в interval_seconds снимает его стек
+    (sys._current_frames) и считает одинаковые стеки. Накладные расходы не зависят от
+    числа вызовов функций, поэтому годится для долгих запусков.
+    """
+
+    def __init__(self, thread_id: int, interval_seconds: float = settings.PROFILING_SAMPLE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.stacks = Counter()  # (корень, ..., лист) -> число выборок
+        self.paused = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            if self.paused:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def write_folded(self, path: str):
+        """Формат свернутых стеков: 'корень;...;лист число' в строке."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(label.replace(';', ',') for label in stack)} {count}\n")
+
+    def top_lines(self, top_n: int) -> list:
+        total = sum(self.stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                inclusive[label] += count
+        lines = [f"Выборок: {total}, период {self.interval_seconds * 1000:.1f} мс", "", "Собственное время:"]
+        lines += [f"{count / total:7.1%}  {count:>7}  {label}" for label, count in own.most_common(top_n)]
+        lines += ["", "Включая вызванные функции:"]
+        lines += [f"{count / total:7.1%}  {count:>7}  {label}" for label, count in inclusive.most_common(top_n)]
+        return lines
+
+
+class _MemoryStage:
+    """Снимки tracemalloc до и после этапа: прирост, пик и top-N мест выделения."""
+
+    def __init__(self, session: 'ProfileSession', stage: str):
+        self.session = session
+        self.stage = stage
+
+    def __enter__(self):
+        # Снимки памяти не должны попадать в CPU-профиль
+        self.session.pause_cpu()
+        self.session.peak_bytes = max(self.session.peak_bytes, tracemalloc.get_traced_memory()[1])
+        self.snapshot_before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self.current_before = tracemalloc.get_traced_memory()[0]
+        self.session.resume_cpu()
+        self.started = time_module.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time_module.perf_counter() - self.started
+        self.session.pause_cpu()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        top = snapshot.compare_to(self.snapshot_before, 'lineno')[:self.session.top_n]
+        self.session.resume_cpu()
+        self.session.memory_stages.append({
+            'stage': self.stage, 'seconds': seconds,
+            'delta_bytes': current - self.current_before, 'peak_bytes': peak - self.current_before,
+            'top': [str(stat) for stat in top],
+        })
+        return False
+
+
+class ProfileSession:
+    """Одна сессия профилирования: CPU-профиль потока, вызвавшего start(), и память по этапам."""
+
+    def __init__(self, name: str, mode: str = None, memory: bool = None, directory: str = None,
+                 top_n: int = settings.PROFILING_TOP_N, **fields):
+        self.name = name
+        self.mode = mode or settings.PROFILING_MODE
+        self.memory = settings.PROFILING_MEMORY if memory is None else memory
+        self.directory = directory or default_directory()
+        self.top_n = top_n
+        self.fields = {k: v for k, v in fields.items() if v is not None}
+        self.memory_stages = []
+        self.peak_bytes = 0  # reset_peak() на каждом этапе - общий пик собирается здесь
+        self.reports = []
+        self._profiler = None
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.mode == MODE_SAMPLING:
+            self._sampler = StackSampler(threading.get_ident()).start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self.started = time_module.perf_counter()
+        return self
+
+    def stage(self, stage: str):
+        return _MemoryStage(self, stage)
+
+    def pause_cpu(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.paused = True
+
+    def resume_cpu(self):
+        if self._profiler is not None:
+            self._profiler.enable()
+        if self._sampler is not None:
+            self._sampler.paused = False
+
+    def stop(self) -> list:
+        """Останавливает сбор и пишет отчеты; возвращает пути к файлам."""
+        seconds = time_module.perf_counter() - self.started
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        peak = max(self.peak_bytes, tracemalloc.get_traced_memory()[1]) if tracemalloc.is_tracing() else None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self._file_stem())
+        header = [f"{self.name} {' '.join(f'{k}={v}' for k, v in self.fields.items())}".rstrip(),
+                  f"Режим: {self.mode}, время: {seconds:.3f} с, pid {os.getpid()}", ""]
+
+        if self._profiler is not None:
+            self._profiler.dump_stats(base + '.prof')
+            self.reports.append(base + '.prof')
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+            stats.sort_stats('tottime').print_stats(self.top_n)
+            top = stream.getvalue().splitlines()
+        else:
+            self._sampler.write_folded(base + '.folded')
+            self.reports.append(base + '.folded')
+            top = self._sampler.top_lines(self.top_n)
+        self._write_text(base + '_top.txt', header + top)
+
+        if self.memory:
+            lines = list(header)
+            if peak is not None:
+                lines.append(f"Пик за сессию: {peak / 1024 / 1024:.1f} МБ")
+            for entry in self.memory_stages:
+                lines += ["", f"== {entry['stage']}: {entry['seconds'] * 1000:.1f} мс, "
+                              f"прирост {entry['delta_bytes'] / 1024:.0f} КБ, пик {entry['peak_bytes'] / 1024:.0f} КБ"]
+                lines += entry['top']
+            self._write_text(base + '_memory.txt', lines)
+        rotate_reports(self.directory)
+        return self.reports
+
+    def _file_stem(self) -> str:
+        parts = [self.name] + [str(v).replace('/', '_').replace(os.sep, '_') for v in self.fields.values()]
+        parts.append(datetime.now().strftime('%Y%m%d_%H%M%S'))
+        parts.append(str(os.getpid()))
+        return '_'.join(parts)
+
+    def _write_text(self, path: str, lines: list):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.reports.append(path)
+
+
+REPORT_SUFFIXES = ('.prof', '.folded', '_top.txt', '_memory.txt')
+
+
+def rotate_reports(directory: str, keep: int = settings.PROFILING_MAX_REPORT_FILES):
+    """Оставляет в директории keep самых новых файлов отчетов (по времени изменения), остальные удаляет."""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(REPORT_SUFFIXES)]
+    except FileNotFoundError:
+        return
+    if len(entries) <= keep:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - keep]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class _ProfileRun:
+    __slots__ = ('session', 'token')
+
+    def __init__(self, session: ProfileSession):
+        self.session = session
+        self.token = None
+
+    def __enter__(self):
+        if not _session_lock.acquire(blocking=False):
+            logger.warning("Профилирование уже идет в другом потоке, %s не профилируется", self.session.name,
+                           extra={'stage': 'profiling'})
+            self.session = None
+            return None
+        try:
+            self.session.start()
+        except Exception:
+            _session_lock.release()
+            raise
+        self.token = _active_session.set(self.session)
+        return self.session
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.session is None:
+            return False
+        _active_session.reset(self.token)
+        try:
+            reports = self.session.stop()
+            logger.info("Профиль %s сохранен: %s", self.session.name, ', '.join(reports),
+                        extra={'stage': 'profiling'})
+        except Exception as e:
+            logger.exception("Не удалось сохранить профиль %s: %s", self.session.name, e,
+                             extra={'stage': 'profiling'})
+        finally:
+            _session_lock.release()
+        return False
+
+
+class _NoopContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopContext()
+
+
+def profile_run(name: str, enabled: bool = None, directory: str = None, mode: str = None, **fields):
+    """
+    with profile_run('analysis', symbol='EUR/USD', timeframe='1h'): ... - профилирует блок,
+    если enabled (по умолчанию settings.PROFILING_ENABLED, т.е. TSBOT_PROFILE=1).
+    fields попадают в имена файлов отчетов. Внутри уже идущей сессии - ничего не делает.
+    """
+    if not (settings.PROFILING_ENABLED if enabled is None else enabled):
+        return _NOOP
+    if _active_session.get() is not None:
+        return _NOOP
+    return _ProfileRun(ProfileSession(name, mode=mode, directory=directory, **fields))
+
+
+def stage(name: str):
+    """
+    with stage('swings'): ... - снимки памяти этапа для текущей сессии профилирования.
+    Без активной сессии (или с PROFILING_MEMORY = False) - пустой контекстный менеджер.
+    """
+    session = _active_session.get()
+    if session is None or not session.memory:
+        return _NOOP
+    return session.stage(name)
+
+
+def active() -> bool:
+    return _active_session.get() is not None
+
+
+if __name__ == '__main__':
+    import tempfile
+    print("Тестирование profiling.py...")
+    output_directory = tempfile.mkdtemp(prefix='tsbot-profile-')
+
+    def workload():
+        with stage('build'):
+            data = [list(range(200)) for _ in range(2000)]
+        with stage('sum'):
+            return sum(sum(row) for row in data)
+
+    with profile_run('disabled', enabled=False) as session:
+        print("Выключено, сессия:", session)
+    for profile_mode in (MODE_CPROFILE, MODE_SAMPLING):
+        with profile_run('selftest', enabled=True, directory=output_directory, mode=profile_mode, symbol='EUR/USD') as session:
+            for _ in range(20):
+                workload()
+        print(f"{profile_mode}: {', '.join(os.path.basename(p) for p in session.reports)}")
+    with open(session.reports[-1], encoding='utf-8') as f:
+        print(f.read()[:1500])